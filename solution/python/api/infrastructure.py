@@ -9,14 +9,38 @@ from aws_cdk import aws_sns as sns
 from aws_cdk import aws_s3_notifications as s3n
 from aws_cdk import aws_iam as iam
 from aws_cdk import aws_cognito as cognito
+from aws_cdk import aws_dynamodb as ddb
+from aws_cdk import aws_secretsmanager as secretsmanager
 from aws_cdk import CfnOutput
+import tuning
 
 class APIStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        # S3 Bucket để lưu ảnh
-        bucket = s3.Bucket(self, "CW-Workshop-Images")
+        # Ảnh có key bắt đầu bằng bulk_key_prefix (bulk ingest, upload "priority": "bulk")
+        # hoặc lớn hơn bulk_min_image_bytes đi lane bulk, còn lại đi lane interactive
+        bulk_key_prefix = self.node.try_get_context("bulk_key_prefix") or "bulk/"
+        bulk_min_image_bytes = tuning.context_int(self, "bulk_min_image_bytes", 8 * 1024 * 1024)
+
+        # S3 Bucket để lưu ảnh. CORS cho client upload trực tiếp bằng URL ký sẵn
+        # (ETag của từng part cần cho /uploads/complete), multipart bỏ dở được dọn sau 1 ngày
+        bucket = s3.Bucket(
+            self,
+            "CW-Workshop-Images",
+            cors=[
+                s3.CorsRule(
+                    allowed_methods=[s3.HttpMethods.POST, s3.HttpMethods.PUT],
+                    allowed_origins=self.node.try_get_context("upload_allowed_origins") or ["*"],
+                    allowed_headers=["*"],
+                    exposed_headers=["ETag"],
+                    max_age=3000,
+                )
+            ],
+            lifecycle_rules=[
+                s3.LifecycleRule(abort_incomplete_multipart_upload_after=Duration.days(1)),
+            ],
+        )
 
         # Import bucket chứa Lambda layer
         asset_bucket = s3.Bucket.from_bucket_name(
@@ -35,6 +59,15 @@ class APIStack(Stack):
             code=lambda_.S3Code(bucket=asset_bucket, key=requests_layer_file),
         )
 
+        # Lambda Layer dùng chung (shared.clients, ...)
+        common = lambda_.LayerVersion(
+            self,
+            "common_layer",
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_11],
+            code=lambda_.Code.from_asset("common"),
+            description="Shared runtime helpers for the image recognition Lambdas",
+        )
+
         # IAM Role cho Lambda
         lambda_role = iam.Role(
             self,
@@ -46,18 +79,107 @@ class APIStack(Stack):
         )
         bucket.grant_read_write(lambda_role)
 
+        # Chỉ mục nội dung sha256 -> key canonical để bỏ qua ảnh trùng khi ingest
+        content_index = ddb.Table(
+            self,
+            "ContentIndex",
+            partition_key=ddb.Attribute(name="sha256", type=ddb.AttributeType.STRING),
+        )
+        content_index.grant_read_write_data(lambda_role)
+
         # Lambda function
         image_get_and_save_lambda = lambda_.Function(
             self,
             "ImageGetAndSaveLambda",
             function_name="ImageGetAndSaveLambda",
             runtime=lambda_.Runtime.PYTHON_3_11,
-            layers=[requests],
+            layers=[requests, common],
             code=lambda_.Code.from_asset("api/runtime"),
             handler="get_save_image.handler",
-            environment={"BUCKET_NAME": bucket.bucket_name},
+            environment={
+                "BUCKET_NAME": bucket.bucket_name,
+                "DEDUP_TABLE": content_index.table_name,
+                "STREAMING_INGEST": "true",
+                "MAX_IMAGE_BYTES": str(50 * 1024 * 1024),
+                "ALLOWED_CONTENT_TYPES": "image/",
+            },
             role=lambda_role,
             timeout=Duration.seconds(60),  # Tăng timeout nếu cần
+            # Streaming ingest chỉ giữ tối đa một part trong bộ nhớ
+            memory_size=256,
+        )
+
+        # Lambda ingest nhiều URL trong một request
+        bulk_ingest_lambda = lambda_.Function(
+            self,
+            "ImageBulkIngestLambda",
+            function_name="ImageBulkIngestLambda",
+            runtime=lambda_.Runtime.PYTHON_3_11,
+            layers=[requests, common],
+            code=lambda_.Code.from_asset("api/runtime"),
+            handler="bulk_ingest.handler",
+            environment={
+                "BUCKET_NAME": bucket.bucket_name,
+                "DEDUP_TABLE": content_index.table_name,
+                "MAX_IMAGE_BYTES": str(50 * 1024 * 1024),
+                "ALLOWED_CONTENT_TYPES": "image/",
+                "HTTP_POOL_SIZE": "16",
+                "BULK_MAX_WORKERS": "16",
+                "BULK_MAX_PER_HOST": "4",
+                "BULK_MAX_ITEMS": "500",
+                "BULK_KEY_PREFIX": bulk_key_prefix,
+            },
+            role=lambda_role,
+            timeout=Duration.seconds(60),
+            memory_size=1024,
+        )
+
+        # Lambda cấp URL ký sẵn để client upload thẳng lên bucket. URL mang quyền
+        # của role này nên role chỉ được ghi object và thao tác multipart.
+        upload_url_role = iam.Role(
+            self,
+            "UploadUrlLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+        )
+        upload_url_role.add_managed_policy(
+            iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole")
+        )
+        bucket.grant_put(upload_url_role)
+        upload_url_role.add_to_policy(iam.PolicyStatement(
+            actions=["s3:ListMultipartUploadParts"],
+            resources=[bucket.arn_for_objects("*")],
+        ))
+
+        # Khóa ký upload_token: /uploads/complete chỉ ghép multipart upload do /uploads mở
+        upload_token_secret = secretsmanager.Secret(
+            self,
+            "UploadTokenSecret",
+            generate_secret_string=secretsmanager.SecretStringGenerator(
+                password_length=64,
+                exclude_punctuation=True,
+            ),
+        )
+        upload_token_secret.grant_read(upload_url_role)
+
+        upload_url_lambda = lambda_.Function(
+            self,
+            "UploadUrlLambda",
+            function_name="UploadUrlLambda",
+            runtime=lambda_.Runtime.PYTHON_3_11,
+            layers=[common],
+            code=lambda_.Code.from_asset("api/runtime"),
+            handler="upload_url.handler",
+            environment={
+                "BUCKET_NAME": bucket.bucket_name,
+                "MAX_IMAGE_BYTES": str(50 * 1024 * 1024),
+                "ALLOWED_CONTENT_TYPES": "image/",
+                "PRESIGN_EXPIRES_SECONDS": "900",
+                "BULK_KEY_PREFIX": bulk_key_prefix,
+                "UPLOAD_TOKEN_SECRET_ARN": upload_token_secret.secret_arn,
+                "UPLOAD_TOKEN_EXPIRES_SECONDS": "3600",
+            },
+            role=upload_url_role,
+            timeout=Duration.seconds(10),
         )
 
         # Cognito User Pool
@@ -114,22 +236,79 @@ class APIStack(Stack):
             authorizer=authorizer,
         )
 
-        # SQS Queue
+        # Method POST /bulk để ingest nhiều URL, cũng xác thực bằng Cognito
+        bulk_resource = api.root.add_resource("bulk")
+        bulk_resource.add_method(
+            "POST",
+            apigateway.LambdaIntegration(bulk_ingest_lambda),
+            authorization_type=apigateway.AuthorizationType.COGNITO,
+            authorizer=authorizer,
+        )
+
+        # POST /uploads cấp URL ký sẵn, POST /uploads/complete ghép multipart upload
+        uploads_resource = api.root.add_resource("uploads")
+        upload_url_integration = apigateway.LambdaIntegration(upload_url_lambda)
+        for resource in (uploads_resource, uploads_resource.add_resource("complete")):
+            resource.add_method(
+                "POST",
+                upload_url_integration,
+                authorization_type=apigateway.AuthorizationType.COGNITO,
+                authorizer=authorizer,
+            )
+
+        # SQS Queue cho lane interactive (ảnh người dùng đang chờ), message nhận quá
+        # recognition_max_receive_count lần chuyển sang DLQ
         upload_queue = sqs.Queue(
-            self, id="uploaded_image_queue", visibility_timeout=Duration.seconds(60)
+            self,
+            id="uploaded_image_queue",
+            visibility_timeout=tuning.seconds(self, "recognition_visibility_timeout_seconds", 60),
+            dead_letter_queue=tuning.dead_letter_queue(self, "recognition", "uploaded_image_dlq"),
+        )
+        # Lane bulk: ảnh backfill/bulk ingest và ảnh lớn, xử lý bởi function riêng
+        # (context recognition_bulk_*) nên không làm chậm lane interactive
+        bulk_queue = sqs.Queue(
+            self,
+            id="uploaded_image_bulk_queue",
+            visibility_timeout=tuning.seconds(self, "recognition_bulk_visibility_timeout_seconds", 360),
+            dead_letter_queue=tuning.dead_letter_queue(self, "recognition_bulk", "uploaded_image_bulk_dlq"),
         )
+        self.image_bucket_arn = bucket.bucket_arn
         self.upload_queue_url = upload_queue.queue_url
         self.upload_queue_arn = upload_queue.queue_arn
+        self.bulk_queue_arn = bulk_queue.queue_arn
 
-        # SNS Topic + subscription SQS
+        # SNS Topic + subscription SQS, filter policy trên nội dung S3 event chia message
+        # vào hai lane (mỗi S3 event chỉ có một record, hai policy bù nhau)
         upload_event_topic = sns.Topic(self, id="uploaded_image_topic")
-        sqs_subscription = sns_subs.SqsSubscription(upload_queue, raw_message_delivery=True)
-        upload_event_topic.add_subscription(sqs_subscription)
+        lane_policies = [
+            (upload_queue, {"Records": {"s3": {"object": {
+                "key": [{"anything-but": {"prefix": bulk_key_prefix}}],
+                "size": [{"numeric": ["<", bulk_min_image_bytes]}],
+            }}}}),
+            (bulk_queue, {"Records": {"s3": {"object": {"$or": [
+                {"key": [{"prefix": bulk_key_prefix}]},
+                {"size": [{"numeric": [">=", bulk_min_image_bytes]}]},
+            ]}}}}),
+        ]
+        for queue, policy in lane_policies:
+            subscription = upload_event_topic.add_subscription(
+                sns_subs.SqsSubscription(queue, raw_message_delivery=True))
+            # SubscriptionFilter của CDK chưa hỗ trợ "$or" nên ghi thẳng vào CfnSubscription
+            subscription.node.default_child.add_property_override("FilterPolicyScope", "MessageBody")
+            subscription.node.default_child.add_property_override("FilterPolicy", policy)
 
         # Gắn event notification cho bucket
         bucket.add_event_notification(
             s3.EventType.OBJECT_CREATED_PUT, s3n.SnsDestination(upload_event_topic)
         )
+        # Upload trực tiếp bằng presigned POST
+        bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED_POST, s3n.SnsDestination(upload_event_topic)
+        )
+        # Ảnh lớn được streaming ingest (hoặc client upload trực tiếp) ghi bằng multipart upload
+        bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED_COMPLETE_MULTIPART_UPLOAD, s3n.SnsDestination(upload_event_topic)
+        )
 
         # Output thông tin
         CfnOutput(self, "UserPoolId", value=user_pool.user_pool_id)
@@ -142,4 +321,12 @@ class APIStack(Stack):
 
     @property
     def sqs_arn(self) -> str:
-        return self.upload_queue_arn
\ No newline at end of file
+        return self.upload_queue_arn
+
+    @property
+    def bulk_sqs_arn(self) -> str:
+        return self.bulk_queue_arn
+
+    @property
+    def bucket_arn(self) -> str:
+        return self.image_bucket_arn
\ No newline at end of file
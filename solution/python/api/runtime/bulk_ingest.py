@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import base64
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from shared import clients, metrics
+from get_save_image import S3_BUCKET, HTTP_POOL_SIZE, IngestError, get_session, stream_url_to_s3, warm_up
+
+# Số lượt tải song song tối đa trong một lần invoke
+MAX_WORKERS = int(os.getenv('BULK_MAX_WORKERS', str(HTTP_POOL_SIZE)))
+# Giới hạn số kết nối đồng thời tới cùng một host
+MAX_PER_HOST = int(os.getenv('BULK_MAX_PER_HOST', '4'))
+# Số item tối đa trong một request
+MAX_ITEMS = int(os.getenv('BULK_MAX_ITEMS', '500'))
+# Tiền tố key của ảnh bulk ingest, S3 event của các key này được SNS filter policy
+# chuyển sang lane bulk của image_recognition (rỗng là giữ nguyên tên)
+BULK_KEY_PREFIX = os.getenv('BULK_KEY_PREFIX', '')
+# API Gateway cắt request sau 29s nên không bắt đầu item mới sau mốc này,
+# item đang tải bị dừng khi tới mốc
+DEADLINE_SECONDS = float(os.getenv('BULK_DEADLINE_SECONDS', '25'))
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+def _host(url):
+    return urlsplit(url).netloc.lower() if isinstance(url, str) else ''
+
+
+class HostScheduler:
+    """
+    Phân phối item cho các worker, mỗi host tối đa MAX_PER_HOST item đang tải.
+    Worker không bao giờ chờ slot của một host: nếu mọi item còn lại thuộc các
+    host đã đủ slot, worker dừng và các worker đang tải host đó sẽ lấy tiếp.
+    """
+    def __init__(self, items, max_per_host=MAX_PER_HOST):
+        self.max_per_host = max_per_host
+        self._queues = {}  # host -> deque (index, url, name), giữ thứ tự host xuất hiện
+        for index, (url, name) in enumerate(items):
+            self._queues.setdefault(_host(url), deque()).append((index, url, name))
+        self._active = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def next(self, finished_host=None):
+        """
+        Trả slot của finished_host (nếu có) và lấy item kế tiếp có host còn slot,
+        xoay vòng giữa các host. None nếu không còn item chạy được.
+        """
+        with self._lock:
+            if finished_host is not None:
+                self._active[finished_host] -= 1
+            for host in list(self._queues):
+                if self._active[host] < self.max_per_host:
+                    queue = self._queues.pop(host)
+                    item = queue.popleft()
+                    if queue:
+                        self._queues[host] = queue  # chuyển host xuống cuối vòng
+                    self._active[host] += 1
+                    return host, item
+            return None
+
+
+def _response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body)
+    }
+
+
+def parse_items(event):
+    """
+    Đọc danh sách (url, name) từ body JSON của request POST.
+    Chấp nhận list các object {"url", "name"}, list các cặp [url, name]
+    hoặc object {"items": [...]}.
+    """
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list):
+        raise ValueError('Body must be a JSON list of {"url", "name"} items.')
+
+    items = []
+    for entry in data:
+        if isinstance(entry, dict):
+            items.append((entry.get('url'), entry.get('name')))
+        elif isinstance(entry, (list, tuple)) and len(entry) == 2:
+            items.append((entry[0], entry[1]))
+        else:
+            items.append((None, None))
+    return items
+
+
+def ingest_item(index, url, name, deadline):
+    """
+    Tải một ảnh qua session dùng chung và stream lên S3.
+    Trả về một dòng trong manifest kết quả, status là uploaded, duplicate
+    (chỉ ghi alias, kèm canonical) hoặc unchanged nếu thành công.
+    """
+    result = {'index': index, 'url': url, 'name': name}
+    if not isinstance(url, str) or not isinstance(name, str) or not url or not name:
+        result.update(status='invalid', statusCode=400, error='Missing "url" or "name".')
+        return result
+    key = name if name.startswith(BULK_KEY_PREFIX) else BULK_KEY_PREFIX + name
+    if key != name:
+        result['key'] = key
+    if urlsplit(url).scheme not in ('http', 'https'):
+        result.update(status='invalid', statusCode=400, error='Only http(s) URLs are supported.')
+        return result
+
+    # Item chưa bắt đầu trước deadline được trả lại để client gửi lại sau
+    if time.monotonic() > deadline:
+        result.update(status='skipped', statusCode=503, error='Deadline exceeded before download started.')
+        return result
+    try:
+        outcome = stream_url_to_s3(url, S3_BUCKET, key, session=get_session(), deadline=deadline)
+    except IngestError as e:
+        result.update(status='failed', statusCode=e.status_code, error=str(e))
+        return result
+    except Exception as e:
+        print(f"Unexpected error ingesting {url}: {e}")
+        result.update(status='failed', statusCode=500, error='Unexpected error.')
+        return result
+
+    result.update(status=outcome['status'], statusCode=200, bytes=outcome['bytes'])
+    if outcome['canonical'] != key:
+        result['canonical'] = outcome['canonical']
+    return result
+
+
+@metrics.instrument("BulkIngest")
+def handler(event, context):
+    if clients.is_warmup_event(event):
+        warm_up()
+        _get_executor()
+        return {'warmup': True}
+    try:
+        items = parse_items(event)
+    except (ValueError, TypeError) as e:
+        return _response(400, f'Invalid request body: {e}')
+
+    if not items:
+        return _response(400, 'No items to ingest.')
+    if len(items) > MAX_ITEMS:
+        return _response(400, f'Too many items, maximum is {MAX_ITEMS} per request.')
+
+    budget = DEADLINE_SECONDS
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        budget = min(budget, context.get_remaining_time_in_millis() / 1000.0 - 5)
+    deadline = time.monotonic() + budget
+
+    scheduler = HostScheduler(items)
+    results = [None] * len(items)
+
+    def _work(_):
+        job = scheduler.next()
+        while job is not None:
+            host, (index, url, name) = job
+            try:
+                results[index] = ingest_item(index, url, name, deadline)
+            finally:
+                job = scheduler.next(host)
+
+    # Mỗi worker lấy item từ scheduler cho tới khi hết item chạy được
+    list(_get_executor().map(metrics.bind(_work), range(min(MAX_WORKERS, len(items)))))
+
+    summary = defaultdict(int)
+    for result in results:
+        summary[result['status']] += 1
+    metrics.put("BulkItems", len(results))
+    metrics.put("BulkFailedItems", sum(1 for result in results if result['statusCode'] != 200))
+    print(f"Bulk ingest finished: {dict(summary)}")
+
+    return _response(200, {
+        'total': len(results),
+        'summary': summary,
+        'items': results,
+    })
@@ -0,0 +1,195 @@
+"""
+Chỉ mục nội dung cho ingest: sha256 của ảnh -> key canonical trong bucket.
+
+Ảnh có nội dung đã tồn tại dưới key khác không được ghi lại; thay vào đó
+key mới là một object rỗng (alias) với metadata "alias-of" trỏ về key
+canonical. Lambda nhận diện đọc metadata này và chép label của ảnh gốc thay
+vì gọi Rekognition lần nữa.
+
+Item của bảng DEDUP_TABLE:
+    {"sha256": S, "key": S, "size": N, "created_at": N, "etag": S}
+"etag" là ETag của object canonical, ghi sau khi upload xong. Object ghi bằng
+multipart upload (và object được ghi đè qua URL ký sẵn) không có metadata
+sha256, chỉ ETag này cho biết object vẫn đúng là nội dung đã claim.
+"""
+import os
+import time
+import botocore.exceptions
+from shared import clients, metrics
+
+DEDUP_TABLE = os.getenv('DEDUP_TABLE')
+# Dùng chung client S3 (cùng cỡ pool) với get_save_image
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+# Entry mới hơn mốc này có thể thuộc về một upload chưa ghi xong lên S3,
+# không được coi là hỏng dù object canonical chưa tồn tại.
+CLAIM_GRACE_SECONDS = int(os.getenv('DEDUP_CLAIM_GRACE_SECONDS', '300'))
+
+ALIAS_METADATA_KEY = 'alias-of'
+DIGEST_METADATA_KEY = 'sha256'
+
+# Kết quả của claim()
+NEW = 'new'
+DUPLICATE = 'duplicate'
+UNCHANGED = 'unchanged'
+
+
+def is_enabled():
+    return bool(DEDUP_TABLE)
+
+
+def _ddb_client():
+    return clients.get_client("dynamodb")
+
+
+def _s3_client():
+    return clients.get_client("s3", max_pool_connections=HTTP_POOL_SIZE)
+
+
+def _canonical_exists(bucket, key, digest, etag=None):
+    """
+    Object canonical còn trong bucket và vẫn đúng nội dung: metadata sha256
+    khớp digest, hoặc (không có metadata) ETag khớp etag đã ghi trong entry.
+    Object không chứng minh được nội dung bị coi như không còn.
+    """
+    try:
+        with metrics.timer("S3Head"):
+            response = _s3_client().head_object(Bucket=bucket, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+    metadata = response.get('Metadata') or {}
+    if ALIAS_METADATA_KEY in metadata:
+        return False
+    stored = metadata.get(DIGEST_METADATA_KEY)
+    if stored is not None:
+        return stored == digest
+    return etag is not None and response.get('ETag') == etag
+
+
+def _put_entry(digest, key, size, previous=None):
+    """
+    Ghi entry digest -> key. previous=None chỉ ghi khi digest chưa có,
+    ngược lại chỉ ghi đè khi entry hiện tại vẫn trỏ tới previous.
+    """
+    kwargs = {'ConditionExpression': 'attribute_not_exists(sha256)'}
+    if previous is not None:
+        kwargs = {
+            'ConditionExpression': '#key = :previous',
+            'ExpressionAttributeNames': {'#key': 'key'},
+            'ExpressionAttributeValues': {':previous': {'S': previous}},
+        }
+    with metrics.timer("DedupClaim"):
+        _ddb_client().put_item(
+            TableName=DEDUP_TABLE,
+            Item={
+                'sha256': {'S': digest},
+                'key': {'S': key},
+                'size': {'N': str(size)},
+                'created_at': {'N': str(int(time.time()))},
+            },
+            **kwargs
+        )
+
+
+def _is_conditional_failure(error):
+    return error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+def _get_entry(digest):
+    with metrics.timer("DedupClaim"):
+        return _ddb_client().get_item(
+            TableName=DEDUP_TABLE, Key={'sha256': {'S': digest}}, ConsistentRead=True).get('Item')
+
+
+def claim(bucket, key, digest, size):
+    """
+    Đăng ký key là canonical của digest nếu nội dung chưa có trong chỉ mục.
+    Trả về (status, canonical_key):
+        NEW       - key vừa trở thành canonical, cần ghi object như bình thường
+        DUPLICATE - nội dung đã có dưới canonical_key, chỉ cần ghi alias
+        UNCHANGED - key đã là canonical với cùng nội dung, không cần ghi gì
+    Entry trỏ tới object đã bị xóa hoặc ghi đè được chuyển sang key mới.
+    """
+    try:
+        _put_entry(digest, key, size)
+        return NEW, key
+    except botocore.exceptions.ClientError as e:
+        if not _is_conditional_failure(e):
+            raise
+
+    existing = _get_entry(digest)
+    if existing is None:
+        # Entry vừa bị xóa giữa hai lần gọi, thử claim lại
+        return claim(bucket, key, digest, size)
+    canonical = existing['key']['S']
+    if _canonical_exists(bucket, canonical, digest, existing.get('etag', {}).get('S')):
+        return (UNCHANGED if canonical == key else DUPLICATE), canonical
+    if canonical == key:
+        # Lần ghi trước của chính key này chưa xong hoặc đã bị xóa, ghi lại
+        return NEW, key
+
+    created_at = int(existing.get('created_at', {}).get('N', '0'))
+    if 'etag' not in existing and time.time() - created_at < CLAIM_GRACE_SECONDS:
+        # Upload của canonical có thể vẫn đang chạy (entry có ETag là upload đã xong)
+        return DUPLICATE, canonical
+    try:
+        _put_entry(digest, key, size, previous=canonical)
+        print(f"Content index entry for {canonical} is stale, {key} is now canonical.")
+        return NEW, key
+    except botocore.exceptions.ClientError as e:
+        if not _is_conditional_failure(e):
+            raise
+    # Một ingest khác vừa chuyển entry sang key của nó
+    return claim(bucket, key, digest, size)
+
+
+def record_etag(digest, key, etag):
+    """
+    Ghi ETag của object canonical vừa upload vào entry (nếu entry vẫn trỏ tới key).
+    Lỗi chỉ được log: entry không có ETag thì object không có metadata sha256
+    bị coi là đã đổi và nội dung được claim lại ở lần ingest sau.
+    """
+    try:
+        with metrics.timer("DedupClaim"):
+            _ddb_client().update_item(
+                TableName=DEDUP_TABLE,
+                Key={'sha256': {'S': digest}},
+                UpdateExpression='SET etag = :etag',
+                ConditionExpression='#key = :key',
+                ExpressionAttributeNames={'#key': 'key'},
+                ExpressionAttributeValues={':etag': {'S': etag}, ':key': {'S': key}},
+            )
+    except botocore.exceptions.ClientError as e:
+        if not _is_conditional_failure(e):
+            print(f"Error recording ETag of {key} in content index: {e}")
+
+
+def release(digest, key):
+    """
+    Xóa entry đã claim khi việc ghi object canonical thất bại, để lần ingest
+    sau không trỏ alias vào một object không tồn tại.
+    """
+    try:
+        with metrics.timer("DedupClaim"):
+            _ddb_client().delete_item(
+                TableName=DEDUP_TABLE,
+                Key={'sha256': {'S': digest}},
+                ConditionExpression='#key = :key',
+                ExpressionAttributeNames={'#key': 'key'},
+                ExpressionAttributeValues={':key': {'S': key}},
+            )
+    except botocore.exceptions.ClientError as e:
+        if not _is_conditional_failure(e):
+            print(f"Error releasing content index entry for {key}: {e}")
+
+
+def write_alias(bucket, key, canonical, digest, content_type=None):
+    """
+    Ghi object rỗng tại key, metadata trỏ về object canonical.
+    """
+    extra = {'ContentType': content_type} if content_type else {}
+    with metrics.timer("S3Put"):
+        _s3_client().put_object(
+            Bucket=bucket, Key=key, Body=b'',
+            Metadata={ALIAS_METADATA_KEY: canonical, DIGEST_METADATA_KEY: digest}, **extra)
@@ -1,19 +1,79 @@
 import os
 import json
-import boto3
-import requests
+import time
+import hashlib
 import botocore.exceptions
+import content_index
+from shared import clients, metrics
+
+# Số kết nối giữ lại (keep-alive) cho mỗi host, dùng chung cho HTTP và S3
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
 
-s3_client = boto3.client("s3")
 S3_BUCKET = os.getenv('BUCKET_NAME')
 
+# Cấu hình chế độ streaming ingest
+STREAMING_INGEST = os.getenv('STREAMING_INGEST', 'true').lower() == 'true'
+MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', str(50 * 1024 * 1024)))
+# Danh sách content-type cho phép, phần tử kết thúc bằng "/" được so khớp theo tiền tố
+ALLOWED_CONTENT_TYPES = [
+    t.strip().lower() for t in os.getenv('ALLOWED_CONTENT_TYPES', 'image/').split(',') if t.strip()
+]
+CHUNK_SIZE = 64 * 1024
+# S3 yêu cầu mỗi part (trừ part cuối) tối thiểu 5 MiB
+PART_SIZE = max(5 * 1024 * 1024, int(os.getenv('MULTIPART_PART_SIZE', str(8 * 1024 * 1024))))
+
+
+class IngestError(Exception):
+    """
+    Lỗi khi ingest ảnh, kèm status code để trả về cho API Gateway.
+    """
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# Kết quả ingest: đã ghi ảnh, ảnh trùng nội dung (chỉ ghi alias), hoặc key đã có đúng nội dung này
+UPLOADED = 'uploaded'
+DUPLICATE = 'duplicate'
+UNCHANGED = 'unchanged'
+
+
+def _s3_client():
+    # Client S3 được tạo lazy, pool kết nối cùng cỡ với HTTP
+    return clients.get_client("s3", max_pool_connections=HTTP_POOL_SIZE)
+
+
+# Session được giữ lại giữa các lần invoke khi container còn warm
+_session = None
+
+
+def get_session():
+    """
+    Trả về requests.Session dùng chung với connection pool keep-alive.
+    """
+    global _session
+    if _session is None:
+        # requests chỉ được import khi thực sự cần tải ảnh
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
 #1 Create function to download the content from a url without a filename and print any request exception.
 def get_file_from_url(url):
+    import requests
     try:
-        response = requests.get(url)
-        # Kiểm tra nếu request thành công (status code 200)
-        response.raise_for_status() 
-        return response.content
+        with metrics.timer("Download"):
+            response = get_session().get(url)
+            # Kiểm tra nếu request thành công (status code 200)
+            response.raise_for_status() 
+            content = response.content
+        metrics.put("ImageBytes", len(content), "Bytes")
+        return content
     except requests.exceptions.RequestException as e:
         print(f"Error downloading file from URL {url}: {e}")
         return None # Trả về None nếu có lỗi
@@ -27,17 +87,252 @@ def upload_image_to_s3(bucket, key, data):
         print("No data to upload to S3.")
         return False
     try:
+        metadata = {}
+        if content_index.is_enabled():
+            digest = hashlib.sha256(data).hexdigest()
+            status, canonical = claim_content(bucket, key, digest, len(data))
+            if status != UPLOADED:
+                finish_duplicate(bucket, key, status, canonical, digest)
+                return True
+            metadata = {content_index.DIGEST_METADATA_KEY: digest}
         print(f"Uploading image to S3 bucket: {bucket} with key: {key}")
-        s3_client.put_object(Body=data, Bucket=bucket, Key=key)
+        with metrics.timer("S3Put"):
+            response = _s3_client().put_object(Body=data, Bucket=bucket, Key=key, Metadata=metadata)
+        if metadata:
+            content_index.record_etag(digest, key, response['ETag'])
         print("Image uploaded successfully!")
         return True
     except botocore.exceptions.ClientError as e:
         print("Error uploading image to S3")
         print(e)
+        if metadata:
+            # Entry đã claim trỏ vào object không được ghi
+            content_index.release(digest, key)
         return False
 
 
+def claim_content(bucket, key, digest, size):
+    """
+    Tra chỉ mục nội dung. Trả về (UPLOADED | DUPLICATE | UNCHANGED, canonical_key).
+    Lỗi của chỉ mục không chặn ingest, ảnh được ghi như khi tắt dedup.
+    """
+    try:
+        status, canonical = content_index.claim(bucket, key, digest, size)
+    except botocore.exceptions.ClientError as e:
+        print(f"Content index lookup failed for {key}, uploading without dedup: {e}")
+        return UPLOADED, key
+    if status == content_index.NEW:
+        return UPLOADED, key
+    return (DUPLICATE if status == content_index.DUPLICATE else UNCHANGED), canonical
+
+
+def finish_duplicate(bucket, key, status, canonical, digest, content_type=None):
+    """
+    Ghi alias cho ảnh trùng nội dung; key đã có đúng nội dung thì không ghi gì.
+    """
+    metrics.put("DuplicateImages", 1)
+    if status == DUPLICATE:
+        content_index.write_alias(bucket, key, canonical, digest, content_type)
+        print(f"Image {key} has the same content as {canonical}, wrote alias only.")
+    else:
+        print(f"Image {key} is unchanged, skipped upload.")
+
+
+def is_allowed_content_type(content_type, allowed=None):
+    """
+    Kiểm tra header Content-Type với danh sách cho phép.
+    """
+    allowed = ALLOWED_CONTENT_TYPES if allowed is None else allowed
+    if not allowed:
+        return True
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    return any(
+        media_type.startswith(t) if t.endswith('/') else media_type == t
+        for t in allowed
+    )
+
+
+class S3StreamWriter:
+    """
+    Ghi dữ liệu vào S3 theo từng part khi bytes tới nơi.
+    Ảnh nhỏ hơn một part được ghi bằng một put_object duy nhất,
+    ảnh lớn hơn dùng multipart upload nên bộ nhớ chỉ giữ tối đa một part.
+    """
+    def __init__(self, bucket, key, content_type=None, part_size=PART_SIZE):
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.size = 0
+        # Metadata đặt trước part đầu tiên được ghi kèm object (put_object hoặc
+        # create_multipart_upload); digest tính khi stream chỉ có sau part đầu
+        # nên object multipart được nhận diện qua ETag trong chỉ mục nội dung
+        self.metadata = {}
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def _extra_args(self):
+        extra_args = {'ContentType': self.content_type} if self.content_type else {}
+        if self.metadata:
+            extra_args['Metadata'] = dict(self.metadata)
+        return extra_args
+
+    def _flush_part(self):
+        if self._upload_id is None:
+            with metrics.timer("S3Put"):
+                response = _s3_client().create_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, **self._extra_args())
+            self._upload_id = response['UploadId']
+        part_number = len(self._parts) + 1
+        with metrics.timer("S3Put"):
+            response = _s3_client().upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                PartNumber=part_number, Body=bytes(self._buffer))
+        self._parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        self._buffer.clear()
+
+    def write(self, chunk):
+        self._buffer.extend(chunk)
+        self.size += len(chunk)
+        if len(self._buffer) >= self.part_size:
+            self._flush_part()
+
+    def close(self):
+        """
+        Hoàn tất ghi object, trả về ETag của object.
+        """
+        if self._upload_id is None:
+            with metrics.timer("S3Put"):
+                response = _s3_client().put_object(
+                    Body=bytes(self._buffer), Bucket=self.bucket, Key=self.key, **self._extra_args())
+            self._buffer.clear()
+            return response['ETag']
+        if self._buffer:
+            self._flush_part()
+        with metrics.timer("S3Put"):
+            response = _s3_client().complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                MultipartUpload={'Parts': self._parts})
+        return response['ETag']
+
+    def abort(self):
+        self._buffer.clear()
+        if self._upload_id is not None:
+            try:
+                _s3_client().abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except botocore.exceptions.ClientError as e:
+                print(f"Error aborting multipart upload for {self.key}: {e}")
+
+
+#3 Stream nội dung từ url thẳng lên S3, kiểm tra content-type và kích thước trong lúc tải.
+def stream_url_to_s3(url, bucket, key, max_bytes=None, allowed_types=None, session=None, deadline=None):
+    """
+    Tải ảnh theo từng chunk và ghi lên S3 ngay khi nhận được.
+    Dừng sớm nếu content-type không hợp lệ, vượt quá max_bytes hoặc quá
+    deadline (time.monotonic(), timeout của request cũng không vượt quá mốc này).
+    Khi bật chỉ mục nội dung (DEDUP_TABLE), sha256 được tính trong lúc stream;
+    ảnh trùng nội dung chỉ được ghi alias (part đã tải lên bị hủy).
+    Trả về {"bytes", "status", "canonical"}, raise IngestError nếu thất bại.
+    """
+    import requests
+    max_bytes = MAX_IMAGE_BYTES if max_bytes is None else max_bytes
+    http = session or get_session()
+    timeout = (5, 30)
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise IngestError('Deadline exceeded before download started.', 503)
+        timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+    try:
+        # Chỉ tính tới khi nhận header, phần body được stream xen kẽ với S3Put
+        with metrics.timer("Download"):
+            response = http.get(url, stream=True, timeout=timeout)
+            response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Error downloading file from URL {url}: {e}")
+        raise IngestError(f'Failed to download image from {url}', 500)
+
+    with response:
+        content_type = response.headers.get('Content-Type')
+        if not is_allowed_content_type(content_type, allowed_types):
+            raise IngestError(f'Unsupported content type: {content_type}', 415)
+
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise IngestError(f'Image exceeds maximum size of {max_bytes} bytes', 413)
+
+        writer = S3StreamWriter(bucket, key, content_type=content_type)
+        hasher = hashlib.sha256() if content_index.is_enabled() else None
+        status, canonical = UPLOADED, key
+        try:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if writer.size + len(chunk) > max_bytes:
+                    raise IngestError(f'Image exceeds maximum size of {max_bytes} bytes', 413)
+                if deadline is not None and time.monotonic() > deadline:
+                    raise IngestError('Download did not finish before the deadline.', 504)
+                writer.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+            if hasher is None:
+                writer.close()
+            else:
+                status, canonical = _close_deduplicated(writer, hasher.hexdigest())
+        except requests.exceptions.RequestException as e:
+            writer.abort()
+            print(f"Error streaming file from URL {url}: {e}")
+            raise IngestError(f'Failed to download image from {url}', 500)
+        except botocore.exceptions.ClientError as e:
+            writer.abort()
+            print("Error uploading image to S3")
+            print(e)
+            raise IngestError('Failed to upload image to S3.', 500)
+        except BaseException:
+            writer.abort()
+            raise
+
+    metrics.put("ImageBytes", writer.size, "Bytes")
+    if status == UPLOADED:
+        print(f"Streamed {writer.size} bytes to S3 bucket: {bucket} with key: {key}")
+    return {'bytes': writer.size, 'status': status, 'canonical': canonical}
+
+
+def _close_deduplicated(writer, digest):
+    """
+    Hoàn tất upload sau khi tra chỉ mục nội dung: ghi object nếu nội dung mới,
+    ngược lại hủy upload và chỉ ghi alias.
+    """
+    status, canonical = claim_content(writer.bucket, writer.key, digest, writer.size)
+    if status == UPLOADED:
+        writer.metadata[content_index.DIGEST_METADATA_KEY] = digest
+        try:
+            etag = writer.close()
+        except BaseException:
+            content_index.release(digest, writer.key)
+            raise
+        content_index.record_etag(digest, writer.key, etag)
+        return status, canonical
+    writer.abort()
+    finish_duplicate(writer.bucket, writer.key, status, canonical, digest, writer.content_type)
+    return status, canonical
+
+
+def warm_up():
+    """
+    Dựng trước client S3 và HTTP session, gọi trong init phase hoặc bởi warm-up event.
+    """
+    _s3_client()
+    get_session()
+    if content_index.is_enabled():
+        clients.warm_up("dynamodb")
+
+
+@metrics.instrument("GetSaveImage")
 def handler(event, context):
+    if clients.is_warmup_event(event):
+        warm_up()
+        return {'warmup': True}
     # Kiểm tra xem queryStringParameters có tồn tại không
     if "queryStringParameters" not in event:
         return {
@@ -55,6 +350,25 @@ def handler(event, context):
             'body': json.dumps('Missing "url" or "name" in queryStringParameters.')
         }
 
+    if STREAMING_INGEST:
+        # call method #3 to stream image straight to s3
+        try:
+            result = stream_url_to_s3(url, S3_BUCKET, name)
+        except IngestError as e:
+            return {
+                'statusCode': e.status_code,
+                'body': json.dumps(str(e))
+            }
+        if result['status'] != UPLOADED:
+            return {
+                'statusCode': 200,
+                'body': json.dumps(f"Image already exists as {result['canonical']}, linked without re-upload.")
+            }
+        return {
+            'statusCode': 200,
+            'body': json.dumps('Successfully Uploaded Img!')
+        }
+
     # call method #1 to download image
     data = get_file_from_url(url)
 
@@ -76,4 +390,8 @@ def handler(event, context):
         return {
             'statusCode': 500,
             'body': json.dumps('Failed to upload image to S3.')
-        }
\ No newline at end of file
+        }
+
+
+if clients.WARM_UP_ON_INIT:
+    warm_up()
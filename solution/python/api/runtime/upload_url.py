@@ -0,0 +1,295 @@
+"""
+Upload trực tiếp lên S3 bằng URL ký sẵn, bytes của ảnh không đi qua Lambda.
+
+    POST /uploads            {"name": "a.jpg", "content_type": "image/jpeg", "size": 123456, "priority": "bulk"}
+    POST /uploads/complete   {"name": "a.jpg", "upload_id": "...", "upload_token": "...",
+                              "parts": [{"part_number": 1, "etag": "..."}]}
+
+Ảnh nhỏ hơn MULTIPART_THRESHOLD nhận một presigned POST: policy ràng buộc
+key, Content-Type và content-length đúng bằng size đã khai báo. Ảnh lớn hơn
+nhận một multipart upload với URL PUT ký sẵn cho từng part (Content-Length
+của part nằm trong chữ ký); client upload các part rồi gọi /uploads/complete
+với upload_token nhận được. Token ký HMAC (khóa trong Secrets Manager) ràng
+buộc key, upload_id, size và priority như policy của presigned POST, nên
+/uploads/complete chỉ ghép được upload do /uploads mở, đúng tiền tố key của
+priority, và tổng kích thước đọc từ S3 phải bằng size đã khai báo.
+
+Notification ObjectCreated của bucket vẫn kích hoạt nhận diện như với
+get_save_image. Ảnh upload trực tiếp không qua chỉ mục nội dung (dedup).
+"priority": "bulk" (tùy chọn) thêm BULK_KEY_PREFIX vào key để ảnh được nhận
+diện ở lane bulk; client dùng "name" trong response cho /uploads/complete.
+"""
+import os
+import json
+import time
+import hmac
+import base64
+import hashlib
+import botocore.exceptions
+from shared import clients, metrics
+from get_save_image import S3_BUCKET, HTTP_POOL_SIZE, MAX_IMAGE_BYTES, PART_SIZE, is_allowed_content_type
+
+# Thời hạn của URL ký sẵn
+EXPIRES_SECONDS = int(os.getenv('PRESIGN_EXPIRES_SECONDS', '900'))
+# Ảnh từ kích thước này trở lên dùng multipart upload
+MULTIPART_THRESHOLD = int(os.getenv('PRESIGN_MULTIPART_THRESHOLD', str(2 * PART_SIZE)))
+# Tiền tố key của ảnh "priority": "bulk", xem bulk_ingest.BULK_KEY_PREFIX
+BULK_KEY_PREFIX = os.getenv('BULK_KEY_PREFIX', '')
+PRIORITIES = ('interactive', 'bulk')
+# Giới hạn số part của S3
+MAX_PARTS = 10000
+# Secret chứa khóa ký upload_token của multipart upload
+UPLOAD_TOKEN_SECRET_ARN = os.getenv('UPLOAD_TOKEN_SECRET_ARN')
+# Thời hạn của upload_token (thời gian upload các part và gọi /uploads/complete)
+TOKEN_EXPIRES_SECONDS = int(os.getenv('UPLOAD_TOKEN_EXPIRES_SECONDS', '3600'))
+
+# Khóa ký token, đọc từ Secrets Manager một lần mỗi container
+_token_key = None
+
+
+def _s3_client():
+    # SigV4 để Content-Length của từng part nằm trong chữ ký
+    return clients.get_client("s3", max_pool_connections=HTTP_POOL_SIZE, signature_version="s3v4")
+
+
+def _response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body)
+    }
+
+
+def _parse_body(event):
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError('Body must be a JSON object.')
+    return data
+
+
+def _get_token_key():
+    global _token_key
+    if _token_key is None:
+        if not UPLOAD_TOKEN_SECRET_ARN:
+            raise RuntimeError('UPLOAD_TOKEN_SECRET_ARN is not set')
+        with metrics.timer("SecretLookup"):
+            response = clients.get_client("secretsmanager").get_secret_value(SecretId=UPLOAD_TOKEN_SECRET_ARN)
+        _token_key = response['SecretString'].encode('utf-8')
+    return _token_key
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def sign_upload(key, upload_id, size, priority):
+    """
+    upload_token cho multipart upload: payload JSON và HMAC-SHA256 của nó.
+    """
+    payload = json.dumps({'key': key, 'upload_id': upload_id, 'size': size, 'priority': priority,
+                          'expires_at': int(time.time()) + TOKEN_EXPIRES_SECONDS},
+                         separators=(',', ':'), sort_keys=True).encode('utf-8')
+    signature = hmac.new(_get_token_key(), payload, hashlib.sha256).digest()
+    return f"{_b64encode(payload)}.{_b64encode(signature)}"
+
+
+def verify_upload(token):
+    """
+    Payload của upload_token nếu chữ ký đúng và token chưa hết hạn, ngược lại None.
+    """
+    try:
+        payload, signature = (_b64decode(part) for part in token.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    expected = hmac.new(_get_token_key(), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    try:
+        claims = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get('expires_at'), int):
+        return None
+    if claims['expires_at'] < time.time():
+        return None
+    return claims
+
+
+def _has_priority_prefix(key, priority):
+    """
+    Key nằm đúng tiền tố của priority như create_upload đã đặt.
+    """
+    return priority != 'bulk' or key.startswith(BULK_KEY_PREFIX)
+
+
+def presign_post(key, content_type, size):
+    """
+    Presigned POST cho một ảnh, chỉ chấp nhận đúng key, Content-Type và size.
+    """
+    with metrics.timer("Presign"):
+        post = _s3_client().generate_presigned_post(
+            Bucket=S3_BUCKET,
+            Key=key,
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', size, size],
+            ],
+            ExpiresIn=EXPIRES_SECONDS,
+        )
+    return {'method': 'POST', 'name': key, 'url': post['url'], 'fields': post['fields'],
+            'expires_in': EXPIRES_SECONDS}
+
+
+def presign_multipart(key, content_type, size, priority):
+    """
+    Mở multipart upload và ký URL PUT cho từng part PART_SIZE bytes (part cuối
+    nhỏ hơn), kèm upload_token cho /uploads/complete.
+    """
+    # Đọc khóa ký trước để không mở multipart upload khi không cấp được token
+    _get_token_key()
+    part_count = -(-size // PART_SIZE)
+    s3 = _s3_client()
+    with metrics.timer("S3CreateMultipart"):
+        upload_id = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=key, ContentType=content_type)['UploadId']
+    parts = []
+    with metrics.timer("Presign"):
+        for number in range(1, part_count + 1):
+            part_size = min(PART_SIZE, size - (number - 1) * PART_SIZE)
+            url = s3.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': S3_BUCKET, 'Key': key, 'UploadId': upload_id,
+                        'PartNumber': number, 'ContentLength': part_size},
+                ExpiresIn=EXPIRES_SECONDS,
+            )
+            parts.append({'part_number': number, 'size': part_size, 'url': url})
+    return {'method': 'MULTIPART', 'name': key, 'upload_id': upload_id, 'part_size': PART_SIZE,
+            'parts': parts, 'expires_in': EXPIRES_SECONDS,
+            'upload_token': sign_upload(key, upload_id, size, priority)}
+
+
+def create_upload(data):
+    name = data.get('name')
+    content_type = data.get('content_type')
+    size = data.get('size')
+    if not isinstance(name, str) or not name:
+        return _response(400, 'Missing "name".')
+    if not isinstance(content_type, str) or not is_allowed_content_type(content_type):
+        return _response(415, f'Unsupported content type: {content_type}')
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        return _response(400, '"size" must be a positive integer (bytes).')
+    if size > MAX_IMAGE_BYTES:
+        return _response(413, f'Image exceeds {MAX_IMAGE_BYTES} bytes.')
+    if size > PART_SIZE * MAX_PARTS:
+        return _response(413, 'Image has too many parts for a multipart upload.')
+    priority = data.get('priority') or 'interactive'
+    if priority not in PRIORITIES:
+        return _response(400, f'"priority" must be one of {", ".join(PRIORITIES)}.')
+    if priority == 'bulk' and not name.startswith(BULK_KEY_PREFIX):
+        name = BULK_KEY_PREFIX + name
+
+    if size < MULTIPART_THRESHOLD:
+        result = presign_post(name, content_type, size)
+    else:
+        result = presign_multipart(name, content_type, size, priority)
+    metrics.put("PresignedUploads", 1)
+    print(f"Presigned {result['method']} upload for {name} ({size} bytes).")
+    return _response(200, result)
+
+
+def _uploaded_size(key, upload_id):
+    """
+    Tổng kích thước các part đã upload, đọc từ S3 thay vì tin client.
+    """
+    s3 = _s3_client()
+    total = 0
+    kwargs = {'Bucket': S3_BUCKET, 'Key': key, 'UploadId': upload_id}
+    while True:
+        with metrics.timer("S3ListParts"):
+            response = s3.list_parts(**kwargs)
+        total += sum(part['Size'] for part in response.get('Parts', []))
+        if not response.get('IsTruncated'):
+            return total
+        kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+
+def complete_upload(data):
+    name = data.get('name')
+    upload_id = data.get('upload_id')
+    parts = data.get('parts')
+    if not isinstance(name, str) or not name or not isinstance(upload_id, str) or not upload_id:
+        return _response(400, 'Missing "name" or "upload_id".')
+    token = data.get('upload_token')
+    if not isinstance(token, str) or not token:
+        return _response(403, 'Missing "upload_token".')
+    claims = verify_upload(token)
+    if claims is None:
+        metrics.put("InvalidUploadTokens", 1)
+        return _response(403, 'Invalid or expired "upload_token".')
+    if claims.get('key') != name or claims.get('upload_id') != upload_id \
+            or not _has_priority_prefix(name, claims.get('priority')):
+        metrics.put("InvalidUploadTokens", 1)
+        return _response(403, '"upload_token" was not issued for this upload.')
+    try:
+        parts = sorted(
+            ({'PartNumber': int(part['part_number']), 'ETag': str(part['etag'])} for part in parts),
+            key=lambda part: part['PartNumber'],
+        )
+    except (TypeError, KeyError, ValueError):
+        return _response(400, '"parts" must be a list of {"part_number", "etag"}.')
+    if not parts:
+        return _response(400, 'No parts to complete.')
+
+    s3 = _s3_client()
+    try:
+        size = _uploaded_size(name, upload_id)
+        if size != claims.get('size'):
+            with metrics.timer("S3AbortMultipart"):
+                s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=name, UploadId=upload_id)
+            status = 413 if size > MAX_IMAGE_BYTES else 400
+            return _response(status, f'Uploaded {size} bytes, declared {claims.get("size")}; upload aborted.')
+        with metrics.timer("S3CompleteMultipart"):
+            s3.complete_multipart_upload(Bucket=S3_BUCKET, Key=name, UploadId=upload_id,
+                                         MultipartUpload={'Parts': parts})
+    except botocore.exceptions.ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code == 'NoSuchUpload':
+            return _response(404, 'Upload not found or already completed.')
+        if code in ('InvalidPart', 'InvalidPartOrder', 'EntityTooSmall'):
+            return _response(400, f'Cannot complete upload: {code}')
+        print(f"Error completing multipart upload for {name}: {e}")
+        return _response(500, 'Failed to complete upload.')
+    metrics.put("ImageBytes", size, "Bytes")
+    print(f"Completed direct upload of {name} ({size} bytes).")
+    return _response(200, {'name': name, 'size': size})
+
+
+def warm_up():
+    _s3_client()
+    if UPLOAD_TOKEN_SECRET_ARN:
+        _get_token_key()
+
+
+@metrics.instrument("UploadUrl")
+def handler(event, context):
+    if clients.is_warmup_event(event):
+        warm_up()
+        return {'warmup': True}
+    try:
+        data = _parse_body(event)
+    except (ValueError, TypeError) as e:
+        return _response(400, f'Invalid request body: {e}')
+
+    if (event.get('resource') or event.get('path') or '').rstrip('/').endswith('/complete'):
+        return complete_upload(data)
+    return create_upload(data)
+
+
+if clients.WARM_UP_ON_INIT:
+    warm_up()
@@ -19,9 +19,12 @@ integrationStack = IntegrationStack(
 RekognitionStack(
     app,
     "RekognitionStack",
-    sqs_url=apiStack.sqs_url,
     sqs_arn=apiStack.sqs_arn,
+    bulk_sqs_arn=apiStack.bulk_sqs_arn,
     sns_arn=integrationStack.sns_arn,
+    event_payload_bucket_arn=integrationStack.event_payload_bucket_arn,
+    event_payload_bucket_name=integrationStack.event_payload_bucket_name,
+    image_bucket_arn=apiStack.bucket_arn,
     env=cdk.Environment(region=DEFAULT_REGION)
 )
 
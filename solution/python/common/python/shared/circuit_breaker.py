@@ -0,0 +1,127 @@
+"""
+Circuit breaker cho một dependency bên ngoài (endpoint của bên thứ ba) để
+không tiếp tục chờ timeout khi dependency đã suy giảm.
+
+    breaker = circuit_breaker.CircuitBreaker("ThirdParty")
+    if breaker.allow():
+        started = time.monotonic()
+        try:
+            post(...)
+        except Exception:
+            breaker.record_failure()
+        else:
+            breaker.record_success(time.monotonic() - started)
+    else:
+        defer(retry_after=breaker.retry_after())
+
+CLOSED: mọi lời gọi được phép, FAILURE_THRESHOLD lỗi liên tiếp (lời gọi chậm
+hơn SLOW_CALL_SECONDS cũng tính là lỗi) thì chuyển OPEN.
+OPEN: không gọi trong RESET_SECONDS, sau đó HALF_OPEN.
+HALF_OPEN: cho tối đa HALF_OPEN_CALLS lời gọi thử đồng thời; thành công thì
+CLOSED, lỗi thì OPEN lại với thời gian gấp đôi (tối đa MAX_RESET_SECONDS).
+
+Trạng thái nằm ở mức module nên được giữ giữa các lần invoke khi container
+còn warm; mỗi container có breaker riêng.
+"""
+import os
+import time
+import threading
+from shared import metrics
+
+FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "30"))
+MAX_RESET_SECONDS = float(os.environ.get("CIRCUIT_MAX_RESET_SECONDS", "300"))
+HALF_OPEN_CALLS = int(os.environ.get("CIRCUIT_HALF_OPEN_CALLS", "1"))
+# Lời gọi thành công nhưng chậm hơn ngưỡng này vẫn tính là lỗi (0 là tắt)
+SLOW_CALL_SECONDS = float(os.environ.get("CIRCUIT_SLOW_CALL_SECONDS", "5"))
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+
+class CircuitOpen(Exception):
+    """
+    Breaker đang OPEN (hoặc HALF_OPEN đã đủ lượt gọi thử), không gọi dependency.
+    """
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_seconds=RESET_SECONDS,
+                 max_reset_seconds=MAX_RESET_SECONDS, half_open_calls=HALF_OPEN_CALLS,
+                 slow_call_seconds=SLOW_CALL_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_reset_seconds = max_reset_seconds
+        self.half_open_calls = half_open_calls
+        self.slow_call_seconds = slow_call_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._open_seconds = reset_seconds
+        self._open_until = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        True nếu được gọi dependency. Ở HALF_OPEN mỗi lần True là một lời gọi
+        thử, phải kết thúc bằng record_success hoặc record_failure.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() < self._open_until:
+                    return False
+                self.state = HALF_OPEN
+                self._probes = 0
+                print(f"Circuit {self.name} is half-open, probing.")
+            if self.state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    return False
+                self._probes += 1
+            return True
+
+    def retry_after(self):
+        """
+        Số giây đến khi breaker cho lời gọi thử tiếp theo (0 nếu đang CLOSED).
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            return max(0.0, self._open_until - time.monotonic())
+
+    def release(self):
+        """
+        Trả lại lượt gọi thử khi lời gọi không đến được dependency (lỗi phía mình).
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record_success(self, duration=0.0):
+        if self.slow_call_seconds and duration > self.slow_call_seconds:
+            metrics.put(f"{self.name}SlowCalls", 1)
+            self.record_failure()
+            return
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"Circuit {self.name} closed.")
+            self.state = CLOSED
+            self.failures = 0
+            self._open_seconds = self.reset_seconds
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                # Lời gọi thử lỗi: mở lại lâu hơn
+                self._open_seconds = min(self.max_reset_seconds, self._open_seconds * 2)
+            elif self.state == OPEN or self.failures < self.failure_threshold:
+                return
+            self.state = OPEN
+            self.opened += 1
+            self._open_until = time.monotonic() + self._open_seconds
+            open_seconds = self._open_seconds
+        print(f"Circuit {self.name} opened for {open_seconds:.0f}s after {self.failures} failures.")
+        metrics.put(f"{self.name}CircuitOpened", 1)
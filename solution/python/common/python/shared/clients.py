@@ -0,0 +1,79 @@
+"""
+Truy cập boto3 client dùng chung cho mọi Lambda runtime.
+
+Client chỉ được tạo ở lần dùng đầu tiên và được cache theo container, nên
+module runtime không phải import boto3 hay dựng client lúc import.
+"""
+import os
+import threading
+
+# Dựng sẵn client trong init phase (hữu ích với provisioned concurrency)
+WARM_UP_ON_INIT = os.environ.get("WARM_UP_ON_INIT", "false").lower() == "true"
+
+_clients = {}
+_lock = threading.Lock()
+_factory = None
+
+
+def _create_client(service_name, max_pool_connections=None, signature_version=None, max_attempts=None):
+    if _factory is not None:
+        return _factory(service_name, max_pool_connections=max_pool_connections)
+    import boto3
+    if max_pool_connections is None and signature_version is None and max_attempts is None:
+        return boto3.client(service_name)
+    from botocore.config import Config
+    options = {"max_pool_connections": max_pool_connections, "signature_version": signature_version}
+    if max_attempts is not None:
+        options["retries"] = {"mode": "standard", "total_max_attempts": max_attempts}
+    return boto3.client(service_name, config=Config(**{k: v for k, v in options.items() if v is not None}))
+
+
+def get_client(service_name, max_pool_connections=None, signature_version=None, max_attempts=None):
+    """
+    Trả về boto3 client của service, tạo lazy và dùng lại giữa các lần invoke.
+    signature_version="s3v4" cần cho URL ký sẵn có ràng buộc header (Content-Length).
+    max_attempts giới hạn tổng số lần gọi của botocore (1 = không retry).
+    """
+    key = (service_name, max_pool_connections, signature_version, max_attempts)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _create_client(service_name, max_pool_connections, signature_version, max_attempts)
+                _clients[key] = client
+    return client
+
+
+def set_client_factory(factory):
+    """
+    Thay cách tạo client (ví dụ bộ mô phỏng local), xóa cache hiện có.
+    factory(service_name, max_pool_connections=None) -> client
+    """
+    global _factory
+    with _lock:
+        _factory = factory
+        _clients.clear()
+
+
+def reset_clients():
+    with _lock:
+        _clients.clear()
+
+
+def warm_up(*services):
+    """
+    Dựng trước các client, services là tên service hoặc (tên, max_pool_connections).
+    """
+    for service in services:
+        if isinstance(service, tuple):
+            get_client(*service)
+        else:
+            get_client(service)
+
+
+def is_warmup_event(event):
+    """
+    Event {"warmup": true} chỉ dùng để làm ấm container.
+    """
+    return isinstance(event, dict) and event.get("warmup") is True
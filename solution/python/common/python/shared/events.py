@@ -0,0 +1,193 @@
+"""
+Envelope JSON có version cho event publish qua SNS, kèm claim check: payload
+lớn hơn INLINE_MAX_BYTES được ghi lên S3 và message chỉ mang con trỏ + digest.
+
+    message, attributes = events.encode(payload, "RecognitionCompleted", {"label_count": 3})
+    sns.publish(TopicArn=..., Message=message, MessageAttributes=attributes)
+
+    event = events.decode(record["body"])    # phía consumer
+    event.digest                              # không cần tải payload
+    event.payload                             # tải (và cache) payload từ S3 nếu cần
+
+Envelope (JSON compact):
+    {"envelope": 1, "type": S, "digest": "sha256:<hex>", "payload": {...}}
+    {"envelope": 1, "type": S, "digest": "sha256:<hex>",
+     "payload_ref": {"bucket": S, "key": S, "size": N}}
+digest là sha256 của payload ở dạng JSON chuẩn (sort_keys, không khoảng
+trắng), cũng là nội dung object trên S3 nên object được đặt tên theo digest
+(ghi lại cùng payload là idempotent) và được kiểm tra khi tải về.
+
+Message attribute "event_type", "envelope_version", "payload_location" và
+các attribute riêng của event dùng cho SNS filter policy; với raw message
+delivery chúng đi tiếp thành message attribute của SQS.
+
+Message không có "envelope" (định dạng cũ, payload nằm thẳng trong body)
+vẫn được decode như payload inline.
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from shared import clients, metrics
+
+ENVELOPE_VERSION = 1
+# Bucket cho payload offload, không đặt thì payload luôn nằm trong message
+PAYLOAD_BUCKET = os.environ.get("EVENT_PAYLOAD_BUCKET")
+PAYLOAD_PREFIX = os.environ.get("EVENT_PAYLOAD_PREFIX", "events/")
+# publish_batch giới hạn 256 KB cho cả batch 10 message nên ngưỡng phải nhỏ
+INLINE_MAX_BYTES = int(os.environ.get("EVENT_INLINE_MAX_BYTES", str(16 * 1024)))
+# Payload đã tải được cache theo digest trong container warm (LRU theo bytes)
+CACHE_MAX_BYTES = int(os.environ.get("EVENT_PAYLOAD_CACHE_BYTES", str(32 * 1024 * 1024)))
+# SNS cho tối đa 10 message attribute
+MAX_ATTRIBUTES = 10
+
+
+class PayloadError(Exception):
+    """
+    Payload offload không tải được hoặc không khớp digest.
+    """
+
+
+def canonical(payload):
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"))
+
+
+def digest_of(body):
+    return "sha256:" + hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def _attribute(value):
+    if isinstance(value, bool):
+        return {"DataType": "String", "StringValue": "true" if value else "false"}
+    if isinstance(value, (int, float)):
+        return {"DataType": "Number", "StringValue": repr(value)}
+    if isinstance(value, (list, tuple)):
+        return {"DataType": "String.Array", "StringValue": json.dumps(list(value), separators=(",", ":"))}
+    return {"DataType": "String", "StringValue": str(value)}
+
+
+def encode(payload, event_type, attributes=None):
+    """
+    Trả về (message, message attributes SNS) cho payload. Payload lớn hơn
+    INLINE_MAX_BYTES được ghi lên PAYLOAD_BUCKET (nếu có) trước khi trả về.
+    attributes là {tên: str | số | list str}, giá trị None bị bỏ qua.
+    """
+    body = canonical(payload)
+    digest = digest_of(body)
+    envelope = {"envelope": ENVELOPE_VERSION, "type": event_type, "digest": digest}
+    location = "inline"
+    size = len(body.encode("utf-8"))
+    if size > INLINE_MAX_BYTES and PAYLOAD_BUCKET:
+        key = f"{PAYLOAD_PREFIX}{digest.split(':', 1)[1]}.json"
+        with metrics.timer("EventPayloadPut"):
+            clients.get_client("s3").put_object(
+                Bucket=PAYLOAD_BUCKET, Key=key, Body=body.encode("utf-8"), ContentType="application/json")
+        metrics.put("EventPayloadBytesOffloaded", size, "Bytes")
+        envelope["payload_ref"] = {"bucket": PAYLOAD_BUCKET, "key": key, "size": size}
+        location = "s3"
+    else:
+        envelope["payload"] = payload
+    message_attributes = {
+        "event_type": _attribute(event_type),
+        "envelope_version": _attribute(ENVELOPE_VERSION),
+        "payload_location": _attribute(location),
+    }
+    for name, value in (attributes or {}).items():
+        if value is not None and len(message_attributes) < MAX_ATTRIBUTES:
+            message_attributes[name] = _attribute(value)
+    return json.dumps(envelope, separators=(",", ":")), message_attributes
+
+
+class _PayloadCache:
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # digest -> (payload, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            self._entries.move_to_end(digest)
+            return entry[0]
+
+    def put(self, digest, payload, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if digest in self._entries:
+                return
+            self._entries[digest] = (payload, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_cache = _PayloadCache()
+
+
+def fetch(reference, digest):
+    """
+    Tải payload offload từ S3 (hoặc cache), kiểm tra digest.
+    """
+    payload = _cache.get(digest)
+    if payload is not None:
+        metrics.put("EventPayloadCacheHits", 1)
+        return payload
+    try:
+        with metrics.timer("EventPayloadGet"):
+            body = clients.get_client("s3").get_object(
+                Bucket=reference["bucket"], Key=reference["key"])["Body"].read().decode("utf-8")
+    except Exception as e:
+        raise PayloadError(f"Could not fetch payload {reference.get('key')}: {e}")
+    if digest_of(body) != digest:
+        raise PayloadError(f"Digest mismatch for payload {reference.get('key')}")
+    payload = json.loads(body)
+    _cache.put(digest, payload, len(body))
+    return payload
+
+
+class Event:
+    """
+    Event đã decode. payload chỉ được tải khi truy cập lần đầu.
+    """
+    __slots__ = ("type", "digest", "reference", "_payload")
+
+    def __init__(self, event_type, digest, payload=None, reference=None):
+        self.type = event_type
+        self.digest = digest
+        self.reference = reference
+        self._payload = payload
+
+    @property
+    def payload(self):
+        if self._payload is None:
+            self._payload = fetch(self.reference, self.digest)
+        return self._payload
+
+
+def decode(message):
+    """
+    Đọc envelope từ message (str). Raise ValueError nếu không phải JSON object.
+    """
+    document = json.loads(message)
+    if not isinstance(document, dict):
+        raise ValueError("Event must be a JSON object")
+    if "envelope" not in document:
+        # Định dạng cũ: body chính là payload
+        return Event(None, digest_of(canonical(document)), payload=document)
+    if document["envelope"] > ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version {document['envelope']}")
+    if "payload_ref" in document:
+        return Event(document.get("type"), document["digest"], reference=document["payload_ref"])
+    payload = document.get("payload")
+    return Event(document.get("type"), document.get("digest") or digest_of(canonical(payload)), payload=payload)
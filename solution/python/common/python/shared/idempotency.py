@@ -0,0 +1,119 @@
+"""
+Sổ ghi (ledger) idempotency trên DynamoDB để không xử lý lại record đã xong
+khi SQS gửi lại message (timeout, lỗi giữa batch, at-least-once delivery).
+
+    ledger = idempotency.Ledger(os.environ["PROCESSING_LEDGER_TABLE"])
+    status, token = ledger.claim(key)
+    if status == idempotency.CLAIMED:
+        ...  # xử lý
+        ledger.complete(key, token)      # hoặc ledger.release(key, token) nếu lỗi
+
+Item: {"id": S, "status": S, "owner": S, "in_progress_until": N, "expires_at": N}
+"expires_at" là attribute TTL của bảng. Claim IN_PROGRESS quá
+in_progress_until (lần xử lý trước bị timeout) được lần sau chiếm lại.
+"""
+import os
+import time
+import uuid
+from shared import clients, metrics
+
+# Claim IN_PROGRESS được coi là bỏ dở sau khoảng này (phải > timeout của Lambda,
+# infrastructure đặt theo từng function: timeout + tuning.LEDGER_MARGIN_SECONDS)
+IN_PROGRESS_SECONDS = int(os.environ.get("LEDGER_IN_PROGRESS_SECONDS", "120"))
+# Thời gian giữ record COMPLETED (TTL), phải dài hơn thời gian giữ message của SQS
+TTL_SECONDS = int(os.environ.get("LEDGER_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Trạng thái lưu trong bảng
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETED = "COMPLETED"
+# Kết quả của claim(): lần này được quyền xử lý
+CLAIMED = "CLAIMED"
+
+
+def _is_conditional_failure(error):
+    return getattr(error, "response", {}).get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+
+class Ledger:
+    def __init__(self, table_name, in_progress_seconds=IN_PROGRESS_SECONDS, ttl_seconds=TTL_SECONDS):
+        self.table_name = table_name
+        self.in_progress_seconds = in_progress_seconds
+        self.ttl_seconds = ttl_seconds
+
+    def claim(self, key):
+        """
+        Đánh dấu key IN_PROGRESS nếu chưa có, hoặc claim trước đó đã quá hạn.
+        Trả về (CLAIMED, token) nếu được xử lý, (COMPLETED, None) nếu đã xong,
+        (IN_PROGRESS, None) nếu một lần xử lý khác đang giữ key.
+        """
+        now = int(time.time())
+        token = uuid.uuid4().hex
+        dynamodb = clients.get_client("dynamodb")
+        try:
+            with metrics.timer("LedgerClaim"):
+                dynamodb.put_item(
+                    TableName=self.table_name,
+                    Item={
+                        "id": {"S": key},
+                        "status": {"S": IN_PROGRESS},
+                        "owner": {"S": token},
+                        "in_progress_until": {"N": str(now + self.in_progress_seconds)},
+                        "expires_at": {"N": str(now + self.ttl_seconds)},
+                    },
+                    ConditionExpression="attribute_not_exists(id) OR (#status = :in_progress AND in_progress_until < :now)",
+                    ExpressionAttributeNames={"#status": "status"},
+                    ExpressionAttributeValues={":in_progress": {"S": IN_PROGRESS}, ":now": {"N": str(now)}},
+                )
+            return CLAIMED, token
+        except Exception as e:
+            if not _is_conditional_failure(e):
+                raise
+        with metrics.timer("LedgerClaim"):
+            item = dynamodb.get_item(TableName=self.table_name, Key={"id": {"S": key}},
+                                     ConsistentRead=True).get("Item")
+        if item is None:
+            # Record vừa hết hạn TTL hoặc bị release, thử lại
+            return self.claim(key)
+        return item["status"]["S"], None
+
+    def complete(self, key, token):
+        """
+        Chuyển claim của token sang COMPLETED. Trả về False nếu claim đã bị chiếm.
+        """
+        try:
+            with metrics.timer("LedgerComplete"):
+                clients.get_client("dynamodb").update_item(
+                    TableName=self.table_name,
+                    Key={"id": {"S": key}},
+                    UpdateExpression="SET #status = :completed, expires_at = :expires REMOVE in_progress_until, #owner",
+                    ConditionExpression="#owner = :owner",
+                    ExpressionAttributeNames={"#status": "status", "#owner": "owner"},
+                    ExpressionAttributeValues={
+                        ":completed": {"S": COMPLETED},
+                        ":owner": {"S": token},
+                        ":expires": {"N": str(int(time.time()) + self.ttl_seconds)},
+                    },
+                )
+            return True
+        except Exception as e:
+            if not _is_conditional_failure(e):
+                raise
+            print(f"Ledger claim for {key} was taken over before completion.")
+            return False
+
+    def release(self, key, token):
+        """
+        Xóa claim của token khi xử lý lỗi để lần gửi lại được xử lý ngay.
+        """
+        try:
+            with metrics.timer("LedgerComplete"):
+                clients.get_client("dynamodb").delete_item(
+                    TableName=self.table_name,
+                    Key={"id": {"S": key}},
+                    ConditionExpression="#owner = :owner",
+                    ExpressionAttributeNames={"#owner": "owner"},
+                    ExpressionAttributeValues={":owner": {"S": token}},
+                )
+        except Exception as e:
+            if not _is_conditional_failure(e):
+                print(f"Error releasing ledger claim for {key}: {e}")
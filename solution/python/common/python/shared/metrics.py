@@ -0,0 +1,201 @@
+"""
+Đo thời gian từng stage của handler và ghi ra CloudWatch Embedded Metric
+Format (EMF): mỗi lần invoke được lấy mẫu in đúng một dòng JSON, CloudWatch
+tự trích metric từ log nên không cần gọi PutMetricData.
+
+    @metrics.instrument("ImageRecognition")
+    def handler(event, context):
+        with metrics.timer("DetectLabels"):
+            ...
+        metrics.put("LabelCount", 7)
+
+METRICS_ENABLED=false bỏ hẳn wrapper của handler; invoke không được lấy mẫu
+(METRICS_SAMPLE_RATE) chỉ trả về timer rỗng dùng chung. Bản ghi hiện tại nằm
+trong contextvars, hàm chạy trên thread pool cần được bọc bằng metrics.bind.
+"""
+import os
+import sys
+import json
+import time
+import random
+import functools
+import threading
+import contextvars
+
+ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "ImageRecognitionSystem")
+# Tỉ lệ invoke được ghi metric (0-1)
+SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get("METRICS_SAMPLE_RATE", "1.0"))))
+# EMF cho phép tối đa 100 giá trị cho mỗi metric trong một bản ghi
+MAX_VALUES = 100
+
+# Bản ghi của lần invoke hiện tại, None nếu không đo
+_current = contextvars.ContextVar("metrics_invocation", default=None)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("_invocation", "_name", "_started")
+
+    def __init__(self, invocation, name):
+        self._invocation = invocation
+        self._name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._invocation.add(f"{self._name}Latency", (time.perf_counter() - self._started) * 1000, "Milliseconds")
+        return False
+
+
+class Invocation:
+    """
+    Gom metric của một lần invoke (an toàn khi ghi từ nhiều luồng).
+    """
+    def __init__(self, service, context=None):
+        self.service = service
+        self.values = {}
+        self.units = {}
+        self.properties = {"SampleRate": SAMPLE_RATE}
+        if context is not None:
+            self.properties["RequestId"] = getattr(context, "aws_request_id", None)
+            self.properties["FunctionName"] = getattr(context, "function_name", None)
+        self._lock = threading.Lock()
+
+    def add(self, name, value, unit):
+        with self._lock:
+            values = self.values.setdefault(name, [])
+            if len(values) < MAX_VALUES:
+                values.append(value)
+            self.units.setdefault(name, unit)
+
+    def record(self):
+        with self._lock:
+            record = dict(self.properties)
+            record["Service"] = self.service
+            record["_aws"] = {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["Service"]],
+                    "Metrics": [{"Name": name, "Unit": self.units[name]} for name in self.values],
+                }],
+            }
+            for name, values in self.values.items():
+                record[name] = values[0] if len(values) == 1 else list(values)
+        return record
+
+    def emit(self):
+        if self.values:
+            # Một lần write duy nhất để dòng EMF không bị chen bởi log của luồng khác
+            sys.stdout.write(json.dumps(_rounded(self.record()), separators=(",", ":")) + "\n")
+
+
+def _rounded(record):
+    """
+    Làm tròn giá trị thời gian để dòng log ngắn hơn.
+    """
+    for name, value in record.items():
+        if isinstance(value, float):
+            record[name] = round(value, 3)
+        elif isinstance(value, list):
+            record[name] = [round(v, 3) if isinstance(v, float) else v for v in value]
+    return record
+
+
+def begin(service, context=None):
+    """
+    Bắt đầu đo một lần invoke nếu được lấy mẫu. Trả về Invocation hoặc None.
+    """
+    invocation = None
+    if ENABLED and (SAMPLE_RATE >= 1.0 or random.random() < SAMPLE_RATE):
+        invocation = Invocation(service, context)
+    _current.set(invocation)
+    return invocation
+
+
+def flush():
+    """
+    In bản ghi EMF của lần invoke hiện tại và kết thúc việc đo.
+    """
+    invocation = _current.get()
+    _current.set(None)
+    if invocation is not None:
+        invocation.emit()
+
+
+def timer(stage):
+    """
+    Context manager đo thời gian stage, ghi thành metric "<stage>Latency".
+    """
+    invocation = _current.get()
+    if invocation is None:
+        return _NULL_TIMER
+    return _Timer(invocation, stage)
+
+
+def put(name, value, unit="Count"):
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.add(name, value, unit)
+
+
+def set_property(name, value):
+    """
+    Thuộc tính không phải metric (ví dụ messageId), chỉ xuất hiện trong log.
+    """
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.properties[name] = value
+
+
+def bind(function):
+    """
+    Bọc function để khi chạy trên luồng khác (thread pool) vẫn ghi vào bản ghi
+    của lần invoke hiện tại (và thấy các contextvars khác như deadline của
+    shared.throttle).
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return wrapper
+
+
+def instrument(service):
+    """
+    Decorator cho handler: bắt đầu đo khi invoke và in bản ghi EMF khi kết thúc.
+    Event warm-up không được đo. Khi METRICS_ENABLED=false trả về handler gốc.
+    """
+    def decorator(handler):
+        if not ENABLED:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if isinstance(event, dict) and event.get("warmup") is True:
+                return handler(event, context)
+            begin(service, context)
+            started = time.perf_counter()
+            try:
+                return handler(event, context)
+            finally:
+                put("HandlerLatency", (time.perf_counter() - started) * 1000, "Milliseconds")
+                flush()
+        return wrapper
+    return decorator
@@ -0,0 +1,80 @@
+"""
+Bộ đếm phiên bản của một bảng DynamoDB, dùng để vô hiệu hóa cache phía đọc.
+
+    table_version.bump(os.environ["VERSION_TABLE"], table_name)      # sau khi ghi
+    version = table_version.current(os.environ["VERSION_TABLE"], table_name)
+
+Item: {"id": S (tên bảng, shard > 0 thêm "#<shard>"), "version": N}. Bên ghi
+tăng bộ đếm của một shard ngẫu nhiên sau mỗi batch ghi thành công, nên các
+batch ghi đồng thời không dồn vào một item nóng; version là tổng SHARDS bộ
+đếm. Bên đọc coi cache được tạo ở version cũ là hết hạn và giữ version đọc
+được trong container tối đa MAX_AGE_SECONDS để không phải đọc bảng ở mọi
+request. Bên đọc và bên ghi phải dùng cùng TABLE_VERSION_SHARDS.
+"""
+import os
+import time
+import random
+import threading
+from shared import clients, metrics
+
+# Thời gian container dùng lại version đã đọc
+MAX_AGE_SECONDS = float(os.environ.get("TABLE_VERSION_MAX_AGE_SECONDS", "1"))
+# Số bộ đếm của mỗi bảng (shard 0 là item cũ, id = tên bảng)
+SHARDS = max(1, int(os.environ.get("TABLE_VERSION_SHARDS", "8")))
+BATCH_GET_MAX_RETRIES = 3
+
+# {(version table, tên bảng): (version, thời điểm đọc)}
+_cache = {}
+_lock = threading.Lock()
+
+
+def shard_id(name, shard):
+    return name if shard == 0 else f"{name}#{shard}"
+
+
+def bump(version_table, name):
+    """
+    Tăng version của bảng name (bộ đếm của một shard ngẫu nhiên).
+    """
+    with metrics.timer("TableVersionBump"):
+        clients.get_client("dynamodb").update_item(
+            TableName=version_table,
+            Key={"id": {"S": shard_id(name, random.randrange(SHARDS))}},
+            UpdateExpression="ADD #version :one",
+            ExpressionAttributeNames={"#version": "version"},
+            ExpressionAttributeValues={":one": {"N": "1"}},
+        )
+    with _lock:
+        _cache.pop((version_table, name), None)
+
+
+def current(version_table, name, max_age=MAX_AGE_SECONDS):
+    """
+    Version hiện tại của bảng name (0 nếu chưa từng được tăng).
+    """
+    now = time.monotonic()
+    with _lock:
+        cached = _cache.get((version_table, name))
+    if cached is not None and now - cached[1] < max_age:
+        return cached[0]
+    request_items = {version_table: {
+        "Keys": [{"id": {"S": shard_id(name, shard)}} for shard in range(SHARDS)],
+        "ConsistentRead": True,
+        "ProjectionExpression": "#version",
+        "ExpressionAttributeNames": {"#version": "version"},
+    }}
+    version = 0
+    with metrics.timer("TableVersionRead"):
+        for attempt in range(BATCH_GET_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(0.05 * 2 ** attempt)
+            response = clients.get_client("dynamodb").batch_get_item(RequestItems=request_items)
+            version += sum(int(item["version"]["N"]) for item in response["Responses"].get(version_table, []))
+            request_items = response.get("UnprocessedKeys")
+            if not request_items:
+                break
+        else:
+            raise RuntimeError(f"Unprocessed version keys remain for {name}")
+    with _lock:
+        _cache[(version_table, name)] = (version, now)
+    return version
@@ -0,0 +1,241 @@
+"""
+Giới hạn tốc độ phía client cho các API hay bị throttle (Rekognition,
+DynamoDB). Mỗi API có một token bucket với tốc độ điều chỉnh theo AIMD:
+tăng cộng dần khi gọi thành công, giảm nhân khi bị throttle. Lỗi throttle
+và lỗi tạm thời được thử lại với exponential backoff (full jitter) nhưng
+không vượt quá thời gian còn lại của lần invoke.
+
+    throttle.start(context)
+    response = throttle.call("DetectLabels", rekognition.detect_labels, Image=image)
+
+Tốc độ được giữ theo container; deadline nằm trong contextvars nên hàm chạy
+trên thread pool cần được bọc bằng metrics.bind. Client truyền vào call nên
+lấy bằng throttle.client() (tắt retry của botocore) để throttle đến được
+governor; các client khác giữ retry mặc định của botocore.
+"""
+import os
+import time
+import random
+import threading
+import contextvars
+from shared import clients, metrics
+
+INITIAL_RATE = float(os.environ.get("THROTTLE_INITIAL_RATE", "50"))
+MIN_RATE = float(os.environ.get("THROTTLE_MIN_RATE", "1"))
+MAX_RATE = float(os.environ.get("THROTTLE_MAX_RATE", "500"))
+# Tốc độ tăng thêm (request/s) sau khoảng một giây gọi thành công
+INCREASE = float(os.environ.get("THROTTLE_INCREASE", "2"))
+# Hệ số nhân khi bị throttle; các throttle gần nhau (từ nhiều luồng cùng
+# lúc) chỉ giảm một lần trong mỗi DECREASE_INTERVAL giây
+DECREASE = float(os.environ.get("THROTTLE_DECREASE", "0.5"))
+DECREASE_INTERVAL = float(os.environ.get("THROTTLE_DECREASE_INTERVAL", "0.25"))
+MAX_ATTEMPTS = int(os.environ.get("THROTTLE_MAX_ATTEMPTS", "8"))
+BASE_DELAY = float(os.environ.get("THROTTLE_BASE_DELAY", "0.05"))
+MAX_DELAY = float(os.environ.get("THROTTLE_MAX_DELAY", "2.0"))
+# Thời gian chừa lại cho handler ghi kết quả và trả về trước khi Lambda timeout
+DEADLINE_MARGIN = float(os.environ.get("THROTTLE_DEADLINE_MARGIN_MS", "3000")) / 1000.0
+
+THROTTLE_CODES = frozenset((
+    "ThrottlingException",
+    "Throttling",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "SlowDown",
+))
+TRANSIENT_CODES = frozenset((
+    "InternalServerError",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "ServiceUnavailableException",
+))
+# Lỗi kết nối của botocore (không có response), so theo tên class và class cha
+TRANSIENT_ERRORS = frozenset((
+    "EndpointConnectionError",
+    "ConnectionClosedError",
+    "ReadTimeoutError",
+    "ConnectTimeoutError",
+))
+
+# Deadline (time.monotonic) của lần invoke hiện tại, None nếu không giới hạn
+_deadline = contextvars.ContextVar("throttle_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Không còn đủ thời gian trong lần invoke để gọi (hoặc gọi lại) API.
+    """
+
+
+def error_code(error):
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code")
+
+
+def is_throttle(error):
+    return error_code(error) in THROTTLE_CODES
+
+
+def is_transient(error):
+    if error_code(error) in TRANSIENT_CODES:
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+def client(service_name):
+    """
+    Client của service cho các API gọi qua call(): botocore không tự retry,
+    mọi lần thử lại đều đi qua governor và deadline của lần invoke.
+    """
+    return clients.get_client(service_name, max_attempts=1)
+
+
+class Governor:
+    """
+    Token bucket AIMD cho một API, dùng chung giữa các luồng.
+    """
+    def __init__(self, name, rate=INITIAL_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE, increase=INCREASE):
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.tokens = max(1.0, rate)
+        self.throttles = 0
+        self._updated = time.monotonic()
+        self._decreased = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # Bucket chứa tối đa một giây token
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, deadline=None):
+        """
+        Lấy một token, chờ nếu cần. Raise DeadlineExceeded nếu phải chờ quá deadline.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    break
+                wait = (1.0 - self.tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded(f"{self.name}: no time left to wait for rate limit")
+            time.sleep(wait)
+            waited += wait
+        if waited:
+            metrics.put(f"{self.name}ThrottleWait", waited * 1000, "Milliseconds")
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / max(self.rate, 1.0))
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._decreased >= DECREASE_INTERVAL:
+                self.rate = max(self.min_rate, self.rate * DECREASE)
+                self._decreased = now
+            self.tokens = min(self.tokens, 0.0)
+            self.throttles += 1
+        metrics.put(f"{self.name}Throttles", 1)
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def governor(name):
+    item = _governors.get(name)
+    if item is None:
+        with _governors_lock:
+            item = _governors.setdefault(name, Governor(name))
+    return item
+
+
+def configure(name, **kwargs):
+    """
+    Đặt giới hạn riêng cho một API (rate, min_rate, max_rate, increase), ví dụ
+    bảng DynamoDB on-demand chịu được tốc độ cao hơn nhiều so với Rekognition.
+    Gọi một lần khi import module runtime.
+    """
+    with _governors_lock:
+        _governors[name] = Governor(name, **kwargs)
+    return _governors[name]
+
+
+def start(context=None, limit=None):
+    """
+    Đặt deadline cho lần invoke từ context.get_remaining_time_in_millis(),
+    không muộn hơn limit giây kể từ bây giờ (nếu có).
+    """
+    deadline = None
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000.0 - DEADLINE_MARGIN
+    if limit is not None:
+        deadline = min(time.monotonic() + limit, deadline if deadline is not None else float("inf"))
+    _deadline.set(deadline)
+    return deadline
+
+
+def remaining():
+    """
+    Số giây còn lại trước deadline, None nếu không giới hạn.
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def backoff(attempt):
+    """
+    Thời gian chờ (full jitter) trước lần thử thứ attempt + 1.
+    Raise DeadlineExceeded nếu không còn đủ thời gian.
+    """
+    delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+    left = remaining()
+    if left is not None and delay >= left:
+        raise DeadlineExceeded("no time left to retry")
+    return delay
+
+
+def call(name, function, *args, **kwargs):
+    """
+    Gọi function(*args, **kwargs) qua governor của API name, thử lại khi bị
+    throttle hoặc lỗi tạm thời. Lỗi khác được raise ngay.
+    """
+    limiter = governor(name)
+    attempt = 0
+    while True:
+        limiter.acquire(_deadline.get())
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            if is_throttle(e):
+                limiter.on_throttle()
+            elif not is_transient(e):
+                raise
+            attempt += 1
+            if attempt >= MAX_ATTEMPTS:
+                raise
+            try:
+                delay = backoff(attempt)
+            except DeadlineExceeded:
+                raise e
+            metrics.put(f"{name}Retries", 1)
+            time.sleep(delay)
+            continue
+        limiter.on_success()
+        return result
+
+
+def report():
+    """
+    Ghi tốc độ cho phép hiện tại của các governor thành metric "<API>AllowedRate".
+    """
+    for name, limiter in list(_governors.items()):
+        metrics.put(f"{name}AllowedRate", round(limiter.rate, 2), "Count/Second")
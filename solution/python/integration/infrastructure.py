@@ -6,16 +6,21 @@ from aws_cdk import aws_sqs as sqs
 from aws_cdk import aws_sns_subscriptions as sns_subs
 from aws_cdk import aws_sns as sns
 from aws_cdk import aws_lambda as lambda_
-from aws_cdk import aws_lambda_event_sources as lambda_events
 from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_iam as iam
+from aws_cdk import aws_dynamodb as ddb
+import tuning
 
 class IntegrationStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        # Message nhận quá integration_max_receive_count lần chuyển sang DLQ
         rekognized_queue = sqs.Queue(
-            self, id="rekognized_image_queue", visibility_timeout=Duration.seconds(60)
+            self,
+            id="rekognized_image_queue",
+            visibility_timeout=Duration.seconds(60),
+            dead_letter_queue=tuning.dead_letter_queue(self, "integration", "rekognized_image_dlq"),
         )
 
         sqs_subscription = sns_subs.SqsSubscription(
@@ -27,6 +32,20 @@ class IntegrationStack(Stack):
         self.rekognized_event_topic_arn = rekognized_event_topic.topic_arn
         rekognized_event_topic.add_subscription(sqs_subscription)
 
+        # Claim check: payload event lớn hơn event_inline_max_bytes được ghi ở đây,
+        # message SNS/SQS chỉ mang con trỏ + digest. Object phải sống lâu hơn
+        # message trong queue và DLQ
+        event_payload_bucket = s3.Bucket(
+            self,
+            "EventPayloads",
+            lifecycle_rules=[
+                s3.LifecycleRule(expiration=Duration.days(
+                    tuning.context_int(self, "event_payload_retention_days", 30))),
+            ],
+        )
+        self.event_payload_bucket_name = event_payload_bucket.bucket_name
+        self.event_payload_bucket_arn = event_payload_bucket.bucket_arn
+
         asset_bucket = s3.Bucket.from_bucket_name(
             scope=self,
             id="lamba_layer_zipfile",
@@ -40,9 +59,20 @@ class IntegrationStack(Stack):
             "requests_layer",
             compatible_runtimes=[lambda_.Runtime.PYTHON_3_11],
             layer_version_name="requests_layer",
+            compatible_architectures=tuning.LAYER_ARCHITECTURES,
             code=lambda_.S3Code(bucket=asset_bucket, key=requests_layer_file),
         )
 
+        # Lambda Layer dùng chung (shared.clients, ...)
+        common = lambda_.LayerVersion(
+            self,
+            "common_layer",
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_11],
+            compatible_architectures=tuning.LAYER_ARCHITECTURES,
+            code=lambda_.Code.from_asset("common"),
+            description="Shared runtime helpers for the image recognition Lambdas",
+        )
+
         # Định nghĩa IAM Role
         lambda_role = iam.Role(
             self,
@@ -59,20 +89,51 @@ class IntegrationStack(Stack):
             resources=[f"arn:aws:ssm:{cdk.Aws.REGION}:{cdk.Aws.ACCOUNT_ID}:parameter/thirdparty_endpoint"]
         ))
 
+        # Ledger idempotency: kết quả đã/đang được POST cho bên thứ ba
+        delivery_ledger = ddb.Table(
+            self,
+            "DeliveryLedger",
+            partition_key=ddb.Attribute(name="id", type=ddb.AttributeType.STRING),
+            time_to_live_attribute="expires_at",
+        )
+        delivery_ledger.grant_read_write_data(lambda_role)
+        event_payload_bucket.grant_read(lambda_role)
+
+        rekognized_queue.grant_send_messages(lambda_role)
+
         # Lambda function
+        integration_timeout = 30
         integration_lambda = lambda_.Function(
             self,
             "IntegrationLambda",
             runtime=lambda_.Runtime.PYTHON_3_11,
-            layers=[requests],
+            layers=[requests, common],
             role=lambda_role,
             handler="send_email.handler",
             code=lambda_.Code.from_asset("integration/runtime"),
-            timeout=Duration.seconds(30),
+            environment={
+                "THIRDPARTY_ENDPOINT_PARAMETER": "thirdparty_endpoint",
+                "ENDPOINT_CACHE_TTL_SECONDS": "300",
+                "DELIVERY_MODE": "single",
+                "DELIVERY_LEDGER_TABLE": delivery_ledger.table_name,
+                "LEDGER_IN_PROGRESS_SECONDS": tuning.ledger_in_progress_seconds(integration_timeout),
+                # Record gửi lỗi (hoặc khi circuit breaker mở) được gửi lại vào queue
+                # với DelaySeconds tăng dần thay vì giữ Lambda chờ endpoint
+                "RETRY_QUEUE_URL": rekognized_queue.queue_url,
+                "DELIVERY_CONCURRENCY": "10",
+                "POST_TIMEOUT_SECONDS": "5",
+                "DELIVERY_DEADLINE_SECONDS": "20",
+                # Payload offload đã tải được cache trong container warm
+                "EVENT_PAYLOAD_CACHE_BYTES": str(32 * 1024 * 1024),
+            },
+            timeout=Duration.seconds(integration_timeout),
+            # Bộ nhớ, kiến trúc, reserved concurrency: context integration_* trong cdk.json
+            **tuning.function_props(self, "integration"),
         )
 
-        # Thêm event source từ SQS
-        integration_lambda.add_event_source(lambda_events.SqsEventSource(rekognized_queue))
+        # Thêm event source từ SQS (batch size, batching window, max concurrency theo
+        # context integration_*), record lỗi được trả về qua batchItemFailures
+        tuning.attach_queue(self, "integration", integration_lambda, rekognized_queue)
 
     @property
     def sns_arn(self) -> str:
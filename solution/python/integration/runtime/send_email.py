@@ -1,61 +1,545 @@
-from xml.etree.ElementTree import Element, ElementTree, tostring
-import requests
-import boto3
+import os
+import re
+import math
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import json
+from shared import circuit_breaker, clients, events, idempotency, metrics, throttle
+
+# Tên SSM parameter chứa endpoint của bên thứ ba
+ENDPOINT_PARAMETER = os.environ.get("THIRDPARTY_ENDPOINT_PARAMETER", "thirdparty_endpoint")
+# Thời gian cache endpoint trong container warm
+ENDPOINT_CACHE_TTL = float(os.environ.get("ENDPOINT_CACHE_TTL_SECONDS", "300"))
+# "single": mỗi record một POST, "batch": cả batch SQS trong một POST
+DELIVERY_MODE = os.environ.get("DELIVERY_MODE", "single").lower()
+POST_TIMEOUT = float(os.environ.get("POST_TIMEOUT_SECONDS", "10"))
+# Gửi XML dạng chunked (Transfer-Encoding: chunked) thay vì dựng toàn bộ body trước
+XML_CHUNKED_BODY = os.environ.get("XML_CHUNKED_BODY", "false").lower() == "true"
+XML_CHUNK_SIZE = 64 * 1024
+# Ledger idempotency để không POST lại cùng một kết quả (tùy chọn)
+DELIVERY_LEDGER_TABLE = os.environ.get("DELIVERY_LEDGER_TABLE")
+# Số POST đồng thời trong một lần invoke (mode "single")
+DELIVERY_CONCURRENCY = int(os.environ.get("DELIVERY_CONCURRENCY", "10"))
+# Thời gian tối đa cho việc gửi một batch; record chưa gửi kịp được hoãn lại
+DELIVERY_DEADLINE_SECONDS = float(os.environ.get("DELIVERY_DEADLINE_SECONDS", "20"))
+# Không bắt đầu POST khi còn ít hơn khoảng này trước deadline
+MIN_POST_SECONDS = 1.0
+# Queue nhận lại record gửi lỗi với DelaySeconds tăng dần (thường là chính queue
+# nguồn); không đặt thì record lỗi được trả về qua batchItemFailures
+RETRY_QUEUE_URL = os.environ.get("RETRY_QUEUE_URL")
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY_SECONDS", "10"))
+# Giới hạn DelaySeconds của SQS
+RETRY_MAX_DELAY = 900
+# Hoãn quá số lần này thì record được trả về qua batchItemFailures (rồi tới DLQ)
+MAX_DEFERRALS = int(os.environ.get("MAX_DEFERRALS", "8"))
+ATTEMPT_ATTRIBUTE = "delivery_attempt"
+SQS_BATCH_SIZE = 10
+
+# Các đối tượng dưới đây được giữ lại giữa các lần invoke khi container còn warm
+_session = None
+_endpoint_cache = {"value": None, "expires_at": 0.0}
+_endpoint_lock = threading.Lock()
+_ledger = idempotency.Ledger(DELIVERY_LEDGER_TABLE) if DELIVERY_LEDGER_TABLE else None
+_breaker = circuit_breaker.CircuitBreaker("ThirdParty")
+_executor = None
+
+
+def get_session():
+    """
+    Trả về requests.Session dùng chung, giữ kết nối keep-alive tới endpoint.
+    """
+    global _session
+    if _session is None:
+        # requests chỉ được import khi thực sự gửi dữ liệu
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(DELIVERY_CONCURRENCY, 1))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(DELIVERY_CONCURRENCY, 1))
+    return _executor
+
+
+def get_thirdparty_endpoint(force_refresh=False):
+    """
+    Đọc endpoint từ SSM, cache ở mức module với TTL ENDPOINT_CACHE_TTL.
+    """
+    with _endpoint_lock:
+        now = time.monotonic()
+        if not force_refresh and _endpoint_cache["value"] and now < _endpoint_cache["expires_at"]:
+            return _endpoint_cache["value"]
+        with metrics.timer("SSMLookup"):
+            response = clients.get_client('ssm').get_parameter(
+                Name=ENDPOINT_PARAMETER, WithDecryption=False)
+        _endpoint_cache["value"] = response['Parameter']['Value']
+        _endpoint_cache["expires_at"] = now + ENDPOINT_CACHE_TTL
+        return _endpoint_cache["value"]
+
+
+def refresh_thirdparty_endpoint():
+    """
+    Bỏ qua cache và đọc lại endpoint từ SSM.
+    """
+    return get_thirdparty_endpoint(force_refresh=True)
+
+
+_INVALID_NAME_CHARS = re.compile(r'[^A-Za-z0-9_.-]')
+_INVALID_TEXT_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_TEXT_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+_ATTR_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'})
+
+
+@lru_cache(maxsize=4096)
+def xml_name(key):
+    """
+    Chuyển key JSON thành tên thẻ XML hợp lệ: ký tự lạ thành "_", thêm "_"
+    phía trước nếu tên không bắt đầu bằng chữ cái/"_" hoặc bắt đầu bằng "xml".
+    """
+    name = _INVALID_NAME_CHARS.sub('_', str(key))
+    if not name or not (name[0].isalpha() or name[0] == '_') or name[:3].lower() == 'xml':
+        name = '_' + name
+    return name
+
+
+def xml_text(value):
+    """
+    Escape giá trị lá (giống str() của bản cũ) và bỏ ký tự không hợp lệ trong XML.
+    """
+    return _INVALID_TEXT_CHARS.sub('', str(value)).translate(_TEXT_ESCAPES)
+
+
+def _children(value):
+    if isinstance(value, dict):
+        return ((xml_name(key), child) for key, child in value.items())
+    return (('item', child) for child in value)
+
+
+def _iter_xml_pieces(json_data, root, attrs=None):
+    """
+    Duyệt JSON không đệ quy bằng stack các iterator, yield từng đoạn chuỗi XML.
+    Bộ nhớ chỉ tỉ lệ với độ sâu, không tỉ lệ với kích thước tài liệu.
+    """
+    attributes = ''.join(
+        f' {xml_name(name)}="{xml_text(value).translate(_ATTR_ESCAPES)}"'
+        for name, value in (attrs or {}).items()
+    )
+    if not isinstance(json_data, (dict, list)):
+        yield f'<{root}{attributes}>{xml_text(json_data)}</{root}>'
+        return
+
+    yield f'<{root}{attributes}>'
+    stack = [(root, _children(json_data))]
+    while stack:
+        name, children = stack[-1]
+        for child_name, child in children:
+            if isinstance(child, (dict, list)):
+                yield f'<{child_name}>'
+                stack.append((child_name, _children(child)))
+                break
+            yield f'<{child_name}>{xml_text(child)}</{child_name}>'
+        else:
+            stack.pop()
+            yield f'</{name}>'
+
+
+def _chunked(pieces, chunk_size=XML_CHUNK_SIZE):
+    """
+    Gom các đoạn chuỗi thành các chunk bytes UTF-8 khoảng chunk_size.
+    """
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def iter_json_xml(json_data, chunk_size=XML_CHUNK_SIZE):
+    """
+    Generator bytes của <data>...</data>, requests gửi được như body chunked.
+    """
+    return _chunked(_iter_xml_pieces(json_data, 'data'), chunk_size)
+
+
+def iter_batch_xml(records, chunk_size=XML_CHUNK_SIZE):
+    """
+    Generator bytes của envelope <batch><record id="messageId">...</record>...</batch>.
+    """
+    def pieces():
+        yield '<batch>'
+        for record_id, json_data in records:
+            yield from _iter_xml_pieces(json_data, 'record', {'id': record_id})
+        yield '</batch>'
+    return _chunked(pieces(), chunk_size)
 
-def get_thirdparty_endpoint():
-    ssm_client = boto3.client('ssm', region_name='us-east-1')  # Nên dùng cdk.Aws.REGION
-    response = ssm_client.get_parameter(
-        Name='thirdparty_endpoint', WithDecryption=False)coginto
-    return response['Parameter']['Value']
 
 def convert_json_to_xml(json_data):
     if not json_data:
         return None
-    root = Element('data')
-    def create_xml_element(parent, data):
-        if isinstance(data, dict):
-            for key, value in data.items():
-                element = Element(key)
-                parent.append(element)
-                create_xml_element(element, value)
-        elif isinstance(data, list):
-            for item in data:
-                element = Element('item')
-                parent.append(element)
-                create_xml_element(element, item)
-        else:
-            parent.text = str(data)
-    create_xml_element(root, json_data)
-    return tostring(root, encoding='utf-8', method='xml')
+    return b''.join(iter_json_xml(json_data))
+
+
+def convert_batch_to_xml(records):
+    """
+    Gộp nhiều record thành một envelope:
+    <batch><record id="messageId">...</record>...</batch>
+    """
+    return b''.join(iter_batch_xml(records))
 
-def send_xml_with_post(xml_string):
+
+def send_xml_with_post(xml_string, timeout=POST_TIMEOUT):
+    """
+    POST XML tới endpoint. xml_string có thể là bytes hoặc generator bytes
+    (gửi chunked); generator không thể gửi lại nên không được retry.
+    """
+    import requests
     endpoint = get_thirdparty_endpoint()
     headers = {'Content-Type': 'application/xml'}
-    response = requests.post(endpoint, data=xml_string, headers=headers, timeout=10)
+    if isinstance(xml_string, bytes):
+        metrics.put("PayloadBytes", len(xml_string), "Bytes")
+    try:
+        with metrics.timer("ThirdPartyPost"):
+            response = get_session().post(endpoint, data=xml_string, headers=headers, timeout=timeout)
+    except requests.exceptions.ConnectionError:
+        # Endpoint có thể đã đổi trong SSM: đọc lại và thử một lần nếu khác
+        new_endpoint = refresh_thirdparty_endpoint()
+        if new_endpoint == endpoint or not isinstance(xml_string, bytes):
+            raise
+        left = throttle.remaining()
+        if left is not None:
+            if left < MIN_POST_SECONDS:
+                raise
+            timeout = min(timeout, left)
+        endpoint = new_endpoint
+        metrics.put("PostRetries", 1)
+        with metrics.timer("ThirdPartyPost"):
+            response = get_session().post(endpoint, data=xml_string, headers=headers, timeout=timeout)
     print(f"POST request to {endpoint} returned status {response.status_code}")
     response.raise_for_status()
     return response.status_code
 
-def handler(event, context):
+
+def is_endpoint_failure(error):
+    """
+    Lỗi cho thấy endpoint suy giảm (timeout, lỗi kết nối, 5xx, 429), được tính
+    vào circuit breaker. Các lỗi 4xx khác là lỗi của riêng record đó.
+    """
+    import requests
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = getattr(error.response, 'status_code', None)
+        return status is None or status >= 500 or status == 429
+    return isinstance(error, requests.exceptions.RequestException)
+
+
+def post_through_breaker(xml_string):
+    """
+    send_xml_with_post qua circuit breaker, timeout không vượt quá deadline
+    của batch. Raise CircuitOpen hoặc DeadlineExceeded nếu không gửi.
+    """
+    left = throttle.remaining()
+    if left is not None and left < MIN_POST_SECONDS:
+        raise throttle.DeadlineExceeded("no time left to deliver")
+    if not _breaker.allow():
+        raise circuit_breaker.CircuitOpen(f"circuit {_breaker.name} is open")
+    timeout = POST_TIMEOUT if left is None else min(POST_TIMEOUT, left)
+    started = time.monotonic()
     try:
-        for record in event.get('Records', []):
-            json_data = json.loads(record.get('body', '{}'))
-            xml_data = convert_json_to_xml(json_data)
-            if xml_data:
-                status_code = send_xml_with_post(xml_data)
-                return {
-                    'statusCode': status_code,
-                    "message": "Success!"
-                }
+        status = send_xml_with_post(xml_string, timeout)
+    except Exception as e:
+        import requests
+        if is_endpoint_failure(e):
+            _breaker.record_failure()
+        elif isinstance(e, requests.exceptions.HTTPError):
+            # Endpoint vẫn trả lời, chỉ từ chối record này
+            _breaker.record_success(time.monotonic() - started)
+        else:
+            _breaker.release()
+        raise
+    _breaker.record_success(time.monotonic() - started)
+    return status
+
+
+def _parse_records(records):
+    """
+    Tách các record hợp lệ và các record lỗi (body không phải envelope JSON).
+    Trả về (list (messageId, events.Event), list messageId lỗi). Payload được
+    offload lên S3 chưa được tải ở bước này.
+    """
+    parsed = []
+    failures = []
+    for record in records:
+        message_id = record.get('messageId')
+        try:
+            event = events.decode(record.get('body') or '{}')
+        except (ValueError, TypeError, KeyError) as e:
+            print(f"Invalid JSON in message {message_id}: {e}")
+            failures.append(message_id)
+            continue
+        if event.reference is None and not event.payload:
+            print(f"Bad Request: No JSON data to convert in message {message_id}.")
+            continue
+        parsed.append((message_id, event))
+    return parsed, failures
+
+
+def delivery_key(event):
+    """
+    Key của delivery ledger: sha256 của nội dung payload (digest của envelope),
+    nên cả message bị SQS gửi lại lẫn kết quả được publish lại giống hệt đều
+    chỉ được POST một lần, không cần tải payload offload.
+    """
+    return event.digest.split(':', 1)[-1]
+
+
+def claim_deliveries(records):
+    """
+    Bỏ qua record đã được gửi (hoặc trùng nội dung trong cùng batch).
+    Trả về (records cần gửi, claims {messageId: (key, token)}, list messageId
+    đang được lần invoke khác gửi). Lỗi của ledger không chặn việc gửi.
+    """
+    if _ledger is None:
+        return records, {}, []
+    pending, claims, busy, seen = [], {}, [], set()
+    skipped = 0
+    for message_id, event in records:
+        key = delivery_key(event)
+        if key in seen:
+            skipped += 1
+            continue
+        seen.add(key)
+        try:
+            status, token = _ledger.claim(key)
+        except Exception as e:
+            print(f"Ledger claim failed for message {message_id}, delivering without it: {e}")
+            pending.append((message_id, event))
+            continue
+        if status == idempotency.COMPLETED:
+            skipped += 1
+        elif status == idempotency.IN_PROGRESS:
+            busy.append(message_id)
+        else:
+            pending.append((message_id, event))
+            claims[message_id] = (key, token)
+    if skipped:
+        metrics.put("DuplicateRecords", skipped)
+    return pending, claims, busy
+
+
+def settle_deliveries(claims, undelivered):
+    undelivered = set(undelivered)
+    for message_id, (key, token) in claims.items():
+        try:
+            if message_id in undelivered:
+                _ledger.release(key, token)
             else:
-                return {
-                    'statusCode': 400,
-                    "message": "Bad Request: No JSON data to convert."
-                }
+                _ledger.complete(key, token)
+        except Exception as e:
+            print(f"Ledger update failed for message {message_id}: {e}")
+
+
+def _load_payload(message_id, event):
+    """
+    Payload của event (tải từ S3 nếu bị offload), None nếu không tải được.
+    """
+    try:
+        return event.payload
+    except events.PayloadError as e:
+        print(f"Failed to load payload of message {message_id}: {e}")
+        metrics.put("EventPayloadErrors", 1)
+        return None
+
+
+def _deliver_record(record):
+    message_id, event = record
+    json_data = _load_payload(message_id, event)
+    if json_data is None:
+        return message_id
+    try:
+        if XML_CHUNKED_BODY:
+            post_through_breaker(iter_json_xml(json_data))
+        else:
+            post_through_breaker(convert_json_to_xml(json_data))
+    except (circuit_breaker.CircuitOpen, throttle.DeadlineExceeded):
+        return message_id
     except Exception as e:
-        print(f"An error occurred: {e}")
-        return {
-            'statusCode': 500,
-            'message': f"An unexpected error occurred: {e}"
-        }
\ No newline at end of file
+        print(f"Failed to deliver message {message_id}: {e}")
+        return message_id
+    return None
+
+
+def deliver_single(records):
+    """
+    Mỗi record một POST, tối đa DELIVERY_CONCURRENCY POST đồng thời.
+    Trả về list messageId gửi thất bại hoặc chưa gửi (breaker mở, hết thời gian).
+    """
+    if len(records) <= 1:
+        results = [_deliver_record(record) for record in records]
+    else:
+        results = _get_executor().map(metrics.bind(_deliver_record), records)
+    return [message_id for message_id in results if message_id is not None]
+
+
+def deliver_batch(records):
+    """
+    Cả batch trong một POST. Nếu POST lỗi thì mọi record đều thất bại.
+    """
+    if not records:
+        return []
+    loaded, unloaded = [], []
+    for message_id, event in records:
+        json_data = _load_payload(message_id, event)
+        if json_data is None:
+            unloaded.append(message_id)
+        else:
+            loaded.append((message_id, json_data))
+    if not loaded:
+        return unloaded
+    try:
+        if XML_CHUNKED_BODY:
+            post_through_breaker(iter_batch_xml(loaded))
+        else:
+            post_through_breaker(convert_batch_to_xml(loaded))
+    except (circuit_breaker.CircuitOpen, throttle.DeadlineExceeded):
+        return unloaded + [message_id for message_id, _ in loaded]
+    except Exception as e:
+        print(f"Failed to deliver batch of {len(loaded)} messages: {e}")
+        return unloaded + [message_id for message_id, _ in loaded]
+    return unloaded
+
+
+def delivery_attempt(record):
+    """
+    Số lần record đã bị hoãn (message attribute delivery_attempt).
+    """
+    attribute = (record.get('messageAttributes') or {}).get(ATTEMPT_ATTRIBUTE) or {}
+    try:
+        return int(attribute.get('stringValue') or 0)
+    except ValueError:
+        return 0
+
+
+def retry_delay(attempt, retry_after=0.0):
+    """
+    DelaySeconds cho lần hoãn thứ attempt + 1: exponential backoff (equal
+    jitter), không sớm hơn lúc breaker cho gọi thử và không quá 900 giây.
+    """
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+    delay = random.uniform(delay / 2, delay)
+    return int(min(RETRY_MAX_DELAY, max(delay, math.ceil(retry_after))))
+
+
+def _message_attributes(record, attempt):
+    attributes = {}
+    for name, value in (record.get('messageAttributes') or {}).items():
+        if value.get('stringValue') is not None:
+            attributes[name] = {'DataType': value.get('dataType') or 'String', 'StringValue': value['stringValue']}
+    attributes[ATTEMPT_ATTRIBUTE] = {'DataType': 'Number', 'StringValue': str(attempt)}
+    return attributes
+
+
+def defer_records(raw_records, message_ids):
+    """
+    Gửi lại các record vào RETRY_QUEUE_URL với DelaySeconds tăng dần thay vì
+    thử lại ngay trong lần invoke. Trả về list messageId không hoãn được
+    (chưa cấu hình queue, đã hoãn quá MAX_DEFERRALS lần, hoặc SQS lỗi),
+    những record này được trả về qua batchItemFailures.
+    """
+    if not RETRY_QUEUE_URL or not message_ids:
+        return list(message_ids)
+    retry_after = _breaker.retry_after()
+    failed, entries = [], []
+    for message_id in message_ids:
+        record = raw_records[message_id]
+        attempt = delivery_attempt(record)
+        if attempt >= MAX_DEFERRALS:
+            print(f"Message {message_id} was deferred {attempt} times, returning it to the source queue.")
+            failed.append(message_id)
+            continue
+        entries.append((message_id, {
+            'Id': str(len(entries)),
+            'MessageBody': record.get('body', ''),
+            'DelaySeconds': retry_delay(attempt, retry_after),
+            'MessageAttributes': _message_attributes(record, attempt + 1),
+        }))
+    sqs = clients.get_client('sqs')
+    for start in range(0, len(entries), SQS_BATCH_SIZE):
+        chunk = entries[start:start + SQS_BATCH_SIZE]
+        try:
+            with metrics.timer("SQSRequeue"):
+                response = sqs.send_message_batch(QueueUrl=RETRY_QUEUE_URL, Entries=[entry for _, entry in chunk])
+        except Exception as e:
+            print(f"Error re-enqueueing {len(chunk)} messages: {e}")
+            failed.extend(message_id for message_id, _ in chunk)
+            continue
+        by_id = {entry['Id']: message_id for message_id, entry in chunk}
+        failed.extend(by_id[item['Id']] for item in response.get('Failed', []))
+    return failed
+
+
+def warm_up():
+    """
+    Dựng trước SSM client, đọc endpoint vào cache và tạo HTTP session.
+    """
+    clients.warm_up('ssm')
+    if RETRY_QUEUE_URL:
+        clients.warm_up('sqs')
+    get_session()
+    try:
+        get_thirdparty_endpoint()
+    except Exception as e:
+        print(f"Could not prefetch third-party endpoint: {e}")
+
+
+@metrics.instrument("SendEmail")
+def handler(event, context):
+    if clients.is_warmup_event(event):
+        warm_up()
+        return {"warmup": True}
+    for record in event.get('Records', []):
+        receive_count = record.get('attributes', {}).get('ApproximateReceiveCount')
+        if receive_count:
+            metrics.put("ReceiveCount", int(receive_count))
+    # Deadline chung cho cả batch: POST bị giới hạn theo thời gian còn lại
+    throttle.start(context, DELIVERY_DEADLINE_SECONDS)
+    raw_records = {record.get('messageId'): record for record in event.get('Records', [])}
+    records, failures = _parse_records(event.get('Records', []))
+    records, claims, busy = claim_deliveries(records)
+    if DELIVERY_MODE == 'batch':
+        undelivered = deliver_batch(records)
+    else:
+        undelivered = deliver_single(records)
+    settle_deliveries(claims, undelivered)
+    # Record chưa gửi được chờ trong queue (DelaySeconds) thay vì giữ Lambda chờ endpoint
+    returned = defer_records(raw_records, undelivered)
+    deferred = len(undelivered) - len(returned)
+    print(f"Delivered {len(records) - len(undelivered)} messages, {deferred} deferred, {len(returned)} failed "
+          f"(circuit {_breaker.state}).")
+    metrics.put("DeferredMessages", deferred)
+    metrics.put("ThirdPartyCircuitOpen", 0 if _breaker.state == circuit_breaker.CLOSED else 1)
+    # Record đang được gửi ở lần invoke khác sẽ được SQS gửi lại và bỏ qua nếu đã xong
+    returned.extend(busy)
+    metrics.put("FailedMessages", len(failures) + len(returned))
+    failures.extend(returned)
+    return {
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]
+    }
+
+
+if clients.WARM_UP_ON_INIT:
+    warm_up()
@@ -4,10 +4,15 @@ from aws_cdk import (
     aws_dynamodb as ddb,
     aws_apigateway as apigateway,
     Stack,
+    ArnFormat,
 )
-from aws_cdk import aws_lambda_event_sources as events
+from aws_cdk import aws_sqs as sqs
+from aws_cdk import aws_s3 as s3
+from aws_cdk import aws_events as eventbridge
+from aws_cdk import aws_events_targets as eventbridge_targets
 from constructs import Construct
 from aws_cdk import Duration
+import tuning
 
 class RekognitionStack(Stack):
     """
@@ -19,9 +24,12 @@ class RekognitionStack(Stack):
         self,
         scope: Construct,
         construct_id: str,
-        sqs_url: str,
         sqs_arn: str,
         sns_arn: str,
+        image_bucket_arn: str = None,
+        bulk_sqs_arn: str = None,
+        event_payload_bucket_arn: str = None,
+        event_payload_bucket_name: str = None,
         **kwargs
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -33,6 +41,61 @@ class RekognitionStack(Stack):
             partition_key=ddb.Attribute(name="image", type=ddb.AttributeType.STRING),
         )
 
+        # Chỉ mục ngược label -> image. Partition key "<label>#<shard>" chia label phổ
+        # biến trên label_index_shards partition; GSI sắp xếp theo confidence (LSI
+        # giới hạn 10 GB cho mỗi giá trị partition key). Đổi số shard thì chạy
+        # tools/rebuild_label_index.py
+        label_index_shards = str(self.node.try_get_context("label_index_shards") or 4)
+        label_index = ddb.Table(
+            self,
+            "LabelIndex",
+            partition_key=ddb.Attribute(name="label", type=ddb.AttributeType.STRING),
+            sort_key=ddb.Attribute(name="image", type=ddb.AttributeType.STRING),
+        )
+        label_index.add_global_secondary_index(
+            index_name="by_confidence",
+            partition_key=ddb.Attribute(name="label", type=ddb.AttributeType.STRING),
+            sort_key=ddb.Attribute(name="confidence", type=ddb.AttributeType.NUMBER),
+        )
+
+        # Ledger idempotency: ảnh (theo phiên bản object) đã/đang được xử lý
+        processing_ledger = ddb.Table(
+            self,
+            "ProcessingLedger",
+            partition_key=ddb.Attribute(name="id", type=ddb.AttributeType.STRING),
+            time_to_live_attribute="expires_at",
+        )
+
+        # Bộ đếm phiên bản của Classifications: image_recognition tăng sau mỗi lần
+        # ghi, ListImagesLambda dùng để vô hiệu hóa cache response. Bộ đếm chia
+        # trên table_version_shards item để các batch ghi không dồn vào một key nóng
+        version_table = ddb.Table(
+            self,
+            "TableVersions",
+            partition_key=ddb.Attribute(name="id", type=ddb.AttributeType.STRING),
+        )
+        table_version_shards = str(self.node.try_get_context("table_version_shards") or 8)
+
+        # Thống kê label tổng hợp sẵn (tổng, theo ngày, histogram confidence), chia shard
+        # để label phổ biến không dồn vào một partition, xem recognition/runtime/label_stats.py
+        label_stats = ddb.Table(
+            self,
+            "LabelStats",
+            partition_key=ddb.Attribute(name="pk", type=ddb.AttributeType.STRING),
+            sort_key=ddb.Attribute(name="sk", type=ddb.AttributeType.STRING),
+        )
+        label_stats_shards = str(self.node.try_get_context("label_stats_shards") or 4)
+
+        # Lambda Layer dùng chung (shared.clients, ...)
+        common = _lambda.LayerVersion(
+            self,
+            "common_layer",
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_11],
+            compatible_architectures=tuning.LAYER_ARCHITECTURES,
+            code=_lambda.Code.from_asset("common"),
+            description="Shared runtime helpers for the image recognition Lambdas",
+        )
+
         # --- IAM ROLE for image_recognition Lambda ---
         recognition_role = iam.Role(
             self,
@@ -43,19 +106,14 @@ class RekognitionStack(Stack):
             ],
         )
 
-        # Grant DynamoDB + SQS + SNS + Rekognition permissions
+        # Grant DynamoDB + SNS + Rekognition permissions (quyền SQS do event source cấp)
         table.grant_write_data(recognition_role)
-        recognition_role.add_to_policy(
-            iam.PolicyStatement(
-                actions=[
-                    "sqs:ReceiveMessage",
-                    "sqs:DeleteMessage",
-                    "sqs:GetQueueAttributes",
-                    "sqs:SendMessage",  # Thêm nếu cần
-                ],
-                resources=[sqs_arn],
-            )
-        )
+        # Đọc label của ảnh canonical/ảnh gần giống để dùng lại
+        table.grant_read_data(recognition_role)
+        label_index.grant_write_data(recognition_role)
+        processing_ledger.grant_read_write_data(recognition_role)
+        version_table.grant_read_write_data(recognition_role)
+        label_stats.grant_read_write_data(recognition_role)
         recognition_role.add_to_policy(
             iam.PolicyStatement(
                 actions=["sns:Publish"],
@@ -69,26 +127,131 @@ class RekognitionStack(Stack):
             )
         )
 
+        # Rekognition đọc S3Object bằng quyền của Lambda, tiền xử lý cũng cần đọc ảnh,
+        # head_object của alias cũng cần s3:GetObject
+        if image_bucket_arn:
+            recognition_role.add_to_policy(
+                iam.PolicyStatement(
+                    actions=["s3:GetObject"],
+                    resources=[f"{image_bucket_arn}/*"],
+                )
+            )
+
+        recognition_environment = {
+            "TABLE_NAME": table.table_name,
+            "TOPIC_ARN": sns_arn,
+            "LABEL_INDEX_TABLE": label_index.table_name,
+            "LABEL_INDEX_SHARDS": label_index_shards,
+            "PROCESSING_LEDGER_TABLE": processing_ledger.table_name,
+            "VERSION_TABLE": version_table.table_name,
+            "TABLE_VERSION_SHARDS": table_version_shards,
+            "LABEL_STATS_TABLE": label_stats.table_name,
+            "LABEL_STATS_SHARDS": label_stats_shards,
+            # Throttle do shared.throttle thử lại (AIMD, trong thời gian còn lại của
+            # invoke); chỉ client gọi qua throttle.call tắt retry của botocore
+            "THROTTLE_INITIAL_RATE": str(self.node.try_get_context("rekognition_tps") or 50),
+            # Tham số detect_labels, đổi giá trị thì chạy tools/backfill.py để nhận diện lại ảnh cũ
+            "MAX_LABELS": str(self.node.try_get_context("max_labels") or 10),
+            "MIN_CONFIDENCE": str(self.node.try_get_context("min_confidence") or 70),
+        }
+
+        # Payload event RecognitionCompleted lớn hơn event_inline_max_bytes được ghi
+        # lên bucket của IntegrationStack (claim check), message chỉ mang con trỏ
+        if event_payload_bucket_arn and event_payload_bucket_name:
+            recognition_role.add_to_policy(
+                iam.PolicyStatement(
+                    actions=["s3:PutObject"],
+                    resources=[f"{event_payload_bucket_arn}/*"],
+                )
+            )
+            recognition_environment.update({
+                "EVENT_PAYLOAD_BUCKET": event_payload_bucket_name,
+                "EVENT_INLINE_MAX_BYTES": str(tuning.context_int(self, "event_inline_max_bytes", 16 * 1024)),
+            })
+        recognition_layers = [common]
+        recognition_memory = 128
+
+        # Tiền xử lý ảnh (thu nhỏ trước khi gửi Rekognition) cần layer Pillow:
+        # cdk deploy -c pillow_layer_arn=arn:aws:lambda:...:layer:Pillow:N
+        pillow_layer_arn = self.node.try_get_context("pillow_layer_arn")
+        if pillow_layer_arn:
+            # Bucket riêng cho ảnh chuẩn hóa/thumbnail, không gắn notification
+            derivative_bucket = s3.Bucket(self, "ImageDerivatives")
+            derivative_bucket.grant_put(recognition_role)
+            recognition_layers.append(
+                _lambda.LayerVersion.from_layer_version_arn(self, "pillow_layer", pillow_layer_arn))
+            # Cache label theo perceptual hash, multi-index theo từng đoạn của hash
+            phash_table = ddb.Table(
+                self,
+                "PerceptualHashes",
+                partition_key=ddb.Attribute(name="bucket", type=ddb.AttributeType.STRING),
+                sort_key=ddb.Attribute(name="image", type=ddb.AttributeType.STRING),
+                time_to_live_attribute="expires_at",
+            )
+            phash_table.grant_read_write_data(recognition_role)
+            recognition_environment.update({
+                "PREPROCESS_IMAGES": "true",
+                "PREPROCESS_MAX_EDGE": str(self.node.try_get_context("preprocess_max_edge") or 1600),
+                "DERIVATIVE_BUCKET": derivative_bucket.bucket_name,
+                "PHASH_TABLE": phash_table.table_name,
+                "PHASH_MAX_DISTANCE": str(self.node.try_get_context("phash_max_distance") or 4),
+            })
+            # Giải mã ảnh lớn cần nhiều bộ nhớ (và CPU đi kèm)
+            recognition_memory = 1024
+
         # Lambda for Rekognition
+        recognition_timeout = 30
         lambda_function = _lambda.Function(
             self,
             "image_recognition",
             runtime=_lambda.Runtime.PYTHON_3_11,
+            layers=recognition_layers,
             handler="image_recognition.handler",
             code=_lambda.Code.from_asset("recognition/runtime"),
             environment={
-                "TABLE_NAME": table.table_name,
-                "SQS_QUEUE_URL": sqs_url,
-                "TOPIC_ARN": sns_arn,
+                **recognition_environment,
+                "LEDGER_IN_PROGRESS_SECONDS": tuning.ledger_in_progress_seconds(recognition_timeout),
             },
             role=recognition_role,
-            timeout=Duration.seconds(30),  # Tăng timeout
+            timeout=Duration.seconds(recognition_timeout),  # Tăng timeout
+            # Bộ nhớ, kiến trúc, reserved concurrency: context recognition_* trong cdk.json
+            **tuning.function_props(self, "recognition", memory_size=recognition_memory),
         )
 
-        # Event source mapping cho SQS (cần tạo Queue từ ARN nếu muốn dùng SqsEventSource)
-        # Giả sử SQS queue đã tồn tại, dùng ARN để cấp quyền
-        # Nếu cần tích hợp trực tiếp, cần import Queue từ stack khác
-        # Ví dụ: từ stack khác, truyền queue object thay vì ARN
+        # Event source mapping từ upload queue (tạo ở APIStack), batch size, batching
+        # window, max concurrency và provisioned concurrency lấy từ context recognition_*.
+        # Message xử lý xong do event source xóa, message lỗi trả về qua batchItemFailures.
+        upload_queue = sqs.Queue.from_queue_arn(self, "UploadQueue", sqs_arn)
+        tuning.attach_queue(self, "recognition", lambda_function, upload_queue)
+
+        # Lane bulk (ảnh backfill/bulk ingest, ảnh lớn): cùng code, function riêng với
+        # timeout dài hơn, batch lớn hơn và trần TPS Rekognition thấp hơn để chừa
+        # quota cho lane interactive. Knob: context recognition_bulk_*.
+        if bulk_sqs_arn:
+            bulk_tps = tuning.context_int(
+                self, "recognition_bulk_tps", max(1, int(recognition_environment["THROTTLE_INITIAL_RATE"]) // 2))
+            bulk_timeout = tuning.context_int(self, "recognition_bulk_timeout_seconds", 120)
+            bulk_function = _lambda.Function(
+                self,
+                "image_recognition_bulk",
+                runtime=_lambda.Runtime.PYTHON_3_11,
+                layers=recognition_layers,
+                handler="image_recognition.handler",
+                code=_lambda.Code.from_asset("recognition/runtime"),
+                environment={
+                    **recognition_environment,
+                    "RECOGNITION_LANE": "bulk",
+                    "THROTTLE_INITIAL_RATE": str(bulk_tps),
+                    "THROTTLE_MAX_RATE": str(bulk_tps),
+                    "MAX_WORKERS": str(tuning.context_int(self, "recognition_bulk_max_workers", 16)),
+                    "LEDGER_IN_PROGRESS_SECONDS": tuning.ledger_in_progress_seconds(bulk_timeout),
+                },
+                role=recognition_role,
+                timeout=Duration.seconds(bulk_timeout),
+                **tuning.function_props(self, "recognition_bulk", memory_size=recognition_memory),
+            )
+            bulk_queue = sqs.Queue.from_queue_arn(self, "UploadBulkQueue", bulk_sqs_arn)
+            tuning.attach_queue(self, "recognition_bulk", bulk_function, bulk_queue)
 
         # --- IAM ROLE for ListImagesLambda ---
         list_role = iam.Role(
@@ -101,16 +264,28 @@ class RekognitionStack(Stack):
         )
 
         table.grant_read_data(list_role)
+        version_table.grant_read_data(list_role)
 
         # Lambda để list images
+        # Content-Type của response ListImagesLambda có thể nén gzip
+        list_binary_media_types = ["application/json", "application/x-ndjson"]
         list_img_lambda = _lambda.Function(
             self,
             "ListImagesLambda",
             function_name="ListImagesLambda",
             runtime=_lambda.Runtime.PYTHON_3_11,
+            layers=[common],
             code=_lambda.Code.from_asset("recognition/runtime"),
             handler="list_images.handler",
-            environment={"TABLE_NAME": table.table_name},
+            environment={
+                "TABLE_NAME": table.table_name,
+                "VERSION_TABLE": version_table.table_name,
+                "TABLE_VERSION_SHARDS": table_version_shards,
+                "BINARY_MEDIA_TYPES": ",".join(list_binary_media_types),
+                # Cache response trong container warm, hết hạn khi version của bảng đổi
+                "RESPONSE_CACHE_TTL_SECONDS": "30",
+                "RESPONSE_CACHE_MAX_BYTES": str(16 * 1024 * 1024),
+            },
             role=list_role,
         )
 
@@ -121,8 +296,139 @@ class RekognitionStack(Stack):
             rest_api_name="List Images Service",
             cloud_watch_role=False,
             description="CW workshop - list images recognized from workshop.",
+            # Response gzip (isBase64Encoded) được API Gateway giải mã base64 trước khi trả về
+            # khi Accept của request là một trong các type này. Chỉ liệt kê type mà
+            # ListImagesLambda nén thay vì "*/*" (mọi body request đều thành binary);
+            # API này chỉ có GET nên không có body request nào bị ảnh hưởng
+            binary_media_types=list_binary_media_types,
         )
 
         list_images = apigateway.LambdaIntegration(list_img_lambda)
 
-        api.root.add_method("GET", list_images)
\ No newline at end of file
+        api.root.add_method("GET", list_images)
+
+        # --- Export hằng đêm bảng Classifications ra S3 (NDJSON) ---
+        export_bucket = s3.Bucket(
+            self,
+            "ClassificationsExports",
+            lifecycle_rules=[
+                s3.LifecycleRule(abort_incomplete_multipart_upload_after=Duration.days(7)),
+            ],
+        )
+
+        export_role = iam.Role(
+            self,
+            "ExportImagesLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole"),
+            ],
+        )
+
+        table.grant_read_data(export_role)
+        export_bucket.grant_read_write(export_role)
+        # Lambda tự invoke lại để resume khi export chưa xong trong 15 phút
+        export_function_name = "ExportImagesLambda"
+        export_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[
+                    self.format_arn(
+                        service="lambda",
+                        resource="function",
+                        resource_name=export_function_name,
+                        arn_format=ArnFormat.COLON_RESOURCE_NAME,
+                    )
+                ],
+            )
+        )
+
+        export_lambda = _lambda.Function(
+            self,
+            "ExportImagesLambda",
+            function_name=export_function_name,
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            layers=[common],
+            code=_lambda.Code.from_asset("recognition/runtime"),
+            handler="export_images.handler",
+            environment={
+                "TABLE_NAME": table.table_name,
+                "EXPORT_BUCKET": export_bucket.bucket_name,
+                "EXPORT_SEGMENTS": "8",
+            },
+            role=export_role,
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+        )
+
+        eventbridge.Rule(
+            self,
+            "NightlyExportRule",
+            schedule=eventbridge.Schedule.cron(minute="0", hour="2"),
+            targets=[eventbridge_targets.LambdaFunction(export_lambda)],
+        )
+
+        # Lambda truy vấn ảnh theo label: GET /labels?label=Dog&min_confidence=90
+        query_role = iam.Role(
+            self,
+            "QueryLabelsLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole"),
+            ],
+        )
+
+        label_index.grant_read_data(query_role)
+
+        query_labels_lambda = _lambda.Function(
+            self,
+            "QueryLabelsLambda",
+            function_name="QueryLabelsLambda",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            layers=[common],
+            code=_lambda.Code.from_asset("recognition/runtime"),
+            handler="query_labels.handler",
+            environment={
+                "LABEL_INDEX_TABLE": label_index.table_name,
+                "LABEL_INDEX_SHARDS": label_index_shards,
+            },
+            role=query_role,
+        )
+
+        api.root.add_resource("labels").add_method(
+            "GET", apigateway.LambdaIntegration(query_labels_lambda)
+        )
+
+        # Lambda thống kê label: GET /stats?top=20&from=2024-01-01&to=2024-01-31,
+        # GET /stats?label=Dog&from=...
+        stats_role = iam.Role(
+            self,
+            "QueryStatsLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole"),
+            ],
+        )
+
+        label_stats.grant_read_data(stats_role)
+
+        query_stats_lambda = _lambda.Function(
+            self,
+            "QueryStatsLambda",
+            function_name="QueryStatsLambda",
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            layers=[common],
+            code=_lambda.Code.from_asset("recognition/runtime"),
+            handler="query_stats.handler",
+            environment={
+                "LABEL_STATS_TABLE": label_stats.table_name,
+                # Phải giống giá trị của image_recognition
+                "LABEL_STATS_SHARDS": label_stats_shards,
+            },
+            role=stats_role,
+            timeout=Duration.seconds(10),
+        )
+
+        api.root.add_resource("stats").add_method(
+            "GET", apigateway.LambdaIntegration(query_stats_lambda)
+        )
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from shared import clients, metrics
+
+from list_images import table_name, scan_pages, to_ndjson_line, decode_item
+
+EXPORT_BUCKET = os.environ.get("EXPORT_BUCKET")
+EXPORT_SEGMENTS = int(os.environ.get("EXPORT_SEGMENTS", "8"))
+EXPORT_MAX_WORKERS = int(os.environ.get("EXPORT_MAX_WORKERS", str(EXPORT_SEGMENTS)))
+# S3 yêu cầu mỗi part (trừ part cuối) tối thiểu 5 MiB
+EXPORT_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get("EXPORT_PART_SIZE", str(8 * 1024 * 1024))))
+# Dừng nhận trang mới khi thời gian còn lại của Lambda dưới mốc này
+EXPORT_SAFETY_MARGIN_MS = int(os.environ.get("EXPORT_SAFETY_MARGIN_MS", "60000"))
+
+CHECKPOINT_NAME = "_checkpoint.json"
+MANIFEST_NAME = "_manifest.json"
+
+
+class ExportCheckpoint:
+    """
+    Trạng thái export lưu ở <prefix>/_checkpoint.json để có thể resume.
+    Mỗi segment giữ UploadId, các part đã upload, LastEvaluatedKey tương ứng
+    với dữ liệu đã nằm trong các part đó và số item đã export.
+    """
+    def __init__(self, bucket, prefix):
+        self.bucket = bucket
+        self.key = f"{prefix}/{CHECKPOINT_NAME}"
+        self._lock = threading.Lock()
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            response = clients.get_client("s3").get_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return {"segments": {}}
+            raise
+        return json.loads(response["Body"].read())
+
+    def segment(self, segment):
+        with self._lock:
+            return dict(self.state["segments"].get(str(segment), {}))
+
+    def update(self, segment, **changes):
+        # put_object nằm trong lock: các segment ghi checkpoint theo đúng thứ tự
+        # snapshot, snapshot cũ không ghi đè được snapshot mới hơn
+        with self._lock:
+            self.state["segments"].setdefault(str(segment), {}).update(changes)
+            body = json.dumps(self.state).encode("utf-8")
+            clients.get_client("s3").put_object(
+                Bucket=self.bucket, Key=self.key, Body=body, ContentType="application/json")
+
+    def configure(self, **settings):
+        """
+        Ghi cấu hình export; export đang dở phải được resume với cùng cấu hình.
+        """
+        with self._lock:
+            existing = {k: self.state.get(k) for k in settings if k in self.state}
+            if existing and existing != settings:
+                raise ValueError(f"Export settings changed since checkpoint: {existing} != {settings}")
+            self.state.update(settings)
+
+
+def _segment_key(prefix, segment):
+    return f"{prefix}/segment-{segment:04d}.ndjson"
+
+
+def export_segment(checkpoint, prefix, segment, total_segments, label=None, fields=None,
+                   deadline=None, part_size=EXPORT_PART_SIZE):
+    """
+    Export một segment của parallel scan thành một object NDJSON bằng multipart upload.
+    Chỉ ghi checkpoint tại ranh giới trang scan, ngay sau khi part chứa trang đó
+    đã upload xong. Trả về True nếu segment đã export xong.
+    """
+    state = checkpoint.segment(segment)
+    if state.get("done"):
+        return True
+
+    bucket = checkpoint.bucket
+    key = _segment_key(prefix, segment)
+    upload_id = state.get("upload_id")
+    if not upload_id:
+        upload_id = clients.get_client("s3").create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType="application/x-ndjson")["UploadId"]
+        checkpoint.update(segment, upload_id=upload_id, parts=[], items=0, last_key=None)
+        state = checkpoint.segment(segment)
+    parts = list(state.get("parts", []))
+    exported = state.get("items", 0)
+
+    buffer = bytearray()
+    pending = 0
+
+    def flush(last_key):
+        nonlocal exported, pending
+        part_number = len(parts) + 1
+        with metrics.timer("S3UploadPart"):
+            response = clients.get_client("s3").upload_part(
+                Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=bytes(buffer))
+        parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        exported += pending
+        buffer.clear()
+        pending = 0
+        checkpoint.update(segment, parts=parts, items=exported, last_key=last_key)
+        print(f"Export progress: segment {segment}/{total_segments} parts={len(parts)} items={exported}")
+
+    for page, last_key in scan_pages(table_name, start_key=state.get("last_key"), label=label, fields=fields,
+                                     segment=segment, total_segments=total_segments):
+        for item in page:
+            buffer.extend(to_ndjson_line(decode_item(item)).encode("utf-8"))
+        pending += len(page)
+        if last_key is None:
+            break
+        if len(buffer) >= part_size:
+            flush(last_key)
+        if deadline is not None and time.monotonic() > deadline:
+            # Phần chưa flush sẽ được quét lại từ last_key trong checkpoint
+            return False
+
+    if not parts and not buffer:
+        # Segment rỗng: multipart upload phải có ít nhất một part
+        clients.get_client("s3").abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        clients.get_client("s3").put_object(Bucket=bucket, Key=key, Body=b"", ContentType="application/x-ndjson")
+    else:
+        if buffer or not parts:
+            flush(None)
+        clients.get_client("s3").complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    checkpoint.update(segment, done=True, items=exported, upload_id=None, parts=[])
+    return True
+
+
+# 2. Export toàn bộ bảng ra S3 dạng NDJSON bằng parallel scan
+def export_all_items(bucket, prefix, total_segments=EXPORT_SEGMENTS, label=None, fields=None, deadline=None):
+    """
+    Chạy parallel scan (Segment/TotalSegments) trên pool luồng, mỗi segment
+    stream vào một object NDJSON. Có thể gọi lại với cùng prefix để resume.
+    Trả về dict trạng thái; "complete" là True khi mọi segment đã xong.
+    """
+    checkpoint = ExportCheckpoint(bucket, prefix)
+    checkpoint.configure(table=table_name, total_segments=total_segments, label=label, fields=fields or None)
+
+    def _run(segment):
+        try:
+            return export_segment(checkpoint, prefix, segment, total_segments,
+                                  label=label, fields=fields, deadline=deadline)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchUpload":
+                raise
+            # Upload dang dở đã bị xóa (lifecycle/abort): export lại segment từ đầu
+            print(f"Multipart upload for segment {segment} no longer exists, restarting segment.")
+            checkpoint.update(segment, upload_id=None, parts=[], items=0, last_key=None)
+            return export_segment(checkpoint, prefix, segment, total_segments,
+                                  label=label, fields=fields, deadline=deadline)
+
+    with ThreadPoolExecutor(max_workers=min(EXPORT_MAX_WORKERS, total_segments)) as pool:
+        finished = list(pool.map(metrics.bind(_run), range(total_segments)))
+
+    segments = {int(k): v for k, v in checkpoint.state["segments"].items()}
+    result = {
+        "bucket": bucket,
+        "prefix": prefix,
+        "complete": all(finished),
+        "items": sum(segment.get("items", 0) for segment in segments.values()),
+        "segments_done": sum(1 for done in finished if done),
+        "total_segments": total_segments,
+    }
+    if result["complete"]:
+        manifest = dict(result, table=table_name, objects=[
+            {"key": _segment_key(prefix, segment), "items": segments[segment].get("items", 0)}
+            for segment in range(total_segments)
+        ])
+        clients.get_client("s3").put_object(Bucket=bucket, Key=f"{prefix}/{MANIFEST_NAME}",
+                             Body=json.dumps(manifest).encode("utf-8"), ContentType="application/json")
+    return result
+
+
+@metrics.instrument("ExportImages")
+def handler(event, context):
+    """
+    Được gọi bởi lịch chạy hằng đêm hoặc invoke trực tiếp với
+    {"prefix": ..., "total_segments": ..., "label": ..., "fields": [...]}.
+    Nếu hết thời gian, Lambda tự invoke lại (async) với cùng prefix để resume.
+    """
+    if clients.is_warmup_event(event):
+        clients.warm_up("dynamodb", "s3", "lambda")
+        return {"warmup": True}
+    if not EXPORT_BUCKET:
+        raise ValueError("EXPORT_BUCKET environment variable is not set")
+
+    event = event or {}
+    prefix = event.get("prefix") or f"exports/{table_name}/{datetime.now(timezone.utc):%Y-%m-%d}"
+    total_segments = int(event.get("total_segments") or EXPORT_SEGMENTS)
+    deadline = None
+    if context is not None:
+        remaining = context.get_remaining_time_in_millis() - EXPORT_SAFETY_MARGIN_MS
+        deadline = time.monotonic() + max(remaining, 0) / 1000.0
+
+    result = export_all_items(EXPORT_BUCKET, prefix, total_segments=total_segments,
+                              label=event.get("label"), fields=event.get("fields"), deadline=deadline)
+    print(f"Export status: {result}")
+    metrics.put("ExportedItems", result["items"])
+
+    if not result["complete"] and context is not None:
+        payload = dict(event, prefix=prefix, total_segments=total_segments)
+        clients.get_client("lambda").invoke(FunctionName=context.function_name, InvocationType="Event",
+                             Payload=json.dumps(payload).encode("utf-8"))
+        print(f"Export incomplete, re-invoked {context.function_name} to resume {prefix}.")
+    return result
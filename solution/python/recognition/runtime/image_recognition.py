@@ -1,102 +1,676 @@
 import os
-import boto3
+import time
 import json
+import datetime
+import label_cache
+import label_index
+import label_schema
+import label_stats
+import preprocess
+from collections import namedtuple
+from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor
+from shared import clients, events, idempotency, metrics, table_version, throttle
 
-sqs = boto3.client("sqs")
-rekognition = boto3.client("rekognition")
-dynamodb = boto3.client("dynamodb")
-sns = boto3.client("sns")
-
-queue_url = os.environ["SQS_QUEUE_URL"]
 table_name = os.environ["TABLE_NAME"]
 topic_arn = os.environ["TOPIC_ARN"]
+# Bảng chỉ mục ngược label -> image (tùy chọn)
+label_index_table_name = os.environ.get("LABEL_INDEX_TABLE")
+# Ledger idempotency theo phiên bản object (tùy chọn)
+processing_ledger_table = os.environ.get("PROCESSING_LEDGER_TABLE")
+# Bảng bộ đếm phiên bản, tăng sau mỗi lần ghi để cache của list_images hết hạn (tùy chọn)
+version_table_name = os.environ.get("VERSION_TABLE")
+
+# Lane của upload queue mà function này tiêu thụ ("interactive" hoặc "bulk"), mỗi
+# lane là một function riêng với cấu hình riêng, metric được tách theo Service
+LANE = os.environ.get("RECOGNITION_LANE", "interactive")
+METRICS_SERVICE = "ImageRecognition" if LANE == "interactive" else f"ImageRecognition{LANE.title()}"
+
+# Tham số của detect_labels. Đổi các giá trị này làm thay đổi RECOGNITION_VERSION,
+# tools/backfill.py nhận diện lại các ảnh có version cũ.
+MAX_LABELS = int(os.environ.get("MAX_LABELS", "10"))
+MIN_CONFIDENCE = float(os.environ.get("MIN_CONFIDENCE", "70"))
+RECOGNITION_VERSION = f"v{label_schema.SCHEMA_VERSION}:max{MAX_LABELS}:min{MIN_CONFIDENCE:g}"
+
+# Số luồng tối đa gọi Rekognition song song trong một lần invoke
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))
+# Số lần thử lại UnprocessedItems của batch_write_item
+DDB_BATCH_MAX_RETRIES = int(os.environ.get("DDB_BATCH_MAX_RETRIES", "5"))
+
+# Tốc độ khởi đầu (request/s) của governor cho DynamoDB, xem shared.throttle
+DDB_INITIAL_RATE = float(os.environ.get("DDB_INITIAL_RATE", "500"))
+
+# Giới hạn của các API batch
+DDB_BATCH_SIZE = 25
+SNS_BATCH_SIZE = 10
+
+SNS_SUBJECT = "CodeWhisperer Workshop Success!"
+# Event "nhận diện xong" publish qua shared.events (envelope JSON, payload lớn
+# được offload lên EVENT_PAYLOAD_BUCKET), có kèm bounding box của label
+EVENT_TYPE = "RecognitionCompleted"
+EVENT_INCLUDE_INSTANCES = os.environ.get("EVENT_INCLUDE_INSTANCES", "true").lower() == "true"
+# Số tên label tối đa trong message attribute "labels" (dùng cho filter policy)
+EVENT_ATTRIBUTE_LABELS = 10
+
+# Metadata của object alias (ảnh trùng nội dung) do get_save_image ghi
+ALIAS_METADATA_KEY = "alias-of"
+DDB_BATCH_GET_SIZE = 100
+
+# Client được tạo lazy qua shared.clients; client của API gọi qua throttle.call
+# lấy bằng throttle.client (botocore không tự retry)
+REQUIRED_CLIENTS = ("dynamodb", "sns")
+THROTTLED_CLIENTS = ("rekognition", "dynamodb")
+
+# Bảng on-demand chịu được tốc độ cao và tăng lại nhanh sau khi bị throttle
+for _api in ("DynamoDBWrite", "DynamoDBRead"):
+    throttle.configure(_api, rate=DDB_INITIAL_RATE, min_rate=10, max_rate=max(DDB_INITIAL_RATE, 1000),
+                       increase=DDB_INITIAL_RATE / 10)
+
+# Label dùng lại từ ảnh gần giống (perceptual hash)
+SimilarImage = namedtuple("SimilarImage", "source distance labels")
+
+# Pool được giữ lại giữa các lần invoke khi container còn warm
+_executor = None
+_ledger = idempotency.Ledger(processing_ledger_table) if processing_ledger_table else None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
 
 # 1 Use Rekognition to detect max of 10 labels with a confidence of 70 percent.
-def detectImgLabels(bucket_name, key, maxLabels=10, minConfidence=70):
-    image = {
-        "S3Object": {
-            "Bucket": bucket_name,
-            "Name": key
-        }
-    }
-    response = rekognition.detect_labels(Image=image, MaxLabels=maxLabels, MinConfidence=minConfidence)
+def detectImgLabels(bucket_name, key, maxLabels=MAX_LABELS, minConfidence=MIN_CONFIDENCE, image=None):
+    # Ảnh đã thu nhỏ dạng bytes nếu bật tiền xử lý, ngược lại là S3Object
+    if image is None:
+        image, _ = preprocess.prepare_image(bucket_name, key)
+    with metrics.timer("DetectLabels"):
+        response = throttle.call("DetectLabels", throttle.client("rekognition").detect_labels,
+                                 Image=image, MaxLabels=maxLabels, MinConfidence=minConfidence)
     return response
 
 # 2 Write labels to DynamoDB given a table name and item.
 def writeToDynamoDb(tableName, item):
-    dynamodb.put_item(
-        TableName=tableName,
-        Item=item
-    )
+    with metrics.timer("DynamoDBWrite"):
+        throttle.call("DynamoDBWrite", throttle.client("dynamodb").put_item,
+            TableName=tableName,
+            Item=item
+        )
 
 # 3 Publish item to SNS
-def triggerSNS(message):
-    response = sns.publish(
-        TopicArn=topic_arn,
-        Message=message,
-        Subject="CodeWhisperer Workshop Success!", # Đã điều chỉnh Subject
-    )
-    print(response)
-
-# 4 Delete message from SQS
-def deleteFromSqs(receipt_handle):
-    sqs.delete_message(
-        QueueUrl=queue_url,
-        ReceiptHandle=receipt_handle
-    )
+def buildEvent(bucket_name, key, db_item, labels):
+    """
+    Trả về (payload, message attributes) của event nhận diện xong một ảnh.
+    """
+    payload = label_schema.to_event(bucket_name, key, labels, instances=EVENT_INCLUDE_INSTANCES)
+    attributes = {
+        "label_count": len(labels),
+        "labels": sorted({normalizeLabel(label["name"]) for label in labels})[:EVENT_ATTRIBUTE_LABELS] or None,
+        "label_source": db_item.get("label_source", {}).get("S", "rekognition"),
+        "lane": LANE,
+    }
+    return payload, attributes
+
+
+def triggerSNS(event):
+    message, attributes = events.encode(event[0], EVENT_TYPE, event[1])
+    with metrics.timer("SNSPublish"):
+        clients.get_client("sns").publish(
+            TopicArn=topic_arn,
+            Message=message,
+            Subject=SNS_SUBJECT, # Đã điều chỉnh Subject
+            MessageAttributes=attributes,
+        )
+
+# 4 Gọi detect_labels song song trên pool có giới hạn số luồng.
+def detectLabelsConcurrently(images):
+    """
+    Nhận danh sách (bucket, key), trả về list (kết quả, phash) cùng thứ tự.
+    Kết quả là response của Rekognition, SimilarImage hoặc Exception nếu lỗi.
+    """
+    def _detect(image):
+        bucket_name, key = image
+        try:
+            return recognizeImage(bucket_name=bucket_name, key=key)
+        except Exception as e:
+            print(f"Error detecting labels for {key}: {e}")
+            return e, None
+
+    if len(images) == 1:
+        return [_detect(images[0])]
+    return list(_get_executor().map(metrics.bind(_detect), images))
+
+# 5 Ghi nhiều item bằng batch_write_item, thử lại UnprocessedItems với backoff.
+def writeBatchToDynamoDb(tableName, items, maxRetries=DDB_BATCH_MAX_RETRIES):
+    """
+    Trả về danh sách item không ghi được sau khi đã thử lại.
+    """
+    requests = [{"PutRequest": {"Item": item}} for item in items]
+    return [request["PutRequest"]["Item"] for request in writeRequestsToDynamoDb(tableName, requests, maxRetries)]
+
+
+def writeRequestsToDynamoDb(tableName, requests, maxRetries=DDB_BATCH_MAX_RETRIES):
+    """
+    Gửi các PutRequest/DeleteRequest bằng batch_write_item.
+    Trả về danh sách request không thực hiện được sau khi đã thử lại.
+    """
+    failed = []
+    for start in range(0, len(requests), DDB_BATCH_SIZE):
+        request_items = {tableName: requests[start:start + DDB_BATCH_SIZE]}
+        attempt = 0
+        while request_items:
+            try:
+                with metrics.timer("DynamoDBWrite"):
+                    response = throttle.call("DynamoDBWrite", throttle.client("dynamodb").batch_write_item,
+                                             RequestItems=request_items)
+            except Exception as e:
+                print(f"DynamoDB batch write error: {e}")
+                failed.extend(request_items.get(tableName, []))
+                break
+            sent = len(request_items.get(tableName, []))
+            request_items = response.get("UnprocessedItems") or {}
+            if not request_items:
+                break
+            # Cả batch bị trả lại nghĩa là bảng đang bị throttle; một phần thì
+            # thường chỉ là partition nóng nên chỉ backoff mà không giảm tốc độ
+            if len(request_items.get(tableName, [])) >= sent:
+                throttle.governor("DynamoDBWrite").on_throttle()
+            try:
+                if attempt >= maxRetries:
+                    raise throttle.DeadlineExceeded("retries exhausted")
+                delay = throttle.backoff(attempt)
+            except throttle.DeadlineExceeded:
+                failed.extend(request_items.get(tableName, []))
+                break
+            time.sleep(delay)
+            attempt += 1
+        metrics.put("DynamoDBRetries", attempt)
+    return failed
+
+# 6 Publish nhiều message bằng publish_batch (tối đa 10 entry mỗi lần gọi).
+def triggerSNSBatch(messages):
+    """
+    Nhận list (payload, message attributes) của buildEvent.
+    Trả về tập chỉ số (index trong messages) publish thất bại.
+    """
+    failed = set()
+    encoded = []
+    for index, (payload, attributes) in enumerate(messages):
+        try:
+            message, message_attributes = events.encode(payload, EVENT_TYPE, attributes)
+        except Exception as e:
+            # Không ghi được payload offload lên S3
+            print(f"Error encoding event {index}: {e}")
+            failed.add(index)
+            continue
+        encoded.append({"Id": str(index), "Message": message, "Subject": SNS_SUBJECT,
+                        "MessageAttributes": message_attributes})
+    for start in range(0, len(encoded), SNS_BATCH_SIZE):
+        entries = encoded[start:start + SNS_BATCH_SIZE]
+        try:
+            with metrics.timer("SNSPublish"):
+                response = clients.get_client("sns").publish_batch(TopicArn=topic_arn, PublishBatchRequestEntries=entries)
+        except Exception as e:
+            print(f"SNS publish_batch error: {e}")
+            failed.update(int(entry["Id"]) for entry in entries)
+            continue
+        for failure in response.get("Failed", []):
+            print(f"SNS publish failed for entry {failure.get('Id')}: {failure.get('Message')}")
+            failed.add(int(failure["Id"]))
+    return failed
+
+# 7 Tìm key canonical của các object rỗng (alias do ingest ghi cho ảnh trùng nội dung).
+def resolveAliases(images):
+    """
+    Nhận danh sách (bucket, key) có size 0, trả về {(bucket, key): canonical_key}
+    cho những object có metadata alias-of.
+    """
+    def _resolve(image):
+        bucket_name, key = image
+        try:
+            with metrics.timer("S3Head"):
+                response = clients.get_client("s3").head_object(Bucket=bucket_name, Key=key)
+        except Exception as e:
+            print(f"Error reading metadata of {key}: {e}")
+            return None
+        return (response.get("Metadata") or {}).get(ALIAS_METADATA_KEY)
+
+    if not images:
+        return {}
+    canonicals = [_resolve(images[0])] if len(images) == 1 else list(_get_executor().map(metrics.bind(_resolve), images))
+    return {image: canonical for image, canonical in zip(images, canonicals) if canonical}
+
+
+# 8 Đọc item đã lưu trong bảng Classifications bằng batch_get_item.
+def getStoredItems(tableName, keys, projection=None):
+    """
+    Trả về {key: item wire format} cho các key đã có trong bảng.
+    projection là danh sách attribute cần đọc (mặc định đọc cả item).
+    """
+    keys = list(dict.fromkeys(keys))
+    stored = {}
+    for start in range(0, len(keys), DDB_BATCH_GET_SIZE):
+        request = {"Keys": [{"image": {"S": key}} for key in keys[start:start + DDB_BATCH_GET_SIZE]]}
+        if projection:
+            request["ProjectionExpression"] = ", ".join(f"#p{i}" for i in range(len(projection)))
+            request["ExpressionAttributeNames"] = {f"#p{i}": name for i, name in enumerate(projection)}
+        request_items = {tableName: request}
+        attempt = 0
+        while request_items:
+            with metrics.timer("DynamoDBRead"):
+                response = throttle.call("DynamoDBRead", throttle.client("dynamodb").batch_get_item,
+                                         RequestItems=request_items)
+            for item in response.get("Responses", {}).get(tableName, []):
+                stored[item["image"]["S"]] = item
+            sent = len(request_items[tableName]["Keys"])
+            request_items = response.get("UnprocessedKeys") or {}
+            if not request_items:
+                break
+            if len(request_items.get(tableName, {}).get("Keys", [])) >= sent:
+                throttle.governor("DynamoDBRead").on_throttle()
+            if attempt >= DDB_BATCH_MAX_RETRIES:
+                break
+            # Key chưa đọc được coi như chưa có label, ảnh sẽ được xử lý lại
+            try:
+                time.sleep(throttle.backoff(attempt))
+            except throttle.DeadlineExceeded:
+                break
+            attempt += 1
+    return stored
+
+
+def getStoredLabels(tableName, keys):
+    """
+    Trả về {key: list label} cho các key đã có trong bảng Classifications.
+    """
+    return {key: label_schema.labels_from_item(item) for key, item in getStoredItems(tableName, keys).items()}
+
+
+# 9 Dùng lại label của ảnh gần giống (perceptual hash) trước khi gọi Rekognition.
+def recognizeImage(bucket_name, key):
+    """
+    Trả về (kết quả, phash): kết quả là response của Rekognition hoặc
+    SimilarImage; phash là None nếu cache tắt hoặc ảnh không giải mã được.
+    """
+    image, decoded = preprocess.prepare_image(bucket_name, key)
+    phash = None
+    if decoded is not None and label_cache.is_enabled():
+        phash = label_cache.dhash(decoded)
+        match = label_cache.lookup(phash)
+        # Ảnh được ghi đè dưới cùng key vẫn được nhận diện lại
+        if match is not None and match[0] != key:
+            source, distance, source_hash = match
+            labels = getSimilarLabels(source, source_hash)
+            if labels is not None:
+                return SimilarImage(source, distance, labels), phash
+    return detectImgLabels(bucket_name, key, image=image), phash
+
+
+def getSimilarLabels(source, source_hash):
+    """
+    Label của ảnh nguồn trong cache perceptual hash, None nếu không dùng được:
+    item Classifications của nguồn phải còn mang đúng hash đó (nguồn chưa bị
+    ghi đè/nhận diện lại với nội dung khác) và được tạo với RECOGNITION_VERSION
+    hiện tại. Entry của nội dung đã đổi bị xóa khỏi cache.
+    """
+    item = getStoredItems(table_name, [source]).get(source)
+    stored_hash = (item or {}).get("phash", {}).get("S")
+    if stored_hash is None or int(stored_hash, 16) != source_hash:
+        print(f"Perceptual hash entry of {source} is stale, calling Rekognition.")
+        label_cache.forget(source, source_hash)
+        return None
+    if item.get("recognition_version", {}).get("S") != RECOGNITION_VERSION:
+        print(f"Labels of similar image {source} are from another recognition version, calling Rekognition.")
+        return None
+    return label_schema.labels_from_item(item)
+
+
+def buildDbItem(key, labels, phash=None):
+    """
+    Tạo item DynamoDB (label_schema version 2) từ response của Rekognition.
+    Trả về (db_item, db_result) với db_result là list label đã rút gọn.
+    """
+    db_result = label_schema.labels_from_rekognition(labels)
+    db_item = label_schema.to_item(key, db_result, recognition_version=RECOGNITION_VERSION, phash=phash)
+    return db_item, db_result
+
+
+def normalizeLabel(name):
+    """
+    Chuẩn hóa tên label (giống partition key của bảng LabelIndex).
+    """
+    return label_index.normalize(name)
+
 
+def buildIndexItems(key, db_result):
+    """
+    Tạo các item cho bảng chỉ mục ngược label -> image (partition key chia
+    shard theo ảnh, GSI "by_confidence" sắp xếp theo confidence).
+    """
+    return label_index.build_items(key, db_result)
 
+
+def buildIndexDeletes(key, old_labels, db_result):
+    """
+    Key của các item chỉ mục ứng với label ảnh không còn có (ví dụ sau khi
+    nhận diện lại với MAX_LABELS/MIN_CONFIDENCE khác).
+    """
+    return label_index.vanished_keys(key, old_labels, db_result)
+
+
+def updateLabelStats(written, previous):
+    """
+    Cập nhật thống kê label (label_stats) cho các ảnh vừa ghi.
+    previous là {key: item} đọc trước khi ghi, ảnh không có trong đó là ảnh mới.
+    """
+    changes = []
+    for key, (db_item, _) in written:
+        old = previous.get(key)
+        changes.append((
+            label_schema.labels_from_item(old) if old is not None else None,
+            label_schema.labels_from_item(db_item),
+        ))
+    try:
+        label_stats.write(label_stats.build_deltas(changes), _get_executor())
+    except Exception as e:
+        # Thống kê là best-effort, không làm ảnh đã ghi bị xử lý lại
+        print(f"Error updating label stats: {e}")
+        metrics.put("LabelStatsWriteErrors", 1)
+
+
+def processImages(images, objects=None, notify=True):
+    """
+    Chạy toàn bộ pipeline cho danh sách (bucket, key): nhận diện song song,
+    ghi DynamoDB theo batch và publish SNS theo batch (notify=False bỏ qua SNS,
+    dùng khi nhận diện lại hàng loạt).
+    objects là thông tin object trong S3 event theo (bucket, key); object có
+    size 0 là alias được chép label của ảnh canonical thay vì gọi Rekognition.
+    Trả về tập (bucket, key) bị lỗi ở bất kỳ bước nào.
+    """
+    images = list(dict.fromkeys(images))  # Bỏ trùng nhưng giữ thứ tự
+    if not images:
+        return set()
+    objects = objects or {}
+
+    aliases = resolveAliases([image for image in images if objects.get(image, {}).get("size") == 0])
+    stored = {}
+    if aliases:
+        try:
+            stored = getStoredLabels(table_name, aliases.values())
+        except Exception as e:
+            print(f"Error reading labels of canonical images: {e}")
+    detected = [image for image in images if image not in aliases]
+
+    # Bảng Classifications chỉ dùng key làm partition key, key trùng trong
+    # cùng một batch_write_item sẽ bị từ chối nên chỉ giữ kết quả cuối cùng.
+    results = {}
+    index_items = {}
+
+    def _addResult(bucket_name, key, db_item, db_result):
+        event = buildEvent(bucket_name, key, db_item, db_result)
+        items = buildIndexItems(key, db_result) if label_index_table_name else []
+        metrics.put("LabelCount", len(db_result))
+        results[key] = (db_item, event)
+        for item in items:
+            index_items[(item["label"]["S"], key)] = item
+
+    def _resultFailed(key, error):
+        # Lỗi dữ liệu của một ảnh (ví dụ label cũ thiếu trường) chỉ làm ảnh đó
+        # bị gửi lại, các ảnh khác trong batch vẫn được ghi
+        print(f"Error building result for {key}: {error!r}")
+        metrics.put("ResultErrors", 1)
+
+    phashes = {}
+    for (bucket_name, key), (labels, phash) in zip(detected, detectLabelsConcurrently(detected)):
+        if isinstance(labels, Exception):
+            continue
+        try:
+            if isinstance(labels, SimilarImage):
+                metrics.put("SimilarImages", 1)
+                db_item = label_schema.to_item(key, labels.labels, similar_to=labels.source,
+                                               distance=labels.distance, recognition_version=RECOGNITION_VERSION)
+                _addResult(bucket_name, key, db_item, labels.labels)
+                continue
+            db_item, db_result = buildDbItem(key, labels, phash=phash)
+            _addResult(bucket_name, key, db_item, db_result)
+        except Exception as e:
+            _resultFailed(key, e)
+            continue
+        if phash is not None:
+            phashes[key] = phash
+
+    for (bucket_name, key), canonical in aliases.items():
+        db_result = stored.get(canonical)
+        if db_result is None:
+            # Ảnh canonical chưa được nhận diện xong, message sẽ được gửi lại
+            print(f"Labels of {canonical} are not available yet, retrying alias {key} later.")
+            continue
+        try:
+            _addResult(bucket_name, key, label_schema.to_item(key, db_result, alias_of=canonical,
+                                                              recognition_version=RECOGNITION_VERSION), db_result)
+        except Exception as e:
+            _resultFailed(key, e)
+            continue
+        metrics.put("AliasedImages", 1)
+
+    # Label cũ của các ảnh (đọc trước khi ghi đè) để thống kê chỉ cộng phần chênh lệch
+    # và xóa các item chỉ mục của label ảnh không còn có
+    previous = None
+    if results and (label_stats.is_enabled() or label_index_table_name):
+        try:
+            previous = getStoredItems(table_name, list(results), projection=["image", "labels"])
+        except Exception as e:
+            if label_index_table_name:
+                # Không biết label cũ thì không xóa được item chỉ mục cũ, xử lý lại sau
+                print(f"Error reading previous labels, retrying the batch later: {e}")
+                return set(images)
+            print(f"Error reading previous labels, skipping label stats: {e}")
+
+    # Ghi chỉ mục trước, ảnh nào ghi chỉ mục lỗi thì không ghi Classifications
+    # để message được gửi lại và cả hai bảng được ghi lại cùng nhau.
+    if label_index_table_name and results:
+        index_requests = [{"PutRequest": {"Item": item}} for item in index_items.values()]
+        for key, (db_item, _) in results.items():
+            old = previous.get(key)
+            if old is not None:
+                index_requests.extend(
+                    {"DeleteRequest": {"Key": index_key}}
+                    for index_key in buildIndexDeletes(key, label_schema.labels_from_item(old),
+                                                       label_schema.labels_from_item(db_item)))
+        for request in writeRequestsToDynamoDb(label_index_table_name, index_requests):
+            image = (request.get("PutRequest", {}).get("Item") or request["DeleteRequest"]["Key"])["image"]["S"]
+            if results.pop(image, None):
+                print(f"Failed to write label index for {image} to DynamoDB.")
+
+    unwritten = writeBatchToDynamoDb(table_name, [db_item for db_item, _ in results.values()])
+    for item in unwritten:
+        print(f"Failed to write labels for {item['image']['S']} to DynamoDB.")
+        results.pop(item["image"]["S"])
+
+    written = list(results.items())
+    if written and version_table_name:
+        # Lỗi ở đây chỉ làm cache phía đọc cũ hơn (tối đa TTL của cache)
+        try:
+            table_version.bump(version_table_name, table_name)
+        except Exception as e:
+            print(f"Error bumping version of {table_name}: {e}")
+    if written and previous is not None and label_stats.is_enabled():
+        updateLabelStats(written, previous)
+    unpublished = set()
+    if notify:
+        unpublished = triggerSNSBatch([event for _, (_, event) in written])
+    succeeded = {key for index, (key, _) in enumerate(written) if index not in unpublished}
+    # Chỉ ảnh đã ghi label mới làm nguồn cho cache perceptual hash
+    if phashes:
+        label_cache.remember([(key, phash) for key, phash in phashes.items() if key in succeeded])
+    return {image for image in images if image[1] not in succeeded}
+
+
+def _parseMessage(Record, objects=None):
+    """
+    Lấy danh sách (bucket, key) từ body của một message SQS (S3 event qua SNS).
+    Thông tin object trong event (size, eTag, sequencer) được ghi vào objects (nếu có).
+    """
+    images = []
+    body_records = json.loads(Record.get("body") or "{}").get("Records", []) # Xử lý trường hợp body rỗng
+    for record in body_records:
+        bucket_name = record.get("s3", {}).get("bucket", {}).get("name") # Xử lý trường hợp key không tồn tại
+        key = record.get("s3", {}).get("object", {}).get("key")
+        size = record.get("s3", {}).get("object", {}).get("size")
+
+        # Bỏ qua nếu không lấy được bucket_name hoặc key
+        if not bucket_name or not key:
+            print("Skipping record due to missing bucket name or key.")
+            continue
+        if size is not None:
+            metrics.put("ImageBytes", size, "Bytes")
+        # Key trong S3 event được URL-encode (dấu cách thành "+")
+        images.append((bucket_name, unquote_plus(key)))
+        if objects is not None:
+            objects[images[-1]] = dict(record["s3"]["object"], event_time=record.get("eventTime"))
+    return images
+
+
+def recordTimeToLabels(images, objects):
+    """
+    Metric TimeToLabels: thời gian từ lúc object được ghi (eventTime của S3 event)
+    đến khi label của ảnh đã được ghi và publish.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for image in images:
+        event_time = objects.get(image, {}).get("event_time")
+        if not event_time:
+            continue
+        try:
+            created = datetime.datetime.fromisoformat(event_time.replace("Z", "+00:00"))
+        except ValueError:
+            continue
+        metrics.put("TimeToLabels", max(0.0, (now - created).total_seconds() * 1000), "Milliseconds")
+
+
+def ledgerKey(image, objects):
+    """
+    Key của ledger: bucket/key#sequencer (hoặc eTag), mỗi lần ghi object là một phiên bản.
+    """
+    bucket_name, key = image
+    info = objects.get(image, {})
+    return f"{bucket_name}/{key}#{info.get('sequencer') or info.get('eTag') or ''}"
+
+
+# 10 Claim ảnh trong processing ledger trước khi xử lý.
+def claimImages(images, objects):
+    """
+    Trả về (claims, done, busy): claims là {image: (ledger key, token)} của ảnh
+    được xử lý lần này, done là ảnh đã xử lý xong trước đó, busy là ảnh đang
+    được một lần invoke khác giữ. Lỗi của ledger không chặn việc xử lý.
+    """
+    claims, done, busy = {}, set(), set()
+    if _ledger is None or not images:
+        return claims, done, busy
+
+    def _claim(image):
+        key = ledgerKey(image, objects)
+        try:
+            return key, _ledger.claim(key)
+        except Exception as e:
+            print(f"Ledger claim failed for {key}, processing without it: {e}")
+            return key, (idempotency.CLAIMED, None)
+
+    images = list(dict.fromkeys(images))
+    results = [_claim(images[0])] if len(images) == 1 else _get_executor().map(metrics.bind(_claim), images)
+    for image, (key, (status, token)) in zip(images, results):
+        if status == idempotency.COMPLETED:
+            done.add(image)
+        elif status == idempotency.IN_PROGRESS:
+            busy.add(image)
+        elif token is not None:
+            claims[image] = (key, token)
+    return claims, done, busy
+
+
+def settleClaims(claims, failed):
+    """
+    Đánh dấu COMPLETED cho ảnh thành công, xóa claim của ảnh lỗi để xử lý lại.
+    """
+    for image, (key, token) in claims.items():
+        try:
+            if image in failed:
+                _ledger.release(key, token)
+            else:
+                _ledger.complete(key, token)
+        except Exception as e:
+            print(f"Ledger update failed for {key}: {e}")
+
+
+def warm_up():
+    """
+    Dựng trước client và thread pool, gọi trong init phase hoặc bởi warm-up event.
+    """
+    clients.warm_up(*REQUIRED_CLIENTS)
+    for service in THROTTLED_CLIENTS:
+        throttle.client(service)
+    _get_executor()
+    if preprocess.PREPROCESS_IMAGES:
+        preprocess.is_enabled()
+
+
+@metrics.instrument(METRICS_SERVICE)
 def handler(event, context):
-    print(event)
-    print(type(event))
+    if clients.is_warmup_event(event):
+        warm_up()
+        return {"warmup": True}
+    throttle.start(context)
     try:
-        # process message from SQS
+        messages = []
+        objects = {}
+        batch_item_failures = []
         for Record in event.get("Records", []): # Đảm bảo Records là một list
-            receipt_handle = Record.get("receiptHandle")
-            body_records = json.loads(Record.get("body", "{}")).get("Records", []) # Xử lý trường hợp body rỗng
-            
-            for record in body_records:
-                bucket_name = record.get("s3", {}).get("bucket", {}).get("name") # Xử lý trường hợp key không tồn tại
-                key = record.get("s3", {}).get("object", {}).get("key")
-
-                # Bỏ qua nếu không lấy được bucket_name hoặc key
-                if not bucket_name or not key:
-                    print("Skipping record due to missing bucket name or key.")
-                    continue
-
-                # call method #1 to generate image label and store as var "labels"
-                labels = detectImgLabels(bucket_name=bucket_name, key=key)
-                print(f"Detected labels for {key}: {labels['Labels']}")
-
-                # code snippet to create dynamodb item from labels
-                db_result = []
-                # Đảm bảo "Labels" tồn tại trước khi truy cập
-                if "Labels" in labels:
-                    json_labels = json.dumps(labels["Labels"])
-                    db_labels = json.loads(json_labels)
-                    for label in db_labels:
-                        if "Name" in label:
-                            db_result.append(label["Name"])
-                
-                db_item = {
-                    "image": {"S": key},
-                    "labels": {"S": str(db_result)}
-                }
-
-                # call method #2 to store "db_item" result on DynamoDB
-                writeToDynamoDb(tableName=table_name, item=db_item)
-                print(f"Wrote labels for {key} to DynamoDB.")
-
-                # call method #3 sending db_result as a string to trigger SNS.
-                triggerSNS(str(db_result))
-                print(f"Published SNS message for {key}.")
-
-                # call method #4 to delete img from SQS.
-                deleteFromSqs(receipt_handle=receipt_handle)
-                print(f"Deleted SQS message with handle: {receipt_handle}")
+            # Số lần message đã được nhận, lớn hơn 1 nghĩa là đang xử lý lại
+            receive_count = Record.get("attributes", {}).get("ApproximateReceiveCount")
+            if receive_count:
+                metrics.put("ReceiveCount", int(receive_count))
+            try:
+                messages.append((Record, _parseMessage(Record, objects)))
+            except ValueError as e:
+                print(f"Invalid message body for {Record.get('messageId')}: {e}")
+                batch_item_failures.append({"itemIdentifier": Record.get("messageId")})
+
+        allImages = [image for _, images in messages for image in images]
+        # Ảnh đã xử lý xong ở lần gửi trước được bỏ qua, ảnh đang được lần
+        # invoke khác xử lý thì để SQS gửi lại sau.
+        claims, done, busy = claimImages(allImages, objects)
+        if done:
+            metrics.put("DuplicateRecords", len(done))
+        # Nếu processImages raise, mọi claim được xóa để lần gửi lại xử lý ngay
+        failed = set(allImages)
+        try:
+            failed = processImages([image for image in allImages if image not in done and image not in busy],
+                                   objects)
+            failed |= busy
+        finally:
+            settleClaims(claims, failed)
+        recordTimeToLabels([image for image in allImages if image not in done and image not in failed], objects)
+
+        # Message có ảnh lỗi được trả về qua batchItemFailures để SQS gửi lại,
+        # các message còn lại do event source mapping xóa.
+        for Record, images in messages:
+            if any(image in failed for image in images):
+                batch_item_failures.append({"itemIdentifier": Record.get("messageId")})
+
+        print(f"Processed {len(messages)} messages, {len(batch_item_failures)} failed.")
+        metrics.put("FailedMessages", len(batch_item_failures))
+        throttle.report()
+
+        return {"batchItemFailures": batch_item_failures}
 
     except Exception as e:
         print(e)
         # Bắt lỗi chung, nhưng cũng cố gắng in ra thông tin chi tiết hơn nếu có thể
         print(f"Error processing records. Details: {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+
+if clients.WARM_UP_ON_INIT:
+    warm_up()
@@ -0,0 +1,311 @@
+"""
+Cache label theo perceptual hash: ảnh gần giống một ảnh đã nhận diện (cùng
+ảnh nhưng khác kích thước, khác chất lượng JPEG) dùng lại label của ảnh đó
+thay vì gọi Rekognition.
+
+Hash là dHash 64 bit tính trên ảnh đã giải mã bởi preprocess, hai ảnh được
+coi là giống nhau khi khoảng cách Hamming <= PHASH_MAX_DISTANCE.
+
+Tra cứu hai tầng:
+  - BKTree trong bộ nhớ (LRU, giữ lại khi container còn warm)
+  - bảng PHASH_TABLE (multi-index hashing): hash được chia thành
+    PHASH_MAX_DISTANCE + 1 đoạn, mỗi đoạn là một partition
+        {"bucket": S = "<số đoạn>:<vị trí>:<giá trị hex>", "image": S, "phash": S}
+    Theo nguyên lý Dirichlet, hai hash cách nhau <= PHASH_MAX_DISTANCE bit
+    trùng nhau hoàn toàn ở ít nhất một đoạn.
+
+Chỉ ảnh được Rekognition nhận diện mới làm nguồn cho cache, ảnh dùng lại
+label không được thêm vào để label không bị "trôi" qua nhiều lần gần giống.
+
+Entry không bị xóa khi ảnh nguồn được ghi đè hay nhận diện lại; bên gọi kiểm
+tra item Classifications của ảnh nguồn (cùng "phash", cùng recognition
+version) trước khi dùng label và gọi forget() với entry đã cũ. Item của bảng
+có "expires_at" (TTL, PHASH_TTL_DAYS) được gia hạn mỗi lần ảnh được nhận diện.
+"""
+import os
+import time
+import threading
+import preprocess
+from collections import OrderedDict
+from shared import clients, metrics
+
+PHASH_TABLE = os.environ.get("PHASH_TABLE")
+MAX_DISTANCE = int(os.environ.get("PHASH_MAX_DISTANCE", "4"))
+# Số hash tối đa giữ trong BKTree của mỗi container
+LOCAL_CAPACITY = int(os.environ.get("PHASH_LOCAL_CAPACITY", "4096"))
+# Số ứng viên tối đa đọc từ mỗi partition (phân trang cho tới mốc này). Chỉ đoạn
+# hash quá phổ biến (ví dụ ảnh trơn) mới chạm mốc, khi đó metric
+# PHashCandidatesTruncated được ghi
+MAX_CANDIDATES = int(os.environ.get("PHASH_MAX_CANDIDATES", "5000"))
+
+# Entry của bảng hết hạn sau số ngày này kể từ lần nhận diện gần nhất của ảnh nguồn
+TTL_DAYS = int(os.environ.get("PHASH_TTL_DAYS", "180"))
+
+HASH_BITS = 64
+DDB_BATCH_SIZE = 25
+
+
+def dhash(image):
+    """
+    Difference hash 64 bit của ảnh PIL: thu nhỏ về 9x8 xám, mỗi bit cho biết
+    pixel có sáng hơn pixel bên phải hay không.
+    """
+    from PIL import Image
+    pixels = image.convert("L").resize((9, 8), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = (value << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return value
+
+
+def distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _chunks(value, count=None):
+    """
+    Chia hash thành count đoạn liên tiếp, trả về list (vị trí, giá trị).
+    """
+    count = count or MAX_DISTANCE + 1
+    widths = [HASH_BITS // count + (1 if i < HASH_BITS % count else 0) for i in range(count)]
+    chunks, shift = [], HASH_BITS
+    for index, width in enumerate(widths):
+        shift -= width
+        chunks.append((index, (value >> shift) & ((1 << width) - 1)))
+    return chunks
+
+
+def bucket_keys(value):
+    count = MAX_DISTANCE + 1
+    return [f"{count}:{index}:{chunk:x}" for index, chunk in _chunks(value, count)]
+
+
+class BKTree:
+    """
+    BK-tree theo khoảng cách Hamming. Không hỗ trợ xóa; node bị loại khỏi
+    LocalCache được bỏ qua khi tìm và cây được dựng lại khi có quá nhiều node thừa.
+    """
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value):
+        self.size += 1
+        if self.root is None:
+            self.root = (value, {})
+            return
+        node = self.root
+        while True:
+            current, children = node
+            d = distance(value, current)
+            if d == 0:
+                self.size -= 1
+                return
+            if d not in children:
+                children[d] = (value, {})
+                return
+            node = children[d]
+
+    def search(self, value, max_distance):
+        """
+        Trả về list (khoảng cách, hash) trong phạm vi max_distance.
+        """
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            current, children = stack.pop()
+            d = distance(value, current)
+            if d <= max_distance:
+                found.append((d, current))
+            for edge, child in children.items():
+                if d - max_distance <= edge <= d + max_distance:
+                    stack.append(child)
+        return found
+
+
+class LocalCache:
+    """
+    LRU hash -> key ảnh nguồn, tra cứu gần đúng bằng BKTree.
+    """
+    def __init__(self, capacity=LOCAL_CAPACITY):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.tree = BKTree()
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def add(self, value, key):
+        with self._lock:
+            if value in self.entries:
+                self.entries.move_to_end(value)
+            else:
+                self.tree.add(value)
+            self.entries[value] = key
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            if self.tree.size > 2 * max(self.capacity, 1):
+                self._rebuild()
+
+    def _rebuild(self):
+        self.tree = BKTree()
+        for value in self.entries:
+            self.tree.add(value)
+
+    def discard(self, value, key):
+        """
+        Bỏ hash khỏi LRU nếu vẫn trỏ tới key (node trong cây được bỏ qua khi tìm).
+        """
+        with self._lock:
+            if self.entries.get(value) == key:
+                del self.entries[value]
+
+    def lookup(self, value, max_distance=MAX_DISTANCE):
+        """
+        Trả về (key nguồn, khoảng cách, hash) gần nhất hoặc None.
+        """
+        with self._lock:
+            matches = [(d, v) for d, v in self.tree.search(value, max_distance) if v in self.entries]
+            if not matches:
+                return None
+            d, best = min(matches)
+            self.entries.move_to_end(best)
+            return self.entries[best], d, best
+
+
+_local = LocalCache()
+_stats = {"local_hits": 0, "remote_hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def is_enabled():
+    # Hash được tính trên ảnh do preprocess giải mã
+    return bool(PHASH_TABLE) and preprocess.is_enabled()
+
+
+def _count(name, metric):
+    with _stats_lock:
+        _stats[name] += 1
+    metrics.put(metric, 1)
+
+
+def stats():
+    """
+    Thống kê của container hiện tại: hit (bộ nhớ / bảng), miss, eviction.
+    """
+    with _stats_lock:
+        result = dict(_stats)
+    result["evictions"] = _local.evictions
+    result["local_size"] = len(_local.entries)
+    return result
+
+
+def _query_bucket(dynamodb, bucket):
+    """
+    Duyệt các (image, phash) của một partition, tối đa MAX_CANDIDATES item.
+    """
+    kwargs = {
+        "TableName": PHASH_TABLE,
+        "KeyConditionExpression": "#bucket = :bucket",
+        "ProjectionExpression": "#image, phash",
+        "ExpressionAttributeNames": {"#bucket": "bucket", "#image": "image"},
+        "ExpressionAttributeValues": {":bucket": {"S": bucket}},
+    }
+    read = 0
+    while True:
+        with metrics.timer("PHashLookup"):
+            response = dynamodb.query(**kwargs)
+        items = response.get("Items", [])
+        read += len(items)
+        yield from items
+        if not response.get("LastEvaluatedKey"):
+            return
+        if read >= MAX_CANDIDATES:
+            print(f"Perceptual hash partition {bucket} has more than {MAX_CANDIDATES} entries, truncated.")
+            metrics.put("PHashCandidatesTruncated", 1)
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def _lookup_remote(value):
+    dynamodb = clients.get_client("dynamodb")
+    best = None
+    for bucket in bucket_keys(value):
+        for item in _query_bucket(dynamodb, bucket):
+            candidate = int(item["phash"]["S"], 16)
+            d = distance(value, candidate)
+            if d <= MAX_DISTANCE and (best is None or d < best[1]):
+                best = (item["image"]["S"], d, candidate)
+                if d == 0:
+                    return best
+    return best
+
+
+def lookup(value):
+    """
+    Tìm ảnh đã nhận diện gần giống nhất. Trả về (key nguồn, khoảng cách, hash
+    của ảnh nguồn) hoặc None. Lỗi đọc bảng được coi là miss.
+    """
+    match = _local.lookup(value)
+    if match is not None:
+        _count("local_hits", "PHashLocalHits")
+        return match
+    try:
+        remote = _lookup_remote(value)
+    except Exception as e:
+        print(f"Perceptual hash lookup failed: {e}")
+        remote = None
+    if remote is None:
+        _count("misses", "PHashMisses")
+        return None
+    key, d, candidate = remote
+    _local.add(candidate, key)
+    _count("remote_hits", "PHashRemoteHits")
+    return key, d, candidate
+
+
+def forget(key, value):
+    """
+    Xóa entry (key, hash) đã cũ: ảnh nguồn đã được ghi đè hoặc nhận diện lại
+    với nội dung khác. Lỗi chỉ được in ra, entry sẽ được kiểm tra lại lần sau.
+    """
+    _local.discard(value, key)
+    metrics.put("PHashStaleEntries", 1)
+    requests = [{"DeleteRequest": {"Key": {"bucket": {"S": bucket}, "image": {"S": key}}}}
+                for bucket in bucket_keys(value)]
+    try:
+        with metrics.timer("PHashWrite"):
+            clients.get_client("dynamodb").batch_write_item(RequestItems={PHASH_TABLE: requests})
+    except Exception as e:
+        print(f"Failed to delete stale perceptual hash of {key}: {e}")
+
+
+def remember(entries):
+    """
+    Ghi các cặp (key, hash) của ảnh vừa được Rekognition nhận diện vào cache.
+    Cache chỉ là tối ưu nên lỗi ghi chỉ được in ra.
+    """
+    evictions = _local.evictions
+    expires_at = {"N": str(int(time.time()) + TTL_DAYS * 86400)}
+    items = []
+    for key, value in entries:
+        _local.add(value, key)
+        items.extend(
+            {"bucket": {"S": bucket}, "image": {"S": key}, "phash": {"S": f"{value:016x}"}, "expires_at": expires_at}
+            for bucket in bucket_keys(value)
+        )
+    if _local.evictions > evictions:
+        metrics.put("PHashEvictions", _local.evictions - evictions)
+    dynamodb = clients.get_client("dynamodb")
+    for start in range(0, len(items), DDB_BATCH_SIZE):
+        request_items = {PHASH_TABLE: [{"PutRequest": {"Item": item}} for item in items[start:start + DDB_BATCH_SIZE]]}
+        try:
+            with metrics.timer("PHashWrite"):
+                response = dynamodb.batch_write_item(RequestItems=request_items)
+            unprocessed = response.get("UnprocessedItems") or {}
+            if unprocessed:
+                with metrics.timer("PHashWrite"):
+                    dynamodb.batch_write_item(RequestItems=unprocessed)
+        except Exception as e:
+            print(f"Failed to write perceptual hashes: {e}")
@@ -0,0 +1,79 @@
+"""
+Chỉ mục ngược label -> image trong bảng LABEL_INDEX_TABLE cho query_labels.
+
+Item: {"label": S = "<label chuẩn hóa>#<shard>", "image": S, "name": S, "confidence": N}
+  - shard = crc32(image) % SHARDS: một (label, image) luôn nằm ở cùng một
+    partition (image_recognition xóa được item khi ảnh không còn label đó) và
+    label phổ biến được chia trên SHARDS partition thay vì một partition nóng
+  - GSI "by_confidence" (pk label, sk confidence) sắp xếp ảnh theo confidence;
+    khác LSI, GSI không giới hạn 10 GB cho mỗi giá trị partition key
+  - label không có confidence (item version 1 hoặc do tools/migrate_labels.py
+    ghi lại) được lưu confidence UNKNOWN_CONFIDENCE (0) thay vì bỏ thuộc tính:
+    GSI là sparse nên item thiếu sort key sẽ không bao giờ được query_labels
+    trả về; với 0 ảnh vẫn được tìm thấy, xếp sau ảnh có confidence thật và bị
+    loại khi min_confidence > 0
+
+Bên đọc query SHARDS partition song song rồi trộn theo confidence. Bên đọc và
+bên ghi phải dùng cùng LABEL_INDEX_SHARDS; đổi giá trị thì dựng lại chỉ mục
+bằng tools/rebuild_label_index.py.
+"""
+import os
+import zlib
+
+INDEX_TABLE = os.environ.get("LABEL_INDEX_TABLE")
+SHARDS = max(1, int(os.environ.get("LABEL_INDEX_SHARDS", "4")))
+CONFIDENCE_INDEX = "by_confidence"
+# Confidence ghi cho label không có confidence (item version 1)
+UNKNOWN_CONFIDENCE = 0
+
+
+def normalize(name):
+    """
+    Chuẩn hóa tên label (không phân biệt hoa thường, bỏ khoảng trắng hai đầu).
+    """
+    return name.strip().lower()
+
+
+def shard_of(image):
+    return zlib.crc32(image.encode("utf-8")) % SHARDS
+
+
+def partition_key(label, shard):
+    return f"{normalize(label)}#{shard}"
+
+
+def partition_keys(label):
+    """
+    Partition key của tất cả shard của một label (bên đọc).
+    """
+    return [partition_key(label, shard) for shard in range(SHARDS)]
+
+
+def key_of(label, image):
+    return {"label": {"S": partition_key(label, shard_of(image))}, "image": {"S": image}}
+
+
+def build_items(image, labels):
+    """
+    Các item chỉ mục của một ảnh, label trùng tên chỉ giữ một item.
+    """
+    items = {}
+    for label in labels:
+        confidence = label.get("confidence")
+        item = key_of(label["name"], image)
+        item.update({
+            "name": {"S": label["name"]},
+            "confidence": {"N": repr(confidence if confidence is not None else UNKNOWN_CONFIDENCE)},
+        })
+        items[normalize(label["name"])] = item
+    return list(items.values())
+
+
+def vanished_keys(image, old_labels, labels):
+    """
+    Key của các item chỉ mục ứng với label có trong old_labels nhưng không
+    còn trong labels.
+    """
+    current = {normalize(label["name"]) for label in labels}
+    vanished = {normalize(label["name"]) for label in old_labels} - current
+    return [key_of(label, image) for label in sorted(vanished)]
@@ -0,0 +1,198 @@
+"""
+Định dạng item của bảng Classifications.
+
+Version 1 (cũ): {"image": S, "labels": S} với labels là str() của list tên label.
+Version 2: labels lưu dạng DynamoDB native
+    {
+        "image": S,
+        "schema_version": N,
+        "labels": L[M{"name": S, "confidence": N, "parents": L[S], "instances": L[M]}],
+        "label_names": SS,
+    }
+"parents"/"instances" chỉ có khi không rỗng, "label_names" dùng cho filter
+expression (contains) phía server. "recognition_version" (S, tùy chọn) là
+tham số detect_labels đã tạo ra label, xem image_recognition.RECOGNITION_VERSION.
+
+Ảnh trùng nội dung với một ảnh đã nhận diện (alias) được chép label từ ảnh
+gốc và có thêm {"alias_of": S, "label_source": S = "alias"}. Ảnh gần giống
+(perceptual hash) dùng lại label có {"similar_to": S, "hash_distance": N,
+"label_source": S = "phash"}. Ảnh được Rekognition nhận diện khi bật cache
+perceptual hash có "phash" (S, 16 ký tự hex) là hash của chính nội dung đó.
+"""
+import ast
+
+SCHEMA_VERSION = 2
+
+# Số chữ số thập phân giữ lại cho confidence và bounding box
+CONFIDENCE_DIGITS = 2
+BOX_DIGITS = 4
+
+BOUNDING_BOX_FIELDS = ("Left", "Top", "Width", "Height")
+
+
+def _number(value):
+    return {"N": repr(value)}
+
+
+def labels_from_rekognition(response):
+    """
+    Chuyển response của detect_labels thành list label gọn (kiểu Python).
+    """
+    labels = []
+    for label in response.get("Labels", []):
+        if "Name" not in label:
+            continue
+        entry = {
+            "name": label["Name"],
+            "confidence": round(label.get("Confidence", 0.0), CONFIDENCE_DIGITS),
+        }
+        parents = [parent["Name"] for parent in label.get("Parents", []) if "Name" in parent]
+        if parents:
+            entry["parents"] = parents
+        instances = []
+        for instance in label.get("Instances", []):
+            box = instance.get("BoundingBox") or {}
+            instances.append({
+                "confidence": round(instance.get("Confidence", 0.0), CONFIDENCE_DIGITS),
+                "bounding_box": {
+                    field.lower(): round(box.get(field, 0.0), BOX_DIGITS) for field in BOUNDING_BOX_FIELDS
+                },
+            })
+        if instances:
+            entry["instances"] = instances
+        labels.append(entry)
+    return labels
+
+
+def _label_to_attribute(label):
+    attribute = {
+        "name": {"S": label["name"]},
+    }
+    if label.get("confidence") is not None:
+        attribute["confidence"] = _number(label["confidence"])
+    if label.get("parents"):
+        attribute["parents"] = {"L": [{"S": parent} for parent in label["parents"]]}
+    if label.get("instances"):
+        attribute["instances"] = {"L": [
+            {"M": {
+                "confidence": _number(instance["confidence"]),
+                "bounding_box": {"M": {
+                    name: _number(value) for name, value in instance["bounding_box"].items()
+                }},
+            }}
+            for instance in label["instances"]
+        ]}
+    return {"M": attribute}
+
+
+def to_item(key, labels, alias_of=None, similar_to=None, distance=None, recognition_version=None, phash=None):
+    """
+    Tạo item DynamoDB (wire format) version 2 từ list label.
+    alias_of là key của ảnh gốc nếu label được chép từ ảnh trùng nội dung,
+    similar_to/distance là ảnh gần giống đã cho label và khoảng cách Hamming.
+    recognition_version ghi lại tham số nhận diện đã tạo ra label, phash là
+    perceptual hash (int) của ảnh đã nhận diện.
+    """
+    item = {
+        "image": {"S": key},
+        "schema_version": {"N": str(SCHEMA_VERSION)},
+        "labels": {"L": [_label_to_attribute(label) for label in labels]},
+    }
+    names = sorted({label["name"] for label in labels})
+    if names:  # String set không được rỗng
+        item["label_names"] = {"SS": names}
+    if alias_of:
+        item["alias_of"] = {"S": alias_of}
+        item["label_source"] = {"S": "alias"}
+    elif similar_to:
+        item["similar_to"] = {"S": similar_to}
+        item["hash_distance"] = {"N": str(distance or 0)}
+        item["label_source"] = {"S": "phash"}
+    if recognition_version:
+        item["recognition_version"] = {"S": recognition_version}
+    if phash is not None:
+        item["phash"] = {"S": f"{phash:016x}"}
+    return item
+
+
+def _attribute_to_number(value):
+    text = value["N"]
+    return float(text) if "." in text or "e" in text or "E" in text else int(text)
+
+
+def _attribute_to_label(attribute):
+    attribute = attribute["M"]
+    label = {"name": attribute["name"]["S"]}
+    if "confidence" in attribute:
+        label["confidence"] = _attribute_to_number(attribute["confidence"])
+    if "parents" in attribute:
+        label["parents"] = [parent["S"] for parent in attribute["parents"]["L"]]
+    if "instances" in attribute:
+        label["instances"] = [
+            {
+                "confidence": _attribute_to_number(instance["M"]["confidence"]),
+                "bounding_box": {
+                    name: _attribute_to_number(value)
+                    for name, value in instance["M"]["bounding_box"]["M"].items()
+                },
+            }
+            for instance in attribute["instances"]["L"]
+        ]
+    return label
+
+
+def labels_from_item(item):
+    """
+    Ngược lại của to_item: đọc list label (kiểu Python) từ item wire format.
+    Item version 1 được nâng cấp trước.
+    """
+    item = upgrade_item(item)
+    return [_attribute_to_label(label) for label in item.get("labels", {}).get("L", [])]
+
+
+def to_event(bucket, key, labels, instances=False):
+    """
+    Payload JSON cho SNS: cùng định dạng label, bounding box ("instances")
+    chỉ được giữ khi instances=True.
+    """
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "bucket": bucket,
+        "image": key,
+        "labels": [
+            {name: value for name, value in label.items() if instances or name != "instances"}
+            for label in labels
+        ],
+    }
+
+
+def parse_v1_labels(value):
+    """
+    Đọc chuỗi str(list) của version 1, trả về list tên label.
+    """
+    try:
+        names = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return []
+    if not isinstance(names, (list, tuple)):
+        return []
+    return [name for name in names if isinstance(name, str)]
+
+
+def is_v1_item(item):
+    return "schema_version" not in item and "S" in item.get("labels", {})
+
+
+def upgrade_item(item):
+    """
+    Nâng cấp item wire format version 1 lên version 2.
+    Item version 1 không có confidence nên label chỉ có "name".
+    Item đã ở version 2 được trả về nguyên vẹn.
+    """
+    if not is_v1_item(item):
+        return item
+    upgraded = dict(item)
+    upgraded.update(to_item(item["image"]["S"], [
+        {"name": name} for name in parse_v1_labels(item["labels"]["S"])
+    ]))
+    return upgraded
@@ -0,0 +1,159 @@
+"""
+Thống kê label tổng hợp sẵn trong bảng LABEL_STATS_TABLE để query_stats trả lời
+top-N và chuỗi thời gian mà không phải scan Classifications.
+
+Item: {"pk": S = "<scope>#<shard>", "sk": S = label đã chuẩn hóa, "name": S,
+       "count": N, "conf_sum": N, "h0".."h90": N}
+  - scope "total" là tổng từ trước đến nay, "day#YYYY-MM-DD" (UTC) là ảnh mới
+    được nhận diện trong ngày
+  - sk "#images" đếm số ảnh của scope
+  - "hNN" là histogram confidence theo khoảng 10 (label có confidence 100
+    nằm trong h90); label không có confidence (item version 1) chỉ tăng count
+
+Mỗi lần ghi chọn ngẫu nhiên một trong SHARDS partition để label phổ biến
+không dồn vào một partition; bên đọc cộng lại SHARDS partition. Bên đọc và
+bên ghi phải dùng cùng LABEL_STATS_SHARDS (chỉ nên tăng, không giảm).
+
+Bộ đếm được cập nhật bằng UpdateItem ADD sau khi Classifications được ghi:
+tổng lấy chênh lệch giữa label cũ và label mới của ảnh (ảnh nhận diện lại
+không bị đếm hai lần), bucket theo ngày và "#images" chỉ đếm ảnh chưa có
+trong bảng. Các thay đổi trong cùng một batch được gộp theo (pk, sk).
+Thống kê là best-effort: ghi lỗi chỉ được log, không làm message bị gửi lại.
+"""
+import os
+import time
+import random
+from collections import Counter, defaultdict
+from shared import metrics, throttle
+
+STATS_TABLE = os.environ.get("LABEL_STATS_TABLE")
+SHARDS = max(1, int(os.environ.get("LABEL_STATS_SHARDS", "4")))
+
+TOTAL = "total"
+IMAGES = "#images"
+HISTOGRAM = tuple(f"h{bucket}" for bucket in range(0, 100, 10))
+DDB_BATCH_GET_SIZE = 100
+# Chữ số thập phân của conf_sum, tránh số float dài trong UpdateItem
+SUM_DIGITS = 4
+
+
+def is_enabled():
+    return bool(STATS_TABLE)
+
+
+def normalize(name):
+    """
+    Chuẩn hóa tên label làm sort key (giống chỉ mục LabelIndex).
+    """
+    return name.strip().lower()
+
+
+def day_of(timestamp=None):
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+
+def day_scope(day):
+    return f"day#{day}"
+
+
+def partition_key(scope, shard):
+    return f"{scope}#{shard}"
+
+
+def histogram_bucket(confidence):
+    return HISTOGRAM[min(len(HISTOGRAM) - 1, max(0, int(confidence // 10)))]
+
+
+def _label_counts(labels, sign):
+    """
+    {label chuẩn hóa: (tên hiển thị, Counter các attribute)} của một ảnh.
+    """
+    counts = {}
+    for label in labels:
+        key = normalize(label["name"])
+        if key in counts:  # Label trùng trong cùng một ảnh chỉ đếm một lần
+            continue
+        values = Counter(count=sign)
+        if label.get("confidence") is not None:
+            values["conf_sum"] = sign * label["confidence"]
+            values[histogram_bucket(label["confidence"])] = sign
+        counts[key] = (label["name"], values)
+    return counts
+
+
+def build_deltas(changes, day=None):
+    """
+    Gộp thay đổi của một batch thành {(scope, sk): (tên hiển thị, Counter)}.
+    changes là list (label cũ hoặc None nếu ảnh chưa có, label mới).
+    """
+    day = day or day_of()
+    deltas = defaultdict(lambda: [None, Counter()])
+
+    def _add(scope, sk, name, values):
+        delta = deltas[(scope, sk)]
+        delta[0] = name or delta[0]
+        delta[1].update(values)
+
+    for previous, labels in changes:
+        scopes = [TOTAL]
+        if previous is None:
+            scopes.append(day_scope(day))
+            for scope in scopes:
+                _add(scope, IMAGES, None, {"count": 1})
+        for sign, source, targets in ((-1, previous or [], [TOTAL]), (1, labels, scopes)):
+            for sk, (name, values) in _label_counts(source, sign).items():
+                for scope in targets:
+                    _add(scope, sk, name, values)
+
+    # Bỏ attribute (và item) có tổng bằng 0, ví dụ ảnh nhận diện lại cho cùng label
+    result = {}
+    for key, (name, values) in deltas.items():
+        values = {
+            attribute: round(value, SUM_DIGITS) if attribute == "conf_sum" else value
+            for attribute, value in values.items() if value
+        }
+        if values:
+            result[key] = (name, values)
+    return result
+
+
+def _update(scope, sk, name, values):
+    names = {f"#a{index}": attribute for index, attribute in enumerate(values)}
+    expression_values = {f":a{index}": {"N": repr(value)} for index, value in enumerate(values.values())}
+    expression = "ADD " + ", ".join(f"#a{index} :a{index}" for index in range(len(values)))
+    if name:
+        names["#name"] = "name"
+        expression_values[":name"] = {"S": name}
+        expression = "SET #name = :name " + expression
+    throttle.call("DynamoDBWrite", throttle.client("dynamodb").update_item,
+                  TableName=STATS_TABLE,
+                  Key={"pk": {"S": partition_key(scope, random.randrange(SHARDS))}, "sk": {"S": sk}},
+                  UpdateExpression=expression,
+                  ExpressionAttributeNames=names,
+                  ExpressionAttributeValues=expression_values)
+
+
+def write(deltas, executor=None):
+    """
+    Ghi các thay đổi của build_deltas, song song trên executor nếu có.
+    Trả về số item ghi lỗi.
+    """
+    def _write(item):
+        (scope, sk), (name, values) = item
+        try:
+            _update(scope, sk, name, values)
+            return 0
+        except Exception as e:
+            print(f"Error updating label stats {scope}/{sk}: {e}")
+            return 1
+
+    items = list(deltas.items())
+    with metrics.timer("LabelStatsWrite"):
+        if executor is None or len(items) < 2:
+            failed = sum(map(_write, items))
+        else:
+            failed = sum(executor.map(metrics.bind(_write), items))
+    metrics.put("LabelStatsUpdates", len(items) - failed)
+    if failed:
+        metrics.put("LabelStatsWriteErrors", failed)
+    return failed
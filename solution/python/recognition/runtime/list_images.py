@@ -1,57 +1,217 @@
 import os
-import boto3
 import json
-from boto3.dynamodb.types import TypeDeserializer
+import base64
+from decimal import Decimal
 from botocore.exceptions import ClientError
+import label_schema
+import response_cache
+from shared import clients, metrics, table_version
 
-# Khởi tạo client DynamoDB
-dynamodb_client = boto3.client("dynamodb")
+# Client DynamoDB được tạo lazy qua shared.clients
 table_name = os.environ.get("TABLE_NAME")
+# Bảng bộ đếm phiên bản do image_recognition tăng sau mỗi lần ghi (tùy chọn)
+version_table_name = os.environ.get("VERSION_TABLE")
+# Cache response trong container warm, tắt khi TTL là 0
+CACHE_ENABLED = response_cache.TTL_SECONDS > 0
+CACHE_CONTROL = os.environ.get("CACHE_CONTROL", "no-cache")
+# binary_media_types của API: API Gateway chỉ giải mã body base64 (gzip) khi
+# media type đầu tiên trong header Accept của request nằm trong danh sách này
+BINARY_MEDIA_TYPES = frozenset(
+    t.strip().lower() for t in os.environ.get("BINARY_MEDIA_TYPES", "").split(",") if t.strip()
+)
 
 # Kiểm tra biến môi trường
 if not table_name:
     raise ValueError("TABLE_NAME environment variable is not set")
 
-# Khởi tạo đối tượng TypeDeserializer
-deserializer = TypeDeserializer()
+_cache = response_cache.ResponseCache()
+
+# TypeDeserializer (kéo theo import boto3) chỉ được tạo khi cần
+_deserializer = None
+
+def _get_deserializer():
+    global _deserializer
+    if _deserializer is None:
+        from boto3.dynamodb.types import TypeDeserializer
+        _deserializer = TypeDeserializer()
+    return _deserializer
+
+def _json_ready(value):
+    """
+    Chuyển Decimal/set do TypeDeserializer tạo ra sang kiểu json.dumps hỗ trợ
+    """
+    if isinstance(value, Decimal):
+        # Cùng quy ước với _number: số không có phần thập phân là int
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, dict):
+        return {k: _json_ready(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_ready(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(_json_ready(v) for v in value)
+    return value
 
 def _deserialize_item(item):
     """
-    Chuyển đổi một mục DynamoDB từ định dạng DynamoDB sang định dạng Python
+    Chuyển đổi một mục DynamoDB từ định dạng DynamoDB sang định dạng Python.
+    Item version 1 (labels là chuỗi) được nâng cấp lên label_schema version 2.
+    """
+    item = label_schema.upgrade_item(item)
+    return {k: _json_ready(_get_deserializer().deserialize(v)) for k, v in item.items()}
+
+def _number(value):
+    """
+    Chuỗi "N" của DynamoDB sang int/float (thay vì Decimal)
+    """
+    if "." in value or "e" in value or "E" in value:
+        return float(value)
+    return int(value)
+
+def _decode_instance(instance):
+    instance = instance["M"]
+    decoded = {"confidence": _number(instance["confidence"]["N"])}
+    box = instance.get("bounding_box")
+    if box is not None:
+        decoded["bounding_box"] = {name: _number(v["N"]) for name, v in box["M"].items()}
+    return decoded
+
+def _decode_label(label):
+    label = label["M"]
+    decoded = {"name": label["name"]["S"]}
+    for name, value in label.items():
+        if name == "name":
+            continue
+        if name == "confidence":
+            decoded[name] = _number(value["N"])
+        elif name == "parents":
+            decoded[name] = [parent["S"] for parent in value["L"]]
+        elif name == "instances":
+            decoded[name] = [_decode_instance(instance) for instance in value["L"]]
+        else:
+            decoded[name] = _json_ready(_get_deserializer().deserialize(value))
+    return decoded
+
+# Decoder chuyên biệt cho các attribute đã biết của label_schema version 2
+_ATTRIBUTE_DECODERS = {
+    "image": lambda value: value["S"],
+    "schema_version": lambda value: _number(value["N"]),
+    "labels": lambda value: [_decode_label(label) for label in value["L"]],
+    "label_names": lambda value: sorted(value["SS"]),
+}
+
+def decode_item(item):
+    """
+    Chuyển item dạng wire ({"S": ...}/{"L": ...}/{"N": ...}) thẳng sang giá trị
+    json.dumps được. Attribute lạ hoặc sai kiểu dùng lại TypeDeserializer.
+    Cho kết quả giống _deserialize_item nhưng nhanh hơn nhiều.
     """
-    return {k: deserializer.deserialize(v) for k, v in item.items()}
+    if label_schema.is_v1_item(item):
+        item = label_schema.upgrade_item(item)
+    decoded = {}
+    for name, value in item.items():
+        decoder = _ATTRIBUTE_DECODERS.get(name)
+        if decoder is not None:
+            try:
+                decoded[name] = decoder(value)
+                continue
+            except (KeyError, TypeError, ValueError):
+                pass
+        decoded[name] = _json_ready(_get_deserializer().deserialize(value))
+    return decoded
+
+def _scan_expressions(label=None, fields=None):
+    """
+    Tạo FilterExpression/ProjectionExpression cho scan trên label_schema version 2.
+    """
+    kwargs = {}
+    names = {}
+    if label:
+        names["#label_names"] = "label_names"
+        kwargs["FilterExpression"] = "contains(#label_names, :label)"
+        kwargs["ExpressionAttributeValues"] = {":label": {"S": label}}
+    if fields:
+        placeholders = []
+        for index, field in enumerate(dict.fromkeys(["image", *fields])):
+            names[f"#f{index}"] = field
+            placeholders.append(f"#f{index}")
+        kwargs["ProjectionExpression"] = ", ".join(placeholders)
+    if names:
+        kwargs["ExpressionAttributeNames"] = names
+    return kwargs
+
+def _segment_args(segment=None, total_segments=None):
+    """
+    Tham số Segment/TotalSegments cho parallel scan.
+    """
+    if total_segments is None:
+        return {}
+    return {"Segment": segment, "TotalSegments": total_segments}
+
+def scan_pages(table_name, start_key=None, label=None, fields=None, segment=None, total_segments=None):
+    """
+    Duyệt bảng theo từng trang scan, yield (items dạng DynamoDB, LastEvaluatedKey).
+    LastEvaluatedKey của trang cuối là None.
+    """
+    kwargs = {"TableName": table_name}
+    kwargs.update(_scan_expressions(label=label, fields=fields))
+    kwargs.update(_segment_args(segment, total_segments))
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+    while True:
+        with metrics.timer("DynamoDBScan"):
+            response = clients.get_client("dynamodb").scan(**kwargs)
+        last_key = response.get("LastEvaluatedKey")
+        yield response.get("Items", []), last_key
+        if not last_key:
+            break
+        kwargs["ExclusiveStartKey"] = last_key
+
+def to_ndjson_line(item):
+    """
+    Một item đã deserialize thành một dòng NDJSON
+    """
+    return json.dumps(item, separators=(",", ":"), ensure_ascii=False) + "\n"
 
 # 1. Tạo hàm để quét và liệt kê tất cả các mục từ bảng DynamoDB
-def scan_all_items(table_name, limit=None, start_key=None):
+def scan_all_items(table_name, limit=None, start_key=None, label=None, fields=None,
+                   segment=None, total_segments=None):
     """
     Quét toàn bộ bảng DynamoDB, xử lý phân trang và trả về tất cả các mục.
     Args:
         table_name (str): Tên bảng DynamoDB
         limit (int, optional): Giới hạn số mục trả về
         start_key (dict, optional): Key để bắt đầu phân trang
+        label (str, optional): Chỉ lấy ảnh có label này (filter phía server)
+        fields (list, optional): Chỉ lấy các attribute này (projection)
+        segment, total_segments (int, optional): Chỉ quét một segment của parallel scan
     """
     items = []
     try:
         kwargs = {"TableName": table_name}
+        kwargs.update(_scan_expressions(label=label, fields=fields))
+        kwargs.update(_segment_args(segment, total_segments))
         if limit:
             kwargs["Limit"] = min(limit, 1000)  # Giới hạn tối đa 1000 theo API DynamoDB
         if start_key:
             kwargs["ExclusiveStartKey"] = start_key
 
-        response = dynamodb_client.scan(**kwargs)
+        with metrics.timer("DynamoDBScan"):
+            response = clients.get_client("dynamodb").scan(**kwargs)
         items.extend(response.get("Items", []))
 
         # Xử lý phân trang
         while 'LastEvaluatedKey' in response and (not limit or len(items) < limit):
             kwargs["ExclusiveStartKey"] = response['LastEvaluatedKey']
-            response = dynamodb_client.scan(**kwargs)
+            with metrics.timer("DynamoDBScan"):
+                response = clients.get_client("dynamodb").scan(**kwargs)
             items.extend(response.get("Items", []))
             if limit and len(items) >= limit:
                 items = items[:limit]
                 break
 
         # Chuyển đổi sang định dạng Python
-        deserialized_items = [_deserialize_item(item) for item in items]
+        deserialized_items = [decode_item(item) for item in items]
+        metrics.put("ItemsReturned", len(deserialized_items))
         return {
             "items": deserialized_items,
             "last_evaluated_key": response.get("LastEvaluatedKey")
@@ -63,21 +223,147 @@ def scan_all_items(table_name, limit=None, start_key=None):
         print(f"Unexpected error: {e}")
         raise
 
-def handler(event, context):
+def warm_up():
+    clients.warm_up("dynamodb")
+
+def _cache_key(limit, start_key, label, fields, output_format):
+    """
+    Key chuẩn hóa của request: cùng tham số theo thứ tự khác cho cùng key.
+    """
+    return (
+        limit,
+        json.dumps(start_key, sort_keys=True, separators=(",", ":")) if start_key else None,
+        label or None,
+        tuple(sorted(set(fields))),
+        output_format if output_format == "ndjson" else None,
+    )
+
+def _current_version():
+    """
+    Version hiện tại của bảng, 0 nếu không có bảng version (cache chỉ hết hạn
+    theo TTL), None nếu đọc lỗi (không dùng cache).
+    """
+    if not version_table_name:
+        return 0
     try:
-        # Lấy tham số từ event (nếu có)
-        limit = event.get("queryStringParameters", {}).get("limit")
-        start_key = event.get("queryStringParameters", {}).get("start_key")
-        limit = int(limit) if limit and limit.isdigit() else None
-        start_key = json.loads(start_key) if start_key else None
+        return table_version.current(version_table_name, table_name)
+    except Exception as e:
+        print(f"Error reading version of {table_name}: {e}")
+        return None
+
+def _request_headers(event):
+    return {name.lower(): value for name, value in (event.get("headers") or {}).items() if value is not None}
+
+def accepts_gzip(accept_encoding):
+    """
+    True nếu header Accept-Encoding cho phép gzip (không có q=0).
+    """
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() not in ("gzip", "*"):
+            continue
+        quality = params.strip().lower()
+        if quality.startswith("q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+def accepts_binary(accept):
+    """
+    True nếu API Gateway sẽ trả body base64 của response dưới dạng bytes: media
+    type đầu tiên của header Accept nằm trong BINARY_MEDIA_TYPES.
+    """
+    first = (accept or "").split(",")[0].partition(";")[0].strip().lower()
+    return first in BINARY_MEDIA_TYPES
 
-        # Gọi phương thức để quét các mục từ DynamoDB
-        result = scan_all_items(table_name, limit=limit, start_key=start_key)
+def etag_matches(if_none_match, etag):
+    """
+    So khớp If-None-Match (danh sách ETag hoặc "*") theo so sánh yếu.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def _build_entry(params, version):
+    limit = params.get("limit")
+    start_key = params.get("start_key")
+    limit = int(limit) if limit and limit.isdigit() else None
+    start_key = json.loads(start_key) if start_key else None
+    label = params.get("label")
+    fields = [f.strip() for f in params.get("fields", "").split(",") if f.strip()]
+    key = _cache_key(limit, start_key, label, fields, params.get("format"))
+
+    if CACHE_ENABLED and version is not None:
+        entry = _cache.get(key, version)
+        if entry is not None:
+            metrics.put("ResponseCacheHits", 1)
+            return entry
+        metrics.put("ResponseCacheMisses", 1)
 
+    # Gọi phương thức để quét các mục từ DynamoDB
+    result = scan_all_items(table_name, limit=limit, start_key=start_key, label=label, fields=fields)
+
+    # format=ndjson: mỗi item một dòng, key phân trang trả qua header
+    if params.get("format") == "ndjson":
+        entry = response_cache.Entry(
+            "".join(to_ndjson_line(item) for item in result["items"]),
+            headers={
+                "Content-Type": "application/x-ndjson",
+                "X-Last-Evaluated-Key": json.dumps(result["last_evaluated_key"] or None),
+            },
+            version=version,
+        )
+    else:
+        entry = response_cache.Entry(json.dumps(result), headers={"Content-Type": "application/json"},
+                                     version=version)
+    if CACHE_ENABLED and version is not None:
+        _cache.put(key, entry)
+    return entry
+
+def _respond(event, entry):
+    """
+    Response 200 (gzip nếu client nhận) hoặc 304 nếu ETag của client còn đúng.
+    Bản gzip và bản gốc có ETag riêng, If-None-Match so với ETag của biến thể
+    mà request này sẽ nhận.
+    """
+    request_headers = _request_headers(event)
+    gzipped = entry.gzipped is not None and accepts_gzip(request_headers.get("accept-encoding")) \
+        and accepts_binary(request_headers.get("accept"))
+    etag = entry.gzip_etag if gzipped else entry.etag
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept, Accept-Encoding"}
+    if etag_matches(request_headers.get("if-none-match"), etag):
+        metrics.put("NotModified", 1)
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    headers.update(entry.headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        metrics.put("ResponseBytes", len(entry.gzipped), "Bytes")
         return {
             "statusCode": 200,
-            "body": json.dumps(result)
+            "headers": headers,
+            "body": base64.b64encode(entry.gzipped).decode("ascii"),
+            "isBase64Encoded": True,
         }
+    metrics.put("ResponseBytes", len(entry.body), "Bytes")
+    return {"statusCode": 200, "headers": headers, "body": entry.body.decode("utf-8")}
+
+@metrics.instrument("ListImages")
+def handler(event, context):
+    if clients.is_warmup_event(event):
+        warm_up()
+        return {"warmup": True}
+    try:
+        # Lấy tham số từ event (nếu có)
+        params = event.get("queryStringParameters") or {}
+        version = _current_version() if CACHE_ENABLED else None
+        return _respond(event, _build_entry(params, version))
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == 'ResourceNotFoundException':
@@ -95,4 +381,7 @@ def handler(event, context):
         return {
             "statusCode": 500,
             "body": json.dumps({"error": "An unexpected error occurred"})
-        }
\ No newline at end of file
+        }
+
+if clients.WARM_UP_ON_INIT:
+    warm_up()
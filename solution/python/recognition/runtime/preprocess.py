@@ -0,0 +1,160 @@
+"""
+Tiền xử lý ảnh trước khi gọi Rekognition: đọc object từ S3, giải mã,
+thu nhỏ về cạnh dài tối đa PREPROCESS_MAX_EDGE, mã hóa lại JPEG và gửi
+dạng Image={"Bytes": ...} (dưới giới hạn 5 MB). Định dạng không giải mã
+được, ảnh quá lớn hoặc môi trường không có Pillow thì dùng lại S3Object.
+
+Nếu DERIVATIVE_BUCKET được cấu hình, ảnh đã chuẩn hóa và thumbnail được ghi
+vào bucket đó (bucket riêng để không kích hoạt lại pipeline nhận diện):
+    normalized/<key>.jpg, thumbnails/<key>.jpg
+"""
+import io
+import os
+from shared import clients, metrics
+
+PREPROCESS_IMAGES = os.environ.get("PREPROCESS_IMAGES", "false").lower() == "true"
+MAX_EDGE = int(os.environ.get("PREPROCESS_MAX_EDGE", "1600"))
+JPEG_QUALITY = int(os.environ.get("PREPROCESS_JPEG_QUALITY", "85"))
+# Không tải về object lớn hơn mốc này, để Rekognition tự đọc từ S3
+MAX_SOURCE_BYTES = int(os.environ.get("PREPROCESS_MAX_SOURCE_BYTES", str(64 * 1024 * 1024)))
+DERIVATIVE_BUCKET = os.environ.get("DERIVATIVE_BUCKET")
+THUMBNAIL_EDGE = int(os.environ.get("THUMBNAIL_EDGE", "256"))
+
+# Giới hạn của Rekognition cho ảnh gửi trực tiếp dạng bytes
+REKOGNITION_MAX_BYTES = 5 * 1024 * 1024
+# Số pixel tối đa được giải mã (chống decompression bomb)
+MAX_PIXELS = int(os.environ.get("PREPROCESS_MAX_PIXELS", str(200 * 1000 * 1000)))
+READ_CHUNK_SIZE = 1024 * 1024
+
+NORMALIZED_PREFIX = "normalized/"
+THUMBNAIL_PREFIX = "thumbnails/"
+
+# Pillow được import lazy; False nghĩa là đã thử và không có
+_pillow = None
+
+
+def _load_pillow():
+    global _pillow
+    if _pillow is None:
+        try:
+            from PIL import Image, ImageOps
+            Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+            _pillow = (Image, ImageOps)
+        except ImportError:
+            print("Pillow is not available, sending S3 references to Rekognition.")
+            _pillow = False
+    return _pillow or None
+
+
+def is_enabled():
+    return PREPROCESS_IMAGES and _load_pillow() is not None
+
+
+def s3_reference(bucket_name, key):
+    return {"S3Object": {"Bucket": bucket_name, "Name": key}}
+
+
+def derivative_keys(key):
+    """
+    Key của ảnh chuẩn hóa và thumbnail trong DERIVATIVE_BUCKET.
+    """
+    return f"{NORMALIZED_PREFIX}{key}.jpg", f"{THUMBNAIL_PREFIX}{key}.jpg"
+
+
+def read_object(bucket_name, key, max_bytes=MAX_SOURCE_BYTES):
+    """
+    Stream object từ S3 theo từng chunk. Trả về None nếu lớn hơn max_bytes.
+    """
+    response = clients.get_client("s3").get_object(Bucket=bucket_name, Key=key)
+    body = response["Body"]
+    try:
+        if response.get("ContentLength", 0) > max_bytes:
+            return None
+        data = bytearray()
+        for chunk in iter(lambda: body.read(READ_CHUNK_SIZE), b""):
+            data.extend(chunk)
+            if len(data) > max_bytes:
+                return None
+        return bytes(data)
+    finally:
+        body.close()
+
+
+def _encode_jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def downscale(data, max_edge=MAX_EDGE, quality=JPEG_QUALITY, max_bytes=REKOGNITION_MAX_BYTES):
+    """
+    Giải mã, xoay theo EXIF, thu nhỏ về cạnh dài max_edge và mã hóa JPEG.
+    Trả về (ảnh PIL đã thu nhỏ, bytes JPEG) hoặc None nếu không giải mã được.
+    """
+    Image, ImageOps = _load_pillow()
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Với JPEG, draft() để decoder giảm độ phân giải ngay khi giải mã
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        encoded = _encode_jpeg(image, quality)
+        # Giảm chất lượng dần nếu vẫn vượt giới hạn của Rekognition
+        while len(encoded) > max_bytes and quality > 40:
+            quality -= 15
+            encoded = _encode_jpeg(image, quality)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Cannot decode image for preprocessing: {e}")
+        return None
+    if len(encoded) > max_bytes:
+        return None
+    return image, encoded
+
+
+def save_derivatives(key, image, encoded):
+    """
+    Ghi ảnh chuẩn hóa và thumbnail vào DERIVATIVE_BUCKET (nếu có).
+    """
+    if not DERIVATIVE_BUCKET:
+        return
+    Image, _ = _load_pillow()
+    normalized_key, thumbnail_key = derivative_keys(key)
+    thumbnail = image.copy()
+    thumbnail.thumbnail((THUMBNAIL_EDGE, THUMBNAIL_EDGE), Image.LANCZOS)
+    s3 = clients.get_client("s3")
+    with metrics.timer("DerivativePut"):
+        s3.put_object(Bucket=DERIVATIVE_BUCKET, Key=normalized_key, Body=encoded, ContentType="image/jpeg",
+                      Metadata={"source-key": key})
+        s3.put_object(Bucket=DERIVATIVE_BUCKET, Key=thumbnail_key, Body=_encode_jpeg(thumbnail, JPEG_QUALITY),
+                      ContentType="image/jpeg", Metadata={"source-key": key})
+
+
+def prepare_image(bucket_name, key):
+    """
+    Trả về (tham số Image cho detect_labels, ảnh PIL đã thu nhỏ hoặc None):
+    {"Bytes": ...} nếu tiền xử lý thành công, ngược lại {"S3Object": ...}.
+    """
+    if not is_enabled():
+        return s3_reference(bucket_name, key), None
+    try:
+        with metrics.timer("Preprocess"):
+            data = read_object(bucket_name, key)
+            if data is None:
+                print(f"Image {key} is too large to preprocess, using S3 reference.")
+                return s3_reference(bucket_name, key), None
+            metrics.put("SourceBytes", len(data), "Bytes")
+            result = downscale(data)
+        if result is None:
+            return s3_reference(bucket_name, key), None
+        image, encoded = result
+        metrics.put("PreprocessedBytes", len(encoded), "Bytes")
+        try:
+            save_derivatives(key, image, encoded)
+        except Exception as e:
+            # Derivative chỉ phục vụ giao diện, không làm hỏng việc nhận diện
+            print(f"Failed to save derivatives for {key}: {e}")
+        return {"Bytes": encoded}, image
+    except Exception as e:
+        print(f"Preprocessing failed for {key}, using S3 reference: {e}")
+        return s3_reference(bucket_name, key), None
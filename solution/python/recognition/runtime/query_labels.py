@@ -0,0 +1,195 @@
+import os
+import json
+import heapq
+import base64
+import binascii
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+import label_index
+from shared import clients, metrics
+
+# Client DynamoDB được tạo lazy qua shared.clients
+index_table_name = label_index.INDEX_TABLE
+
+# Kiểm tra biến môi trường
+if not index_table_name:
+    raise ValueError("LABEL_INDEX_TABLE environment variable is not set")
+
+# GSI sắp xếp các ảnh của cùng một shard label theo confidence
+CONFIDENCE_INDEX = label_index.CONFIDENCE_INDEX
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", str(label_index.SHARDS)))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+
+def encode_cursor(last_evaluated_key):
+    """
+    Mã hóa LastEvaluatedKey thành cursor dạng chuỗi để trả cho client.
+    """
+    if not last_evaluated_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """
+    Giải mã cursor do encode_cursor tạo ra, raise ValueError nếu không hợp lệ.
+    """
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, dict):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def _query_shard(pk, min_confidence, limit, start_key):
+    """
+    Tối đa limit item của một shard, giảm dần theo confidence.
+    Trả về (items, LastEvaluatedKey).
+    """
+    kwargs = {
+        "TableName": index_table_name,
+        "IndexName": CONFIDENCE_INDEX,
+        "KeyConditionExpression": "#label = :label AND #confidence >= :min_confidence",
+        "ExpressionAttributeNames": {"#label": "label", "#confidence": "confidence"},
+        "ExpressionAttributeValues": {
+            ":label": {"S": pk},
+            ":min_confidence": {"N": str(min_confidence)},
+        },
+        "ScanIndexForward": False,
+        "Limit": limit,
+    }
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+    with metrics.timer("DynamoDBQuery"):
+        response = clients.get_client("dynamodb").query(**kwargs)
+    return response.get("Items", []), response.get("LastEvaluatedKey")
+
+
+def _position(item):
+    # ExclusiveStartKey của GSI: key của bảng và key của index
+    return {name: item[name] for name in ("label", "image", "confidence")}
+
+
+# 1. Truy vấn các ảnh có label cho trước: query song song mọi shard trên GSI rồi trộn
+def query_images_by_label(label, min_confidence=0.0, limit=DEFAULT_LIMIT, start_key=None):
+    """
+    Trả về các ảnh chứa label, sắp xếp giảm dần theo confidence.
+    Args:
+        label (str): Tên label (không phân biệt hoa thường)
+        min_confidence (float): Confidence tối thiểu (0-100)
+        limit (int): Số mục tối đa trả về
+        start_key (dict, optional): Vị trí của từng shard để bắt đầu phân trang,
+            {partition key: ExclusiveStartKey, hoặc None nếu shard đã hết}
+    """
+    pks = label_index.partition_keys(label)
+    positions = dict.fromkeys(pks, {})  # {} là từ đầu shard, None là shard đã hết
+    if start_key:
+        if set(start_key) != set(pks) or not all(
+                position is None or isinstance(position, dict) for position in start_key.values()):
+            raise ValueError("Invalid cursor")
+        positions = start_key
+
+    active = [pk for pk in pks if positions[pk] is not None]
+    pages = dict(zip(active, _executor.map(
+        metrics.bind(lambda pk: _query_shard(pk, min_confidence, limit, positions[pk])), active)))
+
+    # Mỗi shard đã sắp xếp giảm dần nên limit item đầu của mỗi shard đủ cho một trang
+    merged = heapq.merge(
+        *([(pk, item) for item in items] for pk, (items, _) in pages.items()),
+        key=lambda entry: -float(entry[1]["confidence"]["N"]),
+    )
+    taken = []
+    consumed = dict.fromkeys(active, 0)
+    for pk, item in merged:
+        if len(taken) >= limit:
+            break
+        taken.append(item)
+        consumed[pk] += 1
+
+    # Shard đã trả hết item của trang đi tiếp từ LastEvaluatedKey, còn lại từ item cuối đã dùng
+    cursor = dict(positions)
+    for pk, (items, last_evaluated_key) in pages.items():
+        if consumed[pk] == len(items):
+            cursor[pk] = last_evaluated_key
+        elif consumed[pk]:
+            cursor[pk] = _position(items[consumed[pk] - 1])
+    more = any(position is not None for position in cursor.values())
+
+    items = [
+        {
+            "image": item["image"]["S"],
+            "label": item.get("name", item["label"])["S"],
+            "confidence": float(item["confidence"]["N"]),
+        }
+        for item in taken
+    ]
+    metrics.put("ItemsReturned", len(items))
+    return {
+        "items": items,
+        "next_cursor": encode_cursor(cursor) if more else None,
+    }
+
+
+def _bad_request(message):
+    return {
+        "statusCode": 400,
+        "body": json.dumps({"error": message})
+    }
+
+
+@metrics.instrument("QueryLabels")
+def handler(event, context):
+    if clients.is_warmup_event(event):
+        clients.warm_up("dynamodb")
+        return {"warmup": True}
+    params = event.get("queryStringParameters") or {}
+    label = (params.get("label") or "").strip()
+    if not label:
+        return _bad_request('Missing "label" in queryStringParameters.')
+
+    try:
+        min_confidence = float(params.get("min_confidence") or 0)
+        limit = int(params.get("limit") or DEFAULT_LIMIT)
+        start_key = decode_cursor(params.get("cursor"))
+    except ValueError as e:
+        return _bad_request(f"Invalid query parameter: {e}")
+    if not 0 <= min_confidence <= 100:
+        return _bad_request('"min_confidence" must be between 0 and 100.')
+    if limit < 1:
+        return _bad_request('"limit" must be a positive integer.')
+
+    try:
+        result = query_images_by_label(
+            label, min_confidence=min_confidence, limit=min(limit, MAX_LIMIT), start_key=start_key)
+        return {
+            "statusCode": 200,
+            "body": json.dumps(result)
+        }
+    except ValueError as e:
+        return _bad_request(str(e))
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code == 'ValidationException':
+            return _bad_request("Invalid cursor")
+        print(f"DynamoDB error: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Failed to query label index"})
+        }
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "An unexpected error occurred"})
+        }
+
+
+if clients.WARM_UP_ON_INIT:
+    clients.warm_up("dynamodb")
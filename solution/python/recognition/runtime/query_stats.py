@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+import label_stats
+from shared import clients, metrics
+
+# Client DynamoDB được tạo lazy qua shared.clients
+# Kiểm tra biến môi trường
+if not label_stats.STATS_TABLE:
+    raise ValueError("LABEL_STATS_TABLE environment variable is not set")
+
+DEFAULT_TOP = 10
+MAX_TOP = 100
+# Số ngày tối đa của một truy vấn theo khoảng thời gian
+MAX_RANGE_DAYS = int(os.environ.get("STATS_MAX_RANGE_DAYS", "92"))
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))
+DDB_BATCH_GET_SIZE = 100
+DDB_BATCH_MAX_RETRIES = 5
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+
+def _number(attribute):
+    text = attribute["N"]
+    return float(text) if "." in text or "e" in text or "E" in text else int(text)
+
+
+def parse_range(start, end):
+    """
+    Danh sách ngày (YYYY-MM-DD) từ start đến end (bao gồm cả hai), None nếu
+    không có khoảng thời gian (dùng bộ đếm tổng). Raise ValueError nếu không hợp lệ.
+    """
+    if not start and not end:
+        return None
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    first = datetime.date.fromisoformat(start) if start else None
+    last = datetime.date.fromisoformat(end) if end else today
+    first = first or last
+    if first > last:
+        raise ValueError('"from" must not be after "to"')
+    days = (last - first).days + 1
+    if days > MAX_RANGE_DAYS:
+        raise ValueError(f"range must not exceed {MAX_RANGE_DAYS} days")
+    return [(first + datetime.timedelta(days=offset)).isoformat() for offset in range(days)]
+
+
+def _scopes(days):
+    return [label_stats.TOTAL] if days is None else [label_stats.day_scope(day) for day in days]
+
+
+def _query_partition(pk):
+    """
+    Đọc toàn bộ item của một partition. Số item bằng số label khác nhau
+    (giới hạn bởi bộ label của Rekognition), không phụ thuộc số ảnh.
+    """
+    kwargs = {
+        "TableName": label_stats.STATS_TABLE,
+        "KeyConditionExpression": "pk = :pk",
+        "ExpressionAttributeValues": {":pk": {"S": pk}},
+    }
+    items = []
+    while True:
+        with metrics.timer("DynamoDBQuery"):
+            response = clients.get_client("dynamodb").query(**kwargs)
+        items.extend(response.get("Items", []))
+        if not response.get("LastEvaluatedKey"):
+            return items
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def _merge(totals, item):
+    entry = totals.setdefault(item["sk"]["S"], {"name": None, "values": {}})
+    if "name" in item:
+        entry["name"] = item["name"]["S"]
+    for attribute in ("count", "conf_sum") + label_stats.HISTOGRAM:
+        if attribute in item:
+            entry["values"][attribute] = entry["values"].get(attribute, 0) + _number(item[attribute])
+
+
+def _summary(label, entry):
+    values = entry["values"]
+    histogram = {bucket: values.get(bucket, 0) for bucket in label_stats.HISTOGRAM}
+    scored = sum(histogram.values())
+    return {
+        "label": label,
+        "name": entry["name"] or label,
+        "count": values.get("count", 0),
+        "average_confidence": round(values.get("conf_sum", 0) / scored, 2) if scored else None,
+        "histogram": {bucket[1:]: count for bucket, count in histogram.items()},
+    }
+
+
+# 1. Top-N label của cả bảng hoặc của một khoảng ngày
+def top_labels(top=DEFAULT_TOP, days=None):
+    pks = [label_stats.partition_key(scope, shard)
+           for scope in _scopes(days) for shard in range(label_stats.SHARDS)]
+    totals = {}
+    for items in _executor.map(metrics.bind(_query_partition), pks):
+        for item in items:
+            _merge(totals, item)
+    images = totals.pop(label_stats.IMAGES, {"values": {}})["values"].get("count", 0)
+    ranked = sorted(
+        (_summary(label, entry) for label, entry in totals.items()),
+        key=lambda summary: (-summary["count"], summary["label"]),
+    )
+    ranked = [summary for summary in ranked if summary["count"] > 0][:top]
+    metrics.put("ItemsReturned", len(ranked))
+    return {"images": images, "labels": ranked}
+
+
+def _batch_get(keys):
+    items = []
+    for start in range(0, len(keys), DDB_BATCH_GET_SIZE):
+        request_items = {label_stats.STATS_TABLE: {"Keys": keys[start:start + DDB_BATCH_GET_SIZE]}}
+        for attempt in range(DDB_BATCH_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(0.05 * 2 ** attempt)
+            with metrics.timer("DynamoDBRead"):
+                response = clients.get_client("dynamodb").batch_get_item(RequestItems=request_items)
+            items.extend(response.get("Responses", {}).get(label_stats.STATS_TABLE, []))
+            request_items = response.get("UnprocessedKeys") or {}
+            if not request_items:
+                break
+        else:
+            raise RuntimeError("Unprocessed keys remain after retries")
+    return items
+
+
+# 2. Thống kê của một label, kèm số lần xuất hiện theo ngày nếu có khoảng thời gian
+def label_summary(label, days=None):
+    sk = label_stats.normalize(label)
+    keys = [
+        {"pk": {"S": label_stats.partition_key(scope, shard)}, "sk": {"S": sk}}
+        for scope in _scopes(days) for shard in range(label_stats.SHARDS)
+    ]
+    totals = {}
+    series = {}
+    for item in _batch_get(keys):
+        _merge(totals, item)
+        if days is not None:
+            day = item["pk"]["S"].split("#")[1]
+            series[day] = series.get(day, 0) + _number(item.get("count", {"N": "0"}))
+    summary = _summary(sk, totals.get(sk, {"name": None, "values": {}}))
+    if days is not None:
+        summary["series"] = [{"day": day, "count": series.get(day, 0)} for day in days]
+    return summary
+
+
+def _bad_request(message):
+    return {
+        "statusCode": 400,
+        "body": json.dumps({"error": message})
+    }
+
+
+@metrics.instrument("QueryStats")
+def handler(event, context):
+    if clients.is_warmup_event(event):
+        clients.warm_up("dynamodb")
+        return {"warmup": True}
+    params = event.get("queryStringParameters") or {}
+    label = (params.get("label") or "").strip()
+
+    try:
+        top = int(params.get("top") or DEFAULT_TOP)
+        days = parse_range(params.get("from"), params.get("to"))
+    except ValueError as e:
+        return _bad_request(f"Invalid query parameter: {e}")
+    if top < 1:
+        return _bad_request('"top" must be a positive integer.')
+
+    try:
+        if label:
+            result = label_summary(label, days)
+        else:
+            result = top_labels(min(top, MAX_TOP), days)
+        if days is not None:
+            result.update({"from": days[0], "to": days[-1]})
+        return {
+            "statusCode": 200,
+            "body": json.dumps(result)
+        }
+    except ClientError as e:
+        print(f"DynamoDB error: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "Failed to query label stats"})
+        }
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": "An unexpected error occurred"})
+        }
+
+
+if clients.WARM_UP_ON_INIT:
+    clients.warm_up("dynamodb")
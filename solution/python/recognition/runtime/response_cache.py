@@ -0,0 +1,102 @@
+"""
+Cache response của list_images trong bộ nhớ của container warm.
+
+Mỗi entry gắn với version của bảng Classifications lúc tạo (shared.table_version):
+image_recognition tăng version sau mỗi lần ghi nên entry của version cũ được
+coi như không có. TTL giới hạn độ cũ khi không có bảng version (hoặc bên ghi
+không tăng được version). Cache là LRU giới hạn theo số entry và tổng số bytes.
+
+Entry lưu body JSON, body gzip và ETag của từng biến thể (ETag của bản gzip
+có hậu tố "-gzip" vì bytes khác) nên request trúng cache không phải scan,
+serialize hay nén lại.
+"""
+import os
+import gzip
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "30"))
+MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Body nhỏ hơn ngưỡng này không được nén
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+
+
+class Entry:
+    """
+    Một response 200: body, header riêng (Content-Type, ...) và ETag của bản
+    gốc và bản gzip.
+    """
+    __slots__ = ("version", "expires_at", "body", "gzipped", "headers", "etag", "gzip_etag", "size")
+
+    def __init__(self, body, headers=None, version=None, ttl=TTL_SECONDS):
+        self.version = version
+        self.expires_at = time.monotonic() + ttl
+        self.body = body.encode("utf-8")
+        # Body nén gzip (mtime=0 để cùng body luôn cho cùng bytes), None nếu quá nhỏ
+        self.gzipped = None
+        if len(self.body) >= GZIP_MIN_BYTES:
+            self.gzipped = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+        self.headers = dict(headers or {})
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = '"' + digest + '"'
+        self.gzip_etag = '"' + digest + '-gzip"' if self.gzipped is not None else None
+        self.size = len(self.body) + len(self.gzipped or b"")
+
+
+class ResponseCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Entry còn hạn được tạo ở đúng version, None nếu không có.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version and now < entry.expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
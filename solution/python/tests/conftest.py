@@ -0,0 +1,64 @@
+"""
+Đường dẫn import và fixture dùng chung cho các test.
+
+Test runtime chạy handler thật trên các service giả của tools/simulator. Các
+module runtime đọc biến môi trường lúc import và giữ state ở mức module nên
+cả phiên test dùng chung một PipelineSimulator (fixture "simulator"); mỗi test
+dùng key riêng (fixture "unique_key") để không đụng dữ liệu của test khác.
+"""
+import os
+import sys
+import json
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from tools.simulator.harness import RUNTIME_PATHS, IMAGE_BUCKET, PipelineSimulator  # noqa: E402
+from tools.simulator.fake_aws import FakeS3  # noqa: E402
+
+for path in reversed(RUNTIME_PATHS):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(scope="session")
+def simulator():
+    simulator = PipelineSimulator(images=0, latency_ms=0, rekognition_latency_ms=0, rekognition_jitter_ms=0,
+                                  origin_latency_ms=0, endpoint_latency_ms=0)
+    simulator.setup()
+    return simulator
+
+
+@pytest.fixture
+def unique_key():
+    prefix = f"test/{uuid.uuid4().hex[:8]}"
+    return lambda name: f"{prefix}/{name}"
+
+
+@pytest.fixture
+def s3_record(simulator):
+    """
+    s3_record(key, body=None, metadata=None): ghi object vào bucket ảnh (body
+    None là không ghi, object không tồn tại) và trả về record SQS của S3 event
+    tương ứng, như image_recognition nhận từ upload queue.
+    """
+    def _record(key, body=b"image", metadata=None):
+        s3 = simulator.cloud.s3
+        if body is None:
+            obj = {"Body": b"image", "ETag": '"%s"' % uuid.uuid4().hex, "Sequencer": uuid.uuid4().hex.upper(),
+                   "LastModified": datetime.now(timezone.utc)}
+        else:
+            s3.put_object(Bucket=IMAGE_BUCKET, Key=key, Body=body, ContentType="image/jpeg", Metadata=metadata or {})
+            obj = s3.buckets[IMAGE_BUCKET][key]
+        return {
+            "messageId": str(uuid.uuid4()),
+            "body": json.dumps(FakeS3._event(IMAGE_BUCKET, key, obj, "ObjectCreated:Put")),
+            "attributes": {"ApproximateReceiveCount": "1"},
+        }
+    return _record
+
@@ -0,0 +1,40 @@
+"""
+Ingest của get_save_image trên các service giả của tools/simulator: entry của
+chỉ mục nội dung không được trỏ vào object canonical chưa ghi được.
+"""
+import hashlib
+
+import pytest
+
+from tools.simulator.fake_aws import client_error
+from tools.simulator.harness import CONTENT_INDEX_TABLE, IMAGE_BUCKET
+
+
+@pytest.fixture
+def ingest(simulator):
+    import get_save_image
+    return get_save_image
+
+
+def content_entry(simulator, data):
+    digest = hashlib.sha256(data).hexdigest()
+    return simulator.cloud.dynamodb.get_item(TableName=CONTENT_INDEX_TABLE, Key={"sha256": {"S": digest}}).get("Item")
+
+
+def test_failed_upload_releases_content_claim(simulator, ingest, unique_key, monkeypatch):
+    data = unique_key("image-bytes").encode()
+
+    def failing_put(**kwargs):
+        raise client_error("InternalError", "We encountered an internal error.", "PutObject", 500)
+
+    monkeypatch.setattr(simulator.cloud.s3, "put_object", failing_put)
+
+    assert ingest.upload_image_to_s3(IMAGE_BUCKET, unique_key("image.jpg"), data) is False
+    assert content_entry(simulator, data) is None
+
+
+def test_upload_records_content_entry(simulator, ingest, unique_key):
+    data = unique_key("image-bytes").encode()
+
+    assert ingest.upload_image_to_s3(IMAGE_BUCKET, unique_key("image.jpg"), data) is True
+    assert content_entry(simulator, data)["key"]["S"] == unique_key("image.jpg")
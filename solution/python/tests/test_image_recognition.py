@@ -0,0 +1,175 @@
+"""
+Handler image_recognition trên các service giả của tools/simulator: lỗi của
+một record chỉ làm record đó nằm trong batchItemFailures, các record còn lại
+vẫn được ghi, và claim của ledger luôn được chốt (COMPLETED hoặc xóa). Ảnh
+có claim COMPLETED được bỏ qua, ảnh có claim của lần invoke khác được gửi lại.
+"""
+import json
+import time
+
+import pytest
+
+from tools.simulator.harness import (
+    CLASSIFICATIONS_TABLE, IMAGE_BUCKET, LABEL_INDEX_TABLE, PROCESSING_LEDGER_TABLE,
+)
+
+
+@pytest.fixture
+def recognition(simulator):
+    import image_recognition
+    return image_recognition
+
+
+def invoke(simulator, records):
+    return simulator.functions["image_recognition"].invoke({"Records": records})
+
+
+def failed_ids(response):
+    return {item["itemIdentifier"] for item in response["batchItemFailures"]}
+
+
+def stored_item(simulator, key):
+    return simulator.cloud.dynamodb.get_item(TableName=CLASSIFICATIONS_TABLE, Key={"image": {"S": key}}).get("Item")
+
+
+def ledger_item(simulator, record):
+    s3_object = json.loads(record["body"])["Records"][0]["s3"]["object"]
+    ledger_key = f"{IMAGE_BUCKET}/{s3_object['key']}#{s3_object['sequencer']}"
+    return simulator.cloud.dynamodb.get_item(TableName=PROCESSING_LEDGER_TABLE, Key={"id": {"S": ledger_key}}).get("Item")
+
+
+def test_alias_of_v1_canonical_does_not_fail_the_batch(simulator, recognition, s3_record, unique_key, monkeypatch):
+    canonical, broken_canonical = unique_key("canonical.jpg"), unique_key("broken-canonical.jpg")
+    for key in (canonical, broken_canonical):
+        # Item version 1: labels là str() của list tên, không có confidence
+        simulator.cloud.dynamodb.put_item(TableName=CLASSIFICATIONS_TABLE, Item={
+            "image": {"S": key}, "labels": {"S": "['Dog', 'Cat']"}})
+    alias = s3_record(unique_key("alias.jpg"), body=b"", metadata={"alias-of": canonical})
+    broken = s3_record(unique_key("broken.jpg"), body=b"", metadata={"alias-of": broken_canonical})
+    image = s3_record(unique_key("image.jpg"), body=b"image-bytes")
+    broken_key = unique_key("broken.jpg")
+
+    build_index_items = recognition.buildIndexItems
+
+    def failing_build(key, db_result):
+        if key == broken_key:
+            raise KeyError("confidence")
+        return build_index_items(key, db_result)
+
+    monkeypatch.setattr(recognition, "buildIndexItems", failing_build)
+
+    response = invoke(simulator, [alias, broken, image])
+
+    assert failed_ids(response) == {broken["messageId"]}
+    item = stored_item(simulator, unique_key("alias.jpg"))
+    assert item["alias_of"]["S"] == canonical
+    assert sorted(label["M"]["name"]["S"] for label in item["labels"]["L"]) == ["Cat", "Dog"]
+    index_rows = [
+        row for row in simulator.cloud.dynamodb.scan(TableName=LABEL_INDEX_TABLE)["Items"]
+        if row["image"]["S"] == unique_key("alias.jpg")
+    ]
+    assert sorted((row["name"]["S"], row["confidence"]["N"]) for row in index_rows) == [("Cat", "0"), ("Dog", "0")]
+    assert stored_item(simulator, unique_key("image.jpg")) is not None
+    assert stored_item(simulator, broken_key) is None
+    # Claim của ảnh lỗi được xóa để lần gửi lại xử lý ngay, ảnh thành công là COMPLETED
+    assert ledger_item(simulator, broken) is None
+    assert ledger_item(simulator, alias)["status"]["S"] == "COMPLETED"
+    assert ledger_item(simulator, image)["status"]["S"] == "COMPLETED"
+
+
+def test_claims_are_released_when_processing_raises(simulator, recognition, s3_record, unique_key, monkeypatch):
+    records = [s3_record(unique_key(f"{index}.jpg")) for index in range(3)]
+
+    def failing_process(images, objects=None, notify=True):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(recognition, "processImages", failing_process)
+
+    with pytest.raises(RuntimeError):
+        invoke(simulator, records)
+
+    assert all(ledger_item(simulator, record) is None for record in records)
+
+
+def test_failing_record_is_the_only_batch_item_failure(simulator, recognition, s3_record, unique_key):
+    first = s3_record(unique_key("first.jpg"), body=b"first-bytes")
+    # Object không tồn tại: DetectLabels lỗi InvalidS3ObjectException
+    missing = s3_record(unique_key("missing.jpg"), body=None)
+    second = s3_record(unique_key("second.jpg"), body=b"second-bytes")
+
+    response = invoke(simulator, [first, missing, second])
+
+    assert failed_ids(response) == {missing["messageId"]}
+    assert stored_item(simulator, unique_key("missing.jpg")) is None
+    for name in ("first.jpg", "second.jpg"):
+        item = stored_item(simulator, unique_key(name))
+        assert item is not None and item["labels"]["L"]
+
+
+@pytest.fixture
+def detected(simulator, monkeypatch):
+    """
+    Danh sách key của các ảnh được gửi tới DetectLabels trong test.
+    """
+    rekognition = simulator.cloud.rekognition
+    detect_labels = rekognition.detect_labels
+    names = []
+
+    def recording_detect_labels(Image, **kwargs):
+        names.append(Image.get("S3Object", {}).get("Name"))
+        return detect_labels(Image=Image, **kwargs)
+
+    monkeypatch.setattr(rekognition, "detect_labels", recording_detect_labels)
+    return names
+
+
+def put_ledger_item(simulator, record, **attributes):
+    s3_object = json.loads(record["body"])["Records"][0]["s3"]["object"]
+    item = {"id": {"S": f"{IMAGE_BUCKET}/{s3_object['key']}#{s3_object['sequencer']}"}}
+    item.update(attributes)
+    simulator.cloud.dynamodb.put_item(TableName=PROCESSING_LEDGER_TABLE, Item=item)
+
+
+def test_completed_claim_skips_the_image(simulator, recognition, s3_record, unique_key, detected):
+    record = s3_record(unique_key("done.jpg"))
+    put_ledger_item(simulator, record, status={"S": "COMPLETED"},
+                    expires_at={"N": str(int(time.time()) + 3600)})
+
+    response = invoke(simulator, [record])
+
+    assert failed_ids(response) == set()
+    assert unique_key("done.jpg") not in detected
+    assert stored_item(simulator, unique_key("done.jpg")) is None
+    assert ledger_item(simulator, record)["status"]["S"] == "COMPLETED"
+
+
+def test_busy_claim_is_reported_as_failure(simulator, recognition, s3_record, unique_key, detected):
+    busy = s3_record(unique_key("busy.jpg"))
+    image = s3_record(unique_key("image.jpg"))
+    now = int(time.time())
+    put_ledger_item(simulator, busy, status={"S": "IN_PROGRESS"}, owner={"S": "other-invocation"},
+                    in_progress_until={"N": str(now + 300)}, expires_at={"N": str(now + 3600)})
+
+    response = invoke(simulator, [busy, image])
+
+    assert failed_ids(response) == {busy["messageId"]}
+    assert unique_key("busy.jpg") not in detected
+    assert stored_item(simulator, unique_key("busy.jpg")) is None
+    # Claim của lần invoke khác được giữ nguyên
+    assert ledger_item(simulator, busy)["owner"]["S"] == "other-invocation"
+    assert stored_item(simulator, unique_key("image.jpg")) is not None
+
+
+def test_claim_is_released_when_processing_fails(simulator, recognition, s3_record, unique_key, detected):
+    record = s3_record(unique_key("late.jpg"), body=None)
+
+    assert failed_ids(invoke(simulator, [record])) == {record["messageId"]}
+    assert ledger_item(simulator, record) is None
+
+    # Lần gửi lại (object đã có) được xử lý ngay thay vì bị coi là đang bận
+    simulator.cloud.s3.put_object(Bucket=IMAGE_BUCKET, Key=unique_key("late.jpg"), Body=b"late-bytes",
+                                  ContentType="image/jpeg")
+    assert failed_ids(invoke(simulator, [record])) == set()
+    assert detected.count(unique_key("late.jpg")) == 2
+    assert stored_item(simulator, unique_key("late.jpg")) is not None
+    assert ledger_item(simulator, record)["status"]["S"] == "COMPLETED"
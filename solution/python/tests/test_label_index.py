@@ -0,0 +1,53 @@
+"""
+Item chỉ mục label -> image (recognition/runtime/label_index.py) và
+tools/rebuild_label_index.py với item Classifications version 1.
+"""
+import label_index
+import label_schema
+from tools import rebuild_label_index
+from tools.simulator.fake_aws import FakeCloud
+
+V1_ITEM = {"image": {"S": "a.jpg"}, "labels": {"S": "['Dog', 'Cat']"}}
+
+
+def test_build_items_from_v1_row():
+    items = label_index.build_items("a.jpg", label_schema.labels_from_item(V1_ITEM))
+    assert sorted(item["name"]["S"] for item in items) == ["Cat", "Dog"]
+    for item in items:
+        # Label không có confidence vẫn có sort key của GSI by_confidence
+        assert item["confidence"] == {"N": str(label_index.UNKNOWN_CONFIDENCE)}
+        assert item["label"]["S"] == label_index.partition_key(item["name"]["S"], label_index.shard_of("a.jpg"))
+
+
+def test_build_items_from_migrated_row():
+    # tools/migrate_labels.py ghi lại item version 1 bằng to_item: label chỉ có "name"
+    migrated = label_schema.to_item("a.jpg", label_schema.labels_from_item(V1_ITEM))
+    items = label_index.build_items("a.jpg", label_schema.labels_from_item(migrated))
+    assert {item["name"]["S"]: item["confidence"]["N"] for item in items} == {"Dog": "0", "Cat": "0"}
+
+
+def test_build_items_keeps_confidence():
+    items = label_index.build_items("a.jpg", [{"name": "Dog", "confidence": 97.5}, {"name": "dog", "confidence": 90.0}])
+    assert len(items) == 1
+    assert items[0]["confidence"] == {"N": "90.0"}
+
+
+def test_rebuild_with_v1_rows():
+    cloud = FakeCloud(latency_ms=0, jitter_ms=0)
+    dynamodb = cloud.client("dynamodb")
+    dynamodb.create_table(TableName="Classifications", KeySchema=[{"AttributeName": "image", "KeyType": "HASH"}])
+    dynamodb.create_table(TableName="LabelIndex", KeySchema=[
+        {"AttributeName": "label", "KeyType": "HASH"}, {"AttributeName": "image", "KeyType": "RANGE"}])
+    dynamodb.put_item(TableName="Classifications", Item=V1_ITEM)
+    dynamodb.put_item(TableName="Classifications", Item=label_schema.to_item(
+        "b.jpg", [{"name": "Dog", "confidence": 88.0}]))
+    # Item của label ảnh không còn có
+    dynamodb.put_item(TableName="LabelIndex", Item=label_index.build_items(
+        "b.jpg", [{"name": "Car", "confidence": 70.0}])[0])
+
+    written, deleted = rebuild_label_index.rebuild(dynamodb, "Classifications", "LabelIndex")
+
+    assert (written, deleted) == (3, 1)
+    rows = dynamodb.scan(TableName="LabelIndex")["Items"]
+    assert sorted((row["image"]["S"], row["name"]["S"], row["confidence"]["N"]) for row in rows) == [
+        ("a.jpg", "Cat", "0"), ("a.jpg", "Dog", "0"), ("b.jpg", "Dog", "88.0")]
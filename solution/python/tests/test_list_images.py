@@ -0,0 +1,113 @@
+"""
+Cache response của list_images trên các service giả của tools/simulator:
+ETag/304, gzip theo BINARY_MEDIA_TYPES và vô hiệu hóa cache khi version của
+bảng Classifications tăng.
+"""
+import gzip
+import json
+import base64
+
+import pytest
+
+from tools.simulator.harness import CLASSIFICATIONS_TABLE, VERSION_TABLE
+
+
+@pytest.fixture
+def listing(simulator, monkeypatch):
+    import list_images
+    monkeypatch.setattr(list_images, "BINARY_MEDIA_TYPES", frozenset({"application/json"}))
+    return list_images
+
+
+@pytest.fixture
+def labelled(simulator, unique_key):
+    """
+    labelled(count): ghi count item có chung một label riêng của test và trả
+    về label đó để list theo ?label= mà không thấy item của test khác.
+    """
+    label = unique_key("label").replace("/", "-")
+
+    def _put(count, start=0):
+        for index in range(start, start + count):
+            simulator.cloud.dynamodb.put_item(TableName=CLASSIFICATIONS_TABLE, Item={
+                "image": {"S": unique_key(f"{index:04d}.jpg")},
+                "schema_version": {"N": "2"},
+                "labels": {"L": [{"M": {"name": {"S": label}, "confidence": {"N": "99.5"}}}]},
+                "label_names": {"SS": [label]},
+            })
+        return label
+    return _put
+
+
+def invoke(simulator, label, **headers):
+    return simulator.functions["list_images"].invoke({
+        "queryStringParameters": {"label": label},
+        "headers": {name.replace("_", "-"): value for name, value in headers.items()},
+    })
+
+
+def images(response):
+    body = response["body"]
+    if response["headers"].get("Content-Encoding") == "gzip":
+        body = gzip.decompress(base64.b64decode(body)).decode("utf-8")
+    return sorted(item["image"] for item in json.loads(body)["items"])
+
+
+def test_if_none_match_returns_304(simulator, listing, labelled):
+    label = labelled(3)
+    first = invoke(simulator, label)
+    assert first["statusCode"] == 200
+
+    response = invoke(simulator, label, If_None_Match=first["headers"]["ETag"])
+
+    assert response["statusCode"] == 304
+    assert response["body"] == ""
+    assert response["headers"]["ETag"] == first["headers"]["ETag"]
+    assert response["headers"]["Vary"] == "Accept, Accept-Encoding"
+    assert invoke(simulator, label, If_None_Match='"other"')["statusCode"] == 200
+
+
+def test_gzip_only_for_binary_media_types(simulator, listing, labelled):
+    # Đủ item để body vượt GZIP_MIN_BYTES
+    label = labelled(20)
+    plain = invoke(simulator, label, Accept="*/*", Accept_Encoding="gzip")
+    compressed = invoke(simulator, label, Accept="application/json", Accept_Encoding="gzip")
+    no_gzip = invoke(simulator, label, Accept="application/json", Accept_Encoding="identity")
+
+    assert "Content-Encoding" not in plain["headers"] and not plain.get("isBase64Encoded")
+    assert "Content-Encoding" not in no_gzip["headers"]
+    assert compressed["headers"]["Content-Encoding"] == "gzip" and compressed["isBase64Encoded"]
+    assert images(compressed) == images(plain) and len(images(plain)) == 20
+    for response in (plain, compressed, no_gzip):
+        assert response["headers"]["Vary"] == "Accept, Accept-Encoding"
+
+    # Mỗi biến thể có ETag riêng, If-None-Match chỉ khớp ETag của biến thể được trả
+    plain_etag, gzip_etag = plain["headers"]["ETag"], compressed["headers"]["ETag"]
+    assert gzip_etag == plain_etag[:-1] + '-gzip"'
+    assert no_gzip["headers"]["ETag"] == plain_etag
+    assert invoke(simulator, label, Accept="application/json", Accept_Encoding="gzip",
+                  If_None_Match=plain_etag)["statusCode"] == 200
+    assert invoke(simulator, label, Accept="application/json", Accept_Encoding="gzip",
+                  If_None_Match=gzip_etag)["statusCode"] == 304
+    assert invoke(simulator, label, Accept="*/*", Accept_Encoding="gzip",
+                  If_None_Match=gzip_etag)["statusCode"] == 200
+
+
+def test_table_version_bump_invalidates_cache(simulator, listing, labelled):
+    from shared import table_version
+
+    label = labelled(2)
+    first = invoke(simulator, label)
+    labelled(1, start=2)
+
+    # Chưa tăng version: trúng cache, item mới chưa thấy
+    cached = invoke(simulator, label)
+    assert images(cached) == images(first) and len(images(cached)) == 2
+    assert cached["headers"]["ETag"] == first["headers"]["ETag"]
+
+    table_version.bump(VERSION_TABLE, CLASSIFICATIONS_TABLE)
+
+    fresh = invoke(simulator, label)
+    assert len(images(fresh)) == 3
+    assert fresh["headers"]["ETag"] != first["headers"]["ETag"]
+    assert invoke(simulator, label, If_None_Match=first["headers"]["ETag"])["statusCode"] == 200
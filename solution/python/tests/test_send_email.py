@@ -0,0 +1,112 @@
+"""
+Circuit breaker của send_email trên các service giả của tools/simulator: khi
+breaker mở, record được hoãn qua RETRY_QUEUE_URL với DelaySeconds tăng dần
+thay vì POST; khi HALF_OPEN chỉ một lời gọi thử tới endpoint.
+"""
+import time
+import uuid
+
+import pytest
+
+from tools.simulator.fake_http import ThirdPartyEndpointSession
+
+
+@pytest.fixture
+def delivery(simulator, monkeypatch):
+    """
+    Module send_email với breaker mới (mở sau một lỗi) và endpoint riêng của
+    test; trả về (module, list entry đã gửi vào RETRY_QUEUE_URL).
+    """
+    import send_email
+    from shared import circuit_breaker
+    monkeypatch.setattr(send_email, "_breaker", circuit_breaker.CircuitBreaker(
+        "ThirdParty", failure_threshold=1, reset_seconds=0.05, slow_call_seconds=0))
+    monkeypatch.setattr(send_email, "_session", ThirdPartyEndpointSession(latency_ms=0))
+
+    sqs = simulator.cloud.sqs
+    send_message_batch = sqs.send_message_batch
+    requeued = []
+
+    def recording_send_message_batch(QueueUrl, Entries, **kwargs):
+        assert QueueUrl == send_email.RETRY_QUEUE_URL
+        requeued.extend(Entries)
+        return send_message_batch(QueueUrl=QueueUrl, Entries=Entries, **kwargs)
+
+    monkeypatch.setattr(sqs, "send_message_batch", recording_send_message_batch)
+    return send_email, requeued
+
+
+def record(attempt=None):
+    from shared import events
+    # Payload riêng cho mỗi record để delivery ledger không bỏ qua như bản trùng
+    message, _ = events.encode({"image": f"test/{uuid.uuid4().hex}.jpg", "labels": ["Dog"]}, "ImageRekognized")
+    attributes = {}
+    if attempt is not None:
+        attributes["delivery_attempt"] = {"stringValue": str(attempt), "dataType": "Number"}
+    return {"messageId": str(uuid.uuid4()), "body": message, "messageAttributes": attributes,
+            "attributes": {"ApproximateReceiveCount": "1"}}
+
+
+def invoke(simulator, records):
+    return simulator.functions["send_email"].invoke({"Records": records})
+
+
+def open_breaker(send_email):
+    send_email._breaker.record_failure()
+    assert send_email._breaker.state == send_email.circuit_breaker.OPEN
+
+
+def test_open_breaker_defers_with_growing_delay(simulator, delivery, monkeypatch):
+    send_email, requeued = delivery
+    monkeypatch.setattr(send_email, "RETRY_BASE_DELAY", 10.0)
+    open_breaker(send_email)
+    records = [record(), record(attempt=1), record(attempt=2)]
+
+    response = invoke(simulator, records)
+
+    assert response["batchItemFailures"] == []
+    assert send_email._session.requests == 0
+    by_body = {entry["MessageBody"]: entry for entry in requeued}
+    entries = [by_body[r["body"]] for r in records]
+    assert [entry["MessageAttributes"]["delivery_attempt"]["StringValue"] for entry in entries] == ["1", "2", "3"]
+    # Equal jitter: lần hoãn thứ n nằm trong [base * 2^n / 2, base * 2^n]
+    delays = [entry["DelaySeconds"] for entry in entries]
+    assert 5 <= delays[0] <= 10 <= delays[1] <= 20 <= delays[2] <= 40
+
+
+def test_record_deferred_too_often_is_returned(simulator, delivery, monkeypatch):
+    send_email, requeued = delivery
+    open_breaker(send_email)
+    exhausted = record(attempt=send_email.MAX_DEFERRALS)
+
+    response = invoke(simulator, [exhausted])
+
+    assert response["batchItemFailures"] == [{"itemIdentifier": exhausted["messageId"]}]
+    assert requeued == []
+
+
+def test_half_open_lets_one_probe_through(simulator, delivery, monkeypatch):
+    send_email, requeued = delivery
+    open_breaker(send_email)
+    time.sleep(0.06)
+    # Lời gọi thử gặp 503: breaker mở lại, các record khác không được POST
+    failing = ThirdPartyEndpointSession(latency_ms=0, failure_rate=1.0)
+    monkeypatch.setattr(send_email, "_session", failing)
+    records = [record() for _ in range(4)]
+
+    response = invoke(simulator, records)
+
+    assert failing.requests == 1
+    assert response["batchItemFailures"] == []
+    assert sorted(entry["MessageBody"] for entry in requeued) == sorted(r["body"] for r in records)
+    assert send_email._breaker.state == send_email.circuit_breaker.OPEN
+
+    # Hết thời gian mở (gấp đôi): lời gọi thử thành công thì breaker đóng lại
+    time.sleep(0.11)
+    healthy = ThirdPartyEndpointSession(latency_ms=0)
+    monkeypatch.setattr(send_email, "_session", healthy)
+    assert invoke(simulator, [record()])["batchItemFailures"] == []
+    assert healthy.requests == 1
+    assert send_email._breaker.state == send_email.circuit_breaker.CLOSED
+    assert invoke(simulator, [record() for _ in range(3)])["batchItemFailures"] == []
+    assert healthy.requests == 4
@@ -0,0 +1,247 @@
+"""
+Kiểm tra các knob throughput (tuning.py) có đi vào template đã synth: event
+source mapping, Lambda, alias provisioned concurrency và redrive policy của
+queue, với context mặc định trong cdk.json và với context ghi đè.
+
+    cd solution/python && python -m pytest tests
+"""
+import os
+import sys
+import json
+
+import pytest
+import aws_cdk as cdk
+from aws_cdk.assertions import Template
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api.infrastructure import APIStack  # noqa: E402
+from integration.infrastructure import IntegrationStack  # noqa: E402
+from recognition.infrastructure import RekognitionStack  # noqa: E402
+
+REGION = "us-east-1"
+
+OVERRIDES = {
+    "recognition_batch_size": "25",
+    "recognition_max_batching_window_seconds": "2",
+    "recognition_max_concurrency": "20",
+    "recognition_reserved_concurrency": "40",
+    "recognition_provisioned_concurrency": "3",
+    "recognition_memory_size": "2048",
+    "recognition_architecture": "x86_64",
+    "recognition_max_receive_count": "3",
+    "recognition_visibility_timeout_seconds": "90",
+    "recognition_bulk_batch_size": "50",
+    "recognition_bulk_max_batching_window_seconds": "10",
+    "recognition_bulk_max_concurrency": "6",
+    "recognition_bulk_reserved_concurrency": "12",
+    "recognition_bulk_memory_size": "3008",
+    "recognition_bulk_architecture": "x86_64",
+    "recognition_bulk_max_receive_count": "2",
+    "recognition_bulk_timeout_seconds": "300",
+    "integration_batch_size": "5",
+    "integration_max_batching_window_seconds": "1",
+    "integration_max_concurrency": "3",
+    "integration_reserved_concurrency": "8",
+    "integration_provisioned_concurrency": "1",
+    "integration_memory_size": "256",
+    "integration_max_receive_count": "0",
+}
+
+
+def synth(overrides=None):
+    """
+    Synth ba stack như app.py, context là cdk.json cộng overrides.
+    Trả về {tên stack: Template}.
+    """
+    with open(os.path.join(ROOT, "cdk.json")) as f:
+        context = json.load(f)["context"]
+    context.update(overrides or {})
+    cwd = os.getcwd()
+    # Code.from_asset dùng đường dẫn tương đối với solution/python
+    os.chdir(ROOT)
+    try:
+        app = cdk.App(context=context)
+        env = cdk.Environment(region=REGION)
+        api = APIStack(app, "APIStack", env=env)
+        integration = IntegrationStack(app, "IntegrationStack", env=env)
+        recognition = RekognitionStack(
+            app,
+            "RekognitionStack",
+            sqs_arn=api.sqs_arn,
+            bulk_sqs_arn=api.bulk_sqs_arn,
+            sns_arn=integration.sns_arn,
+            event_payload_bucket_arn=integration.event_payload_bucket_arn,
+            event_payload_bucket_name=integration.event_payload_bucket_name,
+            image_bucket_arn=api.bucket_arn,
+            env=env,
+        )
+        return {stack.stack_name: Template.from_stack(stack) for stack in (api, integration, recognition)}
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="module")
+def default_templates():
+    return synth()
+
+
+@pytest.fixture(scope="module")
+def overridden_templates():
+    return synth(OVERRIDES)
+
+
+def function_id(template, prefix):
+    """
+    Logical id của Lambda có logical id bắt đầu bằng prefix (và không phải
+    function khác có cùng tiền tố, ví dụ imagerecognition / imagerecognitionbulk).
+    """
+    ids = [
+        logical_id for logical_id in template.find_resources("AWS::Lambda::Function")
+        if logical_id.startswith(prefix) and not logical_id[len(prefix):].startswith("bulk")
+    ]
+    assert len(ids) == 1, ids
+    return ids[0]
+
+
+def event_source(template, target_id):
+    """
+    Event source mapping của function hoặc alias target_id (FunctionName của
+    alias là Fn::Join quanh Ref của alias).
+    """
+    ref = json.dumps({"Ref": target_id})
+    mappings = [
+        resource["Properties"]
+        for resource in template.find_resources("AWS::Lambda::EventSourceMapping").values()
+        if ref in json.dumps(resource["Properties"]["FunctionName"])
+    ]
+    assert len(mappings) == 1, mappings
+    return mappings[0]
+
+
+def alias_id(template, function):
+    aliases = template.find_resources("AWS::Lambda::Alias", {
+        "Properties": {"FunctionName": {"Ref": function}, "Name": "live"},
+    })
+    return next(iter(aliases), None)
+
+
+def queue(template, prefix):
+    queues = [
+        resource["Properties"]
+        for logical_id, resource in template.find_resources("AWS::SQS::Queue").items()
+        if logical_id.startswith(prefix) and not logical_id[len(prefix):].startswith("bulk")
+    ]
+    assert len(queues) == 1, queues
+    return queues[0]
+
+
+# (stack, tiền tố logical id của function, tiền tố logical id của queue nguồn)
+LANES = {
+    "recognition": ("RekognitionStack", "imagerecognition", "uploadedimagequeue"),
+    "recognition_bulk": ("RekognitionStack", "imagerecognitionbulk", "uploadedimagebulkqueue"),
+    "integration": ("IntegrationStack", "IntegrationLambda", "rekognizedimagequeue"),
+}
+
+QUEUE_STACKS = {"recognition": "APIStack", "recognition_bulk": "APIStack", "integration": "IntegrationStack"}
+
+# Giá trị mong đợi với context mặc định (cdk.json)
+DEFAULTS = {
+    "recognition": {
+        "batch_size": 10, "window": None, "max_concurrency": 10, "reserved": None, "provisioned": 0,
+        "memory": 128, "architecture": "arm64", "max_receive_count": 5, "timeout": 30,
+    },
+    "recognition_bulk": {
+        "batch_size": 10, "window": 5, "max_concurrency": 4, "reserved": None, "provisioned": 0,
+        "memory": 128, "architecture": "arm64", "max_receive_count": 5, "timeout": 120,
+    },
+    "integration": {
+        "batch_size": 10, "window": None, "max_concurrency": 5, "reserved": None, "provisioned": 0,
+        "memory": 128, "architecture": "arm64", "max_receive_count": 5, "timeout": 30,
+    },
+}
+
+# Giá trị mong đợi với OVERRIDES
+OVERRIDDEN = {
+    "recognition": {
+        "batch_size": 25, "window": 2, "max_concurrency": 20, "reserved": 40, "provisioned": 3,
+        "memory": 2048, "architecture": "x86_64", "max_receive_count": 3, "timeout": 30,
+    },
+    "recognition_bulk": {
+        "batch_size": 50, "window": 10, "max_concurrency": 6, "reserved": 12, "provisioned": 0,
+        "memory": 3008, "architecture": "x86_64", "max_receive_count": 2, "timeout": 300,
+    },
+    "integration": {
+        "batch_size": 5, "window": 1, "max_concurrency": 3, "reserved": 8, "provisioned": 1,
+        "memory": 256, "architecture": "arm64", "max_receive_count": 0, "timeout": 30,
+    },
+}
+
+
+def check_lane(templates, lane, expected):
+    stack, function_prefix, queue_prefix = LANES[lane]
+    template = templates[stack]
+    function = function_id(template, function_prefix)
+
+    # Lambda: bộ nhớ, kiến trúc, reserved concurrency, timeout
+    properties = template.find_resources("AWS::Lambda::Function")[function]["Properties"]
+    assert properties["MemorySize"] == expected["memory"]
+    assert properties["Architectures"] == [expected["architecture"]]
+    assert properties.get("ReservedConcurrentExecutions") == expected["reserved"]
+    assert properties["Timeout"] == expected["timeout"]
+    # Claim của ledger không hết hạn khi invoke giữ nó còn chạy
+    ledger_seconds = properties["Environment"]["Variables"].get("LEDGER_IN_PROGRESS_SECONDS")
+    if ledger_seconds is not None:
+        assert int(ledger_seconds) > expected["timeout"]
+
+    # Alias "live" có provisioned concurrency, event source gắn vào alias
+    alias = alias_id(template, function)
+    if expected["provisioned"]:
+        assert alias is not None
+        template.has_resource_properties("AWS::Lambda::Alias", {
+            "FunctionName": {"Ref": function},
+            "Name": "live",
+            "ProvisionedConcurrencyConfig": {"ProvisionedConcurrentExecutions": expected["provisioned"]},
+        })
+        target = alias
+    else:
+        assert alias is None
+        target = function
+
+    # Event source mapping
+    mapping = event_source(template, target)
+    assert mapping["BatchSize"] == expected["batch_size"]
+    assert mapping.get("MaximumBatchingWindowInSeconds") == expected["window"]
+    assert mapping["ScalingConfig"] == {"MaximumConcurrency": expected["max_concurrency"]}
+    assert mapping["FunctionResponseTypes"] == ["ReportBatchItemFailures"]
+
+    # Redrive policy của queue nguồn (không có khi max_receive_count = 0)
+    source = queue(templates[QUEUE_STACKS[lane]], queue_prefix)
+    if expected["max_receive_count"]:
+        assert source["RedrivePolicy"]["maxReceiveCount"] == expected["max_receive_count"]
+        assert "deadLetterTargetArn" in source["RedrivePolicy"]
+    else:
+        assert "RedrivePolicy" not in source
+
+
+@pytest.mark.parametrize("lane", sorted(LANES))
+def test_default_context(default_templates, lane):
+    check_lane(default_templates, lane, DEFAULTS[lane])
+
+
+@pytest.mark.parametrize("lane", sorted(LANES))
+def test_overridden_context(overridden_templates, lane):
+    check_lane(overridden_templates, lane, OVERRIDDEN[lane])
+
+
+def test_visibility_timeout_follows_context(default_templates, overridden_templates):
+    assert queue(default_templates["APIStack"], "uploadedimagequeue")["VisibilityTimeout"] == 60
+    assert queue(overridden_templates["APIStack"], "uploadedimagequeue")["VisibilityTimeout"] == 90
+
+
+def test_ledger_window_follows_bulk_timeout(overridden_templates):
+    template = overridden_templates["RekognitionStack"]
+    function = function_id(template, "imagerecognitionbulk")
+    variables = template.find_resources("AWS::Lambda::Function")[function]["Properties"]["Environment"]["Variables"]
+    assert variables["LEDGER_IN_PROGRESS_SECONDS"] == "330"
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Nhận diện lại các ảnh đã có trong bucket sau khi đổi tham số detect_labels
+(MAX_LABELS, MIN_CONFIDENCE) hoặc định dạng label_schema.
+
+    python tools/backfill.py --bucket <image bucket> --table <Classifications table> \\
+        [--label-index-table <LabelIndex table>] [--manifest backfill.json | s3://bucket/key] \\
+        [--partitions 16] [--workers 16] [--rate 20] [--prefix photos/] [--notify]
+
+Dùng lại các hàm của recognition/runtime/image_recognition.py:
+  - key space của bucket được chia thành --partitions khoảng key (theo prefix
+    con tìm bằng Delimiter, hoặc theo ký tự đầu), các khoảng được list song song;
+  - ảnh có item Classifications với recognition_version hiện tại được bỏ qua;
+  - ảnh còn lại đi qua processImages (ghi DynamoDB theo batch) trên pool
+    --workers luồng, DetectLabels bị giới hạn --rate request/s;
+  - pha "images" chạy trước, pha "aliases" (object rỗng của ảnh trùng nội dung)
+    chạy sau để chép label mới của ảnh canonical.
+
+Tiến độ (key cuối cùng đã xử lý của mỗi khoảng) được checkpoint vào manifest
+JSON, chạy lại cùng lệnh sẽ tiếp tục từ checkpoint. Mặc định không publish SNS
+nên bên thứ ba không nhận lại kết quả; thêm --notify nếu cần.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+for path in (os.path.join(ROOT, "recognition", "runtime"), os.path.join(ROOT, "common", "python")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from shared import clients  # noqa: E402
+
+MANIFEST_VERSION = 1
+PHASES = ("images", "aliases")
+# Ký tự đầu của key dùng làm ranh giới khi bucket không có prefix con (theo thứ tự byte)
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+# Số trang list tối đa khi tìm prefix con
+DISCOVERY_PAGES = 10
+
+
+def _s3():
+    return clients.get_client("s3")
+
+
+# --- manifest ---
+def load_manifest(location):
+    """
+    Đọc manifest từ đường dẫn local hoặc s3://bucket/key, None nếu chưa có.
+    """
+    if location.startswith("s3://"):
+        bucket, _, key = location[len("s3://"):].partition("/")
+        try:
+            body = _s3().get_object(Bucket=bucket, Key=key)["Body"].read()
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(body)
+    if not os.path.exists(location):
+        return None
+    with open(location) as f:
+        return json.load(f)
+
+
+def save_manifest(location, manifest):
+    body = json.dumps(manifest, indent=1)
+    if location.startswith("s3://"):
+        bucket, _, key = location[len("s3://"):].partition("/")
+        _s3().put_object(Bucket=bucket, Key=key, Body=body.encode("utf-8"), ContentType="application/json")
+        return
+    # Ghi file tạm rồi rename để checkpoint không bị hỏng khi dừng giữa chừng
+    temporary = f"{location}.tmp"
+    with open(temporary, "w") as f:
+        f.write(body)
+    os.replace(temporary, location)
+
+
+# --- chia key space ---
+def discover_prefix(bucket, prefix, delimiter):
+    """
+    Đi xuống khi cấp hiện tại chỉ có đúng một prefix con và không có object,
+    trả về (prefix, danh sách prefix con).
+    """
+    while True:
+        children, has_objects = [], False
+        kwargs = {"Bucket": bucket, "Prefix": prefix, "Delimiter": delimiter}
+        for _ in range(DISCOVERY_PAGES):
+            response = _s3().list_objects_v2(**kwargs)
+            children.extend(entry["Prefix"] for entry in response.get("CommonPrefixes", []))
+            has_objects = has_objects or bool(response.get("Contents"))
+            if not response.get("IsTruncated"):
+                break
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+        if len(children) == 1 and not has_objects:
+            prefix = children[0]
+            continue
+        return prefix, children
+
+
+def plan_partitions(bucket, prefix, count, delimiter="/"):
+    """
+    Chia key space dưới prefix thành tối đa count khoảng (start, end]:
+    start là StartAfter (None là từ đầu), end là key lớn nhất thuộc khoảng
+    (None là đến hết). Các khoảng phủ toàn bộ key và không giao nhau.
+    """
+    prefix, children = discover_prefix(bucket, prefix, delimiter) if delimiter else (prefix, [])
+    if len(children) >= count:
+        step = len(children) / count
+        bounds = [children[int(i * step)] for i in range(1, count)]
+    else:
+        step = len(ALPHABET) / count
+        bounds = [prefix + ALPHABET[int(i * step)] for i in range(1, count)]
+    bounds = sorted(set(bounds))
+    edges = [None] + bounds + [None]
+    return prefix, [
+        {"start": start, "end": end, "after": start, "done": False,
+         "listed": 0, "recognized": 0, "skipped": 0, "failed": 0}
+        for start, end in zip(edges, edges[1:])
+    ]
+
+
+def list_partition(bucket, prefix, partition, page_size=1000):
+    """
+    Duyệt các trang object của một khoảng, bắt đầu sau checkpoint "after".
+    """
+    kwargs = {"Bucket": bucket, "Prefix": prefix, "MaxKeys": page_size}
+    if partition["after"]:
+        kwargs["StartAfter"] = partition["after"]
+    end = partition["end"]
+    while True:
+        response = _s3().list_objects_v2(**kwargs)
+        contents = response.get("Contents", [])
+        if end is not None:
+            within = [obj for obj in contents if obj["Key"] <= end]
+            if len(within) < len(contents):
+                if within:
+                    yield within
+                return
+            contents = within
+        if contents:
+            yield contents
+        if not response.get("IsTruncated"):
+            return
+        kwargs.pop("StartAfter", None)
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+
+# --- chạy ---
+class Backfill:
+    def __init__(self, recognition, args, manifest):
+        self.recognition = recognition
+        self.args = args
+        self.manifest = manifest
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.started = time.monotonic()
+        self.recognized_at_start = self._total("recognized")
+        self._listed_at_start = 0
+
+    def _total(self, field, phase=None):
+        phases = [phase] if phase else PHASES
+        return sum(p[field] for name in phases for p in self.manifest["phases"].get(name, []))
+
+    def stale(self, keys):
+        """
+        Các key chưa có item hoặc item có recognition_version khác hiện tại.
+        """
+        stored = self.recognition.getStoredItems(self.args.table, keys, projection=["image", "recognition_version"])
+        current = self.recognition.RECOGNITION_VERSION
+        return [
+            key for key in keys
+            if self.args.force or stored.get(key, {}).get("recognition_version", {}).get("S") != current
+        ]
+
+    def process_batch(self, phase, partition, contents):
+        bucket = self.args.bucket
+        wanted = [obj for obj in contents if (obj["Size"] == 0) == (phase == "aliases")]
+        keys = self.stale([obj["Key"] for obj in wanted]) if wanted else []
+        errors = set()
+        if keys:
+            objects = {(bucket, obj["Key"]): {"size": obj["Size"]} for obj in wanted}
+            errors = self.recognition.processImages([(bucket, key) for key in keys], objects, notify=self.args.notify)
+        with self.lock:
+            partition["listed"] += len(contents)
+            partition["recognized"] += len(keys) - len(errors)
+            partition["skipped"] += len(wanted) - len(keys)
+            partition["failed"] += len(errors)
+            # Chỉ tiến checkpoint khi cả batch đã xử lý xong
+            partition["after"] = contents[-1]["Key"]
+
+    def run_partition(self, phase, partition):
+        size = self.args.batch_size
+        for contents in list_partition(self.args.bucket, self.manifest["prefix"], partition):
+            for start in range(0, len(contents), size):
+                if self.stopping.is_set():
+                    return
+                self.process_batch(phase, partition, contents[start:start + size])
+                if self.args.limit and self._total("recognized") - self.recognized_at_start >= self.args.limit:
+                    self.stopping.set()
+                    return
+        with self.lock:
+            partition["done"] = True
+
+    def checkpoint(self):
+        with self.lock:
+            self.manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+            snapshot = json.loads(json.dumps(self.manifest))
+        save_manifest(self.args.manifest, snapshot)
+
+    def report(self, phase):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        with self.lock:
+            listed = self._total("listed", phase)
+            recognized = self._total("recognized")
+            skipped = self._total("skipped")
+            failed = self._total("failed")
+        rate = (recognized - self.recognized_at_start) / elapsed
+        line = (f"[{phase}] listed {listed}, recognized {recognized}, skipped {skipped}, failed {failed}, "
+                f"{rate:.1f} img/s")
+        total = self.manifest.get("total_objects")
+        listed_rate = (listed - self._listed_at_start) / elapsed
+        if total and listed_rate > 0:
+            remaining = max(total - listed, 0)
+            line += f", {min(listed / total, 1.0):.1%} of ~{total}, ETA {timedelta(seconds=int(remaining / listed_rate))}"
+        print(line, flush=True)
+
+    def run_phase(self, phase):
+        partitions = self.manifest["phases"][phase]
+        pending = [partition for partition in partitions if not partition["done"]]
+        if not pending:
+            return True
+        self.started = time.monotonic()
+        self.recognized_at_start = self._total("recognized")
+        self._listed_at_start = self._total("listed", phase)
+        print(f"Phase {phase}: {len(pending)} of {len(partitions)} partitions left.", flush=True)
+        with ThreadPoolExecutor(max_workers=self.args.partition_concurrency) as pool:
+            futures = [pool.submit(self.run_partition, phase, partition) for partition in pending]
+            last_checkpoint = time.monotonic()
+            try:
+                while not all(future.done() for future in futures):
+                    time.sleep(min(1.0, self.args.report_seconds))
+                    now = time.monotonic()
+                    if now - last_checkpoint >= self.args.checkpoint_seconds:
+                        self.checkpoint()
+                        last_checkpoint = now
+                        self.report(phase)
+            except KeyboardInterrupt:
+                print("Interrupted, finishing current pages before checkpointing...", flush=True)
+                self.stopping.set()
+            for future in futures:
+                future.result()
+        self.checkpoint()
+        self.report(phase)
+        return all(partition["done"] for partition in partitions)
+
+
+def estimate_objects(bucket):
+    """
+    Số object của bucket theo metric lưu trữ hằng ngày của CloudWatch, None nếu không có.
+    """
+    try:
+        now = datetime.now(timezone.utc)
+        response = clients.get_client("cloudwatch").get_metric_statistics(
+            Namespace="AWS/S3", MetricName="NumberOfObjects",
+            Dimensions=[{"Name": "BucketName", "Value": bucket}, {"Name": "StorageType", "Value": "AllStorageTypes"}],
+            StartTime=now - timedelta(days=3), EndTime=now, Period=86400, Statistics=["Average"],
+        )
+    except Exception as e:
+        print(f"Could not read NumberOfObjects for {bucket}: {e}")
+        return None
+    points = sorted(response.get("Datapoints", []), key=lambda point: point["Timestamp"])
+    return int(points[-1]["Average"]) if points else None
+
+
+def configure_environment(args):
+    """
+    Biến môi trường cho image_recognition, phải đặt trước khi import module.
+    """
+    os.environ["TABLE_NAME"] = args.table
+    os.environ["TOPIC_ARN"] = args.topic_arn or ""
+    os.environ["MAX_WORKERS"] = str(args.workers)
+    for name, value in (("LABEL_INDEX_TABLE", args.label_index_table), ("VERSION_TABLE", args.version_table),
+                        ("LABEL_STATS_TABLE", args.label_stats_table),
+                        ("EVENT_PAYLOAD_BUCKET", args.event_payload_bucket)):
+        if value:
+            os.environ[name] = value
+        else:
+            os.environ.pop(name, None)
+    os.environ["LABEL_INDEX_SHARDS"] = str(args.label_index_shards)
+    os.environ["TABLE_VERSION_SHARDS"] = str(args.table_version_shards)
+    if args.max_labels is not None:
+        os.environ["MAX_LABELS"] = str(args.max_labels)
+    if args.min_confidence is not None:
+        os.environ["MIN_CONFIDENCE"] = str(args.min_confidence)
+    # Không dùng lại label của ảnh gần giống (có thể được tạo bằng tham số cũ)
+    # và không đi qua ledger của Lambda
+    os.environ.pop("PHASH_TABLE", None)
+    os.environ.pop("PROCESSING_LEDGER_TABLE", None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-run image recognition over the images already in the bucket.")
+    parser.add_argument("--bucket", required=True, help="Image bucket")
+    parser.add_argument("--table", required=True, help="DynamoDB Classifications table name")
+    parser.add_argument("--label-index-table", help="DynamoDB LabelIndex table name")
+    parser.add_argument("--label-index-shards", type=int, default=4,
+                        help="label_index_shards of the deployed stack")
+    parser.add_argument("--version-table", help="DynamoDB TableVersions table name (expires list API caches)")
+    parser.add_argument("--table-version-shards", type=int, default=8,
+                        help="table_version_shards of the deployed stack")
+    parser.add_argument("--label-stats-table", help="DynamoDB LabelStats table name (keeps label statistics in sync)")
+    parser.add_argument("--topic-arn", help="Rekognized SNS topic, needed with --notify")
+    parser.add_argument("--notify", action="store_true", help="Publish results to SNS like the Lambda does")
+    parser.add_argument("--event-payload-bucket",
+                        help="EventPayloads bucket, large events are offloaded there with --notify")
+    parser.add_argument("--prefix", default="", help="Only reprocess keys under this prefix")
+    parser.add_argument("--manifest", default="backfill-manifest.json", help="Local path or s3://bucket/key")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing manifest")
+    parser.add_argument("--partitions", type=int, default=16, help="Key ranges listed in parallel")
+    parser.add_argument("--partition-concurrency", type=int, default=8, help="Key ranges processed at once")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent DetectLabels calls")
+    parser.add_argument("--rate", type=float, default=20.0, help="Max DetectLabels requests/s")
+    parser.add_argument("--batch-size", type=int, default=100, help="Images per processImages call")
+    parser.add_argument("--max-labels", type=int, help="Override MAX_LABELS")
+    parser.add_argument("--min-confidence", type=float, help="Override MIN_CONFIDENCE")
+    parser.add_argument("--force", action="store_true", help="Reprocess images that are already up to date")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after recognizing about this many images")
+    parser.add_argument("--total-objects", type=int, help="Object count for the ETA (default: CloudWatch)")
+    parser.add_argument("--checkpoint-seconds", type=float, default=10.0)
+    parser.add_argument("--report-seconds", type=float, default=10.0)
+    args = parser.parse_args(argv)
+    if args.notify and not args.topic_arn:
+        parser.error("--notify needs --topic-arn")
+
+    configure_environment(args)
+    import image_recognition
+    from shared import throttle
+    throttle.configure("DetectLabels", rate=args.rate, min_rate=min(1.0, args.rate), max_rate=args.rate)
+
+    manifest = None if args.restart else load_manifest(args.manifest)
+    if manifest is not None:
+        if (manifest.get("bucket"), manifest.get("requested_prefix")) != (args.bucket, args.prefix):
+            raise SystemExit(f"Manifest {args.manifest} belongs to another run, use --restart or another --manifest.")
+        if manifest.get("recognition_version") != image_recognition.RECOGNITION_VERSION:
+            raise SystemExit(f"Manifest {args.manifest} was written for {manifest.get('recognition_version')}, "
+                             f"current is {image_recognition.RECOGNITION_VERSION}; use --restart.")
+        print(f"Resuming from {args.manifest}.")
+    else:
+        prefix, partitions = plan_partitions(args.bucket, args.prefix, args.partitions)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "bucket": args.bucket,
+            "requested_prefix": args.prefix,
+            "prefix": prefix,
+            "recognition_version": image_recognition.RECOGNITION_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "phases": {phase: json.loads(json.dumps(partitions)) for phase in PHASES},
+        }
+        print(f"Planned {len(partitions)} partitions under {prefix!r} for {image_recognition.RECOGNITION_VERSION}.")
+    total = args.total_objects or manifest.get("total_objects") or estimate_objects(args.bucket)
+    if total:
+        manifest["total_objects"] = total
+
+    backfill = Backfill(image_recognition, args, manifest)
+    for phase in PHASES:
+        if not backfill.run_phase(phase):
+            print(f"Stopped during phase {phase}, run the same command to resume.")
+            return 1
+    print(f"Backfill finished: recognized {backfill._total('recognized')}, skipped {backfill._total('skipped')}, "
+          f"failed {backfill._total('failed')}.")
+    if backfill._total("failed"):
+        print("Failed images keep their old recognition_version; rerun with --restart to retry them.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
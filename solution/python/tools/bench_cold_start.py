@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Đo thời gian cold start của từng Lambda handler trên máy local:
+import module + lần invoke đầu tiên (event warm-up {"warmup": true},
+dựng client/session nhưng không gọi ra mạng, trừ SSM của send_email
+được bỏ qua bằng endpoint giả).
+
+    python tools/bench_cold_start.py [--runs 5] [--output results.jsonl]
+
+Mỗi lần đo chạy trong một tiến trình Python mới để mô phỏng container mới.
+Với --output, kết quả được nối thêm (JSON lines) để theo dõi theo thời gian.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+COMMON = os.path.join(ROOT, "common", "python")
+
+# (tên, thư mục runtime, module, biến môi trường)
+HANDLERS = [
+    ("get_save_image", "api/runtime", "get_save_image", {"BUCKET_NAME": "bench-bucket"}),
+    ("bulk_ingest", "api/runtime", "bulk_ingest", {"BUCKET_NAME": "bench-bucket"}),
+    ("upload_url", "api/runtime", "upload_url", {"BUCKET_NAME": "bench-bucket"}),
+    ("image_recognition", "recognition/runtime", "image_recognition", {
+        "TABLE_NAME": "bench-table",
+        "TOPIC_ARN": "arn:aws:sns:us-east-1:000000000000:bench",
+    }),
+    ("list_images", "recognition/runtime", "list_images", {"TABLE_NAME": "bench-table"}),
+    ("query_labels", "recognition/runtime", "query_labels", {"LABEL_INDEX_TABLE": "bench-index"}),
+    ("query_stats", "recognition/runtime", "query_stats", {"LABEL_STATS_TABLE": "bench-stats"}),
+    ("export_images", "recognition/runtime", "export_images", {
+        "TABLE_NAME": "bench-table", "EXPORT_BUCKET": "bench-exports",
+    }),
+    ("send_email", "integration/runtime", "send_email", {}),
+]
+
+CHILD = r"""
+import sys, time, json
+t0 = time.perf_counter()
+module = __import__(sys.argv[1])
+t1 = time.perf_counter()
+if sys.argv[1] == "send_email":
+    # Không gọi SSM thật trong benchmark
+    module._endpoint_cache.update(value="http://localhost", expires_at=float("inf"))
+module.handler({"warmup": True}, None)
+t2 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "first_invoke_ms": (t2 - t1) * 1000}))
+"""
+
+
+def run_once(runtime_dir, module, env):
+    child_env = dict(os.environ)
+    child_env.update({
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "PYTHONPATH": os.pathsep.join([os.path.join(ROOT, runtime_dir), COMMON]),
+        "PYTHONDONTWRITEBYTECODE": "1",
+        "WARM_UP_ON_INIT": "false",
+    })
+    child_env.update(env)
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, module], env=child_env, cwd=ROOT,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    total_ms = (time.perf_counter() - start) * 1000
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_ms"] = total_ms
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Lambda handler cold start locally.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--handlers", nargs="+", help="Only these handlers")
+    parser.add_argument("--output", help="Append results as JSON lines to this file")
+    args = parser.parse_args()
+
+    selected = [h for h in HANDLERS if not args.handlers or h[0] in args.handlers]
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    print(f"{'handler':<20} {'import ms':>10} {'1st invoke ms':>14} {'total ms':>9} {'process ms':>11}")
+    for name, runtime_dir, module, env in selected:
+        runs = [run_once(runtime_dir, module, env) for _ in range(args.runs)]
+        summary = {
+            key: statistics.median(run[key] for run in runs)
+            for key in ("import_ms", "first_invoke_ms", "process_ms")
+        }
+        summary["total_ms"] = summary["import_ms"] + summary["first_invoke_ms"]
+        print(f"{name:<20} {summary['import_ms']:>10.1f} {summary['first_invoke_ms']:>14.1f} "
+              f"{summary['total_ms']:>9.1f} {summary['process_ms']:>11.1f}")
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(json.dumps(dict(summary, handler=name, runs=args.runs, timestamp=timestamp,
+                                        python=platform.python_version())) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: decoder chuyên biệt list_images.decode_item so với
+list_images._deserialize_item (TypeDeserializer + chuyển Decimal).
+
+    python tools/bench_decode.py --sizes 10000 100000 1000000
+
+Item được sinh theo label_schema version 2 với số label/instance cấu hình được.
+Để bộ nhớ không tăng theo số item, benchmark lặp vòng trên --pool item mẫu.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from itertools import cycle, islice
+
+os.environ.setdefault("TABLE_NAME", "bench")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "recognition", "runtime"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common", "python"))
+import label_schema  # noqa: E402
+import list_images  # noqa: E402
+
+
+def make_item(rng, index, labels_per_item, instances_per_label):
+    labels = []
+    for n in range(labels_per_item):
+        label = {
+            "name": f"Label{rng.randrange(3000)}",
+            "confidence": round(rng.uniform(70, 100), 2),
+            "parents": [f"Parent{rng.randrange(100)}" for _ in range(rng.randrange(3))],
+            "instances": [
+                {
+                    "confidence": round(rng.uniform(70, 100), 2),
+                    "bounding_box": {f: round(rng.random(), 4) for f in ("left", "top", "width", "height")},
+                }
+                for _ in range(instances_per_label if n == 0 else 0)
+            ],
+        }
+        labels.append({k: v for k, v in label.items() if v})
+    return label_schema.to_item(f"images/{index:08d}.jpg", labels)
+
+
+def bench(decoder, items, count):
+    start = time.perf_counter()
+    for item in islice(cycle(items), count):
+        decoder(item)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Classifications item decoding.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--pool", type=int, default=10_000, help="Number of distinct generated items")
+    parser.add_argument("--labels", type=int, default=10, help="Labels per item")
+    parser.add_argument("--instances", type=int, default=3, help="Instances on the first label")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    items = [make_item(rng, i, args.labels, args.instances) for i in range(args.pool)]
+
+    # Hai decoder phải cho cùng kết quả
+    for item in items:
+        assert list_images.decode_item(item) == list_images._deserialize_item(item), item
+
+    print(f"{'items':>10} {'generic s':>10} {'fast s':>10} {'generic us/item':>16} {'fast us/item':>13} {'speedup':>8}")
+    for size in args.sizes:
+        generic = bench(list_images._deserialize_item, items, size)
+        fast = bench(list_images.decode_item, items, size)
+        print(f"{size:>10} {generic:>10.3f} {fast:>10.3f} {generic / size * 1e6:>16.2f} "
+              f"{fast / size * 1e6:>13.2f} {generic / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
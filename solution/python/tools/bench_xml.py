@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark bộ serializer XML streaming của send_email so với bản
+convert_json_to_xml cũ (ElementTree + đệ quy + tostring).
+
+    python tools/bench_xml.py [--repeat 3]
+
+Ba loại payload: wide (một dict nhiều key), deep (lồng nhau nhiều cấp)
+và large-list (nhiều label có bounding box). In thời gian và bộ nhớ đỉnh
+(tracemalloc); bản cũ báo RecursionError với payload quá sâu.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from xml.etree.ElementTree import Element, tostring
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "integration", "runtime"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common", "python"))
+import send_email  # noqa: E402
+
+
+def legacy_convert_json_to_xml(json_data):
+    """
+    Bản convert_json_to_xml trước đây, giữ lại để so sánh.
+    """
+    if not json_data:
+        return None
+    root = Element('data')
+    def create_xml_element(parent, data):
+        if isinstance(data, dict):
+            for key, value in data.items():
+                element = Element(key)
+                parent.append(element)
+                create_xml_element(element, value)
+        elif isinstance(data, list):
+            for item in data:
+                element = Element('item')
+                parent.append(element)
+                create_xml_element(element, item)
+        else:
+            parent.text = str(data)
+    create_xml_element(root, json_data)
+    return tostring(root, encoding='utf-8', method='xml')
+
+
+def streaming_total(json_data):
+    """
+    Tiêu thụ generator như requests khi gửi chunked, không giữ toàn bộ body.
+    """
+    return sum(len(chunk) for chunk in send_email.iter_json_xml(json_data))
+
+
+def wide_payload(keys):
+    return {f"key{i}": f"value {i}" for i in range(keys)}
+
+
+def deep_payload(depth):
+    root = node = {}
+    for _ in range(depth):
+        node["child"] = {"value": 1}
+        node = node["child"]
+    return root
+
+
+def large_list_payload(labels, seed=42):
+    rng = random.Random(seed)
+    return {
+        "image": "images/0001.jpg",
+        "labels": [
+            {
+                "name": f"Label{i}",
+                "confidence": round(rng.uniform(70, 100), 2),
+                "parents": [f"Parent{rng.randrange(100)}"],
+                "instances": [
+                    {
+                        "confidence": round(rng.uniform(70, 100), 2),
+                        "bounding_box": {f: round(rng.random(), 4) for f in ("left", "top", "width", "height")},
+                    }
+                    for _ in range(3)
+                ],
+            }
+            for i in range(labels)
+        ],
+    }
+
+
+def measure(fn, payload, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(payload)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON to XML serializers.")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [
+        ("wide 100k keys", wide_payload(100_000)),
+        ("deep 500", deep_payload(500)),
+        ("deep 5000", deep_payload(5_000)),
+        ("large-list 20k labels", large_list_payload(20_000)),
+    ]
+    print(f"{'payload':<24} {'impl':<10} {'best s':>8} {'peak MiB':>9}")
+    for name, payload in cases:
+        for impl, fn in (("legacy", legacy_convert_json_to_xml), ("streaming", streaming_total)):
+            try:
+                best, peak = measure(fn, payload, args.repeat)
+            except RecursionError:
+                print(f"{name:<24} {impl:<10} {'RecursionError':>18}")
+                continue
+            print(f"{name:<24} {impl:<10} {best:>8.3f} {peak / 2**20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
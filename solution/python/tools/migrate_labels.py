@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Nâng cấp các item version 1 của bảng Classifications (labels là chuỗi str(list))
+lên label_schema version 2.
+
+    python tools/migrate_labels.py --table <Classifications table name> [--dry-run]
+
+Mỗi item được ghi lại bằng put_item có điều kiện attribute_not_exists(schema_version)
+nên item vừa được image_recognition ghi ở version 2 sẽ không bị ghi đè.
+Có thể chạy lại nhiều lần một cách an toàn.
+"""
+import os
+import sys
+import argparse
+import boto3
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "recognition", "runtime"))
+import label_schema  # noqa: E402
+
+
+def scan_v1_items(dynamodb_client, table_name):
+    """
+    Duyệt các item chưa có schema_version.
+    """
+    kwargs = {
+        "TableName": table_name,
+        "FilterExpression": "attribute_not_exists(#version)",
+        "ExpressionAttributeNames": {"#version": "schema_version"},
+    }
+    while True:
+        response = dynamodb_client.scan(**kwargs)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def migrate(dynamodb_client, table_name, dry_run=False):
+    migrated = skipped = 0
+    for item in scan_v1_items(dynamodb_client, table_name):
+        if not label_schema.is_v1_item(item):
+            skipped += 1
+            continue
+        upgraded = label_schema.upgrade_item(item)
+        if dry_run:
+            print(f"Would migrate {item['image']['S']}: {upgraded['labels']}")
+            migrated += 1
+            continue
+        try:
+            dynamodb_client.put_item(
+                TableName=table_name,
+                Item=upgraded,
+                ConditionExpression="attribute_not_exists(#version)",
+                ExpressionAttributeNames={"#version": "schema_version"},
+            )
+            migrated += 1
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            skipped += 1
+    return migrated, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate Classifications items to label schema v2.")
+    parser.add_argument("--table", required=True, help="DynamoDB Classifications table name")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    parser.add_argument("--dry-run", action="store_true", help="Only print the items that would change")
+    args = parser.parse_args()
+
+    dynamodb_client = boto3.client("dynamodb", region_name=args.region)
+    migrated, skipped = migrate(dynamodb_client, args.table, dry_run=args.dry_run)
+    print(f"Migrated {migrated} items, skipped {skipped}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Dựng lại bảng LabelIndex từ bảng Classifications, ví dụ sau khi bảng chỉ mục
+được tạo lại (chuyển từ LSI sang GSI) hoặc sau khi đổi label_index_shards.
+
+    python tools/rebuild_label_index.py --table <Classifications table name> \\
+        --index-table <LabelIndex table name> [--shards 4] [--dry-run]
+
+Mọi ảnh trong Classifications được ghi lại item chỉ mục theo --shards (phải
+bằng label_index_shards đang deploy), sau đó item chỉ mục nằm sai shard hoặc
+của label ảnh không còn có bị xóa. Không gọi Rekognition; chạy lại nhiều lần
+một cách an toàn.
+"""
+import os
+import sys
+import time
+import argparse
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "recognition", "runtime"))
+import label_index  # noqa: E402
+import label_schema  # noqa: E402
+
+DDB_BATCH_SIZE = 25
+DDB_BATCH_MAX_RETRIES = 8
+
+
+def scan_items(dynamodb_client, table_name, projection=None):
+    kwargs = {"TableName": table_name}
+    if projection:
+        kwargs["ProjectionExpression"] = ", ".join(f"#p{i}" for i in range(len(projection)))
+        kwargs["ExpressionAttributeNames"] = {f"#p{i}": name for i, name in enumerate(projection)}
+    while True:
+        response = dynamodb_client.scan(**kwargs)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def write_requests(dynamodb_client, table_name, requests):
+    for start in range(0, len(requests), DDB_BATCH_SIZE):
+        request_items = {table_name: requests[start:start + DDB_BATCH_SIZE]}
+        for attempt in range(DDB_BATCH_MAX_RETRIES + 1):
+            if attempt:
+                time.sleep(min(5.0, 0.1 * 2 ** attempt))
+            request_items = dynamodb_client.batch_write_item(RequestItems=request_items).get("UnprocessedItems")
+            if not request_items:
+                break
+        else:
+            raise RuntimeError("Unprocessed items remain after retries")
+
+
+def rebuild(dynamodb_client, table_name, index_table_name, dry_run=False):
+    expected = {}
+    for item in scan_items(dynamodb_client, table_name, projection=["image", "labels", "schema_version"]):
+        for index_item in label_index.build_items(item["image"]["S"], label_schema.labels_from_item(item)):
+            expected[(index_item["label"]["S"], index_item["image"]["S"])] = index_item
+
+    stale = [
+        {"label": item["label"], "image": item["image"]}
+        for item in scan_items(dynamodb_client, index_table_name, projection=["label", "image"])
+        if (item["label"]["S"], item["image"]["S"]) not in expected
+    ]
+    if dry_run:
+        print(f"Would write {len(expected)} index items and delete {len(stale)} stale ones.")
+        return len(expected), len(stale)
+    write_requests(dynamodb_client, index_table_name, [{"PutRequest": {"Item": item}} for item in expected.values()])
+    write_requests(dynamodb_client, index_table_name, [{"DeleteRequest": {"Key": key}} for key in stale])
+    return len(expected), len(stale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the LabelIndex table from Classifications.")
+    parser.add_argument("--table", required=True, help="DynamoDB Classifications table name")
+    parser.add_argument("--index-table", required=True, help="DynamoDB LabelIndex table name")
+    parser.add_argument("--shards", type=int, default=label_index.SHARDS,
+                        help="label_index_shards of the deployed stack")
+    parser.add_argument("--region", default=os.environ.get("AWS_REGION", "us-east-1"))
+    parser.add_argument("--dry-run", action="store_true", help="Only count the items that would change")
+    args = parser.parse_args()
+
+    label_index.SHARDS = max(1, args.shards)
+    dynamodb_client = boto3.client("dynamodb", region_name=args.region)
+    written, deleted = rebuild(dynamodb_client, args.table, args.index_table, dry_run=args.dry_run)
+    print(f"Wrote {written} index items, deleted {deleted} stale ones.")
+
+
+if __name__ == "__main__":
+    main()
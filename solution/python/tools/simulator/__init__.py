@@ -0,0 +1,9 @@
+"""
+Bộ mô phỏng pipeline chạy local trong một tiến trình: các service AWS và
+HTTP giả lập trong bộ nhớ, các Lambda handler thật được nối như trong CDK.
+
+    python -m tools.simulator --images 500 --batch-size 10 --recognition-concurrency 4
+"""
+from .fake_aws import FakeCloud, Recorder
+from .fake_http import ImageOriginSession, ThirdPartyEndpointSession
+from .harness import PipelineSimulator, format_report, percentiles
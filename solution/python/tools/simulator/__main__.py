@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Chạy bộ mô phỏng và in thông lượng, percentile độ trễ theo stage, bộ nhớ.
+
+    python -m tools.simulator [--images 200] [--batch-size 10] [--output results.jsonl]
+        [--min-images-per-second N] [--max-p95-ms N]
+
+Với --output, kết quả được nối thêm (JSON lines) để theo dõi theo thời gian.
+--min-images-per-second / --max-p95-ms biến lần chạy thành kiểm tra hồi quy:
+exit code 1 nếu vi phạm ngưỡng.
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+
+from .harness import PipelineSimulator, format_report
+
+
+def _env_pair(value):
+    name, sep, setting = value.partition("=")
+    if not sep or not name:
+        raise argparse.ArgumentTypeError("expected NAME=VALUE")
+    return name, setting
+
+
+def _outage(value):
+    start, sep, duration = value.partition(":")
+    try:
+        return float(start), float(duration)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected START:SECONDS")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the image pipeline end to end against in-memory fakes.")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=10, help="SQS event source batch size")
+    parser.add_argument("--batching-window", type=float, default=0.0, help="Max batching window (seconds)")
+    parser.add_argument("--ingest-concurrency", type=int, default=8)
+    parser.add_argument("--recognition-concurrency", type=int, default=4)
+    parser.add_argument("--integration-concurrency", type=int, default=2)
+    parser.add_argument("--delivery-mode", choices=("single", "batch"), default="single")
+    parser.add_argument("--ingest-mode", choices=("lambda", "direct"), default="lambda",
+                        help="lambda: get_save_image downloads the URL; direct: client uploads with presigned URLs")
+    parser.add_argument("--image-bytes", type=int, default=200 * 1024)
+    parser.add_argument("--image-megapixels", type=float, default=0.0,
+                        help="Serve real JPEGs of this size (needs Pillow) instead of random bytes")
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Per AWS API call latency")
+    parser.add_argument("--rekognition-latency-ms", type=float, default=80.0)
+    parser.add_argument("--rekognition-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--rekognition-ms-per-mb", type=float, default=0.0,
+                        help="Extra detect_labels latency per MB of input image")
+    parser.add_argument("--origin-latency-ms", type=float, default=20.0)
+    parser.add_argument("--endpoint-latency-ms", type=float, default=30.0)
+    parser.add_argument("--endpoint-failure-rate", type=float, default=0.0)
+    parser.add_argument("--endpoint-outage", type=_outage, metavar="START:SECONDS",
+                        help="Endpoint hangs until the POST timeout from START for SECONDS (after the first POST)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of DynamoDB batch writes left unprocessed")
+    parser.add_argument("--rekognition-tps", type=float, default=0.0,
+                        help="Account TPS limit for detect_labels, excess calls are throttled (0 = unlimited)")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="Fraction of images whose source URL repeats an earlier image (same bytes, new name)")
+    parser.add_argument("--redelivery-rate", type=float, default=0.0,
+                        help="Fraction of SNS messages delivered to their queue twice (at-least-once delivery)")
+    parser.add_argument("--bulk-images", type=int, default=0,
+                        help="Images ingested through POST /bulk before the interactive ones (bulk lane)")
+    parser.add_argument("--bulk-image-bytes", type=int, default=0, help="Size of bulk images (default --image-bytes)")
+    parser.add_argument("--bulk-min-image-bytes", type=int, default=8 * 1024 * 1024,
+                        help="Images at least this large are routed to the bulk lane")
+    parser.add_argument("--bulk-concurrency", type=int, default=2, help="Event source concurrency of the bulk lane")
+    parser.add_argument("--retry-delay", type=float, default=1.0, help="Seconds before a failed message is retried")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", type=_env_pair, action="append", default=[],
+                        help="Extra Lambda environment variable NAME=VALUE (repeatable)")
+    parser.add_argument("--trace-memory", action="store_true", help="Report tracemalloc peak (slower)")
+    parser.add_argument("--verbose", action="store_true", help="Show handler output")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--output", help="Append the report as a JSON line to this file")
+    parser.add_argument("--min-images-per-second", type=float)
+    parser.add_argument("--max-p95-ms", type=float, help="Maximum end-to-end p95 latency")
+    args = parser.parse_args(argv)
+
+    simulator = PipelineSimulator(
+        images=args.images, batch_size=args.batch_size, batching_window=args.batching_window,
+        ingest_concurrency=args.ingest_concurrency, recognition_concurrency=args.recognition_concurrency,
+        integration_concurrency=args.integration_concurrency, delivery_mode=args.delivery_mode,
+        ingest_mode=args.ingest_mode,
+        image_bytes=args.image_bytes, image_megapixels=args.image_megapixels, latency_ms=args.latency_ms,
+        rekognition_latency_ms=args.rekognition_latency_ms, rekognition_ms_per_mb=args.rekognition_ms_per_mb,
+        rekognition_jitter_ms=args.rekognition_jitter_ms, origin_latency_ms=args.origin_latency_ms,
+        endpoint_latency_ms=args.endpoint_latency_ms, endpoint_failure_rate=args.endpoint_failure_rate,
+        endpoint_outage=args.endpoint_outage, throttle_rate=args.throttle_rate, rekognition_tps=args.rekognition_tps, duplicate_rate=args.duplicate_rate,
+        redelivery_rate=args.redelivery_rate, retry_delay=args.retry_delay,
+        bulk_images=args.bulk_images, bulk_image_bytes=args.bulk_image_bytes,
+        bulk_min_image_bytes=args.bulk_min_image_bytes, bulk_concurrency=args.bulk_concurrency,
+        timeout=args.timeout, seed=args.seed,
+        trace_memory=args.trace_memory, verbose=args.verbose, env=dict(args.env),
+    )
+    report = simulator.run()
+    report.update(timestamp=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), python=platform.python_version())
+
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+    failures = []
+    if not report["complete"]:
+        failures.append(f"only {report['delivered']}/{report['expected']} images delivered")
+    if args.min_images_per_second is not None and report["images_per_second"] < args.min_images_per_second:
+        failures.append(f"throughput {report['images_per_second']:.1f} < {args.min_images_per_second} images/s")
+    p95 = report["end_to_end"].get("p95")
+    if args.max_p95_ms is not None and (p95 is None or p95 > args.max_p95_ms):
+        failures.append(f"end-to-end p95 {p95} ms > {args.max_p95_ms} ms")
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
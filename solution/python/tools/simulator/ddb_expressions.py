@@ -0,0 +1,385 @@
+"""
+Bộ đánh giá tối giản cho DynamoDB expression dùng trong bộ mô phỏng:
+ConditionExpression / KeyConditionExpression / FilterExpression,
+ProjectionExpression và UpdateExpression (SET, ADD, REMOVE, DELETE).
+
+Chỉ hỗ trợ phần cú pháp mà các Lambda trong repo dùng, đủ để mô phỏng
+hành vi (không nhằm thay thế DynamoDB Local).
+"""
+import re
+from decimal import Decimal
+
+_TOKEN = re.compile(r"\s*(?:(#\w+)|(:\w+)|(<>|<=|>=|=|<|>)|([(),.\[\]+-])|(\d+)|([A-Za-z_]\w*))")
+_KEYWORDS = {"AND", "OR", "NOT", "BETWEEN", "IN", "SET", "ADD", "REMOVE", "DELETE"}
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if not match or match.end() == position:
+            raise ExpressionError(f"Cannot parse expression near: {expression[position:]!r}")
+        position = match.end()
+        name, value, comparator, punct, number, word = match.groups()
+        if name:
+            tokens.append(("name", name))
+        elif value:
+            tokens.append(("value", value))
+        elif comparator:
+            tokens.append(("cmp", comparator))
+        elif punct:
+            tokens.append(("punct", punct))
+        elif number:
+            tokens.append(("number", int(number)))
+        elif word.upper() in _KEYWORDS:
+            tokens.append(("kw", word.upper()))
+        else:
+            tokens.append(("name", word))
+    return tokens
+
+
+def to_python(value):
+    """
+    Giá trị wire format sang kiểu Python so sánh được.
+    """
+    (kind, raw), = value.items()
+    if kind == "S":
+        return raw
+    if kind == "N":
+        return Decimal(raw)
+    if kind == "B":
+        return bytes(raw)
+    if kind == "BOOL":
+        return bool(raw)
+    if kind == "NULL":
+        return None
+    if kind == "SS":
+        return frozenset(raw)
+    if kind == "NS":
+        return frozenset(Decimal(v) for v in raw)
+    if kind == "L":
+        return [to_python(v) for v in raw]
+    if kind == "M":
+        return {k: to_python(v) for k, v in raw.items()}
+    return raw
+
+
+def from_number(number):
+    text = format(number, "f") if isinstance(number, Decimal) else repr(number)
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return {"N": text}
+
+
+class _Parser:
+    def __init__(self, expression, names, values):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if (kind and token[0] != kind) or (text is not None and token[1] != text):
+            raise ExpressionError(f"Expected {text or kind}, got {token}")
+        self.position += 1
+        return token
+
+    def done(self):
+        return self.position >= len(self.tokens)
+
+    # --- path và operand ---
+    def path(self):
+        kind, text = self.take("name")
+        parts = [self.names.get(text, text) if text.startswith("#") else text]
+        while True:
+            token = self.peek()
+            if token == ("punct", "."):
+                self.take()
+                _, text = self.take("name")
+                parts.append(self.names.get(text, text) if text.startswith("#") else text)
+            elif token == ("punct", "["):
+                self.take()
+                _, index = self.take("number")
+                self.take("punct", "]")
+                parts.append(index)
+            else:
+                return tuple(parts)
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == "value":
+            self.take()
+            if text not in self.values:
+                raise ExpressionError(f"Missing expression attribute value {text}")
+            return ("value", self.values[text])
+        if kind == "name" and text in ("size", "if_not_exists", "list_append") and self.peek(1) == ("punct", "("):
+            self.take()
+            self.take("punct", "(")
+            if text == "size":
+                path = self.path()
+                self.take("punct", ")")
+                return ("size", path)
+            first = self.path() if text == "if_not_exists" else self.operand()
+            self.take("punct", ",")
+            second = self.operand()
+            self.take("punct", ")")
+            return (text, first, second)
+        return ("path", self.path())
+
+    # --- condition ---
+    def condition(self):
+        node = self.conjunction()
+        while self.peek() == ("kw", "OR"):
+            self.take()
+            node = ("or", node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.peek() == ("kw", "AND"):
+            self.take()
+            node = ("and", node, self.negation())
+        return node
+
+    def negation(self):
+        if self.peek() == ("kw", "NOT"):
+            self.take()
+            return ("not", self.negation())
+        return self.primary()
+
+    def primary(self):
+        if self.peek() == ("punct", "("):
+            self.take()
+            node = self.condition()
+            self.take("punct", ")")
+            return node
+        kind, text = self.peek()
+        if kind == "name" and text in ("attribute_exists", "attribute_not_exists", "begins_with", "contains") \
+                and self.peek(1) == ("punct", "("):
+            self.take()
+            self.take("punct", "(")
+            path = self.path()
+            if text in ("attribute_exists", "attribute_not_exists"):
+                self.take("punct", ")")
+                return (text, path)
+            self.take("punct", ",")
+            operand = self.operand()
+            self.take("punct", ")")
+            return (text, path, operand)
+        left = self.operand()
+        kind, text = self.peek()
+        if kind == "cmp":
+            self.take()
+            return ("cmp", text, left, self.operand())
+        if (kind, text) == ("kw", "BETWEEN"):
+            self.take()
+            low = self.operand()
+            self.take("kw", "AND")
+            return ("between", left, low, self.operand())
+        if (kind, text) == ("kw", "IN"):
+            self.take()
+            self.take("punct", "(")
+            options = [self.operand()]
+            while self.peek() == ("punct", ","):
+                self.take()
+                options.append(self.operand())
+            self.take("punct", ")")
+            return ("in", left, options)
+        raise ExpressionError(f"Unexpected token {self.peek()}")
+
+
+def _resolve(item, path):
+    value = {"M": item}
+    for part in path:
+        if isinstance(part, int):
+            items = value.get("L") if value else None
+            if items is None or part >= len(items):
+                return None
+            value = items[part]
+        else:
+            attributes = value.get("M") if value else None
+            if attributes is None or part not in attributes:
+                return None
+            value = attributes[part]
+    return value
+
+
+def _operand_value(item, operand):
+    kind = operand[0]
+    if kind == "value":
+        return operand[1]
+    if kind == "path":
+        return _resolve(item, operand[1])
+    if kind == "size":
+        value = _resolve(item, operand[1])
+        if value is None:
+            return None
+        (type_, raw), = value.items()
+        return {"N": str(len(raw.encode("utf-8") if type_ == "S" else raw))}
+    if kind == "if_not_exists":
+        existing = _resolve(item, operand[1])
+        return existing if existing is not None else _operand_value(item, operand[2])
+    if kind == "list_append":
+        first = _operand_value(item, operand[1]) or {"L": []}
+        second = _operand_value(item, operand[2]) or {"L": []}
+        return {"L": first["L"] + second["L"]}
+    raise ExpressionError(f"Unknown operand {operand}")
+
+
+def _compare(op, left, right):
+    if left is None or right is None:
+        return False
+    left, right = to_python(left), to_python(right)
+    try:
+        if op == "=":
+            return left == right
+        if op == "<>":
+            return left != right
+        if op == "<":
+            return left < right
+        if op == "<=":
+            return left <= right
+        if op == ">":
+            return left > right
+        if op == ">=":
+            return left >= right
+    except TypeError:
+        return False
+    raise ExpressionError(f"Unknown comparator {op}")
+
+
+def _evaluate(item, node):
+    kind = node[0]
+    if kind == "or":
+        return _evaluate(item, node[1]) or _evaluate(item, node[2])
+    if kind == "and":
+        return _evaluate(item, node[1]) and _evaluate(item, node[2])
+    if kind == "not":
+        return not _evaluate(item, node[1])
+    if kind == "attribute_exists":
+        return _resolve(item, node[1]) is not None
+    if kind == "attribute_not_exists":
+        return _resolve(item, node[1]) is None
+    if kind == "begins_with":
+        value, prefix = _resolve(item, node[1]), _operand_value(item, node[2])
+        return value is not None and "S" in value and value["S"].startswith(prefix["S"])
+    if kind == "contains":
+        value, needle = _resolve(item, node[1]), _operand_value(item, node[2])
+        if value is None:
+            return False
+        container = to_python(value)
+        needle = to_python(needle)
+        if isinstance(container, list):
+            return needle in container
+        return needle in container if isinstance(container, (str, frozenset)) else False
+    if kind == "cmp":
+        return _compare(node[1], _operand_value(item, node[2]), _operand_value(item, node[3]))
+    if kind == "between":
+        value = _operand_value(item, node[1])
+        return _compare(">=", value, _operand_value(item, node[2])) and \
+            _compare("<=", value, _operand_value(item, node[3]))
+    if kind == "in":
+        value = _operand_value(item, node[1])
+        return any(_compare("=", value, _operand_value(item, option)) for option in node[2])
+    raise ExpressionError(f"Unknown node {node}")
+
+
+def evaluate_condition(item, expression, names=None, values=None):
+    """
+    True nếu item (wire format, có thể là {} khi chưa tồn tại) thỏa expression.
+    """
+    if not expression:
+        return True
+    parser = _Parser(expression, names, values)
+    node = parser.condition()
+    if not parser.done():
+        raise ExpressionError(f"Trailing tokens in {expression!r}")
+    return _evaluate(item or {}, node)
+
+
+def project(item, expression, names=None):
+    """
+    Áp dụng ProjectionExpression (chỉ path cấp cao nhất).
+    """
+    if not expression:
+        return item
+    parser = _Parser(expression, names, None)
+    paths = [parser.path()]
+    while parser.peek() == ("punct", ","):
+        parser.take()
+        paths.append(parser.path())
+    return {path[0]: item[path[0]] for path in paths if path[0] in item}
+
+
+def _set_path(item, path, value):
+    target = item
+    for part in path[:-1]:
+        target = target.setdefault(part, {"M": {}})["M"]
+    target[path[-1]] = value
+
+
+def _remove_path(item, path):
+    target = item
+    for part in path[:-1]:
+        target = target.get(part, {}).get("M")
+        if target is None:
+            return
+    target.pop(path[-1], None)
+
+
+def _arith(op, left, right):
+    if left is None or right is None:
+        raise ExpressionError("Arithmetic on missing attribute")
+    result = to_python(left) + to_python(right) if op == "+" else to_python(left) - to_python(right)
+    return from_number(result)
+
+
+def apply_update(item, expression, names=None, values=None):
+    """
+    Áp dụng UpdateExpression lên item (wire format, sửa tại chỗ) và trả về item.
+    """
+    parser = _Parser(expression, names, values)
+    while not parser.done():
+        _, clause = parser.take("kw")
+        while True:
+            path = parser.path()
+            if clause == "SET":
+                parser.take("cmp", "=")
+                value = _operand_value(item, parser.operand())
+                if parser.peek()[0] == "punct" and parser.peek()[1] in "+-":
+                    _, op = parser.take()
+                    value = _arith(op, value, _operand_value(item, parser.operand()))
+                _set_path(item, path, value)
+            elif clause == "REMOVE":
+                _remove_path(item, path)
+            elif clause in ("ADD", "DELETE"):
+                operand = _operand_value(item, parser.operand())
+                existing = _resolve(item, path)
+                (kind, raw), = operand.items()
+                if kind == "N":
+                    if clause == "DELETE":
+                        raise ExpressionError("DELETE only supports sets")
+                    _set_path(item, path, _arith("+", existing or {"N": "0"}, operand))
+                else:
+                    current = set(existing[kind]) if existing else set()
+                    current = current | set(raw) if clause == "ADD" else current - set(raw)
+                    if current:
+                        _set_path(item, path, {kind: sorted(current)})
+                    else:
+                        _remove_path(item, path)
+            if parser.peek() == ("punct", ","):
+                parser.take()
+                continue
+            break
+    return item
@@ -0,0 +1,1187 @@
+"""
+Các service AWS giả lập trong bộ nhớ cho bộ mô phỏng pipeline.
+
+Mỗi service chỉ cài đặt những API mà các Lambda trong repo gọi, với đúng
+tên tham số và dạng response của boto3 để handler chạy không cần sửa.
+Mọi lời gọi API đi qua decorator api: giả lập độ trễ mạng và ghi thời
+gian vào Recorder theo tên "<service>.<operation>".
+"""
+import io
+import json
+import time
+import heapq
+import uuid
+import zlib
+import random
+import hashlib
+import threading
+import functools
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import quote_plus
+
+from botocore.exceptions import ClientError
+
+from . import ddb_expressions as expr
+
+REGION = "us-east-1"
+ACCOUNT_ID = "000000000000"
+# DynamoDB trả tối đa 1 MB dữ liệu mỗi trang Scan/Query
+DDB_PAGE_BYTES = 1024 * 1024
+
+
+class Recorder:
+    """
+    Gom thời gian (giây) theo tên stage, an toàn khi dùng từ nhiều luồng.
+    """
+    def __init__(self):
+        self._samples = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples.setdefault(stage, []).append(seconds)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return {stage: list(values) for stage, values in self._samples.items()}
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+
+def client_error(code, message, operation, status_code=400):
+    return ClientError({
+        "Error": {"Code": code, "Message": message},
+        "ResponseMetadata": {"HTTPStatusCode": status_code},
+    }, operation)
+
+
+def api(method):
+    """
+    Đánh dấu một API của service giả: thêm độ trễ mạng và ghi thời gian.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        started = time.perf_counter()
+        self.cloud.network_delay(self.service_name, method.__name__)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.cloud.recorder.record(f"{self.service_name}.{method.__name__}", time.perf_counter() - started)
+    return wrapper
+
+
+class FakeService:
+    service_name = None
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self.lock = threading.RLock()
+
+
+class FakeStreamingBody(io.BytesIO):
+    """
+    Tương đương botocore StreamingBody cho get_object.
+    """
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def iter_lines(self, chunk_size=1024, keepends=False):
+        for line in self.read().splitlines(keepends):
+            yield line
+
+
+class FakeS3(FakeService):
+    service_name = "s3"
+
+    def __init__(self, cloud):
+        super().__init__(cloud)
+        self.buckets = {}
+        self.uploads = {}
+        self.notifications = {}
+        self._sequencer = 0
+
+    # --- quản trị (không tính độ trễ) ---
+    def create_bucket(self, Bucket, **kwargs):
+        with self.lock:
+            self.buckets.setdefault(Bucket, {})
+        return {"Location": f"/{Bucket}"}
+
+    def add_notification(self, bucket, topic_arn, events=("ObjectCreated:",), prefix="", suffix=""):
+        """
+        Tương đương s3n.SnsDestination trong CDK: event có tên bắt đầu bằng
+        một trong events và key khớp prefix/suffix được publish lên topic.
+        """
+        with self.lock:
+            self.notifications.setdefault(bucket, []).append((topic_arn, tuple(events), prefix, suffix))
+
+    def _bucket(self, bucket, operation):
+        objects = self.buckets.get(bucket)
+        if objects is None:
+            raise client_error("NoSuchBucket", f"The specified bucket does not exist: {bucket}", operation, 404)
+        return objects
+
+    def _object(self, bucket, key, operation):
+        obj = self._bucket(bucket, operation).get(key)
+        if obj is None:
+            raise client_error("NoSuchKey", "The specified key does not exist.", operation, 404)
+        return obj
+
+    def _store(self, bucket, key, body, content_type=None, metadata=None, event_name="ObjectCreated:Put",
+               operation="PutObject"):
+        with self.lock:
+            objects = self._bucket(bucket, operation)
+            self._sequencer += 1
+            obj = {
+                "Body": bytes(body),
+                "ContentType": content_type or "binary/octet-stream",
+                "Metadata": dict(metadata or {}),
+                "ETag": '"%s"' % hashlib.md5(body).hexdigest(),
+                "LastModified": datetime.now(timezone.utc),
+                "Sequencer": "%016X" % self._sequencer,
+            }
+            objects[key] = obj
+            targets = [
+                topic_arn for topic_arn, events, prefix, suffix in self.notifications.get(bucket, [])
+                if any(event_name.startswith(event) for event in events)
+                and key.startswith(prefix) and key.endswith(suffix)
+            ]
+        for topic_arn in targets:
+            self.cloud.sns.deliver(topic_arn, json.dumps(self._event(bucket, key, obj, event_name)))
+        return obj
+
+    @staticmethod
+    def _event(bucket, key, obj, event_name):
+        return {"Records": [{
+            "eventVersion": "2.1",
+            "eventSource": "aws:s3",
+            "awsRegion": REGION,
+            "eventTime": obj["LastModified"].isoformat().replace("+00:00", "Z"),
+            "eventName": event_name,
+            "s3": {
+                "s3SchemaVersion": "1.0",
+                "bucket": {"name": bucket, "arn": f"arn:aws:s3:::{bucket}"},
+                "object": {
+                    "key": quote_plus(key, safe="/"),
+                    "size": len(obj["Body"]),
+                    "eTag": obj["ETag"].strip('"'),
+                    "sequencer": obj["Sequencer"],
+                },
+            },
+        }]}
+
+    @staticmethod
+    def _read_body(body):
+        if body is None:
+            return b""
+        if hasattr(body, "read"):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        return bytes(body)
+
+    @staticmethod
+    def _head(obj):
+        return {
+            "ContentLength": len(obj["Body"]),
+            "ContentType": obj["ContentType"],
+            "ETag": obj["ETag"],
+            "LastModified": obj["LastModified"],
+            "Metadata": dict(obj["Metadata"]),
+        }
+
+    # --- object API ---
+    @api
+    def put_object(self, Bucket, Key, Body=None, ContentType=None, Metadata=None, **kwargs):
+        obj = self._store(Bucket, Key, self._read_body(Body), ContentType, Metadata)
+        return {"ETag": obj["ETag"]}
+
+    @api
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        with self.lock:
+            obj = self._object(Bucket, Key, "GetObject")
+        body = obj["Body"]
+        if Range:
+            start, _, end = Range.replace("bytes=", "").partition("-")
+            body = body[int(start):int(end) + 1 if end else None]
+        response = self._head(obj)
+        response.update(Body=FakeStreamingBody(body), ContentLength=len(body))
+        return response
+
+    @api
+    def head_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            try:
+                obj = self._object(Bucket, Key, "HeadObject")
+            except ClientError:
+                # head_object trả 404 không kèm mã lỗi chi tiết
+                raise client_error("404", "Not Found", "HeadObject", 404)
+        return self._head(obj)
+
+    @api
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self._bucket(Bucket, "DeleteObject").pop(Key, None)
+        return {}
+
+    @api
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective="COPY", Metadata=None, ContentType=None,
+                    **kwargs):
+        if isinstance(CopySource, str):
+            source_bucket, _, source_key = CopySource.lstrip("/").partition("/")
+        else:
+            source_bucket, source_key = CopySource["Bucket"], CopySource["Key"]
+        with self.lock:
+            source = self._object(source_bucket, source_key, "CopyObject")
+        if MetadataDirective == "REPLACE":
+            metadata, content_type = Metadata, ContentType
+        else:
+            metadata, content_type = source["Metadata"], source["ContentType"]
+        obj = self._store(Bucket, Key, source["Body"], content_type, metadata,
+                          event_name="ObjectCreated:Copy", operation="CopyObject")
+        return {"CopyObjectResult": {"ETag": obj["ETag"], "LastModified": obj["LastModified"]}}
+
+    @api
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, StartAfter=None, MaxKeys=1000, **kwargs):
+        with self.lock:
+            keys = sorted(key for key in self._bucket(Bucket, "ListObjectsV2") if key.startswith(Prefix))
+            objects = self.buckets[Bucket]
+            after = ContinuationToken or StartAfter
+            if after:
+                keys = [key for key in keys if key > after]
+            page = keys[:MaxKeys]
+            contents = [{
+                "Key": key,
+                "Size": len(objects[key]["Body"]),
+                "ETag": objects[key]["ETag"],
+                "LastModified": objects[key]["LastModified"],
+            } for key in page]
+        response = {"Contents": contents, "KeyCount": len(contents), "IsTruncated": len(keys) > MaxKeys}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+    # --- multipart upload ---
+    @api
+    def create_multipart_upload(self, Bucket, Key, ContentType=None, Metadata=None, **kwargs):
+        with self.lock:
+            self._bucket(Bucket, "CreateMultipartUpload")
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {"Bucket": Bucket, "Key": Key, "ContentType": ContentType,
+                                       "Metadata": Metadata, "Parts": {}}
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def _upload(self, upload_id, operation):
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise client_error("NoSuchUpload", "The specified upload does not exist.", operation, 404)
+        return upload
+
+    @api
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body=None, **kwargs):
+        body = self._read_body(Body)
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        with self.lock:
+            self._upload(UploadId, "UploadPart")["Parts"][PartNumber] = (etag, body)
+        return {"ETag": etag}
+
+    @api
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self.lock:
+            upload = self._upload(UploadId, "CompleteMultipartUpload")
+            body = bytearray()
+            for part in MultipartUpload["Parts"]:
+                etag, data = upload["Parts"].get(part["PartNumber"], (None, None))
+                if etag != part["ETag"]:
+                    raise client_error("InvalidPart", f"Part {part['PartNumber']} not found.",
+                                       "CompleteMultipartUpload")
+                body.extend(data)
+            del self.uploads[UploadId]
+        obj = self._store(Bucket, Key, bytes(body), upload["ContentType"], upload["Metadata"],
+                          event_name="ObjectCreated:CompleteMultipartUpload",
+                          operation="CompleteMultipartUpload")
+        return {"Bucket": Bucket, "Key": Key, "ETag": obj["ETag"]}
+
+    @api
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0, MaxParts=1000, **kwargs):
+        with self.lock:
+            upload = self._upload(UploadId, "ListParts")
+            numbers = sorted(number for number in upload["Parts"] if number > PartNumberMarker)
+            page = numbers[:MaxParts]
+            parts = [{"PartNumber": number, "ETag": upload["Parts"][number][0],
+                      "Size": len(upload["Parts"][number][1])} for number in page]
+        response = {"Bucket": Bucket, "Key": Key, "UploadId": UploadId, "Parts": parts,
+                    "IsTruncated": len(numbers) > MaxParts}
+        if response["IsTruncated"]:
+            response["NextPartNumberMarker"] = page[-1]
+        return response
+
+    @api
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self.lock:
+            self._upload(UploadId, "AbortMultipartUpload")
+            del self.uploads[UploadId]
+        return {}
+
+    # --- client upload bằng URL ký sẵn ---
+    @api
+    def post_object(self, Bucket, Key, Body, ContentType=None):
+        """
+        Tương đương client gửi form tới presigned POST (event ObjectCreated:Post).
+        """
+        self._store(Bucket, Key, self._read_body(Body), ContentType, event_name="ObjectCreated:Post",
+                    operation="PostObject")
+        return {}
+
+    # --- presign (tính toán local, không gọi mạng) ---
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        params = Params or {}
+        return f"https://{params.get('Bucket')}.s3.local/{quote_plus(params.get('Key', ''), safe='/')}" \
+               f"?X-Amz-Expires={ExpiresIn}&X-Amz-Method={ClientMethod}"
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600, **kwargs):
+        fields = dict(Fields or {}, key=Key, policy="c2ltdWxhdGVk", signature="simulated")
+        return {"url": f"https://{Bucket}.s3.local/", "fields": fields}
+
+
+class FakeSNS(FakeService):
+    service_name = "sns"
+
+    def __init__(self, cloud):
+        super().__init__(cloud)
+        self.topics = {}
+
+    def create_topic(self, Name, **kwargs):
+        arn = f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:{Name}"
+        with self.lock:
+            self.topics.setdefault(arn, [])
+        return {"TopicArn": arn}
+
+    def subscribe_queue(self, topic_arn, queue_url, raw_message_delivery=True, filter_policy=None,
+                        filter_policy_scope="MessageAttributes"):
+        """
+        Tương đương sns_subs.SqsSubscription trong CDK.
+        """
+        with self.lock:
+            self.topics[topic_arn].append({
+                "queue_url": queue_url,
+                "raw": raw_message_delivery,
+                "filter_policy": filter_policy,
+                "filter_policy_scope": filter_policy_scope,
+            })
+
+    def _topic(self, topic_arn, operation):
+        subscriptions = self.topics.get(topic_arn)
+        if subscriptions is None:
+            raise client_error("NotFound", f"Topic does not exist: {topic_arn}", operation, 404)
+        return subscriptions
+
+    def deliver(self, topic_arn, message, subject=None, message_attributes=None, operation="Publish"):
+        """
+        Fan-out một message tới các queue đã subscribe (không tính độ trễ).
+        """
+        with self.lock:
+            subscriptions = list(self._topic(topic_arn, operation))
+        message_id = str(uuid.uuid4())
+        for subscription in subscriptions:
+            if not matches_filter_policy(subscription["filter_policy"], message, message_attributes,
+                                         subscription["filter_policy_scope"]):
+                continue
+            if subscription["raw"]:
+                body, attributes = message, message_attributes
+            else:
+                body = json.dumps({
+                    "Type": "Notification",
+                    "MessageId": message_id,
+                    "TopicArn": topic_arn,
+                    "Subject": subject,
+                    "Message": message,
+                    "Timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+                    "MessageAttributes": {
+                        name: {"Type": value.get("DataType"), "Value": value.get("StringValue")}
+                        for name, value in (message_attributes or {}).items()
+                    },
+                })
+                attributes = None
+            self.cloud.sqs.enqueue(subscription["queue_url"], body, attributes)
+            if self.cloud.should_redeliver():
+                self.cloud.sqs.enqueue(subscription["queue_url"], body, attributes)
+        return message_id
+
+    @api
+    def publish(self, TopicArn, Message, Subject=None, MessageAttributes=None, **kwargs):
+        return {"MessageId": self.deliver(TopicArn, Message, Subject, MessageAttributes)}
+
+    @api
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries, **kwargs):
+        if len(PublishBatchRequestEntries) > 10:
+            raise client_error("TooManyEntriesInBatchRequest", "Maximum 10 entries.", "PublishBatch")
+        successful = []
+        for entry in PublishBatchRequestEntries:
+            message_id = self.deliver(TopicArn, entry["Message"], entry.get("Subject"),
+                                      entry.get("MessageAttributes"), operation="PublishBatch")
+            successful.append({"Id": entry["Id"], "MessageId": message_id})
+        return {"Successful": successful, "Failed": []}
+
+
+def _attribute_value(value):
+    if value.get("DataType", "").startswith("Number"):
+        return float(value.get("StringValue"))
+    if value.get("DataType", "").startswith("String.Array"):
+        return json.loads(value.get("StringValue"))
+    return value.get("StringValue")
+
+
+def _match_rule(rule, value, present):
+    if isinstance(rule, dict):
+        if "exists" in rule:
+            return present == rule["exists"]
+        if not present:
+            return False
+        if "prefix" in rule:
+            return isinstance(value, str) and value.startswith(rule["prefix"])
+        if "suffix" in rule:
+            return isinstance(value, str) and value.endswith(rule["suffix"])
+        if "anything-but" in rule:
+            excluded = rule["anything-but"]
+            if isinstance(excluded, dict):
+                return not _match_rule(excluded, value, present)
+            return value not in (excluded if isinstance(excluded, list) else [excluded])
+        if "numeric" in rule:
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return False
+            conditions = rule["numeric"]
+            for index in range(0, len(conditions), 2):
+                op, bound = conditions[index], conditions[index + 1]
+                if not {"=": value == bound, "<": value < bound, "<=": value <= bound,
+                        ">": value > bound, ">=": value >= bound}[op]:
+                    return False
+            return True
+        return False
+    return present and (value == rule or (isinstance(value, list) and rule in value))
+
+
+def matches_filter_policy(policy, message, message_attributes=None, scope="MessageAttributes"):
+    """
+    Đánh giá SNS filter policy (exact, prefix, suffix, anything-but, numeric, exists, $or).
+    Với MessageBody, mảng object (ví dụ "Records" của S3 event) khớp khi một
+    phần tử khớp.
+    """
+    if not policy:
+        return True
+    if scope == "MessageBody":
+        try:
+            document = json.loads(message)
+        except ValueError:
+            return False
+
+        def _match_body(policy_node, node):
+            if isinstance(node, list):
+                return any(_match_body(policy_node, element) for element in node)
+            for name, rules in policy_node.items():
+                if name == "$or":
+                    if not any(_match_body(option, node) for option in rules):
+                        return False
+                    continue
+                present = isinstance(node, dict) and name in node
+                value = node.get(name) if present else None
+                if isinstance(rules, dict):
+                    if not _match_body(rules, value if isinstance(value, (dict, list)) else {}):
+                        return False
+                elif not any(_match_rule(rule, value, present) for rule in rules):
+                    return False
+            return True
+        return _match_body(policy, document)
+
+    attributes = {name: _attribute_value(value) for name, value in (message_attributes or {}).items()}
+    for name, rules in policy.items():
+        present = name in attributes
+        if not any(_match_rule(rule, attributes.get(name), present) for rule in rules):
+            return False
+    return True
+
+
+class _Queue:
+    def __init__(self, name, url, visibility_timeout, dead_letter_url=None, max_receive_count=None):
+        self.name = name
+        self.url = url
+        self.arn = f"arn:aws:sqs:{REGION}:{ACCOUNT_ID}:{name}"
+        self.visibility_timeout = visibility_timeout
+        self.dead_letter_url = dead_letter_url
+        self.max_receive_count = max_receive_count
+        self.messages = {}
+        self.ready = deque()
+        self.waiting = []  # heap (visible_at, seq, message_id)
+        self.receipts = {}
+        self.condition = None
+
+
+class FakeSQS(FakeService):
+    service_name = "sqs"
+
+    def __init__(self, cloud):
+        super().__init__(cloud)
+        self.queues = {}
+        self._sequence = 0
+
+    def create_queue(self, QueueName, Attributes=None, **kwargs):
+        attributes = Attributes or {}
+        url = f"https://sqs.{REGION}.amazonaws.com/{ACCOUNT_ID}/{QueueName}"
+        redrive = json.loads(attributes.get("RedrivePolicy", "{}"))
+        dead_letter_url = None
+        if redrive:
+            dead_letter_url = next(q.url for q in self.queues.values() if q.arn == redrive["deadLetterTargetArn"])
+        with self.lock:
+            if url not in self.queues:
+                queue = _Queue(QueueName, url, float(attributes.get("VisibilityTimeout", 30)),
+                               dead_letter_url, int(redrive.get("maxReceiveCount", 0)) or None)
+                queue.condition = threading.Condition(self.lock)
+                self.queues[url] = queue
+        return {"QueueUrl": url}
+
+    def queue_arn(self, queue_url):
+        return self.queues[queue_url].arn
+
+    def _queue(self, queue_url, operation):
+        queue = self.queues.get(queue_url)
+        if queue is None:
+            raise client_error("AWS.SimpleQueueService.NonExistentQueue", "The specified queue does not exist.",
+                               operation)
+        return queue
+
+    def enqueue(self, queue_url, body, message_attributes=None, delay_seconds=0):
+        """
+        Thêm message vào queue (dùng bởi SNS fan-out và send_message).
+        """
+        now = time.monotonic()
+        with self.lock:
+            queue = self._queue(queue_url, "SendMessage")
+            self._sequence += 1
+            message_id = str(uuid.uuid4())
+            queue.messages[message_id] = {
+                "MessageId": message_id,
+                "Body": body,
+                "MD5OfBody": hashlib.md5(body.encode("utf-8")).hexdigest(),
+                "MessageAttributes": dict(message_attributes or {}),
+                "SentTimestamp": int(time.time() * 1000),
+                "sent_at": now,
+                "receive_count": 0,
+                "visible_at": now + delay_seconds,
+                "receipt": None,
+            }
+            if delay_seconds:
+                heapq.heappush(queue.waiting, (now + delay_seconds, self._sequence, message_id))
+            else:
+                queue.ready.append(message_id)
+            queue.condition.notify_all()
+        return message_id
+
+    def _promote(self, queue, now):
+        while queue.waiting and queue.waiting[0][0] <= now:
+            visible_at, _, message_id = heapq.heappop(queue.waiting)
+            message = queue.messages.get(message_id)
+            # Bỏ qua entry cũ của message đã xóa hoặc đã đổi visibility
+            if message is not None and message["visible_at"] == visible_at:
+                queue.ready.append(message_id)
+
+    def _take(self, queue, max_messages, visibility_timeout):
+        now = time.monotonic()
+        self._promote(queue, now)
+        taken = []
+        while queue.ready and len(taken) < max_messages:
+            message_id = queue.ready.popleft()
+            message = queue.messages.get(message_id)
+            if message is None or message["visible_at"] > now:
+                continue
+            if queue.max_receive_count and message["receive_count"] >= queue.max_receive_count:
+                del queue.messages[message_id]
+                self.cloud.recorder.count(f"sqs.dead_lettered.{queue.name}")
+                self.enqueue(queue.dead_letter_url, message["Body"], message["MessageAttributes"])
+                continue
+            message["receive_count"] += 1
+            message["visible_at"] = now + visibility_timeout
+            if message["receipt"]:
+                queue.receipts.pop(message["receipt"], None)
+            message["receipt"] = uuid.uuid4().hex
+            queue.receipts[message["receipt"]] = message_id
+            self._sequence += 1
+            heapq.heappush(queue.waiting, (message["visible_at"], self._sequence, message_id))
+            taken.append(dict(message))
+        return taken
+
+    def receive(self, queue_url, max_messages=10, wait_seconds=0.0, visibility_timeout=None):
+        """
+        Nhận message ở dạng nội bộ (dùng bởi event source mapping giả).
+        """
+        deadline = time.monotonic() + wait_seconds
+        with self.lock:
+            queue = self._queue(queue_url, "ReceiveMessage")
+            timeout = queue.visibility_timeout if visibility_timeout is None else visibility_timeout
+            while True:
+                taken = self._take(queue, max_messages, timeout)
+                remaining = deadline - time.monotonic()
+                if taken or remaining <= 0:
+                    return taken
+                next_visible = queue.waiting[0][0] - time.monotonic() if queue.waiting else remaining
+                queue.condition.wait(max(0.0005, min(remaining, next_visible)))
+
+    def pending(self, queue_url):
+        """
+        Số message còn trong queue (kể cả đang in-flight).
+        """
+        with self.lock:
+            return len(self._queue(queue_url, "GetQueueAttributes").messages)
+
+    def release(self, queue_url, receipt_handle, delay_seconds=0.0):
+        with self.lock:
+            queue = self._queue(queue_url, "ChangeMessageVisibility")
+            message_id = queue.receipts.get(receipt_handle)
+            message = queue.messages.get(message_id)
+            if message is None:
+                raise client_error("ReceiptHandleIsInvalid", "The receipt handle is not valid.",
+                                   "ChangeMessageVisibility")
+            message["visible_at"] = time.monotonic() + delay_seconds
+            self._sequence += 1
+            heapq.heappush(queue.waiting, (message["visible_at"], self._sequence, message_id))
+            queue.condition.notify_all()
+
+    def remove(self, queue_url, receipt_handle):
+        with self.lock:
+            queue = self._queue(queue_url, "DeleteMessage")
+            message_id = queue.receipts.pop(receipt_handle, None)
+            if message_id is not None:
+                queue.messages.pop(message_id, None)
+
+    @staticmethod
+    def _api_message(message, include_attributes):
+        result = {
+            "MessageId": message["MessageId"],
+            "ReceiptHandle": message["receipt"],
+            "Body": message["Body"],
+            "MD5OfBody": message["MD5OfBody"],
+            "Attributes": {
+                "ApproximateReceiveCount": str(message["receive_count"]),
+                "SentTimestamp": str(message["SentTimestamp"]),
+            },
+        }
+        if include_attributes and message["MessageAttributes"]:
+            result["MessageAttributes"] = message["MessageAttributes"]
+        return result
+
+    @api
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, MessageAttributes=None, **kwargs):
+        message_id = self.enqueue(QueueUrl, MessageBody, MessageAttributes, DelaySeconds)
+        return {"MessageId": message_id, "MD5OfMessageBody": hashlib.md5(MessageBody.encode("utf-8")).hexdigest()}
+
+    @api
+    def send_message_batch(self, QueueUrl, Entries, **kwargs):
+        if len(Entries) > 10:
+            raise client_error("AWS.SimpleQueueService.TooManyEntriesInBatchRequest", "Maximum 10 entries.",
+                               "SendMessageBatch")
+        successful = []
+        for entry in Entries:
+            message_id = self.enqueue(QueueUrl, entry["MessageBody"], entry.get("MessageAttributes"),
+                                      entry.get("DelaySeconds", 0))
+            successful.append({"Id": entry["Id"], "MessageId": message_id})
+        return {"Successful": successful, "Failed": []}
+
+    @api
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None,
+                        MessageAttributeNames=None, **kwargs):
+        messages = self.receive(QueueUrl, MaxNumberOfMessages, WaitTimeSeconds, VisibilityTimeout)
+        return {"Messages": [self._api_message(m, bool(MessageAttributeNames)) for m in messages]}
+
+    @api
+    def delete_message(self, QueueUrl, ReceiptHandle, **kwargs):
+        self.remove(QueueUrl, ReceiptHandle)
+        return {}
+
+    @api
+    def delete_message_batch(self, QueueUrl, Entries, **kwargs):
+        if len(Entries) > 10:
+            raise client_error("AWS.SimpleQueueService.TooManyEntriesInBatchRequest", "Maximum 10 entries.",
+                               "DeleteMessageBatch")
+        for entry in Entries:
+            self.remove(QueueUrl, entry["ReceiptHandle"])
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+    @api
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout, **kwargs):
+        self.release(QueueUrl, ReceiptHandle, VisibilityTimeout)
+        return {}
+
+    @api
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None, **kwargs):
+        with self.lock:
+            queue = self._queue(QueueUrl, "GetQueueAttributes")
+            now = time.monotonic()
+            visible = sum(1 for m in queue.messages.values() if m["visible_at"] <= now)
+            return {"Attributes": {
+                "QueueArn": queue.arn,
+                "ApproximateNumberOfMessages": str(visible),
+                "ApproximateNumberOfMessagesNotVisible": str(len(queue.messages) - visible),
+            }}
+
+
+class _Table:
+    def __init__(self, name, key_schema, indexes):
+        self.name = name
+        self.key_names = [element["AttributeName"] for element in key_schema]
+        self.indexes = {
+            index["IndexName"]: [element["AttributeName"] for element in index["KeySchema"]]
+            for index in indexes
+        }
+        self.items = {}
+
+    def key_of(self, item, operation):
+        try:
+            return tuple(json.dumps(item[name], sort_keys=True) for name in self.key_names)
+        except KeyError as e:
+            raise client_error("ValidationException", f"Missing the key {e.args[0]} in the item", operation)
+
+    def key_attributes(self, item, index_name=None):
+        names = list(self.key_names)
+        for name in self.indexes.get(index_name, []):
+            if name not in names:
+                names.append(name)
+        return {name: item[name] for name in names}
+
+
+def _item_size(item):
+    return len(json.dumps(item))
+
+
+class FakeDynamoDB(FakeService):
+    service_name = "dynamodb"
+
+    def __init__(self, cloud):
+        super().__init__(cloud)
+        self.tables = {}
+
+    def create_table(self, TableName, KeySchema, LocalSecondaryIndexes=(), GlobalSecondaryIndexes=(), **kwargs):
+        with self.lock:
+            self.tables[TableName] = _Table(TableName, KeySchema,
+                                            list(LocalSecondaryIndexes) + list(GlobalSecondaryIndexes))
+        return {"TableDescription": {"TableName": TableName, "TableStatus": "ACTIVE"}}
+
+    def _table(self, name, operation):
+        table = self.tables.get(name)
+        if table is None:
+            raise client_error("ResourceNotFoundException", f"Requested resource not found: {name}", operation)
+        return table
+
+    @staticmethod
+    def _check(item, condition, names, values, operation):
+        if condition and not expr.evaluate_condition(item, condition, names, values):
+            raise client_error("ConditionalCheckFailedException", "The conditional request failed", operation)
+
+    @staticmethod
+    def _return(old, new, return_values):
+        if return_values == "ALL_OLD" and old:
+            return {"Attributes": old}
+        if return_values == "ALL_NEW":
+            return {"Attributes": new}
+        if return_values == "UPDATED_NEW":
+            return {"Attributes": {k: v for k, v in new.items() if old.get(k) != v}}
+        return {}
+
+    @api
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, ReturnValues="NONE", **kwargs):
+        with self.lock:
+            table = self._table(TableName, "PutItem")
+            key = table.key_of(Item, "PutItem")
+            old = table.items.get(key, {})
+            self._check(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, "PutItem")
+            table.items[key] = json.loads(json.dumps(Item))
+        return self._return(old, Item, ReturnValues)
+
+    @api
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        with self.lock:
+            table = self._table(TableName, "GetItem")
+            item = table.items.get(table.key_of(Key, "GetItem"))
+            item = json.loads(json.dumps(item)) if item else None
+        if item is None:
+            return {}
+        return {"Item": expr.project(item, ProjectionExpression, ExpressionAttributeNames)}
+
+    @api
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues="NONE", **kwargs):
+        with self.lock:
+            table = self._table(TableName, "DeleteItem")
+            key = table.key_of(Key, "DeleteItem")
+            old = table.items.get(key, {})
+            self._check(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                        "DeleteItem")
+            table.items.pop(key, None)
+        return self._return(old, {}, ReturnValues)
+
+    @api
+    def update_item(self, TableName, Key, UpdateExpression=None, ConditionExpression=None,
+                    ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues="NONE", **kwargs):
+        with self.lock:
+            table = self._table(TableName, "UpdateItem")
+            key = table.key_of(Key, "UpdateItem")
+            old = table.items.get(key, {})
+            self._check(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                        "UpdateItem")
+            new = json.loads(json.dumps(old or Key))
+            if UpdateExpression:
+                try:
+                    expr.apply_update(new, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+                except expr.ExpressionError as e:
+                    raise client_error("ValidationException", str(e), "UpdateItem")
+            table.items[key] = new
+        return self._return(old, new, ReturnValues)
+
+    @api
+    def batch_write_item(self, RequestItems, **kwargs):
+        requests = sum(len(entries) for entries in RequestItems.values())
+        if requests > 25:
+            raise client_error("ValidationException", "Too many items requested for the BatchWriteItem call",
+                               "BatchWriteItem")
+        unprocessed = {}
+        with self.lock:
+            for table_name, entries in RequestItems.items():
+                table = self._table(table_name, "BatchWriteItem")
+                keys = [table.key_of(entry.get("PutRequest", {}).get("Item") or entry["DeleteRequest"]["Key"],
+                                     "BatchWriteItem") for entry in entries]
+                if len(set(keys)) != len(keys):
+                    raise client_error("ValidationException", "Provided list of item keys contains duplicates",
+                                       "BatchWriteItem")
+                for key, entry in zip(keys, entries):
+                    if self.cloud.should_throttle("dynamodb.batch_write_item"):
+                        unprocessed.setdefault(table_name, []).append(entry)
+                    elif "PutRequest" in entry:
+                        table.items[key] = json.loads(json.dumps(entry["PutRequest"]["Item"]))
+                    else:
+                        table.items.pop(key, None)
+        return {"UnprocessedItems": unprocessed}
+
+    @api
+    def batch_get_item(self, RequestItems, **kwargs):
+        if sum(len(request["Keys"]) for request in RequestItems.values()) > 100:
+            raise client_error("ValidationException", "Too many items requested for the BatchGetItem call",
+                               "BatchGetItem")
+        responses = {}
+        with self.lock:
+            for table_name, request in RequestItems.items():
+                table = self._table(table_name, "BatchGetItem")
+                found = responses.setdefault(table_name, [])
+                for key in request["Keys"]:
+                    item = table.items.get(table.key_of(key, "BatchGetItem"))
+                    if item:
+                        found.append(expr.project(json.loads(json.dumps(item)),
+                                                  request.get("ProjectionExpression"),
+                                                  request.get("ExpressionAttributeNames")))
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def _page(self, table, candidates, index_name, limit, start_key, filter_expression, projection,
+              names, values, select=None):
+        """
+        Phân trang giống DynamoDB: Limit tính trên số item đã đọc (trước filter)
+        và mỗi trang tối đa DDB_PAGE_BYTES.
+        """
+        if start_key:
+            start = table.key_of(start_key, "Query")
+            positions = [i for i, item in enumerate(candidates) if table.key_of(item, "Query") == start]
+            candidates = candidates[positions[0] + 1:] if positions else candidates
+        items, scanned, size = [], 0, 0
+        last = None
+        for item in candidates:
+            if limit and scanned >= limit or size >= DDB_PAGE_BYTES:
+                break
+            scanned += 1
+            size += _item_size(item)
+            last = item
+            if expr.evaluate_condition(item, filter_expression, names, values):
+                items.append(expr.project(json.loads(json.dumps(item)), projection, names))
+        response = {"Count": len(items), "ScannedCount": scanned}
+        if select != "COUNT":
+            response["Items"] = items
+        if last is not None and scanned < len(candidates):
+            response["LastEvaluatedKey"] = table.key_attributes(last, index_name)
+        return response
+
+    @api
+    def scan(self, TableName, Limit=None, ExclusiveStartKey=None, FilterExpression=None, ProjectionExpression=None,
+             ExpressionAttributeNames=None, ExpressionAttributeValues=None, Segment=None, TotalSegments=None,
+             Select=None, IndexName=None, **kwargs):
+        with self.lock:
+            table = self._table(TableName, "Scan")
+            keys = sorted(table.items)
+            if TotalSegments:
+                keys = [key for key in keys if zlib.crc32(repr(key).encode("utf-8")) % TotalSegments == Segment]
+            candidates = [table.items[key] for key in keys]
+            return self._page(table, candidates, IndexName, Limit, ExclusiveStartKey, FilterExpression,
+                              ProjectionExpression, ExpressionAttributeNames, ExpressionAttributeValues, Select)
+
+    @api
+    def query(self, TableName, KeyConditionExpression, IndexName=None, FilterExpression=None,
+              ProjectionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+              ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, Select=None, **kwargs):
+        with self.lock:
+            table = self._table(TableName, "Query")
+            key_names = table.indexes[IndexName] if IndexName else table.key_names
+            try:
+                candidates = [
+                    item for item in table.items.values()
+                    if all(name in item for name in key_names)
+                    and expr.evaluate_condition(item, KeyConditionExpression, ExpressionAttributeNames,
+                                                ExpressionAttributeValues)
+                ]
+            except expr.ExpressionError as e:
+                raise client_error("ValidationException", str(e), "Query")
+            sort_key = key_names[1] if len(key_names) > 1 else None
+            candidates.sort(key=lambda item: (
+                expr.to_python(item[sort_key]) if sort_key else 0, table.key_of(item, "Query")),
+                reverse=not ScanIndexForward)
+            return self._page(table, candidates, IndexName, Limit, ExclusiveStartKey, FilterExpression,
+                              ProjectionExpression, ExpressionAttributeNames, ExpressionAttributeValues, Select)
+
+
+class FakeSSM(FakeService):
+    service_name = "ssm"
+
+    def __init__(self, cloud):
+        super().__init__(cloud)
+        self.parameters = {}
+
+    @api
+    def put_parameter(self, Name, Value, Type="String", Overwrite=False, **kwargs):
+        with self.lock:
+            if Name in self.parameters and not Overwrite:
+                raise client_error("ParameterAlreadyExists", f"Parameter {Name} already exists.", "PutParameter")
+            self.parameters[Name] = Value
+        return {"Version": 1}
+
+    @api
+    def get_parameter(self, Name, WithDecryption=False, **kwargs):
+        with self.lock:
+            if Name not in self.parameters:
+                raise client_error("ParameterNotFound", f"Parameter {Name} not found.", "GetParameter")
+            return {"Parameter": {"Name": Name, "Type": "String", "Value": self.parameters[Name]}}
+
+
+class FakeSecretsManager(FakeService):
+    service_name = "secretsmanager"
+
+    def __init__(self, cloud):
+        super().__init__(cloud)
+        self.secrets = {}
+
+    @api
+    def get_secret_value(self, SecretId, **kwargs):
+        with self.lock:
+            if SecretId not in self.secrets:
+                raise client_error("ResourceNotFoundException", f"Secret {SecretId} not found.", "GetSecretValue")
+            return {"ARN": SecretId, "SecretString": self.secrets[SecretId]}
+
+
+# Nhãn giả lập: (tên, parents)
+LABEL_VOCABULARY = [
+    ("Dog", ["Animal", "Pet", "Mammal"]), ("Cat", ["Animal", "Pet", "Mammal"]), ("Animal", []),
+    ("Pet", ["Animal"]), ("Mammal", ["Animal"]), ("Person", []), ("Human", []), ("Face", ["Person"]),
+    ("Car", ["Vehicle", "Transportation"]), ("Vehicle", ["Transportation"]), ("Transportation", []),
+    ("Tree", ["Plant"]), ("Plant", []), ("Flower", ["Plant"]), ("Building", ["Architecture"]),
+    ("Architecture", []), ("City", ["Urban"]), ("Urban", []), ("Sky", ["Nature"]), ("Nature", []),
+    ("Outdoors", []), ("Water", []), ("Beach", ["Shoreline", "Nature"]), ("Shoreline", ["Nature"]),
+    ("Food", []), ("Pizza", ["Food"]), ("Text", []), ("Furniture", []), ("Chair", ["Furniture"]),
+    ("Table", ["Furniture"]), ("Computer", ["Electronics"]), ("Electronics", []), ("Phone", ["Electronics"]),
+]
+# Các label có Instances (bounding box), giống Rekognition
+INSTANCE_LABELS = {"Dog", "Cat", "Person", "Human", "Car", "Chair", "Table", "Computer", "Phone", "Flower"}
+
+
+class FakeRekognition(FakeService):
+    service_name = "rekognition"
+
+    # Giới hạn của Rekognition cho ảnh gửi trực tiếp và ảnh trong S3
+    MAX_BYTES_INLINE = 5 * 1024 * 1024
+    MAX_BYTES_S3 = 15 * 1024 * 1024
+
+    def _image_bytes(self, image):
+        if "Bytes" in image:
+            data = bytes(image["Bytes"])
+            if len(data) > self.MAX_BYTES_INLINE:
+                raise client_error("ImageTooLargeException", "Image size is too large.", "DetectLabels")
+            return data
+        s3_object = image.get("S3Object") or {}
+        try:
+            with self.cloud.s3.lock:
+                data = self.cloud.s3._object(s3_object.get("Bucket"), s3_object.get("Name"), "DetectLabels")["Body"]
+        except ClientError:
+            raise client_error("InvalidS3ObjectException", "Unable to get object metadata from S3.", "DetectLabels")
+        if len(data) > self.MAX_BYTES_S3:
+            raise client_error("ImageTooLargeException", "Image size is too large.", "DetectLabels")
+        return data
+
+    @staticmethod
+    def fake_labels(data, max_labels=10, min_confidence=70):
+        """
+        Label tất định theo nội dung ảnh: cùng bytes luôn cho cùng kết quả.
+        """
+        rng = random.Random(hashlib.sha256(data).digest())
+        count = min(max_labels, rng.randint(3, 12))
+        labels = []
+        for name, parents in rng.sample(LABEL_VOCABULARY, count):
+            label = {
+                "Name": name,
+                "Confidence": rng.uniform(min_confidence, 99.99),
+                "Instances": [],
+                "Parents": [{"Name": parent} for parent in parents],
+            }
+            if name in INSTANCE_LABELS:
+                for _ in range(rng.randint(1, 3)):
+                    left, top = rng.uniform(0, 0.7), rng.uniform(0, 0.7)
+                    label["Instances"].append({
+                        "BoundingBox": {"Left": left, "Top": top,
+                                        "Width": rng.uniform(0.05, 1 - left), "Height": rng.uniform(0.05, 1 - top)},
+                        "Confidence": rng.uniform(min_confidence, 99.99),
+                    })
+            labels.append(label)
+        labels.sort(key=lambda label: label["Confidence"], reverse=True)
+        return labels
+
+    @api
+    def detect_labels(self, Image, MaxLabels=None, MinConfidence=55, **kwargs):
+        self.cloud.rate_limit("rekognition.detect_labels", "DetectLabels")
+        data = self._image_bytes(Image)
+        self.cloud.inference_delay(len(data))
+        return {"Labels": self.fake_labels(data, MaxLabels or 1000, MinConfidence), "LabelModelVersion": "3.0"}
+
+
+class FakeLambda(FakeService):
+    service_name = "lambda"
+
+    def __init__(self, cloud):
+        super().__init__(cloud)
+        self.functions = {}
+        self.invocations = []
+
+    def register(self, name, function):
+        self.functions[name] = function
+
+    @api
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload=b"{}", **kwargs):
+        payload = json.loads(Payload or b"{}")
+        with self.lock:
+            self.invocations.append((FunctionName, InvocationType, payload))
+        function = self.functions.get(FunctionName)
+        if InvocationType == "Event":
+            if function is not None:
+                threading.Thread(target=function.invoke, args=(payload,), daemon=True).start()
+            return {"StatusCode": 202}
+        result = function.invoke(payload) if function is not None else None
+        return {"StatusCode": 200, "Payload": FakeStreamingBody(json.dumps(result).encode("utf-8"))}
+
+
+class FakeCloud:
+    """
+    Tập hợp các service giả dùng chung state, cùng mô hình độ trễ.
+
+    latency_ms / jitter_ms: độ trễ mạng mỗi lời gọi API.
+    rekognition_latency_ms / rekognition_jitter_ms: thời gian suy luận của detect_labels.
+    rekognition_ms_per_mb: thời gian thêm theo kích thước ảnh đầu vào (đọc và giải mã).
+    throttle_rate: tỉ lệ request batch_write_item bị trả về UnprocessedItems.
+    rekognition_tps: giới hạn TPS của tài khoản cho detect_labels (0 là không giới hạn),
+        vượt quá trả về ThrottlingException.
+    redelivery_rate: tỉ lệ message SNS được gửi tới queue hai lần (at-least-once delivery).
+    """
+    def __init__(self, latency_ms=2.0, jitter_ms=1.0, rekognition_latency_ms=80.0, rekognition_jitter_ms=20.0,
+                 rekognition_ms_per_mb=0.0, throttle_rate=0.0, rekognition_tps=0.0, redelivery_rate=0.0,
+                 seed=0, recorder=None):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rekognition_latency = rekognition_latency_ms / 1000.0
+        self.rekognition_jitter = rekognition_jitter_ms / 1000.0
+        self.rekognition_per_byte = rekognition_ms_per_mb / 1000.0 / (1024 * 1024)
+        self.throttle_rate = throttle_rate
+        self.rekognition_tps = rekognition_tps
+        self.redelivery_rate = redelivery_rate
+        self._tokens = rekognition_tps
+        self._tokens_at = time.monotonic()
+        self._tokens_lock = threading.Lock()
+        self.recorder = recorder or Recorder()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.s3 = FakeS3(self)
+        self.sns = FakeSNS(self)
+        self.sqs = FakeSQS(self)
+        self.dynamodb = FakeDynamoDB(self)
+        self.ssm = FakeSSM(self)
+        self.secretsmanager = FakeSecretsManager(self)
+        self.rekognition = FakeRekognition(self)
+        self.lambda_ = FakeLambda(self)
+        self._services = {
+            "s3": self.s3, "sns": self.sns, "sqs": self.sqs, "dynamodb": self.dynamodb,
+            "ssm": self.ssm, "secretsmanager": self.secretsmanager, "rekognition": self.rekognition,
+            "lambda": self.lambda_,
+        }
+
+    def client(self, service_name, max_pool_connections=None):
+        """
+        Factory cho shared.clients.set_client_factory.
+        """
+        try:
+            return self._services[service_name]
+        except KeyError:
+            raise ValueError(f"Service {service_name} is not simulated")
+
+    def _uniform(self, low, high):
+        with self._random_lock:
+            return self._random.uniform(low, high)
+
+    def network_delay(self, service_name, operation):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self._uniform(-self.jitter, self.jitter)))
+
+    def inference_delay(self, image_bytes=0):
+        delay = self.rekognition_latency + image_bytes * self.rekognition_per_byte
+        if delay or self.rekognition_jitter:
+            time.sleep(max(0.0, delay + self._uniform(-self.rekognition_jitter, self.rekognition_jitter)))
+
+    def rate_limit(self, operation, api_name):
+        """
+        Token bucket phía service (burst một giây), raise ThrottlingException khi hết token.
+        """
+        if not self.rekognition_tps:
+            return
+        with self._tokens_lock:
+            now = time.monotonic()
+            self._tokens = min(self.rekognition_tps, self._tokens + (now - self._tokens_at) * self.rekognition_tps)
+            self._tokens_at = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return
+        self.recorder.count(f"{operation}.throttled")
+        raise client_error("ThrottlingException", "Rate exceeded", api_name)
+
+    def should_redeliver(self):
+        if not self.redelivery_rate:
+            return False
+        redeliver = self._uniform(0, 1) < self.redelivery_rate
+        if redeliver:
+            self.recorder.count("sns.redelivered")
+        return redeliver
+
+    def should_throttle(self, operation):
+        if not self.throttle_rate:
+            return False
+        throttled = self._uniform(0, 1) < self.throttle_rate
+        if throttled:
+            self.recorder.count(f"{operation}.throttled")
+        return throttled
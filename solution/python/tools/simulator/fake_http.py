@@ -0,0 +1,182 @@
+"""
+HTTP giả lập cho bộ mô phỏng: nguồn ảnh (được get_save_image tải về) và
+endpoint của bên thứ ba (nhận XML từ send_email).
+
+Cả hai thay cho requests.Session của module runtime, chỉ cài đặt phần
+API mà handler dùng (get/post/mount, response dạng stream).
+"""
+import re
+import html
+import time
+import random
+import hashlib
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Header JPEG để content sniffing (nếu có) nhận ra là ảnh
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+
+
+class FakeResponse:
+    def __init__(self, url, status_code=200, body=b"", headers=None, chunk_delay=0.0):
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+        self._body = body
+        self._chunk_delay = chunk_delay
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    @property
+    def content(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self._body), chunk_size):
+            if self._chunk_delay:
+                time.sleep(self._chunk_delay)
+            yield self._body[start:start + chunk_size]
+
+
+class _SessionBase:
+    def mount(self, prefix, adapter):
+        pass
+
+    def close(self):
+        pass
+
+
+class ImageOriginSession(_SessionBase):
+    """
+    Nguồn ảnh giả: nội dung tất định theo path của URL, kích thước quanh
+    image_bytes (±size_jitter), độ trễ first byte latency_ms và băng thông
+    bandwidth_mbps. URL có path bắt đầu bằng /missing/ trả về 404, path bắt
+    đầu bằng /bulk/ có kích thước quanh bulk_image_bytes (nếu có).
+
+    Với image_megapixels > 0, nguồn trả về JPEG thật (cần Pillow) để đo bước
+    tiền xử lý; JPEG_VARIANTS ảnh được dựng sẵn một lần rồi dùng lại.
+    """
+    JPEG_VARIANTS = 8
+
+    def __init__(self, image_bytes=200 * 1024, size_jitter=0.25, latency_ms=20.0, bandwidth_mbps=0.0,
+                 content_type="image/jpeg", image_megapixels=0.0, bulk_image_bytes=0, recorder=None):
+        self.image_bytes = image_bytes
+        self.bulk_image_bytes = bulk_image_bytes or image_bytes
+        self.size_jitter = size_jitter
+        self.latency = latency_ms / 1000.0
+        self.bandwidth = bandwidth_mbps * 1024 * 1024 / 8
+        self.content_type = content_type
+        self.recorder = recorder
+        self._jpegs = self._render_jpegs(image_megapixels) if image_megapixels else None
+
+    def _render_jpegs(self, megapixels):
+        import io
+        from PIL import Image
+        width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+        height = int(width * 3 / 4)
+        variants = []
+        for variant in range(self.JPEG_VARIANTS):
+            rng = random.Random(variant)
+            # Ảnh nhiễu thu nhỏ rồi phóng to: vừa nén được vừa không đồng màu
+            noise = Image.frombytes("RGB", (64, 48), rng.randbytes(64 * 48 * 3))
+            buffer = io.BytesIO()
+            noise.resize((width, height), Image.BICUBIC).save(buffer, format="JPEG", quality=90)
+            variants.append(buffer.getvalue())
+        return variants
+
+    def body_for(self, url):
+        path = urlsplit(url).path
+        rng = random.Random(hashlib.sha256(path.encode("utf-8")).digest())
+        if self._jpegs:
+            return self._jpegs[rng.randrange(len(self._jpegs))]
+        image_bytes = self.bulk_image_bytes if path.startswith("/bulk/") else self.image_bytes
+        size = max(len(JPEG_HEADER), int(image_bytes * rng.uniform(1 - self.size_jitter, 1 + self.size_jitter)))
+        return JPEG_HEADER + rng.randbytes(size - len(JPEG_HEADER))
+
+    def get(self, url, stream=False, timeout=None, **kwargs):
+        started = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        if urlsplit(url).path.startswith("/missing/"):
+            response = FakeResponse(url, 404, b"not found", {"Content-Type": "text/plain"})
+        else:
+            body = self.body_for(url)
+            chunk_delay = 64 * 1024 / self.bandwidth if self.bandwidth else 0.0
+            response = FakeResponse(url, 200, body, {
+                "Content-Type": self.content_type,
+                "Content-Length": str(len(body)),
+            }, chunk_delay)
+        if self.recorder is not None:
+            self.recorder.record("http.origin_get", time.perf_counter() - started)
+        return response
+
+
+class ThirdPartyEndpointSession(_SessionBase):
+    """
+    Endpoint nhận XML: đọc hết body (bytes hoặc generator chunked), ghi lại
+    thời điểm nhận của từng ảnh (theo thẻ <image>) và trả 200, hoặc 503 với
+    xác suất failure_rate.
+    outage=(start, duration): từ giây start (tính từ POST đầu tiên) trong
+    duration giây, mọi POST treo đến hết timeout rồi raise ReadTimeout.
+    """
+    IMAGE_TAG = re.compile(rb"<image>(.*?)</image>")
+
+    def __init__(self, latency_ms=30.0, failure_rate=0.0, outage=None, seed=0, recorder=None, on_delivered=None):
+        self.latency = latency_ms / 1000.0
+        self.failure_rate = failure_rate
+        self.outage = outage
+        self.timeouts = 0
+        self._first_post = None
+        self.recorder = recorder
+        self.on_delivered = on_delivered
+        self.requests = 0
+        self.bytes_received = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _in_outage(self, now):
+        if not self.outage:
+            return False
+        with self._lock:
+            if self._first_post is None:
+                self._first_post = now
+        start, duration = self.outage
+        return start <= now - self._first_post < start + duration
+
+    def post(self, url, data=None, headers=None, timeout=None, **kwargs):
+        started = time.perf_counter()
+        body = data if isinstance(data, (bytes, bytearray)) else b"".join(data or [])
+        if self._in_outage(started):
+            time.sleep(timeout or 0.0)
+            with self._lock:
+                self.timeouts += 1
+            if self.recorder is not None:
+                self.recorder.record("http.endpoint_post", time.perf_counter() - started)
+            raise requests.exceptions.ReadTimeout(f"Read timed out. (read timeout={timeout})")
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += len(body)
+            failed = self.failure_rate and self._random.random() < self.failure_rate
+        if self.recorder is not None:
+            self.recorder.record("http.endpoint_post", time.perf_counter() - started)
+        if failed:
+            return FakeResponse(url, 503, b"unavailable")
+        if self.on_delivered is not None:
+            self.on_delivered([html.unescape(image.decode("utf-8")) for image in self.IMAGE_TAG.findall(body)])
+        return FakeResponse(url, 200, b"ok")
@@ -0,0 +1,585 @@
+"""
+Nối các handler thật với các service giả theo đúng cách các stack CDK nối:
+
+    get_save_image -> S3 -> SNS (upload) -> SQS -> image_recognition
+        -> DynamoDB + SNS (rekognized) -> SQS -> send_email -> HTTP endpoint
+
+S3 event của ảnh bulk (bulk_ingest, key bắt đầu bằng BULK_KEY_PREFIX) hoặc ảnh
+lớn được filter policy chuyển sang queue lane bulk với event source riêng.
+
+và list_images đọc lại bảng Classifications sau khi pipeline chạy xong.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import uuid
+import importlib
+import threading
+import contextlib
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from .fake_aws import FakeCloud, Recorder, REGION, ACCOUNT_ID
+from .fake_http import ImageOriginSession, ThirdPartyEndpointSession
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+RUNTIME_PATHS = [
+    os.path.join(ROOT, "common", "python"),
+    os.path.join(ROOT, "api", "runtime"),
+    os.path.join(ROOT, "recognition", "runtime"),
+    os.path.join(ROOT, "integration", "runtime"),
+]
+
+# Tên tài nguyên giả, tương ứng với các construct trong các stack
+IMAGE_BUCKET = "sim-images"
+DERIVATIVE_BUCKET = "sim-image-derivatives"
+EVENT_PAYLOAD_BUCKET = "sim-event-payloads"
+UPLOAD_TOPIC = "uploaded_image_topic"
+UPLOAD_QUEUE = "uploaded_image_queue"
+UPLOAD_BULK_QUEUE = "uploaded_image_bulk_queue"
+BULK_KEY_PREFIX = "bulk/"
+BULK_REQUEST_ITEMS = 25
+REKOGNIZED_TOPIC = "rekognized_image_topic"
+REKOGNIZED_QUEUE = "rekognized_image_queue"
+CLASSIFICATIONS_TABLE = "Classifications"
+LABEL_INDEX_TABLE = "LabelIndex"
+CONTENT_INDEX_TABLE = "ContentIndex"
+PHASH_TABLE = "PerceptualHashes"
+PROCESSING_LEDGER_TABLE = "ProcessingLedger"
+DELIVERY_LEDGER_TABLE = "DeliveryLedger"
+VERSION_TABLE = "TableVersions"
+LABEL_STATS_TABLE = "LabelStats"
+ENDPOINT_PARAMETER = "thirdparty_endpoint"
+ENDPOINT_URL = "https://thirdparty.local/ingest"
+UPLOAD_TOKEN_SECRET = "arn:aws:secretsmanager:us-east-1:000000000000:secret:UploadTokenSecret"
+
+
+def percentiles(values):
+    """
+    p50/p95/p99/max/mean (ms) theo nearest-rank trên list giây.
+    """
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))] * 1000
+    return {
+        "count": len(ordered),
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "max": ordered[-1] * 1000,
+        "mean": sum(ordered) / len(ordered) * 1000,
+    }
+
+
+class FakeContext:
+    """
+    Tương đương LambdaContext, đủ cho các handler trong repo.
+    """
+    def __init__(self, function_name, timeout_seconds, memory_mb=128):
+        self.function_name = function_name
+        self.function_version = "$LATEST"
+        self.invoked_function_arn = f"arn:aws:lambda:{REGION}:{ACCOUNT_ID}:function:{function_name}"
+        self.memory_limit_in_mb = memory_mb
+        self.aws_request_id = str(uuid.uuid4())
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+class LambdaFunction:
+    def __init__(self, name, handler, recorder, timeout_seconds=30, memory_mb=128):
+        self.name = name
+        self.handler = handler
+        self.recorder = recorder
+        self.timeout_seconds = timeout_seconds
+        self.memory_mb = memory_mb
+
+    def invoke(self, event):
+        started = time.perf_counter()
+        try:
+            return self.handler(event, FakeContext(self.name, self.timeout_seconds, self.memory_mb))
+        except Exception:
+            self.recorder.count(f"lambda.{self.name}.errors")
+            raise
+        finally:
+            self.recorder.record(f"lambda.{self.name}", time.perf_counter() - started)
+
+
+class SqsEventSource:
+    """
+    Tương đương SqsEventSource(report_batch_item_failures=True): các poller
+    gom tối đa batch_size message (chờ tối đa batching_window giây), invoke
+    function, xóa message thành công và trả message lỗi về queue sau retry_delay
+    (thay cho việc chờ hết visibility timeout).
+    """
+    def __init__(self, cloud, queue_url, function, batch_size=10, batching_window=0.0, concurrency=2,
+                 retry_delay=1.0):
+        self.cloud = cloud
+        self.queue_url = queue_url
+        self.queue_arn = cloud.sqs.queue_arn(queue_url)
+        self.function = function
+        self.batch_size = batch_size
+        self.batching_window = batching_window
+        self.concurrency = concurrency
+        self.retry_delay = retry_delay
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._poll, name=f"esm-{self.function.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _record(self, message):
+        return {
+            "messageId": message["MessageId"],
+            "receiptHandle": message["receipt"],
+            "body": message["Body"],
+            "attributes": {
+                "ApproximateReceiveCount": str(message["receive_count"]),
+                "SentTimestamp": str(message["SentTimestamp"]),
+                "SenderId": ACCOUNT_ID,
+                "ApproximateFirstReceiveTimestamp": str(message["SentTimestamp"]),
+            },
+            "messageAttributes": {
+                name: {"stringValue": value.get("StringValue"), "dataType": value.get("DataType")}
+                for name, value in message["MessageAttributes"].items()
+            },
+            "md5OfBody": message["MD5OfBody"],
+            "eventSource": "aws:sqs",
+            "eventSourceARN": self.queue_arn,
+            "awsRegion": REGION,
+        }
+
+    def _collect(self):
+        messages = self.cloud.sqs.receive(self.queue_url, self.batch_size, wait_seconds=0.05)
+        if not messages or not self.batching_window:
+            return messages
+        deadline = time.monotonic() + self.batching_window
+        while len(messages) < self.batch_size and not self._stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            messages.extend(self.cloud.sqs.receive(self.queue_url, self.batch_size - len(messages),
+                                                   wait_seconds=min(remaining, 0.05)))
+        return messages
+
+    def _poll(self):
+        name = self.function.name
+        while not self._stopping.is_set():
+            messages = self._collect()
+            if not messages:
+                continue
+            now = time.monotonic()
+            for message in messages:
+                if message["receive_count"] == 1:
+                    self.cloud.recorder.record(f"queue.{name}.wait", now - message["sent_at"])
+                else:
+                    self.cloud.recorder.count(f"esm.{name}.retries")
+            self.cloud.recorder.count(f"esm.{name}.batches")
+            self.cloud.recorder.count(f"esm.{name}.messages", len(messages))
+            try:
+                response = self.function.invoke({"Records": [self._record(m) for m in messages]})
+                failed = {item["itemIdentifier"] for item in (response or {}).get("batchItemFailures", [])}
+            except Exception:
+                failed = {message["MessageId"] for message in messages}
+            for message in messages:
+                if message["MessageId"] in failed:
+                    try:
+                        self.cloud.sqs.release(self.queue_url, message["receipt"], self.retry_delay)
+                    except Exception:
+                        pass  # Handler đã tự xóa message
+                else:
+                    self.cloud.sqs.remove(self.queue_url, message["receipt"])
+
+
+class PipelineSimulator:
+    """
+    Chạy pipeline end-to-end trong một tiến trình với cấu hình cho trước.
+    Mỗi tiến trình chỉ nên chạy một PipelineSimulator vì các module runtime
+    đọc biến môi trường và giữ state ở mức module.
+    """
+    def __init__(self, images=200, batch_size=10, batching_window=0.0, ingest_concurrency=8,
+                 recognition_concurrency=4, integration_concurrency=2, delivery_mode="single", ingest_mode="lambda",
+                 image_bytes=200 * 1024, image_megapixels=0.0, latency_ms=2.0, rekognition_latency_ms=80.0, rekognition_jitter_ms=20.0,
+                 rekognition_ms_per_mb=0.0,
+                 origin_latency_ms=20.0, endpoint_latency_ms=30.0, endpoint_failure_rate=0.0, endpoint_outage=None,
+                 throttle_rate=0.0,
+                 rekognition_tps=0.0, duplicate_rate=0.0, redelivery_rate=0.0, retry_delay=1.0,
+                 bulk_images=0, bulk_image_bytes=0, bulk_min_image_bytes=8 * 1024 * 1024, bulk_concurrency=2,
+                 timeout=300.0, seed=0, trace_memory=False, verbose=False, env=None):
+        self.config = {
+            "images": images, "batch_size": batch_size, "batching_window": batching_window,
+            "ingest_concurrency": ingest_concurrency, "recognition_concurrency": recognition_concurrency,
+            "integration_concurrency": integration_concurrency, "delivery_mode": delivery_mode,
+            "ingest_mode": ingest_mode,
+            "image_bytes": image_bytes, "image_megapixels": image_megapixels, "latency_ms": latency_ms, "rekognition_latency_ms": rekognition_latency_ms,
+            "rekognition_jitter_ms": rekognition_jitter_ms, "rekognition_ms_per_mb": rekognition_ms_per_mb,
+            "origin_latency_ms": origin_latency_ms,
+            "endpoint_latency_ms": endpoint_latency_ms, "endpoint_failure_rate": endpoint_failure_rate,
+            "endpoint_outage": list(endpoint_outage) if endpoint_outage else None,
+            "throttle_rate": throttle_rate, "rekognition_tps": rekognition_tps, "duplicate_rate": duplicate_rate,
+            "redelivery_rate": redelivery_rate, "retry_delay": retry_delay,
+            "bulk_images": bulk_images, "bulk_image_bytes": bulk_image_bytes,
+            "bulk_min_image_bytes": bulk_min_image_bytes, "bulk_concurrency": bulk_concurrency,
+            "seed": seed, "env": dict(env or {}),
+        }
+        self.timeout = timeout
+        self.trace_memory = trace_memory
+        self.verbose = verbose
+        self.recorder = Recorder()
+        self.cloud = FakeCloud(latency_ms=latency_ms, rekognition_latency_ms=rekognition_latency_ms,
+                               rekognition_jitter_ms=rekognition_jitter_ms, rekognition_ms_per_mb=rekognition_ms_per_mb,
+                               throttle_rate=throttle_rate, rekognition_tps=rekognition_tps,
+                               redelivery_rate=redelivery_rate, seed=seed,
+                               recorder=self.recorder)
+        self.origin = ImageOriginSession(image_bytes=image_bytes, latency_ms=origin_latency_ms,
+                                         image_megapixels=image_megapixels, bulk_image_bytes=bulk_image_bytes,
+                                         recorder=self.recorder)
+        self.endpoint = ThirdPartyEndpointSession(latency_ms=endpoint_latency_ms, failure_rate=endpoint_failure_rate,
+                                                  outage=endpoint_outage, seed=seed, recorder=self.recorder, on_delivered=self._delivered)
+        self.functions = {}
+        self.modules = {}
+        self._started = {}
+        self._delivered_at = {}
+        self._expected = set()
+        self._done = threading.Condition()
+
+    # --- dựng tài nguyên ---
+    def _create_resources(self):
+        cloud = self.cloud
+        cloud.s3.create_bucket(Bucket=IMAGE_BUCKET)
+        cloud.s3.create_bucket(Bucket=DERIVATIVE_BUCKET)
+        cloud.s3.create_bucket(Bucket=EVENT_PAYLOAD_BUCKET)
+        upload_topic = cloud.sns.create_topic(Name=UPLOAD_TOPIC)["TopicArn"]
+        rekognized_topic = cloud.sns.create_topic(Name=REKOGNIZED_TOPIC)["TopicArn"]
+        upload_queue = cloud.sqs.create_queue(QueueName=UPLOAD_QUEUE,
+                                              Attributes={"VisibilityTimeout": "60"})["QueueUrl"]
+        rekognized_queue = cloud.sqs.create_queue(QueueName=REKOGNIZED_QUEUE,
+                                                  Attributes={"VisibilityTimeout": "60"})["QueueUrl"]
+        bulk_queue = cloud.sqs.create_queue(QueueName=UPLOAD_BULK_QUEUE,
+                                            Attributes={"VisibilityTimeout": "360"})["QueueUrl"]
+        # Filter policy theo APIStack
+        bulk_min_image_bytes = self.config["bulk_min_image_bytes"]
+        cloud.sns.subscribe_queue(upload_topic, upload_queue, raw_message_delivery=True, filter_policy_scope="MessageBody",
+                                  filter_policy={"Records": {"s3": {"object": {
+                                      "key": [{"anything-but": {"prefix": BULK_KEY_PREFIX}}],
+                                      "size": [{"numeric": ["<", bulk_min_image_bytes]}],
+                                  }}}})
+        cloud.sns.subscribe_queue(upload_topic, bulk_queue, raw_message_delivery=True, filter_policy_scope="MessageBody",
+                                  filter_policy={"Records": {"s3": {"object": {"$or": [
+                                      {"key": [{"prefix": BULK_KEY_PREFIX}]},
+                                      {"size": [{"numeric": [">=", bulk_min_image_bytes]}]},
+                                  ]}}}})
+        cloud.sns.subscribe_queue(rekognized_topic, rekognized_queue, raw_message_delivery=True)
+        cloud.s3.add_notification(IMAGE_BUCKET, upload_topic,
+                                  events=("ObjectCreated:Put", "ObjectCreated:Post",
+                                          "ObjectCreated:CompleteMultipartUpload"))
+        cloud.dynamodb.create_table(TableName=CLASSIFICATIONS_TABLE,
+                                    KeySchema=[{"AttributeName": "image", "KeyType": "HASH"}])
+        cloud.dynamodb.create_table(
+            TableName=LABEL_INDEX_TABLE,
+            KeySchema=[{"AttributeName": "label", "KeyType": "HASH"}, {"AttributeName": "image", "KeyType": "RANGE"}],
+            GlobalSecondaryIndexes=[{"IndexName": "by_confidence", "KeySchema": [
+                {"AttributeName": "label", "KeyType": "HASH"}, {"AttributeName": "confidence", "KeyType": "RANGE"}]}],
+        )
+        cloud.dynamodb.create_table(TableName=CONTENT_INDEX_TABLE,
+                                    KeySchema=[{"AttributeName": "sha256", "KeyType": "HASH"}])
+        cloud.dynamodb.create_table(
+            TableName=PHASH_TABLE,
+            KeySchema=[{"AttributeName": "bucket", "KeyType": "HASH"}, {"AttributeName": "image", "KeyType": "RANGE"}],
+        )
+        cloud.dynamodb.create_table(
+            TableName=LABEL_STATS_TABLE,
+            KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}, {"AttributeName": "sk", "KeyType": "RANGE"}],
+        )
+        for table in (PROCESSING_LEDGER_TABLE, DELIVERY_LEDGER_TABLE, VERSION_TABLE):
+            cloud.dynamodb.create_table(TableName=table, KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}])
+        cloud.ssm.parameters[ENDPOINT_PARAMETER] = ENDPOINT_URL
+        cloud.secretsmanager.secrets[UPLOAD_TOKEN_SECRET] = "simulator-upload-token-key"
+        self.upload_queue = upload_queue
+        self.bulk_queue = bulk_queue
+        self.rekognized_queue = rekognized_queue
+        return {
+            "BUCKET_NAME": IMAGE_BUCKET,
+            "TOPIC_ARN": rekognized_topic,
+            "TABLE_NAME": CLASSIFICATIONS_TABLE,
+            "LABEL_INDEX_TABLE": LABEL_INDEX_TABLE,
+            "DEDUP_TABLE": CONTENT_INDEX_TABLE,
+            "PHASH_TABLE": PHASH_TABLE,
+            "PROCESSING_LEDGER_TABLE": PROCESSING_LEDGER_TABLE,
+            "DELIVERY_LEDGER_TABLE": DELIVERY_LEDGER_TABLE,
+            "VERSION_TABLE": VERSION_TABLE,
+            "LABEL_STATS_TABLE": LABEL_STATS_TABLE,
+            "RETRY_QUEUE_URL": rekognized_queue,
+            "DERIVATIVE_BUCKET": DERIVATIVE_BUCKET,
+            "EVENT_PAYLOAD_BUCKET": EVENT_PAYLOAD_BUCKET,
+            "THIRDPARTY_ENDPOINT_PARAMETER": ENDPOINT_PARAMETER,
+            "UPLOAD_TOKEN_SECRET_ARN": UPLOAD_TOKEN_SECRET,
+            "DELIVERY_MODE": self.config["delivery_mode"],
+            "BULK_KEY_PREFIX": BULK_KEY_PREFIX,
+            "WARM_UP_ON_INIT": "false",
+        }
+
+    def setup(self):
+        environment = self._create_resources()
+        environment.update(self.config["env"])
+        os.environ.update(environment)
+        for path in reversed(RUNTIME_PATHS):
+            if path not in sys.path:
+                sys.path.insert(0, path)
+
+        from shared import clients
+        clients.set_client_factory(self.cloud.client)
+
+        for name in ("get_save_image", "bulk_ingest", "upload_url", "image_recognition", "list_images", "send_email"):
+            self.modules[name] = importlib.import_module(name)
+        self.modules["get_save_image"]._session = self.origin
+        self.modules["send_email"]._session = self.endpoint
+        self.modules["send_email"]._endpoint_cache.update(value=None, expires_at=0.0)
+
+        # Timeout/memory theo các stack CDK
+        for name, timeout, memory in (("get_save_image", 60, 256), ("bulk_ingest", 60, 1024), ("upload_url", 10, 128),
+                                      ("image_recognition", 30, 128), ("list_images", 30, 128), ("send_email", 30, 128)):
+            self.functions[name] = LambdaFunction(name, self.modules[name].handler, self.recorder, timeout, memory)
+            self.cloud.lambda_.register(name, self.functions[name])
+        # Lane bulk dùng cùng module (cùng tiến trình nên cùng biến môi trường), timeout theo RekognitionStack
+        self.functions["image_recognition_bulk"] = LambdaFunction(
+            "image_recognition_bulk", self.modules["image_recognition"].handler, self.recorder, 120, 128)
+
+        config = self.config
+        self.event_sources = [
+            SqsEventSource(self.cloud, self.upload_queue, self.functions["image_recognition"],
+                           batch_size=config["batch_size"], batching_window=config["batching_window"],
+                           concurrency=config["recognition_concurrency"], retry_delay=config["retry_delay"]),
+            SqsEventSource(self.cloud, self.bulk_queue, self.functions["image_recognition_bulk"],
+                           batch_size=config["batch_size"], batching_window=config["batching_window"],
+                           concurrency=config["bulk_concurrency"], retry_delay=config["retry_delay"]),
+            SqsEventSource(self.cloud, self.rekognized_queue, self.functions["send_email"],
+                           batch_size=config["batch_size"], batching_window=config["batching_window"],
+                           concurrency=config["integration_concurrency"], retry_delay=config["retry_delay"]),
+        ]
+
+    # --- theo dõi tiến độ ---
+    def _delivered(self, images):
+        now = time.perf_counter()
+        with self._done:
+            for image in images:
+                self._delivered_at.setdefault(image, now)
+            if self._expected <= self._delivered_at.keys():
+                self._done.notify_all()
+
+    def source_url(self, index):
+        """
+        URL nguồn của ảnh thứ index; với xác suất duplicate_rate là URL của một
+        ảnh trước đó (cùng nội dung, khác tên) như nguồn đăng lại ảnh stock.
+        """
+        rng = random.Random(f"{self.config['seed']}:{index}")
+        source = index
+        if index and rng.random() < self.config["duplicate_rate"]:
+            source = rng.randrange(index)
+        return f"https://images.local/photos/{source:06d}.jpg"
+
+    def _upload_direct(self, name, url):
+        """
+        Client đã có bytes: xin URL ký sẵn qua upload_url rồi upload thẳng lên S3.
+        """
+        body = self.origin.body_for(url)
+        content_type = self.origin.content_type
+        response = self.functions["upload_url"].invoke({"resource": "/uploads", "body": json.dumps(
+            {"name": name, "content_type": content_type, "size": len(body)})})
+        if response.get("statusCode") != 200:
+            return response
+        upload = json.loads(response["body"])
+        if upload["method"] == "POST":
+            self.cloud.s3.post_object(Bucket=IMAGE_BUCKET, Key=name, Body=body, ContentType=content_type)
+            return response
+        parts = []
+        for part in upload["parts"]:
+            start = (part["part_number"] - 1) * upload["part_size"]
+            etag = self.cloud.s3.upload_part(Bucket=IMAGE_BUCKET, Key=name, UploadId=upload["upload_id"],
+                                             PartNumber=part["part_number"],
+                                             Body=body[start:start + part["size"]])["ETag"]
+            parts.append({"part_number": part["part_number"], "etag": etag})
+        return self.functions["upload_url"].invoke({"resource": "/uploads/complete", "body": json.dumps(
+            {"name": name, "upload_id": upload["upload_id"], "upload_token": upload["upload_token"],
+             "parts": parts})})
+
+    def _ingest(self, index):
+        name = f"sim/{index:06d}.jpg"
+        self._started[name] = time.perf_counter()
+        if self.config["ingest_mode"] == "direct":
+            response = self._upload_direct(name, self.source_url(index))
+        else:
+            event = {"queryStringParameters": {"url": self.source_url(index), "name": name}}
+            response = self.functions["get_save_image"].invoke(event)
+        if response.get("statusCode") != 200:
+            self.recorder.count("ingest.failed")
+            with self._done:
+                self._expected.discard(name)
+                self._done.notify_all()
+
+    def _ingest_bulk(self, indexes):
+        """
+        Một request POST /bulk cho các ảnh bulk, key có thêm BULK_KEY_PREFIX.
+        """
+        now = time.perf_counter()
+        items = []
+        for index in indexes:
+            name = f"sim/bulk-{index:06d}.jpg"
+            self._started[BULK_KEY_PREFIX + name] = now
+            items.append({"url": f"https://images.local/bulk/{index:06d}.jpg", "name": name})
+        response = self.functions["bulk_ingest"].invoke({"body": json.dumps(items)})
+        results = json.loads(response["body"]).get("items", []) if response.get("statusCode") == 200 else []
+        failed = [BULK_KEY_PREFIX + item["name"] for item in items]
+        if results:
+            failed = [result.get("key", result["name"]) for result in results if result["statusCode"] != 200]
+        if failed:
+            self.recorder.count("ingest.failed", len(failed))
+            with self._done:
+                self._expected.difference_update(failed)
+                self._done.notify_all()
+
+    def _list_all(self):
+        """
+        Đọc lại toàn bộ Classifications qua list_images như client của API.
+        """
+        count = 0
+        params = {"limit": "100"}
+        while True:
+            response = self.functions["list_images"].invoke({"queryStringParameters": params})
+            body = json.loads(response["body"])
+            count += len(body.get("items", []))
+            if not body.get("last_evaluated_key"):
+                return count
+            params = {"limit": "100", "start_key": json.dumps(body["last_evaluated_key"])}
+
+    def run(self):
+        self.setup()
+        images = self.config["images"]
+        self._expected = {f"sim/{index:06d}.jpg" for index in range(images)}
+        bulk_images = self.config["bulk_images"]
+        self._expected |= {f"{BULK_KEY_PREFIX}sim/bulk-{index:06d}.jpg" for index in range(bulk_images)}
+        # Đợt bulk (mỗi request BULK_REQUEST_ITEMS ảnh) được gửi trước ảnh interactive
+        tasks = [(self._ingest_bulk, range(start, min(start + BULK_REQUEST_ITEMS, bulk_images)))
+                 for start in range(0, bulk_images, BULK_REQUEST_ITEMS)]
+        tasks += [(self._ingest, index) for index in range(images)]
+        output = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        if self.trace_memory:
+            tracemalloc.start()
+
+        with output as buffer:
+            started = time.perf_counter()
+            for source in self.event_sources:
+                source.start()
+            with ThreadPoolExecutor(max_workers=self.config["ingest_concurrency"]) as pool:
+                for _ in pool.map(lambda task: task[0](task[1]), tasks):
+                    if buffer is not None and buffer.tell() > 1024 * 1024:
+                        # Giữ log handler trong giới hạn bộ nhớ
+                        buffer.seek(0)
+                        buffer.truncate()
+            ingested_at = time.perf_counter()
+            with self._done:
+                self._done.wait_for(lambda: self._expected <= self._delivered_at.keys(),
+                                    timeout=max(0.0, self.timeout - (ingested_at - started)))
+            finished = time.perf_counter()
+            for source in self.event_sources:
+                source.stop()
+            listed = self._list_all()
+
+        memory = {}
+        if self.trace_memory:
+            memory["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        try:
+            import resource
+            # ru_maxrss tính bằng KB trên Linux, bytes trên macOS
+            scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+            memory["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+        except ImportError:
+            pass
+
+        return self._report(started, ingested_at, finished, listed, memory)
+
+    def _report(self, started, ingested_at, finished, listed, memory):
+        delivered = {image: at for image, at in self._delivered_at.items() if image in self._started}
+        last_delivery = max(delivered.values(), default=finished)
+        samples = self.recorder.samples()
+        counters = self.recorder.counters()
+        batches = counters.get("esm.image_recognition.batches", 0)
+        counters.update({
+            "http.endpoint_requests": self.endpoint.requests,
+            "http.endpoint_bytes": self.endpoint.bytes_received,
+            "http.endpoint_timeouts": self.endpoint.timeouts,
+            "sqs.pending.upload": self.cloud.sqs.pending(self.upload_queue),
+            "sqs.pending.upload_bulk": self.cloud.sqs.pending(self.bulk_queue),
+            "sqs.pending.rekognized": self.cloud.sqs.pending(self.rekognized_queue),
+            "circuit.thirdparty.opened": self.modules["send_email"]._breaker.opened,
+        })
+        label_cache = self.modules["image_recognition"].label_cache
+        if label_cache.is_enabled():
+            counters.update({f"phash.{name}": value for name, value in label_cache.stats().items()})
+        elapsed = last_delivery - started
+        return {
+            "config": self.config,
+            "images": self.config["images"],
+            "expected": len(self._expected),
+            "delivered": len(delivered),
+            "listed": listed,
+            "complete": self._expected <= delivered.keys(),
+            "elapsed_seconds": elapsed,
+            "ingest_seconds": ingested_at - started,
+            "images_per_second": len(delivered) / elapsed if elapsed > 0 else 0.0,
+            "mean_batch_size": counters.get("esm.image_recognition.messages", 0) / batches if batches else 0.0,
+            "end_to_end": percentiles([at - self._started[image] for image, at in delivered.items()]),
+            "lanes": {
+                lane: percentiles([at - self._started[image] for image, at in delivered.items()
+                                   if image.startswith(BULK_KEY_PREFIX) == (lane == "bulk")])
+                for lane in ("interactive", "bulk")
+            } if self.config["bulk_images"] else {},
+            "stages": {stage: percentiles(values) for stage, values in sorted(samples.items())},
+            "counters": counters,
+            "memory": memory,
+        }
+
+
+def format_report(report):
+    lines = [
+        f"Delivered {report['delivered']}/{report['expected']} images in {report['elapsed_seconds']:.2f}s "
+        f"-> {report['images_per_second']:.1f} images/s (ingest took {report['ingest_seconds']:.2f}s, "
+        f"listed {report['listed']}, mean batch {report['mean_batch_size']:.1f})",
+    ]
+    end_to_end = report["end_to_end"]
+    if end_to_end.get("count"):
+        lines.append(f"End-to-end latency ms: p50 {end_to_end['p50']:.1f}  p95 {end_to_end['p95']:.1f}  "
+                     f"p99 {end_to_end['p99']:.1f}  max {end_to_end['max']:.1f}")
+    for lane, stats in report.get("lanes", {}).items():
+        if stats.get("count"):
+            lines.append(f"  {lane + ' lane':<18} ({stats['count']:>5}): p50 {stats['p50']:.1f}  p95 {stats['p95']:.1f}  "
+                         f"p99 {stats['p99']:.1f}  max {stats['max']:.1f}")
+    lines.append("")
+    lines.append(f"{'stage':<40} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for stage, stats in report["stages"].items():
+        lines.append(f"{stage:<40} {stats['count']:>7} {stats['p50']:>9.2f} {stats['p95']:>9.2f} "
+                     f"{stats['p99']:>9.2f} {stats['max']:>9.2f}")
+    if report["counters"]:
+        lines.append("")
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f"{name:<40} {value:>12}")
+    if report["memory"]:
+        lines.append("")
+        lines.append("Memory: " + ", ".join(f"{name} {value:.1f}" for name, value in report["memory"].items()))
+    return "\n".join(lines)
@@ -0,0 +1,112 @@
+"""
+Các knob throughput của pipeline đọc từ context (cdk.json hoặc -c key=value).
+
+Mỗi Lambda tiêu thụ SQS có một tiền tố ("recognition", "recognition_bulk", "integration"):
+    <prefix>_batch_size                    số message tối đa mỗi lần invoke
+    <prefix>_max_batching_window_seconds   thời gian chờ gom batch
+    <prefix>_max_concurrency               số invoke đồng thời tối đa của event source (>= 2)
+    <prefix>_reserved_concurrency          reserved concurrency của function
+    <prefix>_provisioned_concurrency       provisioned concurrency (trên alias "live")
+    <prefix>_memory_size                   bộ nhớ (MB), CPU tỉ lệ theo bộ nhớ
+    <prefix>_architecture                  "arm64" hoặc "x86_64"
+    <prefix>_timeout_seconds               timeout của function
+    <prefix>_visibility_timeout_seconds    visibility timeout của queue (nên >= timeout của function)
+    <prefix>_max_receive_count             số lần nhận trước khi chuyển sang DLQ (0 là tắt DLQ)
+    <prefix>_dlq_retention_days            thời gian giữ message trong DLQ
+Giá trị truyền qua -c luôn là chuỗi nên được ép kiểu ở đây.
+"""
+from aws_cdk import Duration
+from aws_cdk import aws_lambda as _lambda
+from aws_cdk import aws_sqs as sqs
+from aws_cdk import aws_lambda_event_sources as lambda_events
+from constructs import Construct
+
+ARCHITECTURES = {
+    "arm64": _lambda.Architecture.ARM_64,
+    "x86_64": _lambda.Architecture.X86_64,
+}
+
+# Layer thuần Python dùng được trên cả hai kiến trúc
+LAYER_ARCHITECTURES = [_lambda.Architecture.X86_64, _lambda.Architecture.ARM_64]
+
+# Claim IN_PROGRESS của ledger chỉ hết hạn sau timeout của function cộng khoảng này
+LEDGER_MARGIN_SECONDS = 30
+
+
+def context_int(scope: Construct, key: str, default=None):
+    value = scope.node.try_get_context(key)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+def architecture(scope: Construct, prefix: str):
+    name = scope.node.try_get_context(f"{prefix}_architecture") or "x86_64"
+    try:
+        return ARCHITECTURES[name]
+    except KeyError:
+        raise ValueError(f"{prefix}_architecture must be one of {sorted(ARCHITECTURES)}, got {name!r}")
+
+
+def function_props(scope: Construct, prefix: str, memory_size: int = 128) -> dict:
+    """
+    Tham số cho _lambda.Function: memory_size, architecture, reserved_concurrent_executions.
+    """
+    return {
+        "memory_size": context_int(scope, f"{prefix}_memory_size", memory_size),
+        "architecture": architecture(scope, prefix),
+        "reserved_concurrent_executions": context_int(scope, f"{prefix}_reserved_concurrency"),
+    }
+
+
+def seconds(scope: Construct, key: str, default: int) -> Duration:
+    return Duration.seconds(context_int(scope, key, default))
+
+
+def ledger_in_progress_seconds(timeout_seconds: int) -> str:
+    """
+    Giá trị LEDGER_IN_PROGRESS_SECONDS cho function có timeout timeout_seconds,
+    để record không bị lần xử lý khác claim lại khi invoke đang giữ nó còn chạy.
+    """
+    return str(timeout_seconds + LEDGER_MARGIN_SECONDS)
+
+
+def dead_letter_queue(scope: Construct, prefix: str, construct_id: str):
+    """
+    Tạo DLQ và trả về sqs.DeadLetterQueue cho queue nguồn, hoặc None nếu tắt.
+    """
+    max_receive_count = context_int(scope, f"{prefix}_max_receive_count", 0)
+    if not max_receive_count:
+        return None
+    queue = sqs.Queue(
+        scope,
+        construct_id,
+        retention_period=Duration.days(context_int(scope, f"{prefix}_dlq_retention_days", 14)),
+    )
+    return sqs.DeadLetterQueue(queue=queue, max_receive_count=max_receive_count)
+
+
+def attach_queue(scope: Construct, prefix: str, function: _lambda.Function, queue: sqs.IQueue):
+    """
+    Gắn queue làm event source của function (hoặc alias "live" khi có
+    provisioned concurrency), record lỗi được trả về qua batchItemFailures.
+    """
+    target = function
+    provisioned = context_int(scope, f"{prefix}_provisioned_concurrency", 0)
+    if provisioned:
+        target = _lambda.Alias(
+            scope,
+            f"{function.node.id}Live",
+            alias_name="live",
+            version=function.current_version,
+            provisioned_concurrent_executions=provisioned,
+        )
+    window = context_int(scope, f"{prefix}_max_batching_window_seconds", 0)
+    target.add_event_source(lambda_events.SqsEventSource(
+        queue,
+        batch_size=context_int(scope, f"{prefix}_batch_size", 10),
+        max_batching_window=Duration.seconds(window) if window else None,
+        max_concurrency=context_int(scope, f"{prefix}_max_concurrency"),
+        report_batch_item_failures=True,
+    ))
+    return target